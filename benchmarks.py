@@ -0,0 +1,187 @@
+# benchmarks.py
+# Times the MIS hot paths (lead load, DataFrame build, status styling, dashboards, Excel exports,
+# email extraction) against synthetic data and writes the results as JSON so runs can be compared.
+#
+#   python benchmarks.py --sizes 1000,10000,100000 --output bench_before.json
+#   python benchmarks.py --sizes 1000,10000 --compare bench_before.json
+#   python benchmarks.py --sizes "" --db-concurrency 1,10,50   (sync vs async reads against the MySQL in instance/config.py)
+
+import io
+import os
+import sys
+import json
+import time
+import sqlite3
+import platform
+import argparse
+import datetime
+import tempfile
+import asyncio
+import statistics
+import contextlib
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+import mis_core
+import mis_analytics
+import synthetic_data
+
+
+def time_call(func, repeat):
+    timings = []; result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()): # extract_info_from_email & co. print per call
+            result = func()
+        timings.append(time.perf_counter() - start)
+    return timings, result
+
+def load_leads_sqlite(path):
+    conn = sqlite3.connect(path, detect_types=sqlite3.PARSE_DECLTYPES)
+    conn.row_factory = sqlite3.Row
+    try:
+        return [dict(row) for row in conn.execute("SELECT * FROM office ORDER BY received_date DESC")]
+    finally:
+        conn.close()
+
+
+def run_size(size, seed, repeat, email_count, work_dir):
+    db_path = os.path.join(work_dir, f"bench_{size}.db")
+    if os.path.exists(db_path): os.remove(db_path)
+    synthetic_data.write_leads_sqlite(db_path, synthetic_data.generate_leads(size, seed=seed))
+
+    results = {}
+    def bench(name, func):
+        timings, result = time_call(func, repeat)
+        results[name] = {'min_s': round(min(timings), 6), 'median_s': round(statistics.median(timings), 6), 'runs': len(timings)}
+        print(f"  {name:<28} min {min(timings):9.4f}s   median {statistics.median(timings):9.4f}s")
+        return result
+
+    rows = bench('lead_load_sqlite', lambda: load_leads_sqlite(db_path))
+    df = bench('build_lead_dataframe', lambda: mis_core.build_lead_dataframe(rows))
+    raw_bytes = mis_core.lead_frame_memory_bytes(pd.DataFrame(rows)); typed_bytes = mis_core.lead_frame_memory_bytes(df)
+    results['_memory_per_10k'] = {'object_frame_bytes': int(raw_bytes * 10000 / max(len(rows), 1)),
+                                  'typed_frame_bytes': int(typed_bytes * 10000 / max(len(rows), 1))}
+    print(f"  {'memory per 10k leads':<28} object {raw_bytes * 10000 / max(len(rows), 1) / 2**20:7.2f} MiB   "
+          f"typed {typed_bytes * 10000 / max(len(rows), 1) / 2**20:7.2f} MiB")
+    bench('status_styling', lambda: [mis_core.get_status_and_color_value(row) for row in df.to_dict('records')])
+    bench('summary_dashboard', lambda: mis_core.compute_summary_dashboard_tables(df))
+    today = datetime.date.today()
+    bench('per_day_allocation', lambda: mis_core.build_per_day_allocation_table(df, today.year, today.month))
+    bench('turnaround_analytics', lambda: mis_analytics.compute_turnaround_analytics(df))
+    bench('standard_excel_export', lambda: mis_core.build_standard_excel_export(df))
+    bench('custom_excel_report', lambda: mis_core.generate_custom_excel_report(df))
+    emails = synthetic_data.generate_valuation_emails(email_count, seed=seed)
+    bench('email_extraction', lambda: [mis_core.extract_info_from_email(s, b, f) for s, b, f in emails])
+    results['_rows'] = len(rows)
+    os.remove(db_path)
+    return results
+
+
+# --- DB concurrency: sync connect-per-query path (run_db_query) vs the async pool (mis_async_db) ---
+# One simulated request = a dashboard aggregate, a lead lookup and that lead's file listing.
+DB_CONCURRENCY_READS = [
+    ("SELECT status, COUNT(*) AS n FROM office GROUP BY status", False),
+    ("SELECT * FROM office WHERE id = %s", True),
+    ("SELECT site_photo_filenames, site_document_filenames FROM office WHERE id = %s", True),
+]
+
+def _request_reads(lead_id):
+    return [(query, (lead_id,) if '%s' in query else (), fetch_one) for query, fetch_one in DB_CONCURRENCY_READS]
+
+def _sync_request(mysql_config, lead_id):
+    import mysql.connector
+    for query, params, _ in _request_reads(lead_id):
+        conn = mysql.connector.connect(**mysql_config)
+        try:
+            cursor = conn.cursor(dictionary=True); cursor.execute(query, params); cursor.fetchall(); cursor.close()
+        finally:
+            conn.close()
+
+async def _async_requests(mysql_config, lead_ids, concurrency):
+    import mis_async_db
+    db = mis_async_db.AsyncLeadDatabase(mis_async_db.mysql_pool(mysql_config, size=concurrency))
+    slots = asyncio.Semaphore(concurrency)
+    async def one_request(lead_id):
+        async with slots:
+            for query, params, fetch_one in _request_reads(lead_id):
+                await (db.fetch_one(query, params) if fetch_one else db.fetch_all(query, params))
+    try: await asyncio.gather(*(one_request(lead_id) for lead_id in lead_ids))
+    finally: await db.pool.close()
+
+def run_db_concurrency(mysql_config, levels, request_count, seed):
+    import random
+    import mysql.connector
+    conn = mysql.connector.connect(**mysql_config)
+    try:
+        cursor = conn.cursor(); cursor.execute("SELECT id FROM office ORDER BY id DESC LIMIT 5000"); ids = [row[0] for row in cursor.fetchall()]; cursor.close()
+    finally:
+        conn.close()
+    if not ids: print("  office is empty - fill it with synthetic_data.py --mysql first."); return {}
+    lead_ids = [random.Random(seed).choice(ids) for _ in range(request_count)]
+    results = {}
+    for level in levels:
+        modes = {
+            'sync_sequential': lambda: [_sync_request(mysql_config, lead_id) for lead_id in lead_ids],
+            'sync_threads': lambda: list(ThreadPoolExecutor(max_workers=level).map(lambda lead_id: _sync_request(mysql_config, lead_id), lead_ids)),
+            'async_pool': lambda: asyncio.run(_async_requests(mysql_config, lead_ids, level)),
+        }
+        results[str(level)] = {}
+        for mode, func in modes.items():
+            if mode == 'sync_sequential' and level != levels[0]: continue # independent of the concurrency level
+            started = time.perf_counter(); func(); seconds = time.perf_counter() - started
+            results[str(level)][mode] = {'seconds': round(seconds, 4), 'requests_per_s': round(request_count / seconds, 1)}
+            print(f"  concurrency {level:<4} {mode:<16} {seconds:8.3f}s   {request_count / seconds:8.1f} req/s")
+    return results
+
+
+def print_comparison(current, baseline):
+    print("\n--- Comparison (median, current vs baseline) ---")
+    for size, benches in current['results'].items():
+        base_benches = baseline.get('results', {}).get(size)
+        if not base_benches: print(f"size {size}: not in baseline"); continue
+        print(f"size {size}:")
+        for name, stats in benches.items():
+            if name.startswith('_') or name not in base_benches: continue
+            old, new = base_benches[name]['median_s'], stats['median_s']
+            change = ((new - old) / old * 100) if old else 0.0
+            print(f"  {name:<28} {old:9.4f}s -> {new:9.4f}s   {change:+6.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the MIS hot paths on synthetic data.")
+    parser.add_argument('--sizes', default="1000,10000,100000", help="Comma separated lead counts.")
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--emails', type=int, default=1000, help="Emails fed to the extraction benchmark.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--output', help="Write the JSON results here (printed to stdout otherwise).")
+    parser.add_argument('--compare', help="Baseline JSON from an earlier run to compare against.")
+    parser.add_argument('--db-concurrency', help="Comma separated concurrency levels for the sync vs async DB read benchmark (needs MySQL).")
+    parser.add_argument('--db-requests', type=int, default=300, help="Simulated requests per concurrency level.")
+    args = parser.parse_args()
+
+    sizes = [int(s) for s in args.sizes.split(',') if s.strip()]
+    report = {'meta': {'timestamp': datetime.datetime.now().isoformat(timespec='seconds'), 'python': platform.python_version(),
+                       'pandas': pd.__version__, 'platform': platform.platform(), 'seed': args.seed, 'repeat': args.repeat,
+                       'emails': args.emails},
+              'results': {}}
+    with tempfile.TemporaryDirectory() as work_dir:
+        for size in sizes:
+            print(f"Benchmarking {size} leads...")
+            report['results'][str(size)] = run_size(size, args.seed, args.repeat, args.emails, work_dir)
+    if args.db_concurrency:
+        from instance import config
+        print(f"DB concurrency ({args.db_requests} requests x {len(DB_CONCURRENCY_READS)} reads)...")
+        report['db_concurrency'] = run_db_concurrency(config.MYSQL_CONFIG, [int(c) for c in args.db_concurrency.split(',') if c.strip()], args.db_requests, args.seed)
+
+    if args.output:
+        with open(args.output, 'w') as f: json.dump(report, f, indent=2)
+        print(f"Results written to {args.output}")
+    else:
+        json.dump(report, sys.stdout, indent=2); print()
+    if args.compare:
+        with open(args.compare) as f: print_comparison(report, json.load(f))
+
+if __name__ == "__main__":
+    main()
@@ -2,7 +2,12 @@
 # This file contains your secret configurations.
 # It WILL BE IGNORED by Git if 'instance/' is in your .gitignore file.
 
-# MySQL Database Configuration
+# --- Storage backend ---
+DB_BACKEND = "mysql"                        # "mysql", or "sqlite" for a single-office install on one PC
+# SQLITE_DATABASE_PATH = "instance/mis_office.db"     # default; WAL mode, created on first start
+# SQLITE_PRAGMAS = {"busy_timeout": 10000}           # overrides of mis_storage.SQLITE_DEFAULT_PRAGMAS
+
+# MySQL Database Configuration (DB_BACKEND = "mysql")
 MYSQL_CONFIG = {
     'user': 'root',         # Replace with your MySQL username
     'password': 'Password@12345',     # Replace with your MySQL password
@@ -11,10 +16,69 @@ MYSQL_CONFIG = {
     'raise_on_warnings': True
 }
 
+# --- Read replica (optional; MySQL only) ---
+# READ_REPLICA_CONFIG = {**MYSQL_CONFIG, 'host': 'replica.example.com'}   # lists, dashboards, exports and search read here
+# READ_REPLICA_MAX_LAG_SECONDS = 5          # fall back to the primary while the replica is further behind
+# READ_REPLICA_HEARTBEAT_SECONDS = 1        # lag check interval (python mis_replica.py --watch)
+
 # Admin Signup Secret Code
 ADMIN_SIGNUP_SECRET = "R"  # Choose a strong secret
 
 # Email Account for Fetching Leads
 EMAIL_ACCOUNT = "your_email_address@example.com"  # Your MIS email
 EMAIL_PASSWORD = "your_email_app_password"        # For Gmail, use an App Password
-IMAP_SERVER = "imap.example.com"                  # e.g., "imap.gmail.com"
\ No newline at end of file
+IMAP_SERVER = "imap.example.com"                  # e.g., "imap.gmail.com"
+
+# --- Password Hashing / Login Throttling (optional; defaults shown) ---
+PASSWORD_HASH_SCHEMES = ["bcrypt"]          # First scheme is used for new hashes; older hashes are upgraded at login
+PASSWORD_HASH_ROUNDS = {"bcrypt": 12}        # bcrypt cost factor
+LOGIN_VERIFY_WORKERS = 4
+LOGIN_MAX_FAILED_ATTEMPTS = 5
+LOGIN_LOCKOUT_SECONDS = 300
+
+# --- Deadline Alert Engine (optional; defaults shown) ---
+ALERT_ENGINE_ENABLED = True
+ALERT_ENGINE_INTERVAL_SECONDS = 900
+ALERT_DUE_SOON_DAYS = 2
+ALERT_NEARING_DAYS = 5
+ALERT_DIGEST_HOUR = 8                       # Digests go out on the first refresh after this hour
+ALERT_ADMIN_EMAILS = []                     # e.g. ["admin@example.com"]
+ALERT_ENGINEER_EMAILS = {}                  # engineer username -> email address
+# SMTP_SERVER = "smtp.example.com"          # Digests are only sent when this is set
+# SMTP_PORT = 587
+# SMTP_USER = EMAIL_ACCOUNT
+# SMTP_PASSWORD = EMAIL_PASSWORD
+# SMTP_USE_TLS = True
+# ALERT_FROM_ADDRESS = EMAIL_ACCOUNT
+
+# --- Shared lead cache (optional; defaults shown) ---
+SHARED_LEAD_CACHE_ENABLED = True
+SHARED_LEAD_CACHE_INTERVAL_SECONDS = 10
+
+# --- Async DB pool (optional; default shown) ---
+ASYNC_DB_POOL_SIZE = 8                      # Async pool for concurrent dashboard reads (mysql.connector.aio)
+
+# --- Lead archive (optional; defaults shown) ---
+ARCHIVE_AFTER_DAYS = 180                    # Approved leads completed longer ago than this move to office_archive
+ARCHIVE_BATCH_SIZE = 500                    # Leads moved per transaction (python mis_archive.py --archive)
+
+# --- Email attachments (optional; defaults shown) ---
+EMAIL_ATTACHMENTS_ENABLED = True            # Attachments of lead emails become the new lead's documents
+EMAIL_ATTACHMENT_EXTENSIONS = ['.pdf', '.doc', '.docx', '.xls', '.xlsx', '.txt', '.jpg', '.jpeg', '.png']
+EMAIL_ATTACHMENT_MAX_MB = 20                # Larger attachments are skipped without downloading them
+EMAIL_ATTACHMENTS_MAX_TOTAL_MB = 50         # Per email
+
+# --- Per-bank email extraction rules (optional; python mis_rules.py --list) ---
+# Field templates per sender domain; rules can also be added to the email_extraction_rules table (mis_rules.py --import).
+EMAIL_EXTRACTION_RULES = [
+    # {'name': 'hdfc', 'domains': ['hdfcbank.com'], 'bank_name': 'HDFC Bank',
+    #  'fields': {'customer_name': "Applicant Name: {value}", 'property_details': "Property Address: {block}",
+    #             'deadline': "TAT Date: {value}", 'contact_number': "Mobile: {value}"},
+    #  'date_formats': ['%d-%b-%Y']},
+]
+
+# --- Prebuilt reports (optional; defaults shown) ---
+REPORT_SCHEDULE_ENABLED = True              # Daily MIS, per-bank and per-day allocation workbooks in instance/reports
+REPORT_SCHEDULE_TIMES = ["07:00"]           # Build times (HH:MM, server local time); python mis_reports.py --build
+REPORT_RETENTION_DAYS = 30                  # Older files are deleted...
+REPORT_KEEP_LATEST = 3                      # ...except the newest few of each report
@@ -77,3 +77,104 @@ ALTER TABLE office
 ADD COLUMN site_photo_filenames TEXT NULL DEFAULT NULL,
 ADD COLUMN site_document_filenames TEXT NULL DEFAULT NULL;
 
+
+-- Role-scoped lead lists (engineers / report creators) filter on these columns.
+-- streamlit_app.py creates them automatically on startup if they are missing.
+CREATE INDEX idx_office_site_engineer ON office (site_engineer, received_date);
+CREATE INDEX idx_office_report_creator ON office (report_creator, received_date);
+
+-- Optimistic concurrency: every UPDATE on office bumps version; bulk actions
+-- only touch rows whose version still matches what the user saw.
+-- (streamlit_app.py adds this column automatically on startup if missing.)
+ALTER TABLE office ADD COLUMN version INT NOT NULL DEFAULT 0;
+
+-- Unified login table: one indexed lookup for sign-in and username uniqueness.
+-- streamlit_app.py creates and fills it automatically on startup if it is missing;
+-- the statements below do the same by hand. Legacy tables are kept as they are.
+CREATE TABLE accounts (
+    account_id INT PRIMARY KEY AUTO_INCREMENT,
+    username VARCHAR(50) NOT NULL,
+    password_hash VARCHAR(255) NOT NULL,
+    role VARCHAR(20) NOT NULL DEFAULT 'user',     -- 'admin', 'user' or 'engineer'
+    full_name VARCHAR(100) NULL,
+    contact_number VARCHAR(20) NULL,
+    UNIQUE KEY uq_accounts_username (username)
+);
+INSERT INTO accounts (username, password_hash, role)
+SELECT a.username, a.password_hash, 'admin' FROM admins a
+WHERE NOT EXISTS (SELECT 1 FROM accounts x WHERE x.username = a.username);
+INSERT INTO accounts (username, password_hash, role, full_name, contact_number)
+SELECT e.username, e.password_hash, 'engineer', e.full_name, e.contact_number FROM site_engineers e
+WHERE NOT EXISTS (SELECT 1 FROM accounts x WHERE x.username = e.username);
+INSERT INTO accounts (username, password_hash, role)
+SELECT u.username, u.password_hash,
+       CASE LOWER(TRIM(u.role)) WHEN 'admin' THEN 'admin' WHEN 'engineer' THEN 'engineer' ELSE 'user' END
+FROM users u
+WHERE NOT EXISTS (SELECT 1 FROM accounts x WHERE x.username = u.username);
+
+-- Daily rollup for the trend dashboards: per (day, bank, engineer, status) counters.
+-- streamlit_app.py creates and fills it on startup if missing; rebuild any time with
+--   python mis_rollup.py --rebuild
+CREATE TABLE IF NOT EXISTS daily_lead_stats (
+    stat_date DATE NOT NULL,
+    bank_name VARCHAR(255) NOT NULL,
+    site_engineer VARCHAR(255) NOT NULL DEFAULT '',
+    status VARCHAR(50) NOT NULL,
+    received_count INT NOT NULL DEFAULT 0,      -- leads received that day
+    entered_count INT NOT NULL DEFAULT 0,       -- leads that moved into this status that day
+    exited_count INT NOT NULL DEFAULT 0,        -- leads that moved out of this status that day
+    turnaround_days_sum INT NOT NULL DEFAULT 0, -- 'Completed' only: received -> completion days
+    PRIMARY KEY (stat_date, bank_name, site_engineer, status)
+);
+
+-- Deadline-alert engine (mis_alerts.py): current overdue / due-soon / on-hold leads and the
+-- per-recipient digest log. streamlit_app.py creates both tables and the index on startup.
+CREATE INDEX idx_office_status_deadline ON office (status, deadline);
+CREATE TABLE IF NOT EXISTS lead_alerts (
+    lead_id INT NOT NULL,
+    alert_type VARCHAR(20) NOT NULL,            -- 'overdue', 'due_soon' or 'on_hold'
+    bank_name VARCHAR(255) NULL,
+    customer_name VARCHAR(255) NULL,
+    site_engineer VARCHAR(255) NULL,
+    report_creator VARCHAR(255) NULL,
+    status VARCHAR(50) NULL,
+    deadline DATE NULL,
+    days_to_deadline INT NULL,
+    first_seen_at DATETIME NOT NULL,
+    last_seen_at DATETIME NOT NULL,
+    PRIMARY KEY (lead_id, alert_type),
+    INDEX idx_lead_alerts_engineer (site_engineer),
+    INDEX idx_lead_alerts_creator (report_creator)
+);
+CREATE TABLE IF NOT EXISTS alert_digest_log (
+    recipient VARCHAR(255) NOT NULL,
+    sent_on DATE NOT NULL,
+    alert_count INT NOT NULL,
+    sent_at DATETIME NOT NULL,
+    PRIMARY KEY (recipient, sent_on)
+);
+
+-- Append-only lead history (mis_events.py): one row per creation, status transition or field edit,
+-- written in the same transaction as the change. Never updated or deleted. streamlit_app.py creates it
+-- on startup with baseline events for existing leads; or run  python mis_events.py --seed
+CREATE TABLE IF NOT EXISTS lead_events (
+    event_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+    lead_id INT NOT NULL,
+    event_at DATETIME NOT NULL,
+    actor VARCHAR(50) NULL,                     -- username, 'email' for ingested leads, NULL for baseline rows
+    event_type VARCHAR(20) NOT NULL,            -- 'created', 'transition', 'update' or 'baseline'
+    old_status VARCHAR(50) NULL,
+    new_status VARCHAR(50) NULL,                -- status after the event
+    bank_name VARCHAR(255) NULL,
+    site_engineer VARCHAR(255) NULL,
+    changed_fields TEXT NULL,                   -- JSON {column: [old, new]}
+    INDEX idx_lead_events_lead (lead_id, event_id),
+    INDEX idx_lead_events_time (event_at),
+    INDEX idx_lead_events_actor (actor, event_at)
+);
+
+-- Cold storage for approved leads completed more than ARCHIVE_AFTER_DAYS ago (mis_archive.py).
+-- Same definition as office plus archived_at; streamlit_app.py creates it on startup and adds any
+-- column office gains later. Move leads with  python mis_archive.py --archive
+CREATE TABLE IF NOT EXISTS office_archive LIKE office;
+ALTER TABLE office_archive ADD COLUMN archived_at DATETIME NULL, ADD INDEX idx_office_archive_archived_at (archived_at);
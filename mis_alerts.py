@@ -0,0 +1,325 @@
+# mis_alerts.py
+# Deadline alert engine. Finds overdue / due-soon / on-hold leads with indexed (status, deadline)
+# queries, keeps the current set in 'lead_alerts', and mails one digest per engineer and per admin
+# a day over a single SMTP connection. The UI only reads 'lead_alerts'; every lead write rewrites that
+# lead's rows in its own transaction (lead_alert_statements), so the page never waits for the next cycle.
+#
+#   python mis_alerts.py --once                 (refresh alerts + send today's digests)
+#   python mis_alerts.py --once --no-email      (refresh alerts only)
+#   python mis_alerts.py --smtp-sink 1025       (local SMTP stand-in that prints what it receives)
+
+import sys
+import time
+import smtplib
+import argparse
+import datetime
+import threading
+import socketserver
+from email.message import EmailMessage
+
+ALERT_OPEN_STATUSES = ['New', 'Assigned Engineer', 'Visit Done', 'Report in Progress', 'On Hold']
+ALERT_TYPES = {
+    'overdue': "Overdue Leads",
+    'due_soon': "Leads Due Soon (Urgent)",
+    'on_hold': "Leads On Hold / Nearing Deadline",
+}
+
+LEAD_ALERTS_DDL = """
+    CREATE TABLE IF NOT EXISTS lead_alerts (
+        lead_id INT NOT NULL,
+        alert_type VARCHAR(20) NOT NULL,
+        bank_name VARCHAR(255) NULL,
+        customer_name VARCHAR(255) NULL,
+        site_engineer VARCHAR(255) NULL,
+        report_creator VARCHAR(255) NULL,
+        status VARCHAR(50) NULL,
+        deadline DATE NULL,
+        days_to_deadline INT NULL,
+        first_seen_at DATETIME NOT NULL,
+        last_seen_at DATETIME NOT NULL,
+        PRIMARY KEY (lead_id, alert_type),
+        INDEX idx_lead_alerts_engineer (site_engineer),
+        INDEX idx_lead_alerts_creator (report_creator)
+    )
+"""
+ALERT_DIGEST_LOG_DDL = """
+    CREATE TABLE IF NOT EXISTS alert_digest_log (
+        recipient VARCHAR(255) NOT NULL,
+        sent_on DATE NOT NULL,
+        alert_count INT NOT NULL,
+        sent_at DATETIME NOT NULL,
+        PRIMARY KEY (recipient, sent_on)
+    )
+"""
+ALERT_LEAD_COLUMNS = "id, bank_name, customer_name, site_engineer, report_creator, status, deadline"
+ALERT_UPSERT_SQL = (
+    "INSERT INTO lead_alerts (lead_id, alert_type, bank_name, customer_name, site_engineer, report_creator, status, deadline, "
+    "days_to_deadline, first_seen_at, last_seen_at) VALUES (%s, %s, %s, %s, %s, %s, %s, %s, %s, %s, %s) "
+    "ON DUPLICATE KEY UPDATE bank_name=%s, customer_name=%s, site_engineer=%s, report_creator=%s, status=%s, "
+    "deadline=%s, days_to_deadline=%s, last_seen_at=%s"
+)
+
+
+def _fetch_dicts(cursor, query, params=()):
+    cursor.execute(query, params)
+    columns = [desc[0] for desc in cursor.description]
+    return [dict(zip(columns, row)) for row in cursor.fetchall()]
+
+def _as_date(value):
+    # Rows from the DB carry dates; rows written by the app may carry ISO strings or a pandas NaT.
+    if isinstance(value, str):
+        try: return datetime.date.fromisoformat(value.strip()[:10])
+        except ValueError: return None
+    if isinstance(value, datetime.datetime): return None if value != value else value.date()
+    return value if isinstance(value, datetime.date) else None
+
+def ensure_alert_tables(cursor):
+    cursor.execute(LEAD_ALERTS_DDL)
+    cursor.execute(ALERT_DIGEST_LOG_DDL)
+
+def find_alert_leads(cursor, today=None, due_soon_days=2, nearing_days=5):
+    # Same buckets as the old in-page warnings: overdue, due within due_soon_days, and on hold or due within
+    # nearing_days. Every query is a range on the (status, deadline) index, never a scan of all leads.
+    today = today or datetime.date.today()
+    status_placeholders = ", ".join(["%s"] * len(ALERT_OPEN_STATUSES))
+    base_query = f"SELECT {ALERT_LEAD_COLUMNS} FROM office WHERE status IN ({status_placeholders})"
+    overdue = _fetch_dicts(cursor, base_query + " AND deadline < %s", (*ALERT_OPEN_STATUSES, today))
+    upcoming = _fetch_dicts(cursor, base_query + " AND deadline >= %s AND deadline <= %s",
+                            (*ALERT_OPEN_STATUSES, today, today + datetime.timedelta(days=nearing_days)))
+    on_hold = _fetch_dicts(cursor, f"SELECT {ALERT_LEAD_COLUMNS} FROM office WHERE status = %s", ('On Hold',))
+    return classify_alert_leads(overdue + upcoming + on_hold, today, due_soon_days, nearing_days)
+
+def classify_alert_leads(leads, today=None, due_soon_days=2, nearing_days=5):
+    # Alert rows for the open leads among 'leads' (dicts with ALERT_LEAD_COLUMNS).
+    today = today or datetime.date.today()
+    alerts = {}
+    for lead in leads:
+        if lead.get('id') is None or lead.get('status') not in ALERT_OPEN_STATUSES or lead['id'] in alerts: continue
+        deadline = _as_date(lead.get('deadline'))
+        days_left = (deadline - today).days if deadline else None
+        if days_left is not None and days_left < 0: alerts[lead['id']] = ('overdue', lead)
+        elif days_left is not None and days_left <= due_soon_days: alerts[lead['id']] = ('due_soon', lead)
+        elif (days_left is not None and days_left <= nearing_days) or lead.get('status') == 'On Hold': alerts[lead['id']] = ('on_hold', lead)
+
+    results = []
+    for lead_id, (alert_type, lead) in sorted(alerts.items()):
+        deadline = _as_date(lead.get('deadline'))
+        results.append({'lead_id': lead_id, 'alert_type': alert_type, 'bank_name': lead.get('bank_name'),
+                        'customer_name': lead.get('customer_name'), 'site_engineer': lead.get('site_engineer'),
+                        'report_creator': lead.get('report_creator'), 'status': lead.get('status'), 'deadline': deadline,
+                        'days_to_deadline': (deadline - today).days if deadline else None})
+    return results
+
+def _alert_upsert_params(alert, seen_at):
+    details = [alert['bank_name'], alert['customer_name'], alert['site_engineer'], alert['report_creator'],
+               alert['status'], alert['deadline'], alert['days_to_deadline']]
+    return tuple([alert['lead_id'], alert['alert_type']] + details + [seen_at, seen_at] + details + [seen_at])
+
+def lead_alert_statements(leads, today=None, due_soon_days=2, nearing_days=5):
+    # (query, params) pairs that bring the lead_alerts rows of just-written leads up to date, for the writer's
+    # own transaction. leads: the rows as they are after the write. first_seen_at survives an unchanged alert.
+    leads = [lead for lead in leads if lead.get('id') is not None]
+    if not leads: return []
+    seen_at = datetime.datetime.now().replace(microsecond=0)
+    alerts = {alert['lead_id']: alert for alert in classify_alert_leads(leads, today, due_soon_days, nearing_days)}
+    cleared_ids = [lead['id'] for lead in leads if lead['id'] not in alerts]
+    statements = [(f"DELETE FROM lead_alerts WHERE lead_id IN ({', '.join(['%s'] * len(cleared_ids))})", tuple(cleared_ids))] if cleared_ids else []
+    for lead_id, alert in sorted(alerts.items()):
+        statements.append(("DELETE FROM lead_alerts WHERE lead_id = %s AND alert_type <> %s", (lead_id, alert['alert_type'])))
+        statements.append((ALERT_UPSERT_SQL, _alert_upsert_params(alert, seen_at)))
+    return statements
+
+def refresh_lead_alerts(conn, today=None, due_soon_days=2, nearing_days=5):
+    # Upserts the current alerts and drops the resolved ones in one transaction. Returns the current alerts.
+    cursor = conn.cursor()
+    try:
+        run_started = datetime.datetime.now().replace(microsecond=0)
+        alerts = find_alert_leads(cursor, today, due_soon_days, nearing_days)
+        rows = [_alert_upsert_params(alert, run_started) for alert in alerts]
+        for start in range(0, len(rows), 500):
+            cursor.executemany(ALERT_UPSERT_SQL, rows[start:start + 500])
+        cursor.execute("DELETE FROM lead_alerts WHERE last_seen_at < %s", (run_started,))
+        conn.commit()
+    except Exception:
+        conn.rollback(); raise
+    finally:
+        cursor.close()
+    return alerts
+
+
+# --- Digests ---
+def _digest_line(alert):
+    deadline = alert['deadline'].strftime('%d-%b-%Y') if alert.get('deadline') else 'no deadline'
+    return (f"  ID {alert['lead_id']} | {(alert.get('bank_name') or 'N/A')[:30]} | {alert.get('customer_name') or '-'} | "
+            f"{alert.get('status')} | deadline {deadline} | engineer {alert.get('site_engineer') or '-'}")
+
+def build_digest_message(recipient_address, recipient_label, alerts, sender, app_name="MIS", today=None):
+    today = today or datetime.date.today()
+    counts = {alert_type: sum(1 for a in alerts if a['alert_type'] == alert_type) for alert_type in ALERT_TYPES}
+    msg = EmailMessage()
+    msg['Subject'] = f"[{app_name}] Deadline digest {today:%d-%b-%Y}: {counts['overdue']} overdue, {counts['due_soon']} due soon"
+    msg['From'] = sender; msg['To'] = recipient_address
+    body = [f"Deadline digest for {recipient_label} - {today:%d %B %Y}", ""]
+    for alert_type, heading in ALERT_TYPES.items():
+        section = [a for a in alerts if a['alert_type'] == alert_type]
+        if not section: continue
+        body.append(f"{heading} ({len(section)}):")
+        body.extend(_digest_line(a) for a in section)
+        body.append("")
+    msg.set_content("\n".join(body))
+    return msg
+
+def build_digests(alerts, admin_emails, engineer_emails, sender, app_name="MIS", today=None):
+    # [(recipient_key, EmailMessage, alert_count)]: every admin gets all alerts, every engineer with a known address gets theirs.
+    digests = []
+    if alerts:
+        for address in admin_emails or []:
+            digests.append((f"admin:{address}", build_digest_message(address, "Admin", alerts, sender, app_name, today), len(alerts)))
+    by_engineer = {}
+    for alert in alerts:
+        if alert.get('site_engineer'): by_engineer.setdefault(alert['site_engineer'], []).append(alert)
+    for engineer, engineer_alerts in sorted(by_engineer.items()):
+        address = (engineer_emails or {}).get(engineer)
+        if not address: print(f"Alert digest: no email address configured for engineer '{engineer}', skipped."); continue
+        digests.append((f"engineer:{engineer}", build_digest_message(address, engineer, engineer_alerts, sender, app_name, today), len(engineer_alerts)))
+    return digests
+
+def send_alert_digests(conn, alerts, smtp_settings, admin_emails, engineer_emails, app_name="MIS", today=None):
+    # Sends each recipient at most one digest per day (alert_digest_log), all over one SMTP connection.
+    # The log row is written first as a claim and removed again if the send fails, so a failed digest is retried.
+    # smtp_settings: {'host', 'port', 'user', 'password', 'use_tls', 'sender'}. Returns the number sent.
+    today = today or datetime.date.today()
+    cursor = conn.cursor()
+    try:
+        already_sent = {row['recipient'] for row in _fetch_dicts(cursor, "SELECT recipient FROM alert_digest_log WHERE sent_on = %s", (today,))}
+        digests = [digest for digest in build_digests(alerts, admin_emails, engineer_emails, smtp_settings['sender'], app_name, today) if digest[0] not in already_sent]
+        if not digests: return 0
+        sent = 0
+        with smtplib.SMTP(smtp_settings['host'], smtp_settings.get('port', 25), timeout=30) as smtp:
+            if smtp_settings.get('use_tls'): smtp.starttls()
+            if smtp_settings.get('user'): smtp.login(smtp_settings['user'], smtp_settings.get('password') or '')
+            for recipient_key, msg, alert_count in digests:
+                # Claim the (recipient, day) row before sending: the primary key lets only one process send it.
+                try:
+                    cursor.execute("INSERT INTO alert_digest_log (recipient, sent_on, alert_count, sent_at) VALUES (%s, %s, %s, %s)",
+                                   (recipient_key, today, alert_count, datetime.datetime.now().replace(microsecond=0)))
+                    conn.commit()
+                except Exception as e_claim:
+                    conn.rollback(); print(f"Alert digest to {recipient_key} skipped, already claimed today: {e_claim}"); continue
+                try: smtp.send_message(msg)
+                except (smtplib.SMTPException, OSError) as e_send:
+                    print(f"Alert digest to {recipient_key} failed: {e_send}")
+                    cursor.execute("DELETE FROM alert_digest_log WHERE recipient = %s AND sent_on = %s", (recipient_key, today))
+                    conn.commit(); continue
+                sent += 1
+        return sent
+    finally:
+        cursor.close()
+
+
+# --- Scheduler ---
+def run_alert_cycle(connect, settings, send_digests=True):
+    # One refresh (+ digests once the configured hour has passed). connect: callable returning a new connection.
+    conn = connect()
+    try:
+        cursor = conn.cursor(); ensure_alert_tables(cursor); cursor.close()
+        alerts = refresh_lead_alerts(conn, due_soon_days=settings.get('due_soon_days', 2), nearing_days=settings.get('nearing_days', 5))
+        digests_sent = 0
+        if send_digests and settings.get('smtp') and datetime.datetime.now().hour >= settings.get('digest_hour', 8):
+            digests_sent = send_alert_digests(conn, alerts, settings['smtp'], settings.get('admin_emails'), settings.get('engineer_emails'), settings.get('app_name', 'MIS'))
+    finally:
+        conn.close()
+    counts = {alert_type: sum(1 for a in alerts if a['alert_type'] == alert_type) for alert_type in ALERT_TYPES}
+    return {'ran_at': datetime.datetime.now(), 'counts': counts, 'digests_sent': digests_sent}
+
+def start_alert_scheduler(connect, settings, interval_seconds=900):
+    # Daemon thread running run_alert_cycle every interval_seconds. Returns a state dict (stop with state['stop'].set()).
+    state = {'stop': threading.Event(), 'last_result': None, 'last_error': None, 'lock': threading.Lock()}
+    def loop():
+        while not state['stop'].is_set():
+            try:
+                result = run_alert_cycle(connect, settings)
+                with state['lock']: state['last_result'] = result; state['last_error'] = None
+            except Exception as e:
+                with state['lock']: state['last_error'] = f"{datetime.datetime.now():%H:%M:%S} {e}"
+                print(f"Alert engine cycle failed: {e}")
+            state['stop'].wait(interval_seconds)
+    state['thread'] = threading.Thread(target=loop, name="mis-alert-engine", daemon=True)
+    state['thread'].start()
+    return state
+
+
+# --- Local SMTP stand-in (testing) ---
+class _SMTPSinkHandler(socketserver.StreamRequestHandler):
+    def reply(self, line): self.wfile.write((line + "\r\n").encode())
+
+    def handle(self):
+        self.reply("220 localhost MIS SMTP sink")
+        while True:
+            line = self.rfile.readline()
+            if not line: return
+            command = line.decode(errors='replace').strip()
+            verb = command.split(" ", 1)[0].upper()
+            if verb in ("EHLO", "HELO"): self.reply("250 localhost")
+            elif verb == "DATA":
+                self.reply("354 End data with <CR><LF>.<CR><LF>")
+                data_lines = []
+                for data_line in iter(self.rfile.readline, b""):
+                    if data_line in (b".\r\n", b".\n"): break
+                    data_lines.append(data_line[1:] if data_line.startswith(b"..") else data_line)
+                self.server.messages.append(b"".join(data_lines))
+                if self.server.echo: print(b"".join(data_lines).decode(errors='replace'), "\n" + "-" * 60)
+                self.reply("250 OK queued")
+            elif verb == "QUIT": self.reply("221 Bye"); return
+            else: self.reply("250 OK")
+
+class SMTPSink(socketserver.ThreadingTCPServer):
+    # Accepts every message and keeps the raw bytes in .messages; enough for smtplib to talk to.
+    allow_reuse_address = True
+    daemon_threads = True
+
+    def __init__(self, host="127.0.0.1", port=1025, echo=False):
+        super().__init__((host, port), _SMTPSinkHandler)
+        self.messages = []; self.echo = echo
+
+
+def load_alert_settings(config):
+    # Alert settings from instance/config.py, with the same defaults streamlit_app.py uses.
+    smtp_host = getattr(config, 'SMTP_SERVER', None)
+    return {
+        'due_soon_days': getattr(config, 'ALERT_DUE_SOON_DAYS', 2),
+        'nearing_days': getattr(config, 'ALERT_NEARING_DAYS', 5),
+        'digest_hour': getattr(config, 'ALERT_DIGEST_HOUR', 8),
+        'admin_emails': getattr(config, 'ALERT_ADMIN_EMAILS', []),
+        'engineer_emails': getattr(config, 'ALERT_ENGINEER_EMAILS', {}),
+        'app_name': getattr(config, 'APP_NAME', 'MIS'),
+        'smtp': {
+            'host': smtp_host, 'port': getattr(config, 'SMTP_PORT', 587),
+            'user': getattr(config, 'SMTP_USER', None), 'password': getattr(config, 'SMTP_PASSWORD', None),
+            'use_tls': getattr(config, 'SMTP_USE_TLS', True), 'sender': getattr(config, 'ALERT_FROM_ADDRESS', None) or getattr(config, 'SMTP_USER', None) or 'mis@localhost',
+        } if smtp_host else None,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Deadline alert engine.")
+    parser.add_argument('--once', action='store_true', help="Refresh lead_alerts (and send today's digests) once.")
+    parser.add_argument('--no-email', action='store_true', help="Only refresh lead_alerts.")
+    parser.add_argument('--smtp-sink', type=int, metavar='PORT', help="Run a local SMTP stand-in on this port and print received mail.")
+    args = parser.parse_args()
+
+    if args.smtp_sink:
+        with SMTPSink(port=args.smtp_sink, echo=True) as sink:
+            print(f"SMTP sink listening on 127.0.0.1:{args.smtp_sink} (Ctrl+C to stop)")
+            try: sink.serve_forever()
+            except KeyboardInterrupt: pass
+        return
+    if not args.once: parser.print_help(); return
+
+    from instance import config
+    from mis_storage import backend_from_config
+    started = time.perf_counter()
+    result = run_alert_cycle(backend_from_config(config).connect, load_alert_settings(config), send_digests=not args.no_email)
+    print(f"Alerts refreshed in {time.perf_counter() - started:.2f}s: {result['counts']}; {result['digests_sent']} digest(s) sent.")
+
+if __name__ == "__main__":
+    sys.exit(main())
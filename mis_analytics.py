@@ -0,0 +1,118 @@
+# mis_analytics.py
+# Turnaround-time and SLA analytics over the typed lead frame (mis_core.build_lead_dataframe).
+# Everything is column-wise pandas; nothing loops over leads.
+#
+# Stages (whole days, from the date columns the workflow already fills in):
+#   Allocation  received_date         -> date_of_allocation
+#   Visit       date_of_allocation    -> visit_completion_date
+#   Report      visit_completion_date -> lead_completion_date
+#   Total       received_date         -> lead_completion_date
+
+import datetime
+from io import BytesIO
+
+import numpy as np
+import pandas as pd
+
+TURNAROUND_STAGES = {
+    'Allocation': ('received_date', 'date_of_allocation'),
+    'Visit': ('date_of_allocation', 'visit_completion_date'),
+    'Report': ('visit_completion_date', 'lead_completion_date'),
+    'Total': ('received_date', 'lead_completion_date'),
+}
+AGEING_BUCKETS = [(0, 2, '0-2 days'), (3, 5, '3-5 days'), (6, 10, '6-10 days'), (11, 20, '11-20 days'), (21, None, '21+ days')]
+TURNAROUND_GROUPINGS = {'By Engineer': 'site_engineer', 'By Bank': 'bank_name', 'By Month': 'received_month'}
+
+
+def lead_data_version(df):
+    # Cheap fingerprint of a lead frame: any insert, delete or UPDATE (which bumps 'version') changes it.
+    if df is None or df.empty: return (0, 0, 0)
+    version_sum = int(df['version'].sum()) if 'version' in df.columns else 0
+    return (int(df.shape[0]), int(df['id'].max()) if 'id' in df.columns else 0, version_sum)
+
+def _day_column(df, col_name):
+    if col_name not in df.columns: return pd.Series(pd.NaT, index=df.index, dtype='datetime64[ns]')
+    return pd.to_datetime(df[col_name], errors='coerce').dt.normalize()
+
+def compute_stage_durations(df, today=None):
+    # One row per lead: stage durations in days (NaN while a stage is unfinished), SLA outcome and age.
+    today = pd.Timestamp(today or datetime.date.today())
+    days = {col_name: _day_column(df, col_name) for col_name in
+            {col for stage_cols in TURNAROUND_STAGES.values() for col in stage_cols} | {'deadline'}}
+    durations = pd.DataFrame({
+        'id': df['id'] if 'id' in df.columns else pd.Series(range(len(df)), index=df.index),
+        'bank_name': df['bank_name'] if 'bank_name' in df.columns else None,
+        'site_engineer': df['site_engineer'] if 'site_engineer' in df.columns else None,
+        'status': df['status'] if 'status' in df.columns else None,
+        'received_month': days['received_date'].dt.strftime('%Y-%m'),
+    }, index=df.index)
+    for stage_name, (start_col, end_col) in TURNAROUND_STAGES.items():
+        stage_days = (days[end_col] - days[start_col]) / np.timedelta64(1, 'D')
+        durations[stage_name] = stage_days.where(stage_days >= 0) # negative = data entry error, ignored
+
+    is_completed = durations['status'].astype(object).eq('Completed') & days['lead_completion_date'].notna()
+    has_deadline = days['deadline'].notna()
+    # SLA is decided once a lead is completed, or once its deadline has passed while still open.
+    durations['sla_due'] = has_deadline & (is_completed | (days['deadline'] < today))
+    durations['sla_met'] = durations['sla_due'] & is_completed & (days['lead_completion_date'] <= days['deadline'])
+    durations['is_open'] = ~durations['status'].astype(object).eq('Completed')
+    durations['age_days'] = ((today - days['received_date']) / np.timedelta64(1, 'D')).where(durations['is_open'])
+    return durations
+
+def turnaround_percentiles(durations, group_col):
+    # Per group: lead count, p50/p90 of every stage, SLA hit rate (%).
+    grouped = durations.groupby(group_col, observed=True, dropna=True)
+    stage_names = list(TURNAROUND_STAGES)
+    quantiles = grouped[stage_names].quantile([0.5, 0.9]).unstack()
+    quantiles.columns = [f"{stage} p{int(q * 100)}" for stage, q in quantiles.columns]
+    summary = pd.DataFrame({'Leads': grouped.size()})
+    sla_due = grouped['sla_due'].sum(); sla_met = grouped['sla_met'].sum()
+    summary['SLA Hit %'] = (sla_met / sla_due.where(sla_due > 0) * 100).round(1)
+    summary = summary.join(quantiles.round(1))
+    summary.index.name = {'site_engineer': 'Engineer', 'bank_name': 'Bank', 'received_month': 'Month'}.get(group_col, group_col)
+    return summary[summary['Leads'] > 0].sort_index()
+
+def open_lead_ageing(durations):
+    # Open leads per status x age bucket (days since received).
+    open_leads = durations[durations['is_open'] & durations['age_days'].notna()]
+    bucket_labels = [label for _, _, label in AGEING_BUCKETS]
+    if open_leads.empty: return pd.DataFrame(columns=bucket_labels + ['Total Open'], index=pd.Index([], name='Status'))
+    edges = [lower for lower, _, _ in AGEING_BUCKETS] + [np.inf]
+    buckets = pd.cut(open_leads['age_days'], bins=[edge - 0.5 for edge in edges], labels=bucket_labels)
+    ageing = pd.crosstab(open_leads['status'].astype(object), buckets, dropna=False).reindex(columns=bucket_labels, fill_value=0)
+    ageing.columns.name = None
+    ageing['Total Open'] = ageing.sum(axis=1)
+    ageing.index.name = 'Status'
+    return ageing[ageing['Total Open'] > 0]
+
+def compute_turnaround_analytics(df, today=None):
+    durations = compute_stage_durations(df, today)
+    sla_due = int(durations['sla_due'].sum()); sla_met = int(durations['sla_met'].sum())
+    open_ages = durations['age_days'].dropna()
+    overview = {
+        'Leads Analysed': int(durations.shape[0]),
+        'SLA Hit Rate %': round(sla_met / sla_due * 100, 1) if sla_due else None,
+        'SLA Decided Leads': sla_due,
+        'Total TAT p50 (days)': round(float(durations['Total'].quantile(0.5)), 1) if durations['Total'].notna().any() else None,
+        'Total TAT p90 (days)': round(float(durations['Total'].quantile(0.9)), 1) if durations['Total'].notna().any() else None,
+        'Open Leads': int(durations['is_open'].sum()),
+        'Open > 10 days': int((open_ages > 10).sum()),
+    }
+    return {
+        'overview': overview,
+        'durations': durations,
+        'groups': {label: turnaround_percentiles(durations, group_col) for label, group_col in TURNAROUND_GROUPINGS.items()},
+        'ageing': open_lead_ageing(durations),
+    }
+
+def build_turnaround_excel(analytics):
+    # Workbook with the overview, every grouping, open-lead ageing and the per-lead durations; returns bytes.
+    output_stream = BytesIO()
+    with pd.ExcelWriter(output_stream, engine='openpyxl') as excel_writer:
+        pd.DataFrame(list(analytics['overview'].items()), columns=['Metric', 'Value']).to_excel(excel_writer, index=False, sheet_name='TAT Overview')
+        for label, table in analytics['groups'].items():
+            table.to_excel(excel_writer, sheet_name=f"TAT {label}")
+        analytics['ageing'].to_excel(excel_writer, sheet_name='Open Lead Ageing')
+        lead_rows = analytics['durations'].drop(columns=['is_open']).rename(columns={'sla_due': 'SLA Decided', 'sla_met': 'SLA Met', 'age_days': 'Open Age (days)'})
+        lead_rows.astype(object).where(lead_rows.notna(), None).to_excel(excel_writer, index=False, sheet_name='Lead Durations')
+    return output_stream.getvalue()
@@ -0,0 +1,606 @@
+# mis_api.py
+# Lightweight JSON API over 'office' for field engineers on phones: cursor-paginated lead lists
+# with field selection, ETags (unchanged pages answer 304 with no body) and gzip, plus the same
+# lead transitions, notes and site-file uploads as the action panel in streamlit_app.py.
+# Standard library only (http.server); one DB connection per request, as in the Streamlit app.
+#
+#   python mis_api.py --port 8502                               (MySQL from instance/config.py)
+#   python mis_api.py --sqlite bench.db --port 8502             (local SQLite, e.g. from synthetic_data.py)
+#   python mis_api.py --sqlite bench.db --add-account ravi engineer   (create a login; prompts for the password)
+#   python mis_api.py --selftest                                (pagination, lockout, guarded writes and uploads on a throwaway SQLite DB)
+#
+# Endpoints (all but /api/login need "Authorization: Bearer <token>"):
+#   POST /api/login                                   {"username", "password"} -> {"token", "role", "expires_in"}
+#   GET  /api/leads?limit=&cursor=&fields=&status=&bank=    -> {"items", "next_cursor"}
+#   GET  /api/leads/<id>?fields=
+#   POST /api/leads/<id>/actions/<action>             {"assignee"} for assign_engineer / assign_creator
+#   PUT  /api/leads/<id>/notes                        {"report_issue_notes"}
+#   GET  /api/leads/<id>/files                        -> {"photos": [...], "documents": [...]}
+#   POST /api/leads/<id>/files/<photos|documents>?name=<file name>   raw file bytes as the body
+#   GET  /api/leads/<id>/files/<photos|documents>/<file name>
+# Writes honour "If-Match: <lead ETag>" and answer 412 when the lead changed in the meantime.
+
+import os
+import re
+import sys
+import json
+import gzip
+import time
+import base64
+import hashlib
+import shutil
+import secrets
+import tempfile
+import getpass
+import decimal
+import argparse
+import datetime
+import threading
+from http import HTTPStatus
+from urllib.parse import urlsplit, parse_qs, unquote
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+from mis_auth import PASSLIB_AVAILABLE, PasswordPolicy, password_policy_from_config
+from mis_core import OFFICE_INSERT_COLUMNS
+from mis_rollup import lead_stats_transition_statements
+from mis_events import lead_event_row, lead_event_statements
+from mis_alerts import classify_alert_leads, ensure_alert_tables, lead_alert_statements, load_alert_settings
+from mis_storage import SqliteBackend, backend_from_config
+
+APP_ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+LEAD_FILES_BASE_PATH = os.path.join(APP_ROOT_PATH, "instance", "lead_uploads")
+
+API_LEAD_FIELDS = ['id'] + OFFICE_INSERT_COLUMNS + ['version']
+API_DEFAULT_LIST_FIELDS = ['id', 'bank_name', 'customer_name', 'location', 'contact_number', 'status', 'deadline',
+                           'site_engineer', 'report_creator', 'version']
+API_PAGE_SIZE = 50; API_MAX_PAGE_SIZE = 500
+API_TOKEN_TTL_SECONDS = 12 * 3600
+API_MAX_UPLOAD_BYTES = 25 * 1024 * 1024
+API_GZIP_MIN_BYTES = 1024
+API_LOGIN_MAX_FAILED_ATTEMPTS = 5; API_LOGIN_LOCKOUT_SECONDS = 300
+API_SCOPE_COLUMNS = {'engineer': 'site_engineer', 'user': 'report_creator'} # admins see every lead
+API_UPLOAD_EXTENSIONS = {'photos': {'.png', '.jpg', '.jpeg'}, 'documents': {'.pdf', '.doc', '.docx', '.xls', '.xlsx', '.txt'}}
+API_FILE_COLUMNS = {'photos': 'site_photo_filenames', 'documents': 'site_document_filenames'}
+
+# Same rules as the action buttons in build_mis_app. 'who': roles allowed, or the lead column that must name the caller.
+API_LEAD_ACTIONS = {
+    'assign_engineer': {'from_status': 'New', 'to_status': 'Assigned Engineer', 'assignee_column': 'site_engineer', 'date_column': 'date_of_allocation', 'review_status': None, 'who': ['admin']},
+    'visit_done': {'from_status': 'Assigned Engineer', 'to_status': 'Visit Done', 'assignee_column': None, 'date_column': 'visit_completion_date', 'review_status': None, 'who': ['admin', 'site_engineer']},
+    'assign_creator': {'from_status': 'Visit Done', 'to_status': 'Report in Progress', 'assignee_column': 'report_creator', 'date_column': None, 'review_status': None, 'who': ['admin']},
+    'report_done': {'from_status': 'Report in Progress', 'to_status': 'Completed', 'assignee_column': None, 'date_column': 'lead_completion_date', 'review_status': 'Pending Review', 'who': ['admin', 'report_creator']},
+}
+API_NOTES_STATUSES = ['Assigned Engineer', 'Visit Done', 'Report in Progress', 'Completed']
+API_UPLOAD_STATUSES = ['Assigned Engineer', 'Visit Done', 'Report in Progress', 'Completed']
+
+SQLITE_ACCOUNTS_DDL = """
+    CREATE TABLE IF NOT EXISTS accounts (
+        account_id INTEGER PRIMARY KEY AUTOINCREMENT,
+        username TEXT NOT NULL UNIQUE,
+        password_hash TEXT NOT NULL,
+        role TEXT NOT NULL DEFAULT 'user',
+        full_name TEXT, contact_number TEXT
+    )
+"""
+
+
+class ApiError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message); self.status = status; self.message = message
+
+
+class LeadDatabase:
+    # Thin DB-API wrapper: dict rows, multi-statement transactions. Queries use %s placeholders for both
+    # dialects; mis_storage.SqliteBackend rewrites them (and converts date/datetime parameters) for SQLite.
+    def __init__(self, connect, dialect):
+        self.connect = connect; self.dialect = dialect
+        self._tables = set()
+
+    def fetch_all(self, query, params=()):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            columns = [desc[0] for desc in cursor.description]
+            rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+            cursor.close()
+            return rows
+        finally:
+            conn.close()
+
+    def fetch_one(self, query, params=()):
+        rows = self.fetch_all(query, params)
+        return rows[0] if rows else None
+
+    def has_table(self, table):
+        # Optional tables (daily_lead_stats, lead_events) appear once the MIS app has started on this database,
+        # so only their presence is cached; a missing table is looked up again on the next write.
+        if table not in self._tables and self.fetch_all(f"SHOW TABLES LIKE '{table}'"): self._tables.add(table)
+        return table in self._tables
+
+    def run_transaction(self, statements, followup=None):
+        # Returns the rowcount of each (query, params); everything is rolled back on error.
+        # followup(rowcounts) may return more statements, run in the same transaction.
+        conn = self.connect()
+        try:
+            cursor = conn.cursor(); rowcounts = []
+            for query, params in statements:
+                cursor.execute(query, params); rowcounts.append(cursor.rowcount)
+            for query, params in (followup(list(rowcounts)) if followup else []):
+                cursor.execute(query, params); rowcounts.append(cursor.rowcount)
+            conn.commit(); cursor.close()
+            return rowcounts
+        except Exception:
+            conn.rollback(); raise
+        finally:
+            conn.close()
+
+
+# --- Helpers ---
+def _json_default(value):
+    if isinstance(value, (datetime.datetime, datetime.date)): return value.isoformat()
+    if isinstance(value, decimal.Decimal): return float(value)
+    if isinstance(value, bytes): return value.decode(errors='replace')
+    raise TypeError(f"Not JSON serialisable: {type(value).__name__}")
+
+def encode_cursor(last_id):
+    return base64.urlsafe_b64encode(str(last_id).encode()).decode().rstrip("=")
+
+def decode_cursor(cursor_text):
+    try: return int(base64.urlsafe_b64decode(cursor_text + "=" * (-len(cursor_text) % 4)).decode())
+    except (ValueError, UnicodeDecodeError): raise ApiError(HTTPStatus.BAD_REQUEST, "Invalid cursor.")
+
+def parse_fields(fields_text, default_fields):
+    if not fields_text: return list(default_fields)
+    fields = [f.strip() for f in fields_text.split(',') if f.strip()]
+    unknown = [f for f in fields if f not in API_LEAD_FIELDS]
+    if unknown: raise ApiError(HTTPStatus.BAD_REQUEST, f"Unknown field(s): {', '.join(unknown)}")
+    return list(dict.fromkeys(['id', 'version'] + fields)) # id + version always come back (paging, If-Match)
+
+def make_etag(*parts):
+    return '"' + hashlib.sha1(json.dumps(parts, default=_json_default).encode()).hexdigest()[:20] + '"'
+
+def lead_etag(lead_id, version, fields):
+    # "<id>.<version>.<fields hash>": If-Match only needs the version, whatever fields the client asked for.
+    return f'"{lead_id}.{version}.{hashlib.sha1(",".join(fields).encode()).hexdigest()[:8]}"'
+
+def etag_matches(header_value, etag):
+    if not header_value: return False
+    candidates = [tag.strip() for tag in header_value.split(',')]
+    return '*' in candidates or etag in candidates or f"W/{etag}" in candidates
+
+def _file_list(value):
+    if not value: return []
+    try: return list(json.loads(value))
+    except (json.JSONDecodeError, TypeError): return []
+
+
+class LeadApi:
+    # Request-independent logic; the HTTP handler only parses, routes and serialises.
+    def __init__(self, db, files_base_path=LEAD_FILES_BASE_PATH, password_policy=None, alert_settings=None):
+        # password_policy: a mis_auth.PasswordPolicy (the app's schemes and rounds); None means logins are unavailable.
+        self.db = db; self.files_base_path = files_base_path
+        self.alert_thresholds = {key: (alert_settings or {})[key] for key in ('due_soon_days', 'nearing_days') if key in (alert_settings or {})}
+        self.passwords = password_policy
+        self.tokens = {}; self.failures = {}; self.lock = threading.Lock()
+
+    # --- Auth ---
+    def login(self, username, password):
+        key = (username or "").strip().lower(); now = time.monotonic()
+        with self.lock:
+            recent = [t for t in self.failures.get(key, []) if now - t < API_LOGIN_LOCKOUT_SECONDS]
+            if recent: self.failures[key] = recent
+            else: self.failures.pop(key, None)
+            if len(recent) >= API_LOGIN_MAX_FAILED_ATTEMPTS: raise ApiError(HTTPStatus.TOO_MANY_REQUESTS, "Too many failed sign-in attempts.")
+        if self.passwords is None: raise ApiError(HTTPStatus.SERVICE_UNAVAILABLE, "Password verification is unavailable (passlib missing).")
+        account = self.db.fetch_one("SELECT username, password_hash, role FROM accounts WHERE username = %s", (username,)) if username and password else None
+        # Unknown usernames still pay for a verification (against the policy's dummy hash).
+        is_valid, upgraded_hash = self.passwords.verify(password, account['password_hash'] if account else None)
+        if not account or not is_valid:
+            with self.lock: self.failures.setdefault(key, []).append(now)
+            raise ApiError(HTTPStatus.UNAUTHORIZED, "Invalid username or password.")
+        if upgraded_hash: self.db.run_transaction([("UPDATE accounts SET password_hash=%s WHERE username=%s", (upgraded_hash, account['username']))])
+        token = secrets.token_urlsafe(32)
+        with self.lock:
+            self.failures.pop(key, None)
+            self.tokens[token] = {'username': account['username'], 'role': account['role'], 'expires': now + API_TOKEN_TTL_SECONDS}
+        return {'token': token, 'username': account['username'], 'role': account['role'], 'expires_in': API_TOKEN_TTL_SECONDS}
+
+    def account_for_token(self, authorization):
+        token = authorization[7:].strip() if authorization and authorization.lower().startswith("bearer ") else None
+        with self.lock:
+            account = self.tokens.get(token) if token else None
+            if account and account['expires'] < time.monotonic(): self.tokens.pop(token, None); account = None
+        if not account: raise ApiError(HTTPStatus.UNAUTHORIZED, "Sign in first (POST /api/login).")
+        return account
+
+    # --- Reads ---
+    def _scope(self, account):
+        scope_column = API_SCOPE_COLUMNS.get(account['role'])
+        return ([f"{scope_column} = %s"], [account['username']]) if scope_column else ([], [])
+
+    def list_page_keys(self, account, query):
+        # Cheap first pass (id + version only) that decides the page and its ETag before any wide row is read.
+        try: limit = min(max(int(query.get('limit', API_PAGE_SIZE)), 1), API_MAX_PAGE_SIZE)
+        except ValueError: raise ApiError(HTTPStatus.BAD_REQUEST, "limit must be a number.")
+        fields = parse_fields(query.get('fields'), API_DEFAULT_LIST_FIELDS)
+        conditions, params = self._scope(account)
+        if query.get('status'):
+            statuses = [s.strip() for s in query['status'].split(',') if s.strip()]
+            conditions.append(f"status IN ({', '.join(['%s'] * len(statuses))})"); params.extend(statuses)
+        if query.get('bank'): conditions.append("bank_name = %s"); params.append(query['bank'])
+        if query.get('cursor'): conditions.append("id < %s"); params.append(decode_cursor(query['cursor']))
+        where_sql = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+        keys = self.db.fetch_all(f"SELECT id, version FROM office{where_sql} ORDER BY id DESC LIMIT %s", tuple(params) + (limit + 1,))
+        next_cursor = encode_cursor(keys[limit - 1]['id']) if len(keys) > limit else None
+        keys = keys[:limit]
+        etag = make_etag('page', fields, [(k['id'], k['version']) for k in keys], next_cursor)
+        return keys, fields, next_cursor, etag
+
+    def list_page_items(self, keys, fields):
+        if not keys: return []
+        rows = self.db.fetch_all(f"SELECT {', '.join(fields)} FROM office WHERE id IN ({', '.join(['%s'] * len(keys))}) ORDER BY id DESC",
+                                 tuple(k['id'] for k in keys))
+        return rows
+
+    def get_lead(self, account, lead_id, fields=None):
+        conditions, params = self._scope(account)
+        where_sql = " AND ".join(["id = %s"] + conditions)
+        lead = self.db.fetch_one(f"SELECT {', '.join(fields or API_LEAD_FIELDS)} FROM office WHERE {where_sql}", (lead_id, *params))
+        if not lead: raise ApiError(HTTPStatus.NOT_FOUND, f"Lead {lead_id} not found.")
+        return lead
+
+    # --- Writes ---
+    def _check_if_match(self, lead, if_match):
+        if not if_match or if_match.strip() == '*': return
+        versions = {match.group(2) for match in re.finditer(r'"(\d+)\.(\d+)\.', if_match) if int(match.group(1)) == lead['id']}
+        if str(lead['version']) not in versions:
+            raise ApiError(HTTPStatus.PRECONDITION_FAILED, "Lead changed since you loaded it; reload and retry.")
+
+    def _guarded_update(self, account, lead, changes, new_engineer=None, extra_where="", extra_where_params=()):
+        # changes: {column: value}. Rollup moves and the lead_events row are written only if the UPDATE won.
+        query = f"UPDATE office SET {', '.join(f'{col}=%s' for col in changes)}, version=version+1 WHERE id=%s AND version=%s{extra_where}"
+        new_status = changes.get('status', lead.get('status'))
+        def followup(rowcounts):
+            if rowcounts[0] != 1: return []
+            event_changes = {col: value for col, value in changes.items() if col != 'status'}
+            statements = lead_stats_transition_statements(lead, new_status, new_engineer) if self.db.has_table('daily_lead_stats') else []
+            if self.db.has_table('lead_events'): statements += lead_event_statements([lead_event_row(lead, new_status, account['username'], event_changes)])
+            if self.db.has_table('lead_alerts'): statements += lead_alert_statements([{**lead, **changes, 'status': new_status}], **self.alert_thresholds)
+            return statements
+        rowcounts = self.db.run_transaction([(query, tuple(changes.values()) + (lead['id'], lead['version']) + tuple(extra_where_params))], followup)
+        if rowcounts[0] != 1: raise ApiError(HTTPStatus.CONFLICT, "Lead changed while saving; reload and retry.")
+
+    def run_action(self, account, lead_id, action, body, if_match=None, fields=None):
+        rules = API_LEAD_ACTIONS.get(action)
+        if not rules: raise ApiError(HTTPStatus.NOT_FOUND, f"Unknown action '{action}'. Use one of: {', '.join(API_LEAD_ACTIONS)}")
+        lead = self.get_lead(account, lead_id)
+        self._check_if_match(lead, if_match)
+        allowed = account['role'] in rules['who'] or any(lead.get(col) == account['username'] for col in rules['who'] if col in API_LEAD_FIELDS)
+        if not allowed: raise ApiError(HTTPStatus.FORBIDDEN, f"Your role cannot run '{action}' on this lead.")
+        if lead.get('status') != rules['from_status']: raise ApiError(HTTPStatus.CONFLICT, f"'{action}' needs status '{rules['from_status']}', lead is '{lead.get('status')}'.")
+        if action == 'assign_creator' and lead.get('report_creator'): raise ApiError(HTTPStatus.CONFLICT, "A report creator is already assigned.")
+
+        changes = {'status': rules['to_status']}; assignee = None
+        if rules['assignee_column']:
+            assignee = (body.get('assignee') or '').strip()
+            if not assignee: raise ApiError(HTTPStatus.BAD_REQUEST, "'assignee' is required.")
+            changes[rules['assignee_column']] = assignee
+        if rules['date_column']: changes[rules['date_column']] = datetime.date.today()
+        if rules['review_status']: changes['admin_review_status'] = rules['review_status']
+        self._guarded_update(account, lead, changes, assignee if rules['assignee_column'] == 'site_engineer' else None, " AND status=%s", (rules['from_status'],))
+        return self.get_lead(account, lead_id, fields)
+
+    def save_notes(self, account, lead_id, body, if_match=None, fields=None):
+        lead = self.get_lead(account, lead_id)
+        self._check_if_match(lead, if_match)
+        if not (account['role'] == 'admin' or account['username'] in (lead.get('site_engineer'), lead.get('report_creator'))):
+            raise ApiError(HTTPStatus.FORBIDDEN, "Only an admin, the assigned engineer or the report creator can edit notes.")
+        if lead.get('status') not in API_NOTES_STATUSES: raise ApiError(HTTPStatus.CONFLICT, f"Notes cannot be edited while the lead is '{lead.get('status')}'.")
+        if 'report_issue_notes' not in body: raise ApiError(HTTPStatus.BAD_REQUEST, "'report_issue_notes' is required.")
+        self._guarded_update(account, lead, {'report_issue_notes': (body['report_issue_notes'] or '').strip() or None})
+        return self.get_lead(account, lead_id, fields)
+
+    def _file_path(self, lead_id, kind, name):
+        safe_name = os.path.basename(name or '').strip()
+        if kind not in API_FILE_COLUMNS: raise ApiError(HTTPStatus.NOT_FOUND, "File kind must be 'photos' or 'documents'.")
+        if not safe_name or safe_name.startswith('.'): raise ApiError(HTTPStatus.BAD_REQUEST, "A file name is required.")
+        return os.path.join(self.files_base_path, str(int(lead_id)), kind, safe_name), safe_name
+
+    def list_files(self, account, lead_id):
+        lead = self.get_lead(account, lead_id, ['id', 'version', 'site_photo_filenames', 'site_document_filenames'])
+        return {kind: _file_list(lead.get(col)) for kind, col in API_FILE_COLUMNS.items()}
+
+    def upload_file(self, account, lead_id, kind, name, data):
+        file_path, safe_name = self._file_path(lead_id, kind, name)
+        if os.path.splitext(safe_name)[1].lower() not in API_UPLOAD_EXTENSIONS[kind]:
+            raise ApiError(HTTPStatus.UNSUPPORTED_MEDIA_TYPE, f"Allowed {kind}: {', '.join(sorted(API_UPLOAD_EXTENSIONS[kind]))}")
+        # The bytes go to a temp name and are renamed into place only once the guarded UPDATE has listed the file,
+        # so a refused or abandoned upload never replaces a file the lead already lists.
+        temp_path = None
+        try:
+            for _ in range(3): # retried when another upload to the same lead wins the version race
+                lead = self.get_lead(account, lead_id)
+                if lead.get('site_engineer') != account['username'] or account['role'] != 'engineer':
+                    raise ApiError(HTTPStatus.FORBIDDEN, "Only the assigned site engineer can upload files.")
+                if lead.get('status') not in API_UPLOAD_STATUSES: raise ApiError(HTTPStatus.CONFLICT, f"Files cannot be uploaded while the lead is '{lead.get('status')}'.")
+                if temp_path is None:
+                    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+                    temp_fd, temp_path = tempfile.mkstemp(prefix=".upload-", suffix=".tmp", dir=os.path.dirname(file_path))
+                    with os.fdopen(temp_fd, "wb") as f: f.write(data)
+                file_names = sorted(set(_file_list(lead.get(API_FILE_COLUMNS[kind])) + [safe_name]))
+                try: self._guarded_update(account, lead, {API_FILE_COLUMNS[kind]: json.dumps(file_names)})
+                except ApiError as e:
+                    if e.status == HTTPStatus.CONFLICT: continue
+                    raise
+                os.replace(temp_path, file_path); temp_path = None
+                return {'kind': kind, 'name': safe_name, 'bytes': len(data), 'files': file_names}
+            raise ApiError(HTTPStatus.CONFLICT, "Lead kept changing while saving the upload; retry.")
+        finally:
+            if temp_path is not None and os.path.exists(temp_path): os.remove(temp_path)
+
+    def file_bytes(self, account, lead_id, kind, name):
+        file_path, safe_name = self._file_path(lead_id, kind, name)
+        if safe_name not in self.list_files(account, lead_id).get(kind, []) or not os.path.exists(file_path):
+            raise ApiError(HTTPStatus.NOT_FOUND, "File not found.")
+        with open(file_path, "rb") as f: return f.read()
+
+
+class LeadApiHandler(BaseHTTPRequestHandler):
+    api = None # set by make_server
+    server_version = "MISApi/1.0"
+    protocol_version = "HTTP/1.1"
+
+    ROUTES = [
+        ('POST', re.compile(r"^/api/login$"), 'handle_login'),
+        ('GET', re.compile(r"^/api/leads$"), 'handle_list'),
+        ('GET', re.compile(r"^/api/leads/(\d+)$"), 'handle_get'),
+        ('POST', re.compile(r"^/api/leads/(\d+)/actions/([a-z_]+)$"), 'handle_action'),
+        ('PUT', re.compile(r"^/api/leads/(\d+)/notes$"), 'handle_notes'),
+        ('GET', re.compile(r"^/api/leads/(\d+)/files$"), 'handle_list_files'),
+        ('POST', re.compile(r"^/api/leads/(\d+)/files/([a-z]+)$"), 'handle_upload'),
+        ('GET', re.compile(r"^/api/leads/(\d+)/files/([a-z]+)/([^/]+)$"), 'handle_download'),
+    ]
+
+    def log_message(self, format, *args):
+        print(f"API {self.address_string()} - {format % args}")
+
+    def do_GET(self): self.dispatch('GET')
+    def do_POST(self): self.dispatch('POST')
+    def do_PUT(self): self.dispatch('PUT')
+
+    def dispatch(self, method):
+        parsed = urlsplit(self.path)
+        self.query = {k: v[-1] for k, v in parse_qs(parsed.query).items()}
+        try:
+            for route_method, pattern, handler_name in self.ROUTES:
+                match = pattern.match(parsed.path)
+                if match and route_method == method: return getattr(self, handler_name)(*[unquote(g) for g in match.groups()])
+            raise ApiError(HTTPStatus.NOT_FOUND, "No such endpoint.")
+        except ApiError as e:
+            self.send_json({'error': e.message}, e.status)
+        except Exception as e:
+            print(f"API Error: {e} | {method} {self.path}")
+            self.send_json({'error': "Internal error. See server log."}, HTTPStatus.INTERNAL_SERVER_ERROR)
+
+    # --- I/O ---
+    def read_body(self, limit=1024 * 1024):
+        length = int(self.headers.get('Content-Length') or 0)
+        if length > limit: raise ApiError(HTTPStatus.REQUEST_ENTITY_TOO_LARGE, f"Body larger than {limit} bytes.")
+        return self.rfile.read(length) if length else b""
+
+    def read_json(self):
+        raw = self.read_body()
+        try: body = json.loads(raw) if raw else {}
+        except json.JSONDecodeError: raise ApiError(HTTPStatus.BAD_REQUEST, "Body must be JSON.")
+        if not isinstance(body, dict): raise ApiError(HTTPStatus.BAD_REQUEST, "Body must be a JSON object.")
+        return body
+
+    def send_bytes(self, payload, status=HTTPStatus.OK, content_type="application/json", etag=None):
+        headers = {'Content-Type': content_type, 'Cache-Control': 'private, no-cache'}
+        if etag: headers['ETag'] = etag
+        if len(payload) >= API_GZIP_MIN_BYTES and 'gzip' in (self.headers.get('Accept-Encoding') or ''):
+            payload = gzip.compress(payload, compresslevel=5); headers['Content-Encoding'] = 'gzip'; headers['Vary'] = 'Accept-Encoding'
+        self.send_response(status)
+        for name, value in headers.items(): self.send_header(name, value)
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def send_json(self, data, status=HTTPStatus.OK, etag=None):
+        self.send_bytes(json.dumps(data, default=_json_default, separators=(',', ':')).encode(), status, etag=etag)
+
+    def send_not_modified(self, etag):
+        self.send_response(HTTPStatus.NOT_MODIFIED)
+        self.send_header('ETag', etag); self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    # --- Routes ---
+    def handle_login(self):
+        body = self.read_json()
+        self.send_json(self.api.login(body.get('username'), body.get('password')))
+
+    def handle_list(self):
+        account = self.api.account_for_token(self.headers.get('Authorization'))
+        keys, fields, next_cursor, etag = self.api.list_page_keys(account, self.query)
+        if etag_matches(self.headers.get('If-None-Match'), etag): return self.send_not_modified(etag)
+        self.send_json({'items': self.api.list_page_items(keys, fields), 'next_cursor': next_cursor}, etag=etag)
+
+    def handle_get(self, lead_id):
+        account = self.api.account_for_token(self.headers.get('Authorization'))
+        fields = parse_fields(self.query.get('fields'), API_LEAD_FIELDS)
+        lead = self.api.get_lead(account, int(lead_id), fields)
+        etag = lead_etag(lead['id'], lead['version'], fields)
+        if etag_matches(self.headers.get('If-None-Match'), etag): return self.send_not_modified(etag)
+        self.send_json(lead, etag=etag)
+
+    def _send_lead(self, lead, fields):
+        self.send_json(lead, etag=lead_etag(lead['id'], lead['version'], fields))
+
+    def handle_action(self, lead_id, action):
+        account = self.api.account_for_token(self.headers.get('Authorization'))
+        fields = parse_fields(self.query.get('fields'), API_LEAD_FIELDS)
+        self._send_lead(self.api.run_action(account, int(lead_id), action, self.read_json(), self.headers.get('If-Match'), fields), fields)
+
+    def handle_notes(self, lead_id):
+        account = self.api.account_for_token(self.headers.get('Authorization'))
+        fields = parse_fields(self.query.get('fields'), API_LEAD_FIELDS)
+        self._send_lead(self.api.save_notes(account, int(lead_id), self.read_json(), self.headers.get('If-Match'), fields), fields)
+
+    def handle_list_files(self, lead_id):
+        account = self.api.account_for_token(self.headers.get('Authorization'))
+        self.send_json(self.api.list_files(account, int(lead_id)))
+
+    def handle_upload(self, lead_id, kind):
+        account = self.api.account_for_token(self.headers.get('Authorization'))
+        data = self.read_body(API_MAX_UPLOAD_BYTES)
+        if not data: raise ApiError(HTTPStatus.BAD_REQUEST, "Empty upload.")
+        self.send_json(self.api.upload_file(account, int(lead_id), kind, self.query.get('name'), data), HTTPStatus.CREATED)
+
+    def handle_download(self, lead_id, kind, name):
+        account = self.api.account_for_token(self.headers.get('Authorization'))
+        data = self.api.file_bytes(account, int(lead_id), kind, name)
+        etag = make_etag('file', int(lead_id), kind, name, hashlib.sha1(data).hexdigest())
+        if etag_matches(self.headers.get('If-None-Match'), etag): return self.send_not_modified(etag)
+        self.send_bytes(data, content_type="application/octet-stream", etag=etag)
+
+
+def make_server(api, host="127.0.0.1", port=8502):
+    handler = type("BoundLeadApiHandler", (LeadApiHandler,), {'api': api})
+    return ThreadingHTTPServer((host, port), handler)
+
+def sqlite_connector(path):
+    return SqliteBackend(path).connect
+
+def run_selftest(lead_count=120):
+    # End-to-end check of LeadApi on a throwaway SQLite database (synthetic leads). Returns the number of failed checks.
+    from synthetic_data import generate_leads, write_leads_sqlite
+    from mis_events import seed_lead_events
+    work_dir = tempfile.mkdtemp(prefix="mis_api_selftest_")
+    db_path = os.path.join(work_dir, "selftest.db")
+    write_leads_sqlite(db_path, generate_leads(lead_count, seed=7))
+    api = LeadApi(LeadDatabase(sqlite_connector(db_path), 'sqlite'), os.path.join(work_dir, "lead_uploads"),
+                  PasswordPolicy(rounds={'bcrypt': 5}) if PASSLIB_AVAILABLE else None)
+    failures = []
+    def check(name, passed, detail=""):
+        print(f"  {'ok  ' if passed else 'FAIL'} {name}{f' ({detail})' if detail and not passed else ''}")
+        if not passed: failures.append(name)
+    def expect_error(name, status, call):
+        try: call()
+        except ApiError as e: check(name, e.status == status, f"got {e.status.value}: {e.message}"); return
+        check(name, False, "no error raised")
+    print(f"MIS API self-test on {db_path}")
+
+    # Accounts and login lockout
+    if api.passwords is None: print("  skip login checks: passlib is not installed"); return len(failures)
+    engineer = api.db.fetch_one("SELECT site_engineer FROM office WHERE site_engineer IS NOT NULL GROUP BY site_engineer ORDER BY COUNT(*) DESC LIMIT 1")['site_engineer']
+    api.db.run_transaction([(SQLITE_ACCOUNTS_DDL, ())] + [("INSERT INTO accounts (username, password_hash, role) VALUES (%s, %s, %s)", (username, api.passwords.hash("selftest-pw"), role))
+                                                          for username, role in (("selftest.admin", 'admin'), (engineer, 'engineer'))])
+    admin = api.account_for_token("Bearer " + api.login("selftest.admin", "selftest-pw")['token'])
+    check("admin login", admin['role'] == 'admin')
+    for attempt in range(API_LOGIN_MAX_FAILED_ATTEMPTS): expect_error(f"wrong password {attempt + 1} rejected", HTTPStatus.UNAUTHORIZED, lambda: api.login(engineer, "wrong"))
+    expect_error("locked out after repeated failures, even with the right password", HTTPStatus.TOO_MANY_REQUESTS, lambda: api.login(engineer, "selftest-pw"))
+    expect_error("unknown username rejected", HTTPStatus.UNAUTHORIZED, lambda: api.login("selftest.nobody", "selftest-pw"))
+    api.failures.clear()
+    api.db.run_transaction([("INSERT INTO accounts (username, password_hash, role) VALUES (%s, %s, %s)", ("selftest.legacy", PasswordPolicy(rounds={'bcrypt': 4}).hash("selftest-pw"), 'user'))])
+    api.login("selftest.legacy", "selftest-pw")
+    legacy_hash = api.db.fetch_one("SELECT password_hash FROM accounts WHERE username = %s", ("selftest.legacy",))['password_hash']
+    check("below-policy hash upgraded on login", api.passwords.verify("selftest-pw", legacy_hash) == (True, None))
+    engineer_account = api.account_for_token("Bearer " + api.login(engineer, "selftest-pw")['token'])
+    expect_error("unknown token rejected", HTTPStatus.UNAUTHORIZED, lambda: api.account_for_token("Bearer nope"))
+
+    # Cursor pagination
+    expected_ids = [row['id'] for row in api.db.fetch_all("SELECT id FROM office ORDER BY id DESC")]
+    seen_ids = []; query = {'limit': '17'}; pages = 0
+    while True:
+        keys, fields, next_cursor, etag = api.list_page_keys(admin, query)
+        seen_ids += [row['id'] for row in api.list_page_items(keys, fields)]; pages += 1
+        if not next_cursor: break
+        query = {'limit': '17', 'cursor': next_cursor}
+    check("pages cover every lead once, newest first", seen_ids == expected_ids, f"{len(seen_ids)} of {len(expected_ids)} in {pages} pages")
+    first_etag = api.list_page_keys(admin, {'limit': '17'})[3]
+    check("unchanged page keeps its ETag", first_etag == api.list_page_keys(admin, {'limit': '17'})[3])
+    engineer_ids = [row['id'] for row in api.list_page_items(*api.list_page_keys(engineer_account, {'limit': str(API_MAX_PAGE_SIZE)})[:2])]
+    check("engineer sees only their leads", engineer_ids and all(api.get_lead(admin, lead_id)['site_engineer'] == engineer for lead_id in engineer_ids))
+    expect_error("bad cursor rejected", HTTPStatus.BAD_REQUEST, lambda: api.list_page_keys(admin, {'cursor': '!!'}))
+
+    # Guarded transitions (lead_events is created half-way: the next write must pick it up)
+    new_ids = [row['id'] for row in api.db.fetch_all("SELECT id FROM office WHERE status = 'New' ORDER BY id LIMIT 2")]
+    lead = api.get_lead(admin, new_ids[0])
+    expect_error("stale If-Match refused", HTTPStatus.PRECONDITION_FAILED,
+                 lambda: api.run_action(admin, lead['id'], 'assign_engineer', {'assignee': engineer}, lead_etag(lead['id'], lead['version'] + 1, API_LEAD_FIELDS)))
+    updated = api.run_action(admin, lead['id'], 'assign_engineer', {'assignee': engineer}, lead_etag(lead['id'], lead['version'], API_LEAD_FIELDS))
+    check("assign_engineer applied", updated['status'] == 'Assigned Engineer' and updated['version'] == lead['version'] + 1)
+    expect_error("repeat transition refused by status", HTTPStatus.CONFLICT, lambda: api.run_action(admin, lead['id'], 'assign_engineer', {'assignee': engineer}))
+    expect_error("write with an old version refused", HTTPStatus.CONFLICT, lambda: api._guarded_update(admin, lead, {'report_issue_notes': "lost update"}))
+    check("refused write left the lead alone", api.get_lead(admin, lead['id'])['report_issue_notes'] != "lost update")
+    expect_error("other engineers cannot see the lead to change it", HTTPStatus.NOT_FOUND,
+                 lambda: api.run_action({'username': 'someone.else', 'role': 'engineer'}, lead['id'], 'visit_done', {}))
+    api.run_action(engineer_account, lead['id'], 'visit_done', {})
+    check("assigned engineer marked the visit done", api.get_lead(admin, lead['id'])['status'] == 'Visit Done')
+    conn = sqlite_connector(db_path)()
+    try:
+        seed_lead_events(conn)
+        cursor = conn.cursor(); ensure_alert_tables(cursor); cursor.close(); conn.commit()
+    finally: conn.close()
+    api.run_action(admin, new_ids[1], 'assign_engineer', {'assignee': engineer})
+    events = api.db.fetch_all("SELECT event_type FROM lead_events WHERE lead_id = %s AND event_type = 'transition'", (new_ids[1],))
+    check("lead_events created after start-up is written to", len(events) == 1, f"{len(events)} transition event(s)")
+    expected_alerts = [alert['alert_type'] for alert in classify_alert_leads([api.get_lead(admin, new_ids[1])])]
+    stored_alerts = [row['alert_type'] for row in api.db.fetch_all("SELECT alert_type FROM lead_alerts WHERE lead_id = %s", (new_ids[1],))]
+    check("lead_alerts rewritten with the transition", stored_alerts == expected_alerts, f"{stored_alerts} vs {expected_alerts}")
+
+    # Uploads reach their final name only after the lead lists them
+    uploaded = api.upload_file(engineer_account, new_ids[1], 'photos', "site.jpg", b"first")
+    photo_dir = os.path.dirname(api._file_path(new_ids[1], 'photos', "site.jpg")[0])
+    check("upload stored and listed", uploaded['files'] == ["site.jpg"] and api.file_bytes(engineer_account, new_ids[1], 'photos', "site.jpg") == b"first")
+    def always_conflict(*args, **kwargs): raise ApiError(HTTPStatus.CONFLICT, "Lead changed while saving; reload and retry.")
+    api._guarded_update = always_conflict
+    expect_error("upload that keeps losing the version race refused", HTTPStatus.CONFLICT, lambda: api.upload_file(engineer_account, new_ids[1], 'photos', "site.jpg", b"second"))
+    del api._guarded_update
+    check("refused upload left the stored file and no temp file", api.file_bytes(engineer_account, new_ids[1], 'photos', "site.jpg") == b"first"
+          and os.listdir(photo_dir) == ["site.jpg"], f"{os.listdir(photo_dir)}")
+
+    if failures: print(f"{len(failures)} check(s) failed; database left in {work_dir}")
+    else: print("All checks passed."); shutil.rmtree(work_dir, ignore_errors=True)
+    return len(failures)
+
+def main():
+    parser = argparse.ArgumentParser(description="JSON API for MIS leads.")
+    parser.add_argument('--host', default="127.0.0.1")
+    parser.add_argument('--port', type=int, default=8502)
+    parser.add_argument('--sqlite', help="Serve this SQLite file instead of the database configured in instance/config.py.")
+    parser.add_argument('--files-dir', default=LEAD_FILES_BASE_PATH, help="Where site photos / documents are stored.")
+    parser.add_argument('--add-account', nargs=2, metavar=('USERNAME', 'ROLE'), help="Create a login (role: admin, user or engineer) and exit.")
+    parser.add_argument('--selftest', action='store_true', help="Run the end-to-end checks on a throwaway SQLite database and exit.")
+    args = parser.parse_args()
+    if args.selftest: sys.exit(1 if run_selftest() else 0)
+
+    password_policy = PasswordPolicy() if PASSLIB_AVAILABLE else None; alert_settings = None
+    if args.sqlite:
+        connect = sqlite_connector(args.sqlite); dialect = 'sqlite'
+    else:
+        from instance import config
+        backend = backend_from_config(config)
+        connect = backend.connect; dialect = backend.dialect
+        password_policy = password_policy_from_config(config) if PASSLIB_AVAILABLE else None
+        alert_settings = load_alert_settings(config)
+    api = LeadApi(LeadDatabase(connect, dialect), args.files_dir, password_policy, alert_settings)
+
+    if args.add_account:
+        username, role = args.add_account
+        if role not in ('admin', 'user', 'engineer'): parser.error("ROLE must be admin, user or engineer.")
+        if api.passwords is None: sys.exit("passlib is required to hash passwords.")
+        password = getpass.getpass(f"Password for {username}: ")
+        statements = [(SQLITE_ACCOUNTS_DDL, ())] if dialect == 'sqlite' else []
+        api.db.run_transaction(statements + [("INSERT INTO accounts (username, password_hash, role) VALUES (%s, %s, %s)", (username, api.passwords.hash(password), role))])
+        print(f"Account '{username}' ({role}) created.")
+        return
+
+    server = make_server(api, args.host, args.port)
+    print(f"MIS API ({dialect}) listening on http://{args.host}:{args.port}/api/ (Ctrl+C to stop)")
+    try: server.serve_forever()
+    except KeyboardInterrupt: pass
+    finally: server.server_close()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,145 @@
+# mis_archive.py
+# Hot/cold split of the lead table. Approved, completed leads older than a configurable age are moved
+# from 'office' into 'office_archive' (same columns plus archived_at), in batches of one transaction
+# each, so every list query, dashboard and export that reads 'office' only sees the working set.
+# Archived leads keep their id; their lead_events history stays where it is and an 'archived' event
+# is added ('restored' when one is moved back). Search and historical reports read the archive only when
+# asked to (include-archive toggle).
+#
+#   python mis_archive.py --archive                 (move leads older than ARCHIVE_AFTER_DAYS)
+#   python mis_archive.py --archive --days 365
+#   python mis_archive.py --restore 1234            (move one lead back into office)
+
+import argparse
+import datetime
+
+from mis_events import lead_event_statements
+
+ARCHIVE_TABLE = 'office_archive'
+ARCHIVE_DEFAULT_AFTER_DAYS = 180
+ARCHIVE_DEFAULT_BATCH_SIZE = 500
+
+ARCHIVE_CANDIDATES_SQL = (
+    "SELECT id, bank_name, site_engineer FROM office WHERE status = 'Completed' AND admin_review_status = 'Approved' "
+    "AND lead_completion_date < %s ORDER BY id LIMIT %s FOR UPDATE"
+)
+ARCHIVE_SIGNATURE_SQL = f"SELECT COUNT(*) AS row_count, MAX(id) AS max_id, MAX(archived_at) AS last_archived_at FROM {ARCHIVE_TABLE}"
+ARCHIVE_LEADS_SQL = f"SELECT * FROM {ARCHIVE_TABLE}"
+ARCHIVE_PENDING_SQL = ("SELECT COUNT(*) AS pending FROM office WHERE status = 'Completed' AND admin_review_status = 'Approved' "
+                       "AND lead_completion_date < %s")
+
+
+def archive_cutoff(after_days, today=None):
+    return (today or datetime.date.today()) - datetime.timedelta(days=after_days)
+
+def _columns(cursor, table):
+    cursor.execute(f"SHOW COLUMNS FROM {table}")
+    return [(row[0], row[1]) for row in cursor.fetchall()] # (Field, Type)
+
+def ensure_archive_table(cursor):
+    # Creates office_archive as a copy of office's definition and adds any column office gained since.
+    cursor.execute(f"SHOW TABLES LIKE '{ARCHIVE_TABLE}';")
+    if not cursor.fetchone():
+        print(f"Table '{ARCHIVE_TABLE}' not found. Creating it from the office definition...")
+        cursor.execute(f"CREATE TABLE {ARCHIVE_TABLE} LIKE office")
+        cursor.execute(f"ALTER TABLE {ARCHIVE_TABLE} ADD COLUMN archived_at DATETIME NULL")
+        cursor.execute(f"CREATE INDEX idx_office_archive_archived_at ON {ARCHIVE_TABLE} (archived_at)")
+    archive_columns = {name for name, _ in _columns(cursor, ARCHIVE_TABLE)}
+    for name, column_type in _columns(cursor, 'office'):
+        if name not in archive_columns:
+            print(f"Adding column '{name}' to {ARCHIVE_TABLE}...")
+            cursor.execute(f"ALTER TABLE {ARCHIVE_TABLE} ADD COLUMN `{name}` {column_type} NULL")
+
+def archive_completed_leads(conn, after_days=ARCHIVE_DEFAULT_AFTER_DAYS, batch_size=ARCHIVE_DEFAULT_BATCH_SIZE, max_batches=None, today=None):
+    # Moves approved leads completed before the cut-off, batch_size leads per transaction (copy, delete,
+    # 'archived' events), so no lock is held for long. Returns {'archived': n, 'batches': n}.
+    cursor = conn.cursor()
+    try:
+        ensure_archive_table(cursor)
+        column_list = ", ".join(f"`{name}`" for name, _ in _columns(cursor, 'office'))
+        cutoff = archive_cutoff(after_days, today); archived = 0; batches = 0
+        conn.commit() # autocommit is off: each batch below is one transaction, ended by its commit/rollback
+        while max_batches is None or batches < max_batches:
+            try:
+                cursor.execute(ARCHIVE_CANDIDATES_SQL, (cutoff, batch_size))
+                leads = cursor.fetchall()
+                if not leads: conn.rollback(); break
+                ids = [lead[0] for lead in leads]; placeholders = ", ".join(["%s"] * len(ids))
+                archived_at = datetime.datetime.now().replace(microsecond=0)
+                cursor.execute(f"INSERT INTO {ARCHIVE_TABLE} ({column_list}, archived_at) SELECT {column_list}, %s FROM office WHERE id IN ({placeholders})", (archived_at, *ids))
+                copied = cursor.rowcount
+                cursor.execute(f"DELETE FROM office WHERE id IN ({placeholders})", tuple(ids))
+                if cursor.rowcount != copied or copied != len(ids): raise RuntimeError(f"Archive batch mismatch: {len(ids)} selected, {copied} copied, {cursor.rowcount} deleted.")
+                for query, params in lead_event_statements(
+                    (lead_id, archived_at, None, 'archived', 'Completed', 'Completed', bank_name, site_engineer, None) for lead_id, bank_name, site_engineer in leads
+                ): cursor.execute(query, params)
+                conn.commit()
+            except Exception:
+                conn.rollback(); raise
+            archived += len(ids); batches += 1
+            if len(ids) < batch_size: break
+    finally:
+        cursor.close()
+    return {'archived': archived, 'batches': batches}
+
+def restore_archived_lead(conn, lead_id, actor=None):
+    # Moves one lead back into office (e.g. to reopen it), in one transaction with its 'restored' event and a
+    # version bump, so a form still holding the pre-archive version cannot write over it. Returns True if it was in the archive.
+    cursor = conn.cursor()
+    try:
+        column_list = ", ".join(f"`{name}`" for name, _ in _columns(cursor, 'office'))
+        try:
+            cursor.execute(f"INSERT INTO office ({column_list}) SELECT {column_list} FROM {ARCHIVE_TABLE} WHERE id = %s", (lead_id,))
+            restored = cursor.rowcount == 1
+            if restored:
+                cursor.execute(f"DELETE FROM {ARCHIVE_TABLE} WHERE id = %s", (lead_id,))
+                cursor.execute("UPDATE office SET version = version + 1 WHERE id = %s", (lead_id,))
+                cursor.execute("SELECT status, bank_name, site_engineer FROM office WHERE id = %s", (lead_id,))
+                status, bank_name, site_engineer = cursor.fetchone()
+                for query, params in lead_event_statements(
+                    [(lead_id, datetime.datetime.now().replace(microsecond=0), actor, 'restored', status, status, bank_name, site_engineer, None)]
+                ): cursor.execute(query, params)
+            conn.commit()
+        except Exception:
+            conn.rollback(); raise
+    finally:
+        cursor.close()
+    return restored
+
+def merge_lead_rows(hot_rows, archived_rows):
+    # One list in the lead-list order (received_date, id descending); archived rows keep their archived_at.
+    oldest = datetime.datetime.min
+    def sort_key(row):
+        received = row.get('received_date')
+        if isinstance(received, datetime.date) and not isinstance(received, datetime.datetime): received = datetime.datetime.combine(received, datetime.time())
+        return (received or oldest, row.get('id') or 0)
+    return sorted(list(hot_rows or []) + list(archived_rows or []), key=sort_key, reverse=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Move old approved leads between office and office_archive.")
+    parser.add_argument('--archive', action='store_true', help="Archive approved leads completed more than --days ago.")
+    parser.add_argument('--days', type=int, help="Age in days (default: ARCHIVE_AFTER_DAYS from instance/config.py, else 180).")
+    parser.add_argument('--batch-size', type=int, help="Leads per transaction (default: ARCHIVE_BATCH_SIZE, else 500).")
+    parser.add_argument('--restore', type=int, metavar='LEAD_ID', help="Move one archived lead back into office.")
+    args = parser.parse_args()
+    if not args.archive and args.restore is None: parser.print_help(); return
+
+    from instance import config
+    from mis_storage import backend_from_config
+    conn = backend_from_config(config).connect()
+    try:
+        if args.restore is not None:
+            print(f"Lead {args.restore} restored to office." if restore_archived_lead(conn, args.restore) else f"Lead {args.restore} is not in {ARCHIVE_TABLE}.")
+            return
+        after_days = args.days if args.days is not None else getattr(config, 'ARCHIVE_AFTER_DAYS', ARCHIVE_DEFAULT_AFTER_DAYS)
+        batch_size = args.batch_size or getattr(config, 'ARCHIVE_BATCH_SIZE', ARCHIVE_DEFAULT_BATCH_SIZE)
+        started = datetime.datetime.now()
+        result = archive_completed_leads(conn, after_days, batch_size)
+    finally:
+        conn.close()
+    print(f"Archived {result['archived']} lead(s) completed before {archive_cutoff(after_days)} in {result['batches']} batch(es), "
+          f"{(datetime.datetime.now() - started).total_seconds():.2f}s.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,180 @@
+# mis_async_db.py
+# asyncio data access for MySQL (mysql-connector's mysql.connector.aio, no extra dependency).
+# AsyncLeadDatabase mirrors the sync helpers in streamlit_app.py (fetch one / fetch all / execute /
+# executemany / transaction) on top of a small async connection pool, so concurrent reads such as
+# dashboard queries, lead lookups and file listings overlap on one event loop instead of each
+# holding a thread for the whole round trip.
+#
+# AsyncDbRunner owns an event loop on a background thread, so synchronous code (the Streamlit
+# script) can hand it a batch of reads and get all results back after the slowest one.
+
+import time
+import asyncio
+import threading
+import contextlib
+
+try:
+    import mysql.connector.aio
+    from mysql.connector import Error
+    MYSQL_AIO_AVAILABLE = True
+except ImportError:
+    MYSQL_AIO_AVAILABLE = False
+    Error = Exception
+
+
+class AsyncConnectionPool:
+    # Up to `size` open connections, handed out one coroutine at a time. Connections are opened
+    # lazily, pinged when they have been idle for a while and replaced once older than recycle_seconds.
+    def __init__(self, connect, size=10, recycle_seconds=3600, ping_after_seconds=30):
+        self.connect = connect # async callable returning a new connection
+        self.size = size; self.recycle_seconds = recycle_seconds; self.ping_after_seconds = ping_after_seconds
+        self._idle = asyncio.LifoQueue() # most recently used first: fewer pings, idle ones age out
+        self._slots = asyncio.Semaphore(size)
+        self._closed = False
+
+    async def _open(self):
+        return {'conn': await self.connect(), 'created': time.monotonic(), 'used': time.monotonic()}
+
+    async def _checkout(self):
+        while not self._idle.empty():
+            entry = self._idle.get_nowait(); now = time.monotonic()
+            if now - entry['created'] > self.recycle_seconds: await self._discard(entry); continue
+            if now - entry['used'] > self.ping_after_seconds and not await entry['conn'].is_connected(): await self._discard(entry); continue
+            return entry
+        return await self._open()
+
+    async def _discard(self, entry):
+        with contextlib.suppress(Exception): await entry['conn'].close()
+
+    @contextlib.asynccontextmanager
+    async def acquire(self):
+        if self._closed: raise RuntimeError("Connection pool is closed.")
+        async with self._slots:
+            entry = await self._checkout(); healthy = False
+            try:
+                yield entry['conn']
+                healthy = True
+            finally:
+                if healthy and not self._closed:
+                    entry['used'] = time.monotonic(); self._idle.put_nowait(entry)
+                else:
+                    await self._discard(entry) # state unknown after an error: never reuse it
+
+    async def close(self):
+        self._closed = True
+        while not self._idle.empty(): await self._discard(self._idle.get_nowait())
+
+
+def mysql_pool(mysql_config, size=10, **pool_options):
+    if not MYSQL_AIO_AVAILABLE: raise RuntimeError("mysql.connector.aio is not available (mysql-connector-python >= 9 needed).")
+    return AsyncConnectionPool(lambda: mysql.connector.aio.connect(**mysql_config), size, **pool_options)
+
+
+class AsyncLeadDatabase:
+    # Same contract as run_db_query & co.: errors are printed and reported as None, writes commit or roll back.
+    def __init__(self, pool, on_query=None):
+        self.pool = pool
+        self.on_query = on_query # optional callback(query, seconds, rows) for timing
+
+    def _record(self, query, started, rows):
+        if self.on_query: self.on_query(query, time.perf_counter() - started, rows)
+
+    async def _read(self, query, params, fetch_one):
+        started = time.perf_counter(); results = None
+        try:
+            async with self.pool.acquire() as conn:
+                cursor = await conn.cursor(dictionary=True)
+                try:
+                    await cursor.execute(query, params)
+                    results = await cursor.fetchone() if fetch_one else await cursor.fetchall()
+                    if fetch_one: await cursor.fetchall() # drain, so the connection goes back clean
+                finally:
+                    await cursor.close()
+                await conn.rollback() # end the implicit read transaction (autocommit is off)
+        except Error as e:
+            print(f"Async DB Error: {e} | Query: {query} | Params: {params}")
+            results = None
+        self._record(query, started, (1 if results else 0) if fetch_one else (len(results) if results is not None else None))
+        return results
+
+    async def fetch_one(self, query, params=()):
+        return await self._read(query, params, True)
+
+    async def fetch_all(self, query, params=()):
+        return await self._read(query, params, False)
+
+    async def transaction(self, statements):
+        # Returns the affected row count of each (query, params), or None if anything failed (all rolled back).
+        if not statements: return []
+        started = time.perf_counter(); rowcounts = None
+        try:
+            async with self.pool.acquire() as conn:
+                cursor = await conn.cursor()
+                try:
+                    rowcounts = []
+                    for query, params in statements:
+                        await cursor.execute(query, params); rowcounts.append(cursor.rowcount)
+                    await conn.commit()
+                except Error:
+                    rowcounts = None
+                    with contextlib.suppress(Error): await conn.rollback()
+                    raise
+                finally:
+                    await cursor.close()
+        except Error as e:
+            print(f"Async DB Transaction Error: {e} | Statements: {len(statements)}")
+        self._record(f"TRANSACTION x{len(statements)}: {statements[0][0]}", started, sum(rowcounts) if rowcounts else None)
+        return rowcounts
+
+    async def execute(self, query, params=()):
+        rowcounts = await self.transaction([(query, params)])
+        return rowcounts[0] if rowcounts else None
+
+    async def execute_many(self, query, params_seq, extra_statements=()):
+        # One executemany() plus any extra (query, params) pairs in one transaction; returns the executemany's row count.
+        if not params_seq: return 0
+        started = time.perf_counter(); affected = None
+        try:
+            async with self.pool.acquire() as conn:
+                cursor = await conn.cursor()
+                try:
+                    await cursor.executemany(query, params_seq); affected = cursor.rowcount
+                    for extra_query, extra_params in extra_statements: await cursor.execute(extra_query, extra_params)
+                    await conn.commit()
+                except Error:
+                    affected = None
+                    with contextlib.suppress(Error): await conn.rollback()
+                    raise
+                finally:
+                    await cursor.close()
+        except Error as e:
+            print(f"Async DB executemany Error: {e} | Query: {query} | Rows: {len(params_seq)}")
+        self._record(f"EXECUTEMANY x{len(params_seq)}: {query}", started, affected)
+        return affected
+
+    async def gather_reads(self, reads):
+        # reads: [(query, params, fetch_one)] -> results in the same order, run concurrently.
+        return await asyncio.gather(*(self._read(query, params, fetch_one) for query, params, fetch_one in reads))
+
+
+class AsyncDbRunner:
+    # Background event loop + pool for callers that are not async themselves.
+    def __init__(self, pool_factory, on_query=None):
+        self.loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self.loop.run_forever, name="mis-async-db", daemon=True)
+        self._thread.start()
+        self.db = self.submit(self._make_db(pool_factory, on_query))
+
+    @staticmethod
+    async def _make_db(pool_factory, on_query):
+        return AsyncLeadDatabase(pool_factory(), on_query) # the pool's primitives belong to this loop
+
+    def submit(self, coro, timeout=60):
+        return asyncio.run_coroutine_threadsafe(coro, self.loop).result(timeout)
+
+    def gather_reads(self, reads, timeout=60):
+        return self.submit(self.db.gather_reads(reads), timeout)
+
+    def close(self):
+        self.submit(self.db.pool.close())
+        self.loop.call_soon_threadsafe(self.loop.stop)
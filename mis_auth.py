@@ -0,0 +1,50 @@
+# mis_auth.py
+# Password hashing policy shared by streamlit_app.py and mis_api.py, so a login works the same way in
+# both. PASSWORD_HASH_SCHEMES: the first scheme hashes new passwords, older ones are still accepted;
+# PASSWORD_HASH_ROUNDS: per-scheme cost, e.g. {"bcrypt": 12}. A hash in an older scheme or below the
+# configured cost is reported by verify() with its replacement, and the caller stores it.
+#
+# Unknown usernames are checked against a dummy hash with the same cost, so a failed login takes as
+# long whether or not the account exists.
+
+import secrets
+import threading
+
+try:
+    from passlib.context import CryptContext
+    PASSLIB_AVAILABLE = True
+except ImportError:
+    PASSLIB_AVAILABLE = False
+
+
+class PasswordPolicy:
+    def __init__(self, schemes=("bcrypt",), rounds=None):
+        # Raises ImportError without passlib, and AttributeError for a passlib / bcrypt version mismatch.
+        if not PASSLIB_AVAILABLE: raise ImportError("passlib is not installed (pip install passlib[bcrypt]).")
+        rounds_options = {}
+        for scheme_name, scheme_rounds in (rounds or {}).items():
+            rounds_options[f"{scheme_name}__default_rounds"] = scheme_rounds
+            rounds_options[f"{scheme_name}__min_rounds"] = scheme_rounds
+        self.context = CryptContext(schemes=list(schemes), deprecated="auto", **rounds_options)
+        self._dummy_hash = None; self._lock = threading.Lock()
+
+    def hash(self, password):
+        return self.context.hash(password)
+
+    def dummy_hash(self):
+        with self._lock:
+            if self._dummy_hash is None: self._dummy_hash = self.context.hash(secrets.token_urlsafe(16))
+            return self._dummy_hash
+
+    def verify(self, password, stored_hash):
+        # Returns (is_valid, new_hash); new_hash is set when the stored hash should be upgraded.
+        # stored_hash None means no such account: the dummy hash is verified and the result is always False.
+        if not password: return False, None
+        if not stored_hash:
+            self.context.verify(password, self.dummy_hash())
+            return False, None
+        return self.context.verify_and_update(password, stored_hash)
+
+
+def password_policy_from_config(config):
+    return PasswordPolicy(getattr(config, 'PASSWORD_HASH_SCHEMES', ["bcrypt"]), getattr(config, 'PASSWORD_HASH_ROUNDS', {}))
@@ -0,0 +1,528 @@
+# mis_core.py
+# Lead logic shared by the Streamlit app and the standalone tools (benchmarks, data generator):
+# constants, status colouring, email parsing, dashboard tables and Excel builders.
+# Nothing in here imports Streamlit, so it can be used from plain scripts.
+
+import re
+import html
+import calendar
+import datetime
+from io import BytesIO
+from email.header import decode_header
+
+try:
+    PANDAS_AVAILABLE = True
+    import pandas as pd
+    import numpy as np
+    import openpyxl
+    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
+    from openpyxl.utils import get_column_letter
+except ImportError:
+    PANDAS_AVAILABLE = False
+    print("Pandas or Openpyxl not available. Some features might be disabled.")
+
+# --- Bank Names List (Deduplicated and Categorized) ---
+# These are app-specific constants, not secrets.
+BANKS_PORTAL_REPORT = sorted([
+    "Aditya Birla HL (Portal Report)", "Chola Mandalam (Micro LAP) (Portal Report)",
+    "Chola Mandalam (Prime LAP) (Portal Report)", "CSL (Portal Report)",
+    "CSC (Portal Report)", "DMI (Portal Report)", "ICICI (Portal Report)",
+    "IIFL (Portal Report)", "Kotak (Portal Report)", "Motilal (Portal Report)",
+    "Piramal (Portal Report)", "Shubham HFC (Portal Report)", "TATA (Portal Report)"
+])
+
+BANKS_NORMAL = sorted(list(set([ # Using set to ensure uniqueness from various sources
+    "AU Small Finance Bank", "Ambit Finance", "Aye Finance", "Axis", "Canara bank",
+    "Chola (HL)", "Chola (SME)", "Chola Mandalam (SBPL)", "DCB Bank",
+    "Grihum", "Godrej Finance Ltd", "HDFC Bank", "Hero Housing", "ICICI HFC",
+    "IDFC", "Incred", "IndusInd", "Jana bank", "L&T", "LICHFL", "Mahindra",
+    "Poonawalla", "SK Finance", "SMFG", "True home",
+    "Utkarsh Small Finance Bank", "Ujjivan Small Finance Bank", "Yes Bank"
+])))
+ALL_BANK_OPTIONS_COMBINED = sorted(list(set(BANKS_PORTAL_REPORT + BANKS_NORMAL)))
+ALL_BANK_OPTIONS_DROPDOWN = ["--Select Bank--"] + ALL_BANK_OPTIONS_COMBINED + ["Other"]
+ALL_BANK_OPTIONS_FILTER = ["-- All Banks --"] + ALL_BANK_OPTIONS_COMBINED
+LEAD_STATUSES = ['New', 'Assigned Engineer', 'Visit Done', 'Report in Progress', 'Completed', 'On Hold']
+
+# --- Columns accepted when inserting a lead (add_lead_to_db and the bulk importer) ---
+OFFICE_INSERT_COLUMNS = [
+    'bank_name', 'property_details', 'received_date', 'deadline', 'status',
+    'site_engineer', 'report_creator', 'report_issue_notes', 'admin_review_status', 'admin_comments',
+    'date_of_allocation', 'customer_name', 'application_number', 'location', 'contact_number',
+    'site_link', 'visit_initiation_date', 'visit_completion_date', 'lead_completion_date',
+    'appraiser_quotation_obs', 'distance', 'visit_type', 'remarks', 'branch_virtual',
+    'site_photo_filenames', 'site_document_filenames' # Added new columns
+]
+OFFICE_DATE_COLUMNS = ['received_date', 'deadline', 'date_of_allocation',
+                       'visit_initiation_date', 'visit_completion_date', 'lead_completion_date']
+
+
+# --- Email Parsing ---
+HTML_DROP_RE = re.compile(r"<(script|style|head|title)\b.*?</\1\s*>|<!--.*?-->", re.IGNORECASE | re.DOTALL)
+HTML_BREAK_RE = re.compile(r"<br\s*/?>|</(?:p|div|tr|li|h[1-6]|table|blockquote)\s*>", re.IGNORECASE)
+HTML_CELL_RE = re.compile(r"</t[dh]\s*>", re.IGNORECASE)
+HTML_TAG_RE = re.compile(r"<[^>]+>|<[^>]*$") # also a tag cut off by a partial fetch
+
+def html_to_text(html_text):
+    # Regex conversion for HTML-only bank mails: keeps line breaks and "Label: value" table rows, drops markup.
+    text = HTML_DROP_RE.sub(" ", html_text)
+    text = HTML_BREAK_RE.sub("\n", text)
+    text = HTML_CELL_RE.sub(" ", text)
+    text = html.unescape(HTML_TAG_RE.sub("", text)).replace("\xa0", " ")
+    lines = (re.sub(r"[ \t\r\f\v]+", " ", line).strip() for line in text.split("\n"))
+    return re.sub(r"\n{3,}", "\n\n", "\n".join(lines)).strip()
+
+def get_email_body(msg):
+    # First non-attachment text/plain part; HTML-only mail falls back to its text/html part, as text.
+    body = None; charset = None; html_body = None
+    if msg.is_multipart():
+        for part in msg.walk():
+            ctype = part.get_content_type(); cdispo = str(part.get('Content-Disposition'))
+            if ctype in ('text/plain', 'text/html') and 'attachment' not in cdispo:
+                charset = part.get_content_charset()
+                try: decoded = part.get_payload(decode=True).decode(charset or 'utf-8', errors='ignore')
+                except Exception as e: print(f"Error decoding multipart: {e}"); continue
+                if ctype == 'text/plain': body = decoded; break
+                if html_body is None: html_body = decoded
+    else:
+        ctype = msg.get_content_type()
+        if ctype in ('text/plain', 'text/html'):
+            charset = msg.get_content_charset()
+            try:
+                decoded = msg.get_payload(decode=True).decode(charset or 'utf-8', errors='ignore')
+                if ctype == 'text/plain': body = decoded
+                else: html_body = decoded
+            except Exception as e: print(f"Error decoding single part: {e}")
+    if body is None and html_body is not None: body = html_to_text(html_body)
+    return body
+
+def parse_subject(subject_header_val):
+    subject = "No Subject"
+    if subject_header_val:
+        try:
+            parts = []; decoded_header = decode_header(subject_header_val)
+            for part_content,charset in decoded_header:
+                if isinstance(part_content, bytes): parts.append(part_content.decode(charset or 'utf-8', 'ignore'))
+                else: parts.append(part_content)
+            subject = "".join(parts)
+        except Exception as e: print(f"Error decoding subject: {e}"); subject = str(subject_header_val)
+    return subject
+
+def extract_info_from_email(subject_text, body_text, sender_email, preset=None):
+    # Generic patterns for any bank. preset: fields already found by a per-bank rule (mis_rules.py); only the
+    # fields it lacks are looked for here.
+    print(f"\n--- Parsing Email --- From: {sender_email}, Subject: {subject_text}")
+    extracted = dict(preset or {})
+    if not body_text: body_text = "" # Ensure body_text is a string
+    try:
+        match_prop = None if extracted.get('property_details') else re.search(r"Property(?: Address| Details| Location):\s*(.*?)(?:\n\n|Due Date:|Deadline:|$)", body_text, re.IGNORECASE | re.DOTALL)
+        if match_prop: extracted['property_details'] = match_prop.group(1).strip().replace('\r\n', ' ').replace('\n', ' ')[:400]
+        elif not extracted.get('property_details'): extracted['property_details'] = body_text[:200].strip().replace('\r\n', ' ').replace('\n', ' ')
+
+        date_kw = [r"Due Date", r"Deadline", r"Valuation Required By", r"Submit By"]; date_pats = [r"(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})", r"(\d{4}[-/]\d{1,2}[-/]\d{1,2})"]; deadline_str = None
+        if extracted.get('deadline'): date_kw = []
+        for kw in date_kw:
+            if deadline_str: break
+            for pat in date_pats:
+                match_d = re.search(rf"{kw}[:\s]*{pat}", body_text, re.IGNORECASE)
+                if match_d: deadline_str = match_d.group(1).strip(); break
+        if deadline_str:
+            parsed_dt = None; fmts = ["%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d/%m/%y", "%d-%m/%y", "%m/%d/%Y", "%m-%d-%Y", "%Y/%m/%d", "%m/%d/%y", "%m-%d/%y"] # Added YY/MM/DD
+            for fmt in fmts:
+                try: parsed_dt = datetime.datetime.strptime(deadline_str, fmt); extracted['deadline'] = parsed_dt.strftime('%Y-%m-%d'); break
+                except ValueError: continue
+            if not parsed_dt: print(f"Could not parse deadline: {deadline_str}")
+
+        std_bank = extracted.get('bank_name')
+        for known_bank_option in ([] if std_bank else ALL_BANK_OPTIONS_COMBINED): # Ensure this list is defined
+            base_name = known_bank_option.split(" (")[0].strip().lower()
+            if re.search(r'\b' + re.escape(base_name) + r'\b', sender_email.lower()) or \
+               re.search(r'\b' + re.escape(base_name) + r'\b', subject_text.lower()) or \
+               re.search(r'\b' + re.escape(base_name) + r'\b', body_text.lower()): # Added body_text search for bank
+                std_bank = known_bank_option
+                break
+
+        if std_bank: extracted['bank_name'] = std_bank
+        else:
+            match_bank_body = re.search(r"Bank Name[:\s]+(.*?)(?:\n|$)", body_text, re.IGNORECASE)
+            if match_bank_body: extracted['bank_name'] = match_bank_body.group(1).strip()
+            else: extracted['bank_name'] = sender_email.split('@')[0] if '@' in sender_email else sender_email
+
+        match_cust = None if extracted.get('customer_name') else re.search(r"(?:Customer|Client) Name[:\s]+(.*?)(?:\n|$)", body_text, re.IGNORECASE)
+        if match_cust: extracted['customer_name'] = match_cust.group(1).strip()
+        match_app = None if extracted.get('application_number') else re.search(r"Application (?:Number|No|ID)[:\s]+([\w-]+)", body_text, re.IGNORECASE)
+        if match_app: extracted['application_number'] = match_app.group(1).strip()
+        match_loc = None if extracted.get('location') else re.search(r"Location[:\s]+(.*?)(?:\n\n|$)", body_text, re.IGNORECASE | re.DOTALL) # Ensure it's DOTALL
+        if match_loc: extracted['location'] = match_loc.group(1).strip().replace('\r\n', ' ').replace('\n', ' ')
+        elif not extracted.get('location'): extracted['location'] = extracted.get('property_details') # Fallback
+        match_contact = None if extracted.get('contact_number') else re.search(r"(?:Contact|Phone|Mobile) (?:Number|No)[:\s]+([\d\s()-+]+)", body_text, re.IGNORECASE)
+        if match_contact: extracted['contact_number'] = match_contact.group(1).strip()
+
+    except Exception as e_extract: print(f"ERROR during email info extraction: {e_extract}"); return None
+    if not extracted.get('property_details') or not extracted.get('bank_name'): print(f"Core details missing: Subject='{subject_text}'"); return None
+    print(f"Extraction result (Email): {extracted}"); return extracted
+
+# --- Lead Status ---
+def get_status_and_color_value(item):
+    status = item.get('status', 'New'); deadline = item.get('deadline'); creator = item.get('report_creator'); d_str = None
+    if isinstance(deadline, (datetime.date, datetime.datetime)): d_str = deadline.strftime('%Y-%m-%d')
+    elif isinstance(deadline, str):
+        try: datetime.datetime.strptime(deadline, '%Y-%m-%d'); d_str = deadline
+        except ValueError: d_str = None
+
+    clrs={'normal':'white','red':'#ffdddd','orange':'#ffe8cc','green':'#ddffdd','grey':'#e0e0e0','blue':'#ddeeff','purple':'#e8ddff','yellow_assign':'#ffffcc','yellow_report':'#fffacd'}
+    key = 'normal'; final_status = str(status)
+
+    if status == 'Completed': key = 'green'
+    elif status == 'Visit Done' and not creator: key = 'yellow_report'; final_status += " (Pend Report)"
+    elif status == 'Report in Progress': key = 'purple'
+    elif status == 'Visit Done': key = 'blue'
+    elif status == 'Assigned Engineer': key = 'yellow_assign'
+    elif status == 'On Hold': key = 'orange'
+
+    if d_str and status != 'Completed':
+        try:
+            deadline_date = datetime.datetime.strptime(d_str, '%Y-%m-%d').date()
+            days_to_deadline = (deadline_date - datetime.date.today()).days
+            if days_to_deadline < 0:
+                key = 'grey'
+                final_status = final_status.split(" (")[0] + " (Overdue)"
+            elif days_to_deadline <= 2: key = 'red'
+            elif days_to_deadline <= 5 and key not in ['red', 'grey']: key = 'orange'
+        except Exception as e: print(f"Deadline color calculation error: {e}")
+    return final_status, clrs.get(key, 'white')
+
+# --- Lead DataFrame ---
+LEAD_CATEGORY_COLUMNS = ['bank_name', 'status', 'site_engineer', 'report_creator', 'admin_review_status']
+
+def build_lead_dataframe(db_list):
+    # Rows from 'SELECT * FROM office' -> typed frame: categoricals for the low-cardinality columns,
+    # naive datetime64 for the date columns and nullable Float64 for distance.
+    master_df = pd.DataFrame(db_list)
+    for col_name in OFFICE_DATE_COLUMNS:
+        if col_name in master_df.columns:
+            parsed_col = pd.to_datetime(master_df[col_name], errors='coerce')
+            if pd.api.types.is_datetime64_any_dtype(parsed_col) and parsed_col.dt.tz is not None:
+                parsed_col = parsed_col.dt.tz_localize(None)
+            master_df[col_name] = parsed_col
+    for col_name in LEAD_CATEGORY_COLUMNS:
+        if col_name in master_df.columns: master_df[col_name] = master_df[col_name].astype('category')
+    if 'distance' in master_df.columns:
+        master_df['distance'] = pd.to_numeric(master_df['distance'], errors='coerce').astype('Float64')
+    return master_df
+
+def lead_frame_memory_bytes(df):
+    return int(df.memory_usage(index=True, deep=True).sum()) if df is not None else 0
+
+def lead_frame_records(df):
+    # Plain dicts with None for missing values (categorical NaN / NaT / NA), as the DB rows had.
+    return df.astype(object).where(df.notna(), None).to_dict('records')
+
+# --- Lead Store ---
+class LeadStore:
+    # One loaded snapshot of 'office' rows shared by every section of the page. The DB dicts stay the
+    # source of truth; the typed frame is built once on first use, and id / bank / status lookups go
+    # through precomputed indexes (row positions line up with the frame's RangeIndex).
+    def __init__(self, rows):
+        self.rows = list(rows or [])
+        self.by_id = {row['id']: row for row in self.rows if row.get('id') is not None}
+        self.bank_positions = {}; self.status_positions = {}
+        for pos, row in enumerate(self.rows):
+            self.bank_positions.setdefault(row.get('bank_name'), []).append(pos)
+            self.status_positions.setdefault(row.get('status'), []).append(pos)
+        self._frame = None; self._column_positions = {}
+
+    def __len__(self): return len(self.rows)
+
+    def get(self, lead_id):
+        try: return self.by_id.get(int(lead_id))
+        except (TypeError, ValueError): return None
+
+    def rows_for_bank(self, bank_name=None):
+        if bank_name is None: return self.rows
+        return [self.rows[pos] for pos in self.bank_positions.get(bank_name, [])]
+
+    def rows_for(self, column, value):
+        # Rows whose column equals value, in load order; the per-column index is built on first use.
+        positions = self._column_positions.get(column)
+        if positions is None:
+            positions = {}
+            for pos, row in enumerate(self.rows): positions.setdefault(row.get(column), []).append(pos)
+            self._column_positions[column] = positions
+        return [self.rows[pos] for pos in positions.get(value, [])]
+
+    def rows_with_status(self, *statuses):
+        positions = sorted(pos for status in statuses for pos in self.status_positions.get(status, []))
+        return [self.rows[pos] for pos in positions]
+
+    @property
+    def frame(self):
+        if self._frame is None and self.rows and PANDAS_AVAILABLE: self._frame = build_lead_dataframe(self.rows)
+        return self._frame
+
+    def frame_for_bank(self, bank_name=None):
+        if bank_name is None or self.frame is None: return self.frame
+        return self.frame.take(self.bank_positions.get(bank_name, []))
+
+# --- Leads Table ---
+LEAD_TABLE_COLUMN_ORDER = [
+    'id', 'bank_name', 'branch_virtual', 'customer_name', 'application_number',
+    'location', 'contact_number', 'property_details', 'site_link',
+    'received_date', 'date_of_allocation', 'deadline',
+    'visit_initiation_date', 'visit_completion_date', 'lead_completion_date',
+    'status', 'site_engineer', 'report_creator',
+    'visit_type', 'distance', 'remarks', 'report_issue_notes',
+    'admin_review_status', 'admin_comments', 'appraiser_quotation_obs'
+    # 'site_photo_filenames', 'site_document_filenames' # Optionally add to main display
+]
+LEAD_TABLE_SEARCH_COLUMNS = ['customer_name', 'application_number', 'bank_name', 'location', 'property_details',
+                             'contact_number', 'site_engineer', 'report_creator', 'status']
+
+def order_lead_table_rows(df, search_text=None, sort_column=None, descending=False):
+    # Server-side search + sort for the paginated grid. Returns the matching row labels in display
+    # order; the rows themselves are only materialised for the page being shown.
+    match_mask = None
+    if search_text:
+        for col_name in LEAD_TABLE_SEARCH_COLUMNS:
+            if col_name not in df.columns: continue
+            series = df[col_name]
+            if isinstance(series.dtype, pd.CategoricalDtype):
+                categories = series.cat.categories
+                col_mask = series.isin(categories[categories.astype(str).str.contains(search_text, case=False, regex=False)])
+            else: col_mask = series.astype(str).str.contains(search_text, case=False, regex=False)
+            match_mask = col_mask if match_mask is None else (match_mask | col_mask)
+    row_labels = df.index if match_mask is None else df.index[match_mask.to_numpy()]
+    if sort_column and sort_column in df.columns:
+        return df.loc[row_labels, sort_column].sort_values(ascending=not descending, na_position='last', kind='stable').index
+    return row_labels
+
+def format_lead_table(df):
+    # Column order + display strings for the leads table; only ever called on the rows actually shown.
+    actual_columns_to_display = [col for col in LEAD_TABLE_COLUMN_ORDER if col in df.columns]
+    remaining_cols = [col for col in df.columns if col not in actual_columns_to_display]
+    df_to_style_ordered = df[actual_columns_to_display + remaining_cols]
+
+    for col_name_format in df_to_style_ordered.columns:
+        if pd.api.types.is_datetime64_any_dtype(df_to_style_ordered[col_name_format]):
+            is_only_date = False
+            if not df_to_style_ordered[col_name_format].isna().all():
+                try:
+                    valid_times = pd.to_datetime(df_to_style_ordered[col_name_format]).dropna().dt.time
+                    if not valid_times.empty: # Ensure there are non-NaT values
+                        is_only_date = (valid_times == datetime.time(0,0,0)).all()
+                except AttributeError: pass
+
+            if is_only_date:
+                df_to_style_ordered[col_name_format] = pd.to_datetime(df_to_style_ordered[col_name_format], errors='coerce').dt.strftime('%Y-%m-%d')
+            else:
+                df_to_style_ordered[col_name_format] = pd.to_datetime(df_to_style_ordered[col_name_format], errors='coerce').dt.strftime('%Y-%m-%d %H:%M')
+
+    return df_to_style_ordered.astype(str).replace({'None': '-', 'NaT': '-', 'nan':'-', 'nat':'-', '<NA>': '-'})
+
+# --- Dashboard Tables ---
+def compute_summary_dashboard_tables(df):
+    # Returns the four tables shown by the "Overall MIS Summary" dashboard.
+    # Categorical value_counts() also lists unused categories, hence the count > 0 filters.
+    vp_df = df[df['status'] == 'Assigned Engineer']['site_engineer'].value_counts().reset_index(); vp_df.columns = ['Engineer', 'VP Count']; vp_df = vp_df[vp_df['Engineer'].notna() & (vp_df['Engineer'] != '') & (vp_df['VP Count'] > 0)]
+    vd_sts = ['Visit Done', 'Report in Progress', 'Completed']; vd_df = df[df['status'].isin(vd_sts)]['site_engineer'].value_counts().reset_index(); vd_df.columns = ['Engineer', 'VD Count']; vd_df = vd_df[vd_df['Engineer'].notna() & (vd_df['Engineer'] != '') & (vd_df['VD Count'] > 0)]
+
+    issue = {}
+    issue['Rejected/Revision'] = df[df.get('admin_review_status', pd.Series(dtype=str)) == 'Rejected - Needs Revision'].shape[0]
+    issue['On Hold'] = df[df.get('status', pd.Series(dtype=str)) == 'On Hold'].shape[0]
+    issue['New (Unassigned)'] = df[df.get('status', pd.Series(dtype=str)) == 'New'].shape[0]
+    issue_df = pd.DataFrame(list(issue.items()), columns=['Category', 'Count'])
+
+    total_leads = df.shape[0]
+    visit_done_count = df[df['status'].isin(['Visit Done', 'Report in Progress', 'Completed'])].shape[0]
+    visit_pending_count = df[df['status'] == 'Assigned Engineer'].shape[0]
+    completed_count = df[df['status'] == 'Completed'].shape[0]
+    report_in_progress_count = df[df['status'] == 'Report in Progress'].shape[0]
+    pending_delivery_count = df[
+        (df['status'] == 'Report in Progress') |
+        ((df['status'] == 'Completed') & (df.get('admin_review_status', pd.Series(dtype=str)) == 'Pending Review'))
+    ].shape[0]
+
+    summary_counts = {
+        "Total Leads": total_leads,
+        "Visits Actually Done": visit_done_count,
+        "Visits Pending (Assigned)": visit_pending_count,
+        "Reports Completed": completed_count,
+        "Reports in Progress": report_in_progress_count,
+        "Pending Admin Review/Delivery": pending_delivery_count
+    }
+    summary_df = pd.DataFrame.from_dict(summary_counts, orient='index', columns=['Count'])
+    return {'visit_pending': vp_df, 'visit_done': vd_df, 'issues': issue_df, 'summary': summary_df}
+
+def build_per_day_allocation_table(df, yr, mo):
+    # One row per day of the month; returns None when no leads were received in that month.
+    _, num_days_in_month = calendar.monthrange(yr, mo)
+    daily_df = df[[col for col in ('received_date', 'status', 'site_engineer', 'admin_review_status') if col in df.columns]].copy()
+    # Ensure 'received_date' is datetime before accessing .dt
+    daily_df['recv_date_dt'] = pd.to_datetime(daily_df['received_date'], errors='coerce')
+    # Remove timezone if present, before accessing .dt.date
+    if pd.api.types.is_datetime64_any_dtype(daily_df['recv_date_dt']) and daily_df['recv_date_dt'].dt.tz is not None:
+        daily_df['recv_date_dt'] = daily_df['recv_date_dt'].dt.tz_localize(None)
+    daily_df['recv_date'] = daily_df['recv_date_dt'].dt.date
+    daily_df.dropna(subset=['recv_date'], inplace=True) # Drop rows where date conversion failed
+
+    month_df = daily_df[(daily_df['recv_date_dt'].dt.year == yr) & (daily_df['recv_date_dt'].dt.month == mo)]
+    if month_df.empty: return None
+
+    site_engineers_list = []
+    if 'site_engineer' in month_df.columns:
+        assigned_in_month_df = month_df[month_df['status'] == 'Assigned Engineer']
+        if not assigned_in_month_df.empty:
+            site_engineers_list = sorted(assigned_in_month_df['site_engineer'].dropna().unique().tolist())
+            site_engineers_list = [eng for eng in site_engineers_list if str(eng).strip()]
+
+    days_in_month_dates = [datetime.date(yr, mo, d) for d in range(1, num_days_in_month + 1)]
+    report_data_list = []
+
+    base_cols = ["Date", "Total Received", "Completed This Day", "Visit Done This Day", "Visit Pending (Assigned)"]
+    dynamic_engineer_cols = site_engineers_list
+    status_cols = ["New (Mail)", "On Hold", "Rejected/Revision"]
+    report_columns_final_order = base_cols + dynamic_engineer_cols + status_cols
+
+    for specific_day in days_in_month_dates:
+        leads_on_specific_day = month_df[month_df['recv_date'] == specific_day]
+        row_data_dict = {'Date': specific_day.strftime('%d %B %Y').upper()}
+
+        row_data_dict['Total Received'] = leads_on_specific_day.shape[0]
+        row_data_dict['Completed This Day'] = leads_on_specific_day[leads_on_specific_day['status'] == 'Completed'].shape[0]
+        row_data_dict['Visit Done This Day'] = leads_on_specific_day[leads_on_specific_day['status'].isin(['Visit Done', 'Report in Progress'])].shape[0]
+        row_data_dict['Visit Pending (Assigned)'] = leads_on_specific_day[leads_on_specific_day['status'] == 'Assigned Engineer'].shape[0]
+
+        for eng_name in site_engineers_list:
+            row_data_dict[eng_name] = leads_on_specific_day[
+                (leads_on_specific_day['site_engineer'] == eng_name) &
+                (leads_on_specific_day['status'] == 'Assigned Engineer')
+            ].shape[0]
+
+        row_data_dict['New (Mail)'] = leads_on_specific_day[leads_on_specific_day.get('status', pd.Series(dtype=str)) == 'New'].shape[0]
+        row_data_dict['On Hold'] = leads_on_specific_day[leads_on_specific_day.get('status', pd.Series(dtype=str)) == 'On Hold'].shape[0]
+        row_data_dict['Rejected/Revision'] = leads_on_specific_day[leads_on_specific_day.get('admin_review_status', pd.Series(dtype=str)) == 'Rejected - Needs Revision'].shape[0]
+
+        report_data_list.append(row_data_dict)
+
+    display_df = pd.DataFrame(report_data_list, columns=report_columns_final_order)
+    display_df.fillna(0, inplace=True)
+    for col_name in report_columns_final_order:
+        if col_name != 'Date':
+            display_df[col_name] = display_df[col_name].astype(int)
+    return display_df
+
+# --- Excel Reports ---
+def build_standard_excel_export(df):
+    # Plain one-sheet dump of the given leads; returns the xlsx file as bytes.
+    df_for_standard_export = df.copy()
+    for col in df_for_standard_export.select_dtypes(include=[np.datetime64, 'datetime64[ns]', 'datetime64[ns, UTC]']).columns: # Added UTC
+        df_for_standard_export[col] = pd.to_datetime(df_for_standard_export[col], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S')
+    df_for_standard_export = df_for_standard_export.astype(object).where(df_for_standard_export.notna(), '')
+    output_stream_standard = BytesIO()
+    with pd.ExcelWriter(output_stream_standard, engine='openpyxl') as excel_writer_std:
+        df_for_standard_export.to_excel(excel_writer_std, index=False, sheet_name='Filtered_Leads_Data')
+    return output_stream_standard.getvalue()
+
+def generate_custom_excel_report(df_all_leads):
+    if not PANDAS_AVAILABLE:
+        print("Pandas and Openpyxl are required for this Excel report.")
+        return None
+
+    visit_done_statuses = ['Visit Done', 'Report in Progress', 'Completed']
+    visit_pending_statuses = ['Assigned Engineer', 'New', 'On Hold']
+
+    df_visit_done = df_all_leads[df_all_leads['status'].isin(visit_done_statuses)].copy()
+    df_visit_pending = df_all_leads[df_all_leads['status'].isin(visit_pending_statuses)].copy()
+
+    for df_temp in [df_visit_done, df_visit_pending]:
+        date_cols_to_format = ['date_of_allocation', 'received_date', 'deadline', 'visit_initiation_date', 'visit_completion_date', 'lead_completion_date']
+        for col in date_cols_to_format:
+            if col in df_temp.columns:
+                df_temp[col] = pd.to_datetime(df_temp[col], errors='coerce').dt.date
+
+
+    wb = openpyxl.Workbook()
+    ws = wb.active
+    ws.title = "MIS Report"
+
+    header_font = Font(name='Calibri', size=11, bold=True, color="FFFFFF")
+    header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
+    cell_font = Font(name='Calibri', size=11)
+    center_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
+    left_alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
+    border_thin = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
+
+    current_date_str = datetime.date.today().strftime("%d-%b-%Y")
+    report_columns = ["Sr. No.", "Bank Name", "Branch/Virtual", "Received Date", "Customer's Name", "Location", "Site Engg.", "Deadline", "Status"]
+    current_row = 1
+
+    # VISIT DONE Section
+    ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=len(report_columns))
+    title_cell_done = ws.cell(row=current_row, column=1, value=f"VISIT DONE - as on {current_date_str}")
+    title_cell_done.font = Font(name='Calibri', size=14, bold=True)
+    title_cell_done.alignment = center_alignment
+    current_row += 1
+
+    for col_num, header_title in enumerate(report_columns, 1):
+        cell = ws.cell(row=current_row, column=col_num, value=header_title)
+        cell.font = header_font; cell.alignment = center_alignment; cell.border = border_thin; cell.fill = header_fill
+    current_row += 1
+
+    for idx, lead in enumerate(lead_frame_records(df_visit_done), 1):
+        ws.cell(row=current_row, column=1, value=idx).alignment = center_alignment
+        ws.cell(row=current_row, column=2, value=lead.get('bank_name', '')).alignment = left_alignment
+        ws.cell(row=current_row, column=3, value=lead.get('branch_virtual', '')).alignment = left_alignment
+        received_dt = lead.get('received_date'); date_str_recv = received_dt.strftime("%d-%b-%Y") if pd.notna(received_dt) and isinstance(received_dt, datetime.date) else ''
+        ws.cell(row=current_row, column=4, value=date_str_recv).alignment = center_alignment
+        ws.cell(row=current_row, column=5, value=lead.get('customer_name', '')).alignment = left_alignment
+        ws.cell(row=current_row, column=6, value=lead.get('location', '')).alignment = left_alignment
+        ws.cell(row=current_row, column=7, value=lead.get('site_engineer', '')).alignment = left_alignment
+        deadline_dt = lead.get('deadline'); date_str_dead = deadline_dt.strftime("%d-%b-%Y") if pd.notna(deadline_dt) and isinstance(deadline_dt, datetime.date) else ''
+        ws.cell(row=current_row, column=8, value=date_str_dead).alignment = center_alignment
+        ws.cell(row=current_row, column=9, value=lead.get('status', '')).alignment = left_alignment
+
+        for col_num in range(1, len(report_columns) + 1):
+            ws.cell(row=current_row, column=col_num).border = border_thin
+            ws.cell(row=current_row, column=col_num).font = cell_font
+        current_row += 1
+
+    current_row += 2 # Space before next section
+
+    # VISIT PENDING Section
+    ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=len(report_columns))
+    title_cell_pending = ws.cell(row=current_row, column=1, value=f"VISIT PENDING - as on {current_date_str}")
+    title_cell_pending.font = Font(name='Calibri', size=14, bold=True)
+    title_cell_pending.alignment = center_alignment
+    current_row += 1
+
+    for col_num, header_title in enumerate(report_columns, 1):
+        cell = ws.cell(row=current_row, column=col_num, value=header_title)
+        cell.font = header_font; cell.alignment = center_alignment; cell.border = border_thin; cell.fill = header_fill
+    current_row += 1
+
+    for idx, lead in enumerate(lead_frame_records(df_visit_pending), 1):
+        ws.cell(row=current_row, column=1, value=idx).alignment = center_alignment
+        ws.cell(row=current_row, column=2, value=lead.get('bank_name', '')).alignment = left_alignment
+        ws.cell(row=current_row, column=3, value=lead.get('branch_virtual', '')).alignment = left_alignment
+        received_dt = lead.get('received_date'); date_str_recv = received_dt.strftime("%d-%b-%Y") if pd.notna(received_dt) and isinstance(received_dt, datetime.date) else ''
+        ws.cell(row=current_row, column=4, value=date_str_recv).alignment = center_alignment
+        ws.cell(row=current_row, column=5, value=lead.get('customer_name', '')).alignment = left_alignment
+        ws.cell(row=current_row, column=6, value=lead.get('location', '')).alignment = left_alignment
+        ws.cell(row=current_row, column=7, value=lead.get('site_engineer', 'N/A' if lead.get('status') == 'New' else lead.get('site_engineer', ''))).alignment = left_alignment
+        deadline_dt = lead.get('deadline'); date_str_dead = deadline_dt.strftime("%d-%b-%Y") if pd.notna(deadline_dt) and isinstance(deadline_dt, datetime.date) else ''
+        ws.cell(row=current_row, column=8, value=date_str_dead).alignment = center_alignment
+        ws.cell(row=current_row, column=9, value=lead.get('status', '')).alignment = left_alignment
+
+        for col_num in range(1, len(report_columns) + 1):
+            ws.cell(row=current_row, column=col_num).border = border_thin
+            ws.cell(row=current_row, column=col_num).font = cell_font
+        current_row += 1
+
+    custom_widths = [7, 30, 18, 15, 30, 40, 20, 15, 20]
+    for i, col_letter in enumerate([get_column_letter(idx) for idx in range(1, len(report_columns) + 1)]):
+        ws.column_dimensions[col_letter].width = custom_widths[i] if i < len(custom_widths) else 15
+
+    excel_stream = BytesIO()
+    wb.save(excel_stream)
+    excel_stream.seek(0)
+    return excel_stream
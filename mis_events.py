@@ -0,0 +1,180 @@
+# mis_events.py
+# 'lead_events': append-only log of every lead change (creation, status transition, field edit) with
+# who made it and when, written in the same transaction as the change itself. History-based reports
+# ("MIS as of date X", per-user activity) are computed from the log alone, never from 'office'.
+#
+# Leads that existed before the log get reconstructed 'baseline' events when the table is created:
+# created as 'New' on their received date, then moved to their current status on the date column
+# that status sets (same reconstruction as the daily_lead_stats rebuild).
+#
+#   python mis_events.py --seed        (create lead_events and add baseline events for un-logged leads)
+
+import json
+import argparse
+import datetime
+
+try:
+    import pandas as pd
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+
+from mis_rollup import STATUS_DATE_COLUMNS, ROLLUP_SOURCE_COLUMNS
+
+LEAD_EVENTS_DDL = """
+    CREATE TABLE IF NOT EXISTS lead_events (
+        event_id BIGINT PRIMARY KEY AUTO_INCREMENT,
+        lead_id INT NOT NULL,
+        event_at DATETIME NOT NULL,
+        actor VARCHAR(50) NULL,
+        event_type VARCHAR(20) NOT NULL,
+        old_status VARCHAR(50) NULL,
+        new_status VARCHAR(50) NULL,
+        bank_name VARCHAR(255) NULL,
+        site_engineer VARCHAR(255) NULL,
+        changed_fields TEXT NULL,
+        INDEX idx_lead_events_lead (lead_id, event_id),
+        INDEX idx_lead_events_time (event_at),
+        INDEX idx_lead_events_actor (actor, event_at)
+    )
+"""
+LEAD_EVENT_TYPES = ['created', 'transition', 'update', 'baseline', 'archived', 'restored']
+LEAD_EVENT_COLUMNS = ['lead_id', 'event_at', 'actor', 'event_type', 'old_status', 'new_status', 'bank_name', 'site_engineer', 'changed_fields']
+LEAD_EVENT_INSERT_SQL = f"INSERT INTO lead_events ({', '.join(LEAD_EVENT_COLUMNS)}) VALUES "
+LEAD_EVENT_VALUES_SQL = "(" + ", ".join(["%s"] * len(LEAD_EVENT_COLUMNS)) + ")"
+
+
+def _json_value(value):
+    if isinstance(value, (datetime.datetime, datetime.date)): return value.isoformat()
+    if PANDAS_AVAILABLE and not isinstance(value, (list, dict, str)) and pd.isna(value): return None
+    return value
+
+def changed_fields_json(lead, changes):
+    # {column: [old, new]} for the columns whose value actually changes; None when nothing does.
+    diff = {col: [_json_value(lead.get(col)), _json_value(new_value)] for col, new_value in (changes or {}).items()
+            if _json_value(lead.get(col)) != _json_value(new_value)}
+    return json.dumps(diff, sort_keys=True) if diff else None
+
+def lead_event_row(lead, new_status, actor, changes=None, event_type=None, event_at=None):
+    # One lead_events row for a lead as loaded (dict with id, status, bank_name, site_engineer).
+    old_status = lead.get('status')
+    changes = dict(changes or {})
+    return (lead['id'], event_at or datetime.datetime.now().replace(microsecond=0), actor,
+            event_type or ('transition' if new_status != old_status else 'update'), old_status, new_status,
+            changes.get('bank_name', lead.get('bank_name')), changes.get('site_engineer', lead.get('site_engineer')),
+            changed_fields_json(lead, changes))
+
+def lead_event_statements(event_rows, batch_size=500):
+    # Multi-row INSERTs; a bulk action of n leads costs ceil(n / batch_size) statements.
+    event_rows = list(event_rows)
+    return [(LEAD_EVENT_INSERT_SQL + ", ".join([LEAD_EVENT_VALUES_SQL] * len(event_rows[start:start + batch_size])),
+             tuple(value for row in event_rows[start:start + batch_size] for value in row))
+            for start in range(0, len(event_rows), batch_size)]
+
+def lead_created_event_statements(first_lead_id, leads, actor, event_at=None):
+    # Events for leads just inserted with consecutive ids starting at first_lead_id (cursor.lastrowid of the
+    # INSERT / multi-row executemany in the same transaction).
+    event_at = event_at or datetime.datetime.now().replace(microsecond=0)
+    return lead_event_statements(
+        (first_lead_id + offset, event_at, actor, 'created', None, lead.get('status') or 'New', lead.get('bank_name'), lead.get('site_engineer'), None)
+        for offset, lead in enumerate(leads)
+    )
+
+
+# --- Baseline for leads that predate the log ---
+def _as_datetime(value):
+    if value is None: return None
+    if isinstance(value, datetime.datetime): return value
+    if isinstance(value, datetime.date): return datetime.datetime.combine(value, datetime.time())
+    try: return datetime.datetime.fromisoformat(str(value))
+    except ValueError: return None
+
+def derive_baseline_events(leads):
+    rows = []
+    for lead in leads:
+        received_at = _as_datetime(lead.get('received_date'))
+        if received_at is None: continue
+        status = lead.get('status') or 'New'
+        rows.append((lead['id'], received_at, None, 'baseline', None, 'New', lead.get('bank_name'), None, None))
+        if status == 'New': continue
+        moved_at = max(_as_datetime(lead.get(STATUS_DATE_COLUMNS.get(status, 'received_date'))) or received_at, received_at)
+        rows.append((lead['id'], moved_at, None, 'baseline', 'New', status, lead.get('bank_name'), lead.get('site_engineer'), None))
+    return rows
+
+def seed_lead_events(conn, batch_size=500):
+    # Creates lead_events if needed and adds baseline events for every lead without any event. Returns events written.
+    cursor = conn.cursor()
+    try:
+        cursor.execute(LEAD_EVENTS_DDL)
+        cursor.execute(f"SELECT {ROLLUP_SOURCE_COLUMNS} FROM office o WHERE NOT EXISTS (SELECT 1 FROM lead_events e WHERE e.lead_id = o.id) ORDER BY id")
+        columns = [desc[0] for desc in cursor.description]
+        event_rows = derive_baseline_events(dict(zip(columns, row)) for row in cursor.fetchall())
+        for query, params in lead_event_statements(event_rows, batch_size): cursor.execute(query, params)
+        conn.commit()
+    except Exception:
+        conn.rollback(); raise
+    finally:
+        cursor.close()
+    return len(event_rows)
+
+
+# --- History reports (log only) ---
+LEAD_HISTORY_SQL = ("SELECT event_id, event_at, actor, event_type, old_status, new_status, changed_fields "
+                    "FROM lead_events WHERE lead_id = %s ORDER BY event_id")
+# Latest event of every lead before the cut-off; a lead's event ids grow with time.
+LEADS_AS_OF_SQL = (
+    "SELECT e.lead_id, e.new_status AS status, e.bank_name, e.site_engineer, e.event_at "
+    "FROM lead_events e JOIN (SELECT lead_id, MAX(event_id) AS event_id FROM lead_events WHERE event_at < %s GROUP BY lead_id) latest "
+    "ON latest.event_id = e.event_id"
+)
+USER_ACTIVITY_SQL = (
+    "SELECT actor, event_type, new_status, COUNT(*) AS events FROM lead_events "
+    "WHERE actor IS NOT NULL AND event_at >= %s AND event_at < %s GROUP BY actor, event_type, new_status"
+)
+
+def as_of_cutoff(as_of_date):
+    # Events up to the end of as_of_date.
+    return datetime.datetime.combine(as_of_date + datetime.timedelta(days=1), datetime.time())
+
+def leads_as_of_frames(rows):
+    # (status counts, bank x status counts) for the lead states returned by LEADS_AS_OF_SQL.
+    frame = pd.DataFrame(rows or [], columns=['lead_id', 'status', 'bank_name', 'site_engineer', 'event_at'])
+    status_counts = frame['status'].fillna('New').value_counts().rename_axis('Status').to_frame('Leads')
+    bank_status = frame.assign(status=frame['status'].fillna('New'), bank_name=frame['bank_name'].fillna('N/A')) \
+        .pivot_table(index='bank_name', columns='status', values='lead_id', aggfunc='count', fill_value=0)
+    bank_status.index.name = 'Bank'; bank_status.columns.name = None
+    if not bank_status.empty: bank_status['Total'] = bank_status.sum(axis=1)
+    return status_counts, bank_status
+
+def user_activity_frame(rows):
+    # One row per user: leads created, moved into each status, and field edits, over the queried window.
+    frame = pd.DataFrame(rows or [], columns=['actor', 'event_type', 'new_status', 'events'])
+    if frame.empty: return pd.DataFrame(index=pd.Index([], name='User'))
+    frame['Activity'] = [
+        'Created' if event_type == 'created' else f"-> {new_status}" if event_type == 'transition' else 'Edits'
+        for event_type, new_status in zip(frame['event_type'], frame['new_status'])
+    ]
+    activity = frame.pivot_table(index='actor', columns='Activity', values='events', aggfunc='sum', fill_value=0)
+    activity.index.name = 'User'; activity.columns.name = None
+    activity['Total'] = activity.sum(axis=1)
+    return activity.sort_values('Total', ascending=False)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the lead_events log.")
+    parser.add_argument('--seed', action='store_true', help="Create lead_events and add baseline events for leads without any.")
+    args = parser.parse_args()
+    if not args.seed: parser.print_help(); return
+
+    from instance import config
+    from mis_storage import backend_from_config
+    conn = backend_from_config(config).connect()
+    try:
+        started = datetime.datetime.now()
+        written = seed_lead_events(conn)
+    finally:
+        conn.close()
+    print(f"lead_events seeded in {(datetime.datetime.now() - started).total_seconds():.2f}s: {written} baseline event(s) written.")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,320 @@
+# mis_mail.py
+# Structure-aware IMAP fetch for lead emails. Instead of downloading the full RFC822 message (PDF and
+# photo attachments included) only to read its text, fetch_lead_email() asks the server for the MIME
+# tree (BODYSTRUCTURE) plus the Subject/From headers, then fetches just the one part the lead parser
+# needs: the first non-attachment text/plain part, else the first text/html part (converted with
+# mis_core.html_to_text). Each result reports the bytes fetched next to the full message size.
+# Servers that return a BODYSTRUCTURE we cannot read get the old full-message fetch.
+#
+# Attachments (sanction letters, property papers) are saved for the new lead: stage_email_attachments()
+# streams each accepted part to a staging folder in chunks (partial fetches, decoded as they arrive, so
+# a 20 MB PDF never sits in memory), skipping types not in the allow-list and parts over the size
+# limits. The lead INSERT then lists them in site_document_filenames and move_staged_attachments()
+# puts them in instance/lead_uploads/<id>/documents before that transaction commits.
+#
+#   python mis_mail.py --check 20          (dry run: last 20 inbox messages, bytes fetched vs message size)
+
+import os
+import re
+import email
+import quopri
+import base64
+import shutil
+import binascii
+import argparse
+import itertools
+import email.utils
+
+from mis_core import get_email_body, html_to_text, parse_subject
+
+EMAIL_TEXT_PART_MAX_BYTES = 262144 # longer text parts are cut here (partial fetch); lead details sit at the top
+LEAD_EMAIL_HEADER_FIELDS = "SUBJECT FROM"
+EMAIL_ATTACHMENT_EXTENSIONS = ['.pdf', '.doc', '.docx', '.xls', '.xlsx', '.txt', '.jpg', '.jpeg', '.png']
+EMAIL_ATTACHMENT_MAX_BYTES = 20 * 1024 * 1024        # per file (decoded)
+EMAIL_ATTACHMENTS_MAX_TOTAL_BYTES = 50 * 1024 * 1024 # per email
+EMAIL_ATTACHMENTS_MAX_COUNT = 10
+EMAIL_ATTACHMENT_CHUNK_BYTES = 1024 * 1024           # encoded bytes per partial fetch
+
+_TOKEN_RE = re.compile(rb'\s*(?:(\()|(\))|"((?:[^"\\]|\\.)*)"|\{(\d+)\}$|([^\s()"\[]+(?:\[[^\]]*\][^\s()"]*)?))')
+
+
+# --- IMAP response parsing ---
+def _tokens(fetch_data):
+    # imaplib FETCH data -> flat token list. Literals ({n} + bytes) arrive as (prefix, bytes) tuples.
+    for item in fetch_data:
+        prefix, literal = (item[0], item[1]) if isinstance(item, tuple) else (item, None)
+        pos = 0
+        while pos < len(prefix):
+            match = _TOKEN_RE.match(prefix, pos)
+            if not match or match.end() == pos:
+                if prefix[pos:].strip(): raise ValueError(f"Unparsable IMAP response near {prefix[pos:pos + 40]!r}")
+                break
+            pos = match.end()
+            open_paren, close_paren, quoted, literal_size, atom = match.groups()
+            if open_paren: yield '('
+            elif close_paren: yield ')'
+            elif quoted is not None: yield ('str', re.sub(rb'\\(.)', rb'\1', quoted))
+            elif literal_size is not None: yield ('str', literal or b'')
+            elif atom is not None: yield None if atom.upper() == b'NIL' else ('atom', atom)
+
+def _nest(tokens):
+    stack = [[]]
+    for token in tokens:
+        if token == '(': stack.append([])
+        elif token == ')':
+            if len(stack) == 1: raise ValueError("Unbalanced ')' in IMAP response")
+            done = stack.pop(); stack[-1].append(done)
+        else: stack[-1].append(token[1] if token else None)
+    if len(stack) != 1: raise ValueError("Unbalanced '(' in IMAP response")
+    return stack[0]
+
+def parse_fetch_response(fetch_data):
+    # {ITEM NAME (upper-case, partial origin dropped): value} for one message's FETCH response.
+    nested = _nest(_tokens(fetch_data))
+    items = next((value for value in nested if isinstance(value, list)), None)
+    if items is None: raise ValueError("No FETCH item list in IMAP response")
+    result = {}
+    for name, value in zip(items[0::2], items[1::2]):
+        result[re.sub(rb'<\d+>$', b'', name).decode().upper()] = value
+    return result
+
+
+# --- BODYSTRUCTURE ---
+def _text(value):
+    return value.decode(errors='replace') if isinstance(value, bytes) else value
+
+def _params(value):
+    if not isinstance(value, list): return {}
+    return {_text(key).lower(): _text(val) for key, val in zip(value[0::2], value[1::2])}
+
+def body_parts(structure, section=""):
+    # Leaf parts of a BODYSTRUCTURE as dicts (section, type, charset, encoding, size, attachment), in MIME order.
+    # Attached messages (message/rfc822) are treated as attachments, not descended into.
+    if structure and isinstance(structure[0], list): # multipart: children, then subtype and extension data
+        parts = []
+        for index, child in enumerate(itertools.takewhile(lambda item: isinstance(item, list), structure)):
+            parts.extend(body_parts(child, f"{section}.{index + 1}" if section else str(index + 1)))
+        return parts
+    main_type, sub_type = _text(structure[0] or b'').lower(), _text(structure[1] or b'').lower()
+    basic_fields = 8 if main_type == 'text' else 10 if (main_type, sub_type) == ('message', 'rfc822') else 7
+    disposition = structure[basic_fields + 1] if len(structure) > basic_fields + 1 else None
+    disposition_type = _text(disposition[0]).lower() if isinstance(disposition, list) and disposition and disposition[0] else None
+    try: size = int(structure[6]) if structure[6] is not None else 0
+    except (TypeError, ValueError): size = 0
+    disposition_params = _params(disposition[1]) if isinstance(disposition, list) and len(disposition) > 1 else {}
+    filename = disposition_params.get('filename') or _params(structure[2]).get('name')
+    return [{
+        'section': section or "1", 'type': f"{main_type}/{sub_type}", 'charset': _params(structure[2]).get('charset'),
+        'encoding': _text(structure[5] or b'7BIT').upper(), 'size': size,
+        'attachment': disposition_type == 'attachment' or (main_type, sub_type) == ('message', 'rfc822'),
+        'disposition': disposition_type, 'content_id': _text(structure[3]), 'filename': parse_subject(filename) if filename else None,
+    }]
+
+def choose_text_part(parts):
+    # Same choice as mis_core.get_email_body: first inline text/plain, else first inline text/html.
+    inline = [part for part in parts if not part['attachment']]
+    return next((part for part in inline if part['type'] == 'text/plain'), None) or \
+        next((part for part in inline if part['type'] == 'text/html'), None)
+
+def decode_part(payload, part):
+    if part['encoding'] == 'BASE64':
+        compact = re.sub(rb'[^A-Za-z0-9+/=]', b'', payload)
+        try: payload = base64.b64decode(compact[:len(compact) - len(compact) % 4]) # a partial fetch may end mid-quantum
+        except binascii.Error: payload = b''
+    elif part['encoding'] == 'QUOTED-PRINTABLE':
+        payload = quopri.decodestring(payload)
+    text = payload.decode(part['charset'] or 'utf-8', errors='ignore') if payload else ""
+    return html_to_text(text) if part['type'] == 'text/html' else text
+
+
+# --- Fetch ---
+def _item(items, name_prefix):
+    return next((value for name, value in items.items() if name.startswith(name_prefix)), None)
+
+def _fetched_bytes(fetch_data):
+    return sum(len(item[0]) + len(item[1] or b'') if isinstance(item, tuple) else len(item or b'') for item in fetch_data)
+
+def fetch_full_message(mail, message_id):
+    # The old path: whole message, parsed locally. PEEK, like every fetch here: the caller marks \Seen.
+    status, fetch_data = mail.fetch(message_id, "(BODY.PEEK[])")
+    if status != "OK": return None
+    raw = next((item[1] for item in fetch_data if isinstance(item, tuple) and len(item) >= 2 and isinstance(item[1], bytes)), None)
+    if raw is None: return None
+    msg = email.message_from_bytes(raw)
+    return {'subject': parse_subject(msg["Subject"]), 'sender': email.utils.parseaddr(msg.get('From'))[1], 'body': get_email_body(msg),
+            'part': None, 'parts': None, 'message': msg, 'bytes_fetched': _fetched_bytes(fetch_data), 'message_size': len(raw), 'mode': 'full'}
+
+def fetch_lead_email(mail, message_id, max_text_bytes=EMAIL_TEXT_PART_MAX_BYTES):
+    # {'subject', 'sender', 'body', 'part', 'parts', 'bytes_fetched', 'message_size', 'mode'}, or None if the fetch failed.
+    # Both FETCHes use BODY.PEEK[...], so the message stays unseen until the caller stores \Seen once it is handled.
+    status, fetch_data = mail.fetch(message_id, f"(RFC822.SIZE BODYSTRUCTURE BODY.PEEK[HEADER.FIELDS ({LEAD_EMAIL_HEADER_FIELDS})])")
+    if status != "OK": return None
+    try:
+        items = parse_fetch_response(fetch_data)
+        parts = body_parts(items['BODYSTRUCTURE'])
+    except (ValueError, KeyError, IndexError, TypeError) as e:
+        print(f"  BODYSTRUCTURE unreadable for Email ID {_text(message_id)} ({e}); fetching the full message.")
+        return fetch_full_message(mail, message_id)
+    headers = email.message_from_bytes(_item(items, "BODY[HEADER") or b'') # servers echo the field list in their own spelling
+    result = {'subject': parse_subject(headers["Subject"]), 'sender': email.utils.parseaddr(headers.get('From'))[1], 'body': None,
+              'part': None, 'parts': parts, 'message': None, 'bytes_fetched': _fetched_bytes(fetch_data), 'mode': 'structure'}
+    try: result['message_size'] = int(items.get('RFC822.SIZE') or 0)
+    except ValueError: result['message_size'] = 0
+    part = choose_text_part(parts)
+    if part is None: return result
+    status, part_data = mail.fetch(message_id, f"(BODY.PEEK[{part['section']}]<0.{max_text_bytes}>)")
+    if status != "OK": return None
+    result['bytes_fetched'] += _fetched_bytes(part_data)
+    payload = _item(parse_fetch_response(part_data), f"BODY[{part['section']}]") or b''
+    result['part'] = part; result['body'] = decode_part(payload, part)
+    return result
+
+# --- Attachments ---
+def safe_attachment_name(filename, taken=()):
+    # Bare file name safe for the lead folder; "x (2).pdf" when x.pdf is already taken.
+    name = re.sub(r'[\x00-\x1f<>:"/\\|?*]+', '_', os.path.basename((filename or '').replace('\\', '/'))).strip(' .')
+    stem, extension = os.path.splitext(name or 'attachment')
+    candidate = f"{stem[:120]}{extension.lower()}"; counter = 2
+    while candidate.lower() in {taken_name.lower() for taken_name in taken}:
+        candidate = f"{stem[:120]} ({counter}){extension.lower()}"; counter += 1
+    return candidate
+
+def _is_attachment(disposition, filename, content_id):
+    # Named parts, except inline images referenced from the HTML (logos, signatures).
+    return bool(filename) and not (disposition == 'inline' and content_id)
+
+def select_attachments(parts, extensions=EMAIL_ATTACHMENT_EXTENSIONS, max_bytes=EMAIL_ATTACHMENT_MAX_BYTES,
+                       max_total_bytes=EMAIL_ATTACHMENTS_MAX_TOTAL_BYTES, max_count=EMAIL_ATTACHMENTS_MAX_COUNT):
+    # (accepted parts, [(filename, reason)] skipped), decided from BODYSTRUCTURE alone, before any download.
+    accepted = []; skipped = []; total = 0
+    allowed = {extension.lower() for extension in extensions}
+    for part in parts:
+        if part['type'] == 'message/rfc822' or not _is_attachment(part['disposition'], part['filename'], part['content_id']): continue
+        decoded_size = part['size'] * 3 // 4 if part['encoding'] == 'BASE64' else part['size']
+        if os.path.splitext(part['filename'])[1].lower() not in allowed: skipped.append((part['filename'], "type not allowed"))
+        elif decoded_size > max_bytes: skipped.append((part['filename'], f"over {max_bytes / 1048576:g} MB"))
+        elif total + decoded_size > max_total_bytes: skipped.append((part['filename'], "email total over limit"))
+        elif len(accepted) >= max_count: skipped.append((part['filename'], "too many attachments"))
+        else: accepted.append(part); total += decoded_size
+    return accepted, skipped
+
+class _PartDecoder:
+    # Incremental Content-Transfer-Encoding decoder for chunked partial fetches.
+    def __init__(self, encoding):
+        self.encoding = encoding; self.pending = b''
+
+    def feed(self, chunk, final=False):
+        if self.encoding == 'BASE64':
+            data = self.pending + re.sub(rb'[^A-Za-z0-9+/=]', b'', chunk)
+            cut = len(data) if final else len(data) - len(data) % 4
+            self.pending = data[cut:]
+            return base64.b64decode(data[:cut]) if cut else b''
+        if self.encoding == 'QUOTED-PRINTABLE':
+            data = self.pending + chunk
+            cut = len(data) if final else data.rfind(b'\n') + 1 # soft breaks and =XX escapes never span a line
+            self.pending = data[cut:]
+            return quopri.decodestring(data[:cut]) if cut else b''
+        return chunk
+
+def stream_part_to_file(mail, message_id, part, file_path, max_bytes=EMAIL_ATTACHMENT_MAX_BYTES, chunk_bytes=EMAIL_ATTACHMENT_CHUNK_BYTES):
+    # Writes one MIME part to file_path, chunk_bytes of encoded data per FETCH. Returns (bytes written, bytes fetched).
+    # Raises ValueError (file removed) when the decoded part turns out larger than max_bytes.
+    decoder = _PartDecoder(part['encoding']); written = fetched = offset = 0
+    try:
+        with open(file_path, "wb") as f:
+            while True:
+                status, fetch_data = mail.fetch(message_id, f"(BODY.PEEK[{part['section']}]<{offset}.{chunk_bytes}>)")
+                if status != "OK": raise ValueError(f"FETCH of part {part['section']} failed: {status}")
+                fetched += _fetched_bytes(fetch_data)
+                chunk = _item(parse_fetch_response(fetch_data), f"BODY[{part['section']}]") or b''
+                offset += len(chunk); final = len(chunk) < chunk_bytes
+                data = decoder.feed(chunk, final)
+                written += len(data)
+                if written > max_bytes: raise ValueError(f"over {max_bytes / 1048576:g} MB")
+                f.write(data)
+                if final: break
+    except Exception:
+        if os.path.exists(file_path): os.remove(file_path)
+        raise
+    return written, fetched
+
+def stage_email_attachments(mail, message_id, fetched, staging_dir, extensions=EMAIL_ATTACHMENT_EXTENSIONS, max_bytes=EMAIL_ATTACHMENT_MAX_BYTES,
+                            max_total_bytes=EMAIL_ATTACHMENTS_MAX_TOTAL_BYTES, max_count=EMAIL_ATTACHMENTS_MAX_COUNT):
+    # Saves the allowed attachments of one email (a fetch_lead_email result) into staging_dir.
+    # Returns {'dir', 'files': [saved names], 'skipped': [(name, reason)], 'bytes_written', 'bytes_fetched'}.
+    staged = {'dir': staging_dir, 'files': [], 'skipped': [], 'bytes_written': 0, 'bytes_fetched': 0}
+    if fetched.get('message') is not None: # full-message fallback: the parts are already in memory
+        parts = [{'section': None, 'type': part.get_content_type(), 'encoding': '8BIT', 'size': len(part.get_payload(decode=True) or b''),
+                  'disposition': part.get_content_disposition(), 'content_id': part.get('Content-ID'), 'filename': part.get_filename(), 'payload': part}
+                 for part in fetched['message'].walk() if not part.is_multipart()]
+    else: parts = fetched.get('parts') or []
+    accepted, staged['skipped'] = select_attachments(parts, extensions, max_bytes, max_total_bytes, max_count)
+    if not accepted: return staged
+    os.makedirs(staging_dir, exist_ok=True)
+    for part in accepted:
+        name = safe_attachment_name(part['filename'], staged['files']); file_path = os.path.join(staging_dir, name)
+        try:
+            if part.get('payload') is not None:
+                data = part['payload'].get_payload(decode=True) or b''
+                with open(file_path, "wb") as f: f.write(data)
+                written, part_fetched = len(data), 0
+            else: written, part_fetched = stream_part_to_file(mail, message_id, part, file_path, max_bytes)
+        except Exception as e:
+            staged['skipped'].append((part['filename'], str(e))); continue
+        staged['files'].append(name); staged['bytes_written'] += written; staged['bytes_fetched'] += part_fetched
+    return staged
+
+def move_staged_attachments(staged, documents_dir):
+    # Moves staged files into the lead's documents folder (same file system: renames). Returns the paths
+    # created, for discard_moved_attachments() if the lead's transaction then fails.
+    os.makedirs(documents_dir, exist_ok=True); moved = []
+    try:
+        for name in staged['files']:
+            target = os.path.join(documents_dir, name)
+            os.replace(os.path.join(staged['dir'], name), target); moved.append(target)
+    except OSError:
+        discard_moved_attachments(moved); raise
+    return moved
+
+def discard_moved_attachments(paths):
+    for path in paths:
+        try: os.remove(path)
+        except OSError: pass
+
+def discard_staging(staged):
+    if staged and staged.get('dir'): shutil.rmtree(staged['dir'], ignore_errors=True)
+
+
+def describe_fetch(fetched):
+    # "2.1 KB of 3.4 MB (text/plain part 1)" for the per-email log line.
+    def size(n): return f"{n / 1048576:.1f} MB" if n >= 1048576 else f"{n / 1024:.1f} KB"
+    where = f"{fetched['part']['type']} part {fetched['part']['section']}" if fetched.get('part') else fetched['mode'] if fetched['mode'] == 'full' else "no text part"
+    return f"{size(fetched['bytes_fetched'])} of {size(fetched['message_size'])} ({where})"
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Dry run of the structure-aware lead email fetch.")
+    parser.add_argument('--check', type=int, metavar='N', help="Fetch the last N inbox messages read-only and report bytes fetched.")
+    args = parser.parse_args()
+    if not args.check: parser.print_help(); return
+
+    import imaplib
+    from instance import config
+    mail = imaplib.IMAP4_SSL(config.IMAP_SERVER)
+    try:
+        mail.login(config.EMAIL_ACCOUNT, config.EMAIL_PASSWORD)
+        mail.select("inbox", readonly=True) # read-only: nothing gets marked \Seen
+        _, search_data = mail.search(None, "ALL")
+        fetched_total = size_total = 0
+        for message_id in search_data[0].split()[-args.check:]:
+            fetched = fetch_lead_email(mail, message_id)
+            if fetched is None: print(f"{message_id.decode()}: fetch failed"); continue
+            fetched_total += fetched['bytes_fetched']; size_total += fetched['message_size']
+            print(f"{message_id.decode()}: {describe_fetch(fetched)} | {fetched['subject'][:60]}")
+        print(f"Total: {fetched_total} of {size_total} bytes fetched.")
+    finally:
+        try: mail.logout()
+        except Exception: pass
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,170 @@
+# mis_replica.py
+# Read-replica routing. With READ_REPLICA_CONFIG set in instance/config.py (a MySQL replica of the
+# primary in MYSQL_CONFIG), read-only queries - lead lists, dashboards, exports, search, snapshot
+# refreshes - go to the replica and every write stays on the primary.
+#
+# Lag is measured with a heartbeat row, not SHOW REPLICA STATUS (no REPLICATION CLIENT privilege
+# needed): a background thread writes the current time into replica_heartbeat on the primary every
+# READ_REPLICA_HEARTBEAT_SECONDS and reads the replica's copy back. Replication applies commits in
+# order, so once the replica holds a beat written after a commit it also holds that commit:
+#   - lag: 0 when the replica has the last beat written, else seconds since the beat it does have.
+#     Above READ_REPLICA_MAX_LAG_SECONDS (or replica unreachable) all reads fall back to the primary.
+#   - read-your-writes: a session that wrote at time T reads from the primary until the replica's
+#     beat is newer than T (usually one heartbeat), then goes back to the replica.
+#
+# To try it with two local mysqld instances: make the second a replica of the first (CHANGE
+# REPLICATION SOURCE TO ...; START REPLICA), point READ_REPLICA_CONFIG at it, then watch routing with
+#   python mis_replica.py --watch
+# and STOP REPLICA on the second instance to see reads move to the primary after the lag threshold.
+
+import time
+import argparse
+import datetime
+import threading
+
+REPLICA_HEARTBEAT_DDL = """
+    CREATE TABLE IF NOT EXISTS replica_heartbeat (
+        id TINYINT PRIMARY KEY,
+        beat_at DATETIME(6) NOT NULL
+    )
+"""
+REPLICA_HEARTBEAT_WRITE_SQL = "INSERT INTO replica_heartbeat (id, beat_at) VALUES (1, %s) ON DUPLICATE KEY UPDATE beat_at = VALUES(beat_at)"
+REPLICA_HEARTBEAT_READ_SQL = "SELECT beat_at FROM replica_heartbeat WHERE id = 1"
+
+
+class ReplicaRouter:
+    def __init__(self, primary_connect, replica_connect, max_lag_seconds=5, heartbeat_seconds=1):
+        self.primary_connect = primary_connect; self.replica_connect = replica_connect # callables returning new connections
+        self.max_lag_seconds = max_lag_seconds; self.heartbeat_seconds = heartbeat_seconds
+        self.replica_beat = None     # newest beat seen on the replica
+        self.lag_seconds = None      # None: unknown (replica unreachable / not replicating the heartbeat)
+        self.checked_at = None
+        self.last_write_at = None    # newest commit reported by this process (note_write)
+        self.last_error = None
+        self.stats = {'replica_reads': 0, 'primary_reads': 0, 'fallback_reads': 0, 'started_at': datetime.datetime.now()}
+        self._last_beat_written = None
+        self._wake = threading.Event(); self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="mis-replica-heartbeat", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set(); self._wake.set()
+
+    def note_write(self):
+        # Called after any committed write; returns the time to pass as write_at for read-your-writes.
+        write_at = datetime.datetime.now()
+        self.last_write_at = write_at if self.last_write_at is None else max(self.last_write_at, write_at)
+        self._wake.set() # write the next beat now, so the session gets back to the replica sooner
+        return write_at
+
+    def healthy(self):
+        if self.lag_seconds is None or self.checked_at is None: return False
+        stale_after = self.max_lag_seconds + 3 * self.heartbeat_seconds # heartbeat thread stuck or primary down
+        return self.lag_seconds <= self.max_lag_seconds and time.monotonic() - self.checked_at <= stale_after
+
+    def use_replica(self, write_at=None):
+        if not self.healthy(): return False
+        return write_at is None or (self.replica_beat is not None and self.replica_beat > write_at)
+
+    def route(self, write_at=None, reads=1):
+        # use_replica() plus bookkeeping for the admin panel; for callers with their own connections (async pool).
+        on_replica = self.use_replica(write_at)
+        self.stats['replica_reads' if on_replica else 'primary_reads'] += reads
+        return on_replica
+
+    def read_connect(self, write_at=None):
+        # New connection for a read-only query: the replica when it is healthy and has write_at, else the primary.
+        if self.route(write_at):
+            try: return self.replica_connect()
+            except Exception as e:
+                self.lag_seconds = None; self.last_error = f"{datetime.datetime.now():%H:%M:%S} {e}"
+                print(f"Read replica unavailable ({e}), reading from the primary.")
+                self.stats['replica_reads'] -= 1; self.stats['fallback_reads'] += 1
+        return self.primary_connect()
+
+    def status(self):
+        return {'healthy': self.healthy(), 'lag_seconds': self.lag_seconds, 'replica_beat': self.replica_beat,
+                'last_error': self.last_error, **self.stats}
+
+    def _query(self, connect, query, params=()):
+        conn = connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query, params)
+            row = cursor.fetchone() if cursor.description else None
+            if cursor.description: cursor.fetchall()
+            conn.commit(); cursor.close()
+            return row
+        finally:
+            conn.close()
+
+    def ensure_heartbeat_table(self):
+        self._query(self.primary_connect, REPLICA_HEARTBEAT_DDL)
+
+    def check(self):
+        # One heartbeat: read the replica's beat (written last round), then write a new one on the primary.
+        try:
+            row = self._query(self.replica_connect, REPLICA_HEARTBEAT_READ_SQL)
+            self.replica_beat = row[0] if row else None
+            if self.replica_beat is None: self.lag_seconds = None
+            elif self._last_beat_written is not None and self.replica_beat >= self._last_beat_written: self.lag_seconds = 0.0
+            else: self.lag_seconds = (datetime.datetime.now() - self.replica_beat).total_seconds()
+            self.last_error = None
+        except Exception as e:
+            self.lag_seconds = None; self.last_error = f"{datetime.datetime.now():%H:%M:%S} {e}"
+        self.checked_at = time.monotonic()
+        beat_at = datetime.datetime.now()
+        self._query(self.primary_connect, REPLICA_HEARTBEAT_WRITE_SQL, (beat_at,))
+        self._last_beat_written = beat_at
+
+    def _run(self):
+        try: self.ensure_heartbeat_table()
+        except Exception as e: print(f"Could not create replica_heartbeat on the primary: {e}")
+        while not self._stop.is_set():
+            self._wake.clear()
+            try: self.check()
+            except Exception as e:
+                self.last_error = f"{datetime.datetime.now():%H:%M:%S} {e}"
+                print(f"Replica heartbeat failed: {e}")
+            self._wake.wait(self.heartbeat_seconds)
+
+
+def router_from_config(config):
+    # ReplicaRouter for instance/config.py, or None when no replica is configured.
+    replica_config = getattr(config, 'READ_REPLICA_CONFIG', None)
+    if not replica_config or getattr(config, 'DB_BACKEND', 'mysql') != 'mysql': return None
+    from mis_storage import MySqlBackend
+    primary, replica = MySqlBackend(config.MYSQL_CONFIG), MySqlBackend(replica_config)
+    return ReplicaRouter(primary.connect, replica.connect, getattr(config, 'READ_REPLICA_MAX_LAG_SECONDS', 5),
+                         getattr(config, 'READ_REPLICA_HEARTBEAT_SECONDS', 1))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check read-replica lag and routing.")
+    parser.add_argument('--watch', action='store_true', help="Print lag and routing every heartbeat until Ctrl+C.")
+    parser.add_argument('--check', action='store_true', help="Run a few heartbeats and print the result.")
+    args = parser.parse_args()
+    if not args.watch and not args.check: parser.print_help(); return
+
+    from instance import config
+    router = router_from_config(config)
+    if router is None: print("No READ_REPLICA_CONFIG in instance/config.py (or DB_BACKEND is not mysql)."); return
+    router.ensure_heartbeat_table()
+    rounds = 0
+    try:
+        while args.watch or rounds < 3:
+            router.check(); rounds += 1
+            lag = "unknown" if router.lag_seconds is None else f"{router.lag_seconds:.1f}s"
+            print(f"{datetime.datetime.now():%H:%M:%S} lag {lag} -> reads go to {'replica' if router.use_replica() else 'primary'}"
+                  + (f" ({router.last_error})" if router.last_error else ""))
+            time.sleep(router.heartbeat_seconds)
+    except KeyboardInterrupt:
+        pass
+
+if __name__ == "__main__":
+    main()
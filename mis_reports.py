@@ -0,0 +1,270 @@
+# mis_reports.py
+# Prebuilt reports. The standard workbooks - the daily Custom MIS report, the same report per bank,
+# and the per-day allocation table for the current month - are built by a background thread at the
+# times in REPORT_SCHEDULE_TIMES and written to instance/reports/. The UI serves the newest file with
+# its build time instead of rebuilding the workbook on every rerun, and says when leads have changed
+# since (the office signature is kept in the manifest); a live build happens only on "Regenerate now".
+# The admin "Regenerate Now" builds a fresh set for everyone.
+#
+# Files are written to a .tmp name and renamed, so a download never sees half a workbook.
+# reports_manifest.json lists the files per report (newest first); files older than
+# REPORT_RETENTION_DAYS are deleted, but the newest REPORT_KEEP_LATEST of each report are always kept.
+#
+#   python mis_reports.py --build                  (build every report now from the DB in instance/config.py)
+#   python mis_reports.py --build --sqlite bench.db --reports-dir /tmp/reports
+#   python mis_reports.py --list
+
+import os
+import re
+import json
+import hashlib
+import time
+import argparse
+import datetime
+import threading
+from io import BytesIO
+
+from mis_core import PANDAS_AVAILABLE, build_lead_dataframe, build_per_day_allocation_table, generate_custom_excel_report
+
+if PANDAS_AVAILABLE:
+    import pandas as pd
+
+REPORTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "reports")
+REPORT_MANIFEST_FILE = "reports_manifest.json"
+REPORT_KINDS = {
+    'daily_mis': "Daily MIS Report",
+    'per_bank': "Per-Bank MIS Reports",
+    'monthly_allocation': "Per-Day Allocation (month to date)",
+}
+REPORT_LEADS_SQL = "SELECT * FROM office ORDER BY received_date DESC, id DESC"
+# Same signature as mis_shared.SHARED_SIGNATURE_SQL: every lead write changes it (each UPDATE bumps version).
+REPORT_SIGNATURE_SQL = "SELECT COUNT(*) AS row_count, MAX(id) AS max_id, COALESCE(SUM(version), 0) AS version_sum FROM office"
+XLSX_MIME = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+
+def report_key(kind, scope=None):
+    # Manifest key: 'daily_mis', 'per_bank:HDFC Bank', 'monthly_allocation:2026-10'.
+    return kind if scope is None else f"{kind}:{scope}"
+
+def _slug(text):
+    return re.sub(r"[^A-Za-z0-9]+", "_", str(text)).strip("_") or "unnamed"
+
+def _scoped_slug(text):
+    # _slug plus a short hash of the exact text: "A.B" and "A B" share a slug but not a directory.
+    return f"{_slug(text)}_{hashlib.sha1(str(text).encode('utf-8')).hexdigest()[:8]}"
+
+def report_signature(values):
+    # JSON-friendly form of a REPORT_SIGNATURE_SQL row (SUM comes back as Decimal from MySQL).
+    return [int(value or 0) for value in values]
+
+def _fetch_dicts(conn, query, params=()):
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    columns = [desc[0] for desc in cursor.description]
+    rows = [dict(zip(columns, row)) for row in cursor.fetchall()]
+    cursor.close()
+    return rows
+
+def _custom_report_bytes(df):
+    excel_stream = generate_custom_excel_report(df)
+    return excel_stream.getvalue() if excel_stream is not None else None
+
+def build_allocation_excel(table_df, yr, mo):
+    output_stream = BytesIO()
+    with pd.ExcelWriter(output_stream, engine='openpyxl') as excel_writer:
+        table_df.to_excel(excel_writer, index=False, sheet_name=f"Allocation_{yr}_{mo:02d}")
+    return output_stream.getvalue()
+
+def read_report_manifest(reports_dir=REPORTS_DIR):
+    manifest_path = os.path.join(reports_dir, REPORT_MANIFEST_FILE)
+    if not os.path.exists(manifest_path): return {'reports': {}, 'built_at': None}
+    with open(manifest_path) as f: return json.load(f)
+
+def _write_manifest(reports_dir, manifest):
+    tmp_path = os.path.join(reports_dir, REPORT_MANIFEST_FILE + ".tmp")
+    with open(tmp_path, 'w') as f: json.dump(manifest, f, indent=1)
+    os.replace(tmp_path, os.path.join(reports_dir, REPORT_MANIFEST_FILE))
+
+def _write_report(reports_dir, relative_path, data):
+    file_path = os.path.join(reports_dir, relative_path)
+    os.makedirs(os.path.dirname(file_path), exist_ok=True)
+    with open(file_path + ".tmp", 'wb') as f: f.write(data)
+    os.replace(file_path + ".tmp", file_path)
+    return len(data)
+
+def latest_report(key, reports_dir=REPORTS_DIR, manifest=None):
+    # (absolute path, manifest entry) of the newest file for key, or None if there is none on disk.
+    manifest = manifest or read_report_manifest(reports_dir)
+    for entry in manifest['reports'].get(key, []):
+        file_path = os.path.join(reports_dir, entry['file'])
+        if os.path.exists(file_path): return file_path, entry
+    return None
+
+def apply_retention(reports_dir, manifest, retention_days=30, keep_latest=3, now=None):
+    # Drops files older than retention_days from the manifest and disk, keeping the newest keep_latest per report.
+    cutoff = ((now or datetime.datetime.now()) - datetime.timedelta(days=retention_days)).isoformat(timespec='seconds')
+    removed = 0
+    for key, entries in manifest['reports'].items():
+        kept = []
+        for position, entry in enumerate(entries):
+            if position < keep_latest or entry['generated_at'] >= cutoff: kept.append(entry); continue
+            try: os.remove(os.path.join(reports_dir, entry['file'])); removed += 1
+            except FileNotFoundError: pass
+        manifest['reports'][key] = kept
+    return removed
+
+def build_reports(connect, reports_dir=REPORTS_DIR, kinds=tuple(REPORT_KINDS), retention_days=30, keep_latest=3, now=None):
+    # Builds the given report kinds from one read of 'office'. Returns {'files': n, 'bytes': n, 'rows': n, 'seconds': s, 'removed': n}.
+    if not PANDAS_AVAILABLE: raise RuntimeError("pandas and openpyxl are required for the prebuilt reports.")
+    started = time.perf_counter()
+    now = now or datetime.datetime.now()
+    conn = connect()
+    try:
+        signature = report_signature(_fetch_dicts(conn, REPORT_SIGNATURE_SQL)[0].values()) # before the rows: a write in between only marks the files stale
+        rows = _fetch_dicts(conn, REPORT_LEADS_SQL)
+    finally: conn.close()
+    lead_df = build_lead_dataframe(rows) if rows else pd.DataFrame()
+    stamp = f"{now:%Y%m%d_%H%M%S}"; generated_at = now.isoformat(timespec='seconds')
+
+    outputs = [] # (key, relative path, bytes, rows)
+    if rows and 'daily_mis' in kinds:
+        outputs.append((report_key('daily_mis'), os.path.join('daily_mis', f"MIS_Formatted_Report_{stamp}.xlsx"), _custom_report_bytes(lead_df), len(lead_df)))
+    if rows and 'per_bank' in kinds:
+        for bank_name, bank_df in lead_df.groupby('bank_name', observed=True, sort=True):
+            if bank_df.empty or not str(bank_name).strip(): continue
+            outputs.append((report_key('per_bank', str(bank_name)), os.path.join('per_bank', _scoped_slug(bank_name), f"MIS_Formatted_Report_{_slug(bank_name)}_{stamp}.xlsx"),
+                            _custom_report_bytes(bank_df), len(bank_df)))
+    if rows and 'monthly_allocation' in kinds:
+        manifest = read_report_manifest(reports_dir)
+        months = [(now.year, now.month)]
+        previous_month = (now.replace(day=1) - datetime.timedelta(days=1))
+        previous_entry = latest_report(report_key('monthly_allocation', f"{previous_month:%Y-%m}"), reports_dir, manifest)
+        if previous_entry is None or previous_entry[1]['generated_at'] < f"{now:%Y-%m}-01": months.append((previous_month.year, previous_month.month)) # once more after the month closes
+        for yr, mo in months:
+            table_df = build_per_day_allocation_table(lead_df, yr, mo)
+            if table_df is None: continue
+            outputs.append((report_key('monthly_allocation', f"{yr}-{mo:02d}"), os.path.join('monthly_allocation', f"Per_Day_Allocation_{yr}-{mo:02d}_{stamp}.xlsx"),
+                            build_allocation_excel(table_df, yr, mo), int(table_df['Total Received'].sum())))
+
+    os.makedirs(reports_dir, exist_ok=True)
+    total_bytes = 0
+    for key, relative_path, data, row_count in outputs:
+        if data: total_bytes += _write_report(reports_dir, relative_path, data)
+    manifest = read_report_manifest(reports_dir) # re-read: a concurrent CLI build may have added entries
+    for key, relative_path, data, row_count in outputs:
+        if data: manifest['reports'].setdefault(key, []).append({'file': relative_path, 'generated_at': generated_at, 'rows': row_count,
+                                                                 'bytes': len(data), 'office_signature': signature})
+    for entries in manifest['reports'].values(): entries.sort(key=lambda entry: entry['generated_at'], reverse=True)
+    removed = apply_retention(reports_dir, manifest, retention_days, keep_latest, now)
+    manifest['built_at'] = generated_at
+    _write_manifest(reports_dir, manifest)
+    return {'files': sum(1 for output in outputs if output[2]), 'bytes': total_bytes, 'rows': len(rows),
+            'seconds': round(time.perf_counter() - started, 2), 'removed': removed}
+
+def parse_schedule_times(times):
+    return sorted(datetime.datetime.strptime(text.strip(), "%H:%M").time() for text in times)
+
+def last_scheduled_run(now, schedule_times):
+    # Most recent scheduled datetime at or before now (today's or yesterday's last slot), None without a schedule.
+    if not schedule_times: return None
+    today_slots = [datetime.datetime.combine(now.date(), slot) for slot in schedule_times if datetime.datetime.combine(now.date(), slot) <= now]
+    return today_slots[-1] if today_slots else datetime.datetime.combine(now.date() - datetime.timedelta(days=1), schedule_times[-1])
+
+def is_report_current(entry, signature, schedule_times=(), now=None):
+    # A manifest entry is still what a live build would produce: built at or after the last scheduled run,
+    # and 'office' still has the signature it was built from. signature: a REPORT_SIGNATURE_SQL row, or None.
+    scheduled_run = last_scheduled_run(now or datetime.datetime.now(), schedule_times)
+    if scheduled_run is not None and entry['generated_at'] < scheduled_run.isoformat(timespec='seconds'): return False
+    return signature is not None and entry.get('office_signature') == report_signature(signature)
+
+
+class ReportScheduler:
+    def __init__(self, connect, reports_dir=REPORTS_DIR, schedule_times=("07:00",), retention_days=30, keep_latest=3, check_seconds=60):
+        self.connect = connect # callable returning a new DB-API connection
+        self.reports_dir = reports_dir
+        self.schedule_times = parse_schedule_times(schedule_times)
+        self.retention_days = retention_days; self.keep_latest = keep_latest; self.check_seconds = check_seconds
+        self.last_result = None; self.last_error = None; self.building_since = None
+        self._build_lock = threading.Lock()
+        self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None and self.schedule_times:
+            self._thread = threading.Thread(target=self._run, name="mis-report-scheduler", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def run_now(self):
+        # Builds every report now. A call made while a build is running waits for it and then builds again,
+        # so the caller always gets files that include the data as of its click.
+        with self._build_lock:
+            self.building_since = datetime.datetime.now()
+            try:
+                self.last_result = build_reports(self.connect, self.reports_dir, retention_days=self.retention_days, keep_latest=self.keep_latest)
+                self.last_error = None
+            except Exception as e:
+                self.last_error = f"{datetime.datetime.now():%H:%M:%S} {e}"
+                raise
+            finally:
+                self.building_since = None
+            return self.last_result
+
+    def next_run(self, now=None):
+        now = now or datetime.datetime.now()
+        if not self.schedule_times: return None
+        upcoming = [datetime.datetime.combine(now.date(), slot) for slot in self.schedule_times if datetime.datetime.combine(now.date(), slot) > now]
+        return upcoming[0] if upcoming else datetime.datetime.combine(now.date() + datetime.timedelta(days=1), self.schedule_times[0])
+
+    def due(self, now=None):
+        # True when the latest scheduled slot has passed since the last build (also catches up after a restart).
+        slot = last_scheduled_run(now or datetime.datetime.now(), self.schedule_times)
+        built_at = read_report_manifest(self.reports_dir).get('built_at')
+        return slot is not None and (built_at is None or built_at < slot.isoformat(timespec='seconds'))
+
+    def status(self):
+        manifest = read_report_manifest(self.reports_dir)
+        return {'built_at': manifest.get('built_at'), 'next_run': self.next_run(), 'building_since': self.building_since,
+                'last_result': self.last_result, 'last_error': self.last_error, 'report_count': len(manifest['reports'])}
+
+    def _run(self):
+        while not self._stop.is_set():
+            try:
+                if self.due():
+                    result = self.run_now()
+                    print(f"Scheduled reports built: {result['files']} file(s), {result['bytes'] / 1048576:.1f} MB in {result['seconds']}s, {result['removed']} old file(s) removed.")
+            except Exception as e:
+                self.last_error = f"{datetime.datetime.now():%H:%M:%S} {e}"
+                print(f"Scheduled report build failed: {e}")
+            self._stop.wait(self.check_seconds)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Prebuilt MIS reports.")
+    parser.add_argument('--build', action='store_true', help="Build every report now.")
+    parser.add_argument('--list', action='store_true', help="List the newest file of each report.")
+    parser.add_argument('--sqlite', help="Read leads from this SQLite file instead of the configured database.")
+    parser.add_argument('--reports-dir', default=REPORTS_DIR)
+    args = parser.parse_args()
+    if not args.build and not args.list: parser.print_help(); return
+
+    if args.build:
+        if args.sqlite:
+            from mis_storage import SqliteBackend
+            connect = SqliteBackend(args.sqlite).connect
+        else:
+            from instance import config
+            from mis_storage import backend_from_config
+            connect = backend_from_config(config).connect
+        result = build_reports(connect, args.reports_dir)
+        print(f"Built {result['files']} file(s) ({result['bytes'] / 1048576:.1f} MB) from {result['rows']} leads in {result['seconds']}s; "
+              f"{result['removed']} old file(s) removed.")
+    manifest = read_report_manifest(args.reports_dir)
+    for key, entries in sorted(manifest['reports'].items()):
+        if entries: print(f"{key:<45} {entries[0]['generated_at']}  {entries[0]['rows']:>7} rows  {entries[0]['file']}  ({len(entries)} kept)")
+
+if __name__ == "__main__":
+    main()
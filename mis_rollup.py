@@ -0,0 +1,212 @@
+# mis_rollup.py
+# 'daily_lead_stats': per (day, bank, engineer, status) counters kept up to date alongside every lead
+# insert and status change, so the multi-month trend dashboards never scan 'office'.
+#
+#   received_count       leads received that day (counted under the status they were created with)
+#   entered_count        leads that moved into this status that day (creation counts as entering)
+#   exited_count         leads that moved out of this status that day
+#   turnaround_days_sum  for 'Completed': received -> completion days of the leads completed that day
+#
+# Open leads in a status on day D = sum(entered - exited) up to D, which gives the backlog curve.
+#
+#   python mis_rollup.py --rebuild       (recompute the whole table from 'office' and 'office_archive')
+
+import argparse
+import datetime
+from collections import defaultdict
+
+try:
+    import pandas as pd
+    PANDAS_AVAILABLE = True
+except ImportError:
+    PANDAS_AVAILABLE = False
+
+DAILY_LEAD_STATS_DDL = """
+    CREATE TABLE IF NOT EXISTS daily_lead_stats (
+        stat_date DATE NOT NULL,
+        bank_name VARCHAR(255) NOT NULL,
+        site_engineer VARCHAR(255) NOT NULL DEFAULT '',
+        status VARCHAR(50) NOT NULL,
+        received_count INT NOT NULL DEFAULT 0,
+        entered_count INT NOT NULL DEFAULT 0,
+        exited_count INT NOT NULL DEFAULT 0,
+        turnaround_days_sum INT NOT NULL DEFAULT 0,
+        PRIMARY KEY (stat_date, bank_name, site_engineer, status)
+    )
+"""
+LEAD_STATS_COUNTERS = ['received_count', 'entered_count', 'exited_count', 'turnaround_days_sum']
+LEAD_STATS_UPSERT_SQL = (
+    "INSERT INTO daily_lead_stats (stat_date, bank_name, site_engineer, status, " + ", ".join(LEAD_STATS_COUNTERS) + ") "
+    "SELECT %s, %s, %s, %s, %s, %s, %s, %s FROM {source} "
+    "ON DUPLICATE KEY UPDATE " + ", ".join(f"{col}={col}+%s" for col in LEAD_STATS_COUNTERS)
+)
+LEAD_STATS_INSERT_SQL = (
+    "INSERT INTO daily_lead_stats (stat_date, bank_name, site_engineer, status, " + ", ".join(LEAD_STATS_COUNTERS) + ") "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s, %s)"
+)
+# Date column each status sets when a lead moves into it (used when history has to be reconstructed).
+STATUS_DATE_COLUMNS = {'Assigned Engineer': 'date_of_allocation', 'Visit Done': 'visit_completion_date',
+                       'Report in Progress': 'visit_completion_date', 'Completed': 'lead_completion_date'}
+ROLLUP_SOURCE_COLUMNS = "id, bank_name, site_engineer, status, received_date, date_of_allocation, visit_completion_date, lead_completion_date"
+ROLLUP_ARCHIVE_TABLE = 'office_archive' # mis_archive.ARCHIVE_TABLE; not imported, mis_archive imports this module via mis_events
+
+
+def _as_date(value):
+    if value is None: return None
+    if PANDAS_AVAILABLE and pd.isna(value): return None
+    if isinstance(value, datetime.datetime): return value.date()
+    if isinstance(value, datetime.date): return value
+    try: return datetime.datetime.strptime(str(value)[:10], '%Y-%m-%d').date()
+    except ValueError: return None
+
+def _turnaround_days(received, completed_on):
+    received_on = _as_date(received)
+    return max((completed_on - received_on).days, 0) if received_on and completed_on else 0
+
+def lead_stats_upsert(stat_date, bank_name, engineer, status, counters, guard=None):
+    # counters: {counter column: increment}. guard=(lead_id, version) makes the row count only if office
+    # holds that version of the lead, i.e. the UPDATE it is paired with in the transaction went through.
+    increments = [int(counters.get(col, 0)) for col in LEAD_STATS_COUNTERS]
+    key = [stat_date, bank_name or '', engineer or '', status or 'New']
+    if guard: return LEAD_STATS_UPSERT_SQL.format(source="office WHERE id=%s AND version=%s"), tuple(key + increments + list(guard) + increments)
+    return LEAD_STATS_UPSERT_SQL.format(source="DUAL"), tuple(key + increments + increments)
+
+def lead_stats_insert_statements(leads):
+    # Statements to run in the same transaction as the INSERT(s) of new leads; one upsert per rollup key.
+    totals = defaultdict(int)
+    for lead in leads:
+        received_on = _as_date(lead.get('received_date')) or datetime.date.today()
+        totals[(received_on, lead.get('bank_name') or '', lead.get('site_engineer') or '', lead.get('status') or 'New')] += 1
+    return [lead_stats_upsert(*key, {'received_count': count, 'entered_count': count}) for key, count in totals.items()]
+
+def lead_stats_transition_statements(lead, new_status, new_engineer=None, event_date=None):
+    # Moves one lead (as loaded) between rollup keys: an exit under its old (engineer, status) and an
+    # entry under the new one. Run them only once the lead's UPDATE is known to have changed the row
+    # (run_db_transaction's followup), so a lost race never counts twice.
+    old_status = lead.get('status') or 'New'; old_engineer = lead.get('site_engineer') or ''
+    new_engineer = (new_engineer if new_engineer is not None else old_engineer) or ''
+    if old_status == new_status and old_engineer == new_engineer: return []
+    event_date = event_date or datetime.date.today()
+    entry_counters = {'entered_count': 1}
+    if new_status == 'Completed': entry_counters['turnaround_days_sum'] = _turnaround_days(lead.get('received_date'), event_date)
+    return [lead_stats_upsert(event_date, lead.get('bank_name'), old_engineer, old_status, {'exited_count': 1}),
+            lead_stats_upsert(event_date, lead.get('bank_name'), new_engineer, new_status, entry_counters)]
+
+
+# --- Rebuild ---
+def derive_daily_lead_stats(leads):
+    # Rollup rows reconstructed from the current office rows. History is not stored, so every lead is taken
+    # to arrive as 'New' (unassigned) on its received date and to move straight to its current status on the
+    # date column that status sets; open counts per status therefore match 'office' exactly.
+    stats = defaultdict(lambda: dict.fromkeys(LEAD_STATS_COUNTERS, 0))
+    for lead in leads:
+        received_on = _as_date(lead.get('received_date'))
+        if received_on is None: continue
+        bank_name = lead.get('bank_name') or ''; status = lead.get('status') or 'New'
+        new_key = (received_on, bank_name, '', 'New')
+        stats[new_key]['received_count'] += 1; stats[new_key]['entered_count'] += 1
+        if status == 'New': continue
+        moved_on = max(_as_date(lead.get(STATUS_DATE_COLUMNS.get(status, 'received_date'))) or received_on, received_on)
+        stats[(moved_on, bank_name, '', 'New')]['exited_count'] += 1
+        current_key = (moved_on, bank_name, lead.get('site_engineer') or '', status)
+        stats[current_key]['entered_count'] += 1
+        if status == 'Completed': stats[current_key]['turnaround_days_sum'] += _turnaround_days(received_on, moved_on)
+    return [key + tuple(counters[col] for col in LEAD_STATS_COUNTERS) for key, counters in sorted(stats.items())]
+
+def rebuild_daily_lead_stats(conn, batch_size=1000):
+    # Replaces the rollup in one transaction. conn: a mysql.connector connection. Returns rollup rows written.
+    # Archived leads keep their counters (archiving moves rows, not history), so they are read back in too.
+    cursor = conn.cursor()
+    try:
+        cursor.execute(DAILY_LEAD_STATS_DDL)
+        cursor.execute(f"SHOW TABLES LIKE '{ROLLUP_ARCHIVE_TABLE}';")
+        has_archive = cursor.fetchone() is not None
+        source_sql = f"SELECT {ROLLUP_SOURCE_COLUMNS} FROM office"
+        if has_archive: source_sql += f" UNION ALL SELECT {ROLLUP_SOURCE_COLUMNS} FROM {ROLLUP_ARCHIVE_TABLE}"
+        cursor.execute(source_sql)
+        columns = [desc[0] for desc in cursor.description]
+        rollup_rows = derive_daily_lead_stats(dict(zip(columns, row)) for row in cursor.fetchall())
+        cursor.execute("DELETE FROM daily_lead_stats") # same transaction as the inserts (autocommit is off)
+        for start in range(0, len(rollup_rows), batch_size):
+            cursor.executemany(LEAD_STATS_INSERT_SQL, rollup_rows[start:start + batch_size])
+        conn.commit()
+    except Exception:
+        conn.rollback(); raise
+    finally:
+        cursor.close()
+    return len(rollup_rows)
+
+
+# --- Trend Queries (rollup only) ---
+TREND_MONTHLY_SQL = (
+    "SELECT YEAR(stat_date) AS yr, MONTH(stat_date) AS mo, SUM(received_count) AS received, "
+    "SUM(CASE WHEN status = 'Completed' THEN entered_count ELSE 0 END) AS completed, "
+    "SUM(CASE WHEN status = 'Completed' THEN turnaround_days_sum ELSE 0 END) AS turnaround_days "
+    "FROM daily_lead_stats WHERE stat_date >= %s GROUP BY yr, mo ORDER BY yr, mo"
+)
+TREND_BANK_VOLUME_SQL = (
+    "SELECT YEAR(stat_date) AS yr, MONTH(stat_date) AS mo, bank_name, SUM(received_count) AS received "
+    "FROM daily_lead_stats WHERE stat_date >= %s AND received_count > 0 GROUP BY yr, mo, bank_name"
+)
+TREND_BACKLOG_OPENING_SQL = (
+    "SELECT COALESCE(SUM(entered_count - exited_count), 0) AS open_leads FROM daily_lead_stats "
+    "WHERE status <> 'Completed' AND stat_date < %s"
+)
+TREND_BACKLOG_DAILY_SQL = (
+    "SELECT stat_date, SUM(entered_count - exited_count) AS delta FROM daily_lead_stats "
+    "WHERE status <> 'Completed' AND stat_date >= %s GROUP BY stat_date ORDER BY stat_date"
+)
+
+def trend_window_start(months=12, today=None):
+    today = today or datetime.date.today()
+    month_index = today.year * 12 + today.month - 1 - (months - 1)
+    return datetime.date(month_index // 12, month_index % 12 + 1, 1)
+
+def _month_labels(since, today=None):
+    today = today or datetime.date.today()
+    return [f"{month_index // 12}-{month_index % 12 + 1:02d}" for month_index in range(since.year * 12 + since.month - 1, today.year * 12 + today.month)]
+
+def monthly_trend_frame(rows, since, today=None):
+    # One row per month (empty months included): Received, Completed, Avg Turnaround (days).
+    frame = pd.DataFrame(rows or [], columns=['yr', 'mo', 'received', 'completed', 'turnaround_days'])
+    frame['Month'] = [f"{int(y)}-{int(m):02d}" for y, m in zip(frame['yr'], frame['mo'])]
+    frame = frame.set_index('Month')[['received', 'completed', 'turnaround_days']].astype(float).reindex(_month_labels(since, today), fill_value=0)
+    frame['avg_turnaround'] = (frame['turnaround_days'] / frame['completed'].where(frame['completed'] > 0)).round(1)
+    return frame.rename(columns={'received': 'Received', 'completed': 'Completed', 'avg_turnaround': 'Avg Turnaround (days)'}).drop(columns='turnaround_days').astype({'Received': int, 'Completed': int})
+
+def bank_volume_frame(rows, since, top_n=10, today=None):
+    # Months x banks received counts; banks outside the top_n by volume are folded into 'Others'.
+    frame = pd.DataFrame(rows or [], columns=['yr', 'mo', 'bank_name', 'received'])
+    if frame.empty: return pd.DataFrame(index=_month_labels(since, today))
+    frame['Month'] = [f"{int(y)}-{int(m):02d}" for y, m in zip(frame['yr'], frame['mo'])]
+    frame['received'] = frame['received'].astype(int)
+    top_banks = frame.groupby('bank_name')['received'].sum().nlargest(top_n).index
+    frame['bank_name'] = frame['bank_name'].where(frame['bank_name'].isin(top_banks), 'Others')
+    return frame.pivot_table(index='Month', columns='bank_name', values='received', aggfunc='sum', fill_value=0).reindex(_month_labels(since, today), fill_value=0)
+
+def backlog_frame(opening_open_leads, daily_rows, since, today=None):
+    # Open (not completed) leads at the end of every day from 'since' to today.
+    today = today or datetime.date.today()
+    deltas = pd.Series({pd.Timestamp(row['stat_date']): int(row['delta'] or 0) for row in (daily_rows or [])}, dtype='int64')
+    deltas = deltas.reindex(pd.date_range(since, today, freq='D'), fill_value=0)
+    return pd.DataFrame({'Open Leads': int(opening_open_leads or 0) + deltas.cumsum()})
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Maintain the daily_lead_stats rollup.")
+    parser.add_argument('--rebuild', action='store_true', help="Recompute daily_lead_stats from the office and office_archive tables.")
+    args = parser.parse_args()
+    if not args.rebuild: parser.print_help(); return
+
+    from instance import config
+    from mis_storage import backend_from_config
+    conn = backend_from_config(config).connect()
+    try:
+        started = datetime.datetime.now()
+        written = rebuild_daily_lead_stats(conn)
+    finally:
+        conn.close()
+    print(f"daily_lead_stats rebuilt: {written} rollup rows in {(datetime.datetime.now() - started).total_seconds():.2f}s")
+
+if __name__ == "__main__":
+    main()
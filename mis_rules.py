@@ -0,0 +1,302 @@
+# mis_rules.py
+# Per-bank email extraction rules. Each bank mails leads in its own layout, so the generic patterns in
+# mis_core.extract_info_from_email miss fields and fall back to the first 200 characters of the body
+# (property) and the sender's mailbox name (bank). A rule maps a bank's sender domains to field templates
+# for that layout; the generic patterns then only fill the fields the rule did not find.
+#
+# Rules come from EMAIL_EXTRACTION_RULES in instance/config.py and the 'email_extraction_rules' table
+# (a table row replaces the config rule of the same name), e.g.
+#   {'name': 'hdfc', 'domains': ['hdfcbank.com'], 'bank_name': 'HDFC Bank',
+#    'fields': {'customer_name': "Applicant Name: {value}", 'property_details': "Property Address: {block}",
+#               'deadline': "TAT Date: {value}"},
+#    'subject_fields': {'application_number': r"Ref(?:erence)?\s*#?\s*(\w+)"},
+#    'date_formats': ['%d-%b-%Y']}
+# A template is literal text with {value} (rest of the line) or {block} (up to the next blank line);
+# anything else is a regular expression whose first group is the value. Templates are compiled once.
+#
+# The sender's domain (and its parents: mail.hdfcbank.com -> hdfcbank.com) is looked up in a dict, so
+# the cost per email does not grow with the number of rules. Per-rule counters - emails, leads, field
+# hits/misses, generic fallbacks, time - show which bank formats are failing (admin Performance panel).
+#
+#   python mis_rules.py --list                   (rules from config + DB)
+#   python mis_rules.py --import rules.json      (upsert a JSON list of rules into the DB table)
+#   python mis_rules.py --synthetic 500          (run generated emails through the rules, print hit rates)
+
+import re
+import json
+import time
+import argparse
+import datetime
+import threading
+import collections
+from email.utils import parseaddr
+
+from mis_core import extract_info_from_email
+from mis_storage import DATABASE_ERRORS
+
+GENERIC_RULE_NAME = "(generic)"
+RULE_FIELDS = ['bank_name', 'customer_name', 'application_number', 'property_details', 'location', 'deadline', 'contact_number']
+DEFAULT_DATE_FORMATS = ["%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d/%m/%y", "%d-%m-%y", "%d-%b-%Y", "%d %b %Y", "%d %B %Y", "%d.%m.%Y"]
+UNMATCHED_DOMAINS_KEPT = 20
+
+EMAIL_RULES_DDL = """
+    CREATE TABLE IF NOT EXISTS email_extraction_rules (
+        name VARCHAR(100) NOT NULL PRIMARY KEY,
+        domains VARCHAR(500) NOT NULL,
+        bank_name VARCHAR(255) NULL,
+        fields_json TEXT NOT NULL,
+        date_formats VARCHAR(255) NULL,
+        enabled TINYINT NOT NULL DEFAULT 1,
+        updated_at DATETIME NOT NULL
+    )
+"""
+EMAIL_RULES_SELECT_SQL = "SELECT name, domains, bank_name, fields_json, date_formats FROM email_extraction_rules WHERE enabled = 1"
+EMAIL_RULES_SIGNATURE_SQL = "SELECT COUNT(*), MAX(updated_at) FROM email_extraction_rules"
+EMAIL_RULES_UPSERT_SQL = (
+    "INSERT INTO email_extraction_rules (name, domains, bank_name, fields_json, date_formats, enabled, updated_at) "
+    "VALUES (%s, %s, %s, %s, %s, %s, %s) ON DUPLICATE KEY UPDATE domains = VALUES(domains), bank_name = VALUES(bank_name), "
+    "fields_json = VALUES(fields_json), date_formats = VALUES(date_formats), enabled = VALUES(enabled), updated_at = VALUES(updated_at)"
+)
+
+
+def ensure_extraction_rules_table(cursor):
+    cursor.execute(EMAIL_RULES_DDL)
+
+def compile_field_template(template):
+    # "Applicant Name: {value}" -> regex with a 'value' group; whitespace in the literal text matches any run of it.
+    if '{value}' not in template and '{block}' not in template:
+        return re.compile(template, re.IGNORECASE | re.MULTILINE)
+    pattern = ""
+    for piece in re.split(r"(\{value\}|\{block\})", template):
+        if piece == '{value}': pattern += r"[ \t]*(?P<value>[^\n]*?)[ \t]*(?:\r?$)"
+        elif piece == '{block}': pattern += r"\s*(?P<value>.*?)(?:\r?\n[ \t]*\r?\n|\Z)"
+        elif piece.strip():
+            words = [re.escape(word[:-1]) + r"\s*:" if word.endswith(':') else re.escape(word) for word in piece.split()] # "Name :" too
+            pattern += (r"\s*" if piece[0].isspace() else "") + r"\s+".join(words) + (r"[ \t]*" if piece[-1].isspace() else "")
+    return re.compile(pattern, re.IGNORECASE | re.MULTILINE | re.DOTALL)
+
+def _clean(value):
+    return re.sub(r"\s+", " ", value).strip()
+
+def parse_deadline(text, date_formats):
+    text = _clean(text).rstrip(".,")
+    for fmt in list(date_formats) + DEFAULT_DATE_FORMATS:
+        try: return datetime.datetime.strptime(text, fmt).strftime('%Y-%m-%d')
+        except ValueError: continue
+    return None
+
+def sender_domain(sender):
+    address = parseaddr(sender or "")[1] or (sender or "")
+    return address.rpartition('@')[2].strip().strip('>').lower()
+
+
+class ExtractionRule:
+    def __init__(self, spec):
+        self.name = spec['name']
+        self.domains = [domain.strip().lower() for domain in spec['domains'] if domain.strip()]
+        self.bank_name = spec.get('bank_name')
+        self.date_formats = spec.get('date_formats') or []
+        unknown = set(spec.get('fields', {})) | set(spec.get('subject_fields', {}))
+        unknown -= set(RULE_FIELDS)
+        if unknown: raise ValueError(f"unknown field(s) {', '.join(sorted(unknown))}")
+        self.body_fields = [(field, compile_field_template(template)) for field, template in spec.get('fields', {}).items()]
+        self.subject_fields = [(field, compile_field_template(template)) for field, template in spec.get('subject_fields', {}).items()]
+        self.field_names = [field for field, _ in self.subject_fields + self.body_fields]
+
+    def apply(self, subject, body):
+        # Fields this rule finds in one email, in extract_info_from_email's format.
+        found = {'bank_name': self.bank_name} if self.bank_name else {}
+        for text, templates in ((subject or "", self.subject_fields), (body or "", self.body_fields)):
+            for field, regex in templates:
+                if found.get(field): continue
+                match = regex.search(text)
+                if not match: continue
+                value = match.group('value') if 'value' in regex.groupindex else (match.group(1) if regex.groups else match.group(0))
+                value = parse_deadline(value, self.date_formats) if field == 'deadline' else _clean(value or "")
+                if value: found[field] = value[:400] if field == 'property_details' else value
+        return found
+
+
+def _new_stats():
+    return {'emails': 0, 'leads': 0, 'failed': 0, 'field_hits': collections.Counter(), 'field_misses': collections.Counter(),
+            'fallbacks': collections.Counter(), 'seconds': 0.0, 'max_seconds': 0.0, 'last_at': None}
+
+def generic_fallbacks(lead, body, sender):
+    # Fields that ended up as extract_info_from_email's last-resort guesses rather than real matches.
+    fallbacks = []
+    if lead.get('property_details') == (body or "")[:200].strip().replace('\r\n', ' ').replace('\n', ' '): fallbacks.append('property_details')
+    if '@' in (sender or "") and lead.get('bank_name') == sender.split('@')[0]: fallbacks.append('bank_name')
+    return fallbacks
+
+
+class ExtractionRuleRegistry:
+    def __init__(self, config_rules=(), connect=None):
+        self.config_rules = list(config_rules or []); self.connect = connect # connect: callable returning a DB connection, or None
+        self.rules = {}; self.by_domain = {}; self.errors = []
+        self.db_signature = None
+        self.stats = collections.defaultdict(_new_stats)
+        self.unmatched_domains = collections.Counter()
+        self._lock = threading.Lock()
+        self.load(self.config_rules)
+
+    def load(self, specs):
+        # Compiles the rules and rebuilds the domain index. A bad rule is reported and skipped, not fatal.
+        rules = {}; by_domain = {}; errors = []
+        for spec in specs:
+            try:
+                rule = ExtractionRule(spec)
+            except (KeyError, TypeError, ValueError, re.error) as e:
+                errors.append(f"{spec.get('name', '?') if isinstance(spec, dict) else spec}: {e}"); continue
+            rules[rule.name] = rule
+        for rule in rules.values():
+            for domain in rule.domains:
+                if domain in by_domain and by_domain[domain] is not rule: errors.append(f"{domain}: in both {by_domain[domain].name} and {rule.name}")
+                by_domain[domain] = rule
+        for error in errors: print(f"Extraction rule skipped - {error}")
+        self.rules, self.by_domain, self.errors = rules, by_domain, errors # swapped whole, so readers never see half a reload
+        return self
+
+    def refresh(self):
+        # Reloads when the DB table changed (one small query); config rules stay underneath DB rules of the same name.
+        # On a DB error the rules already loaded stay in use.
+        if self.connect is None: return False
+        try:
+            conn = self.connect()
+            try:
+                cursor = conn.cursor()
+                cursor.execute(EMAIL_RULES_SIGNATURE_SQL)
+                signature = tuple(cursor.fetchone())
+                if signature == self.db_signature: cursor.close(); return False
+                db_rules = load_db_rules(cursor)
+                cursor.close()
+            finally:
+                conn.close()
+        except DATABASE_ERRORS as e:
+            print(f"Could not load extraction rules from the database ({e}); using {len(self.rules)} loaded rule(s).")
+            return False
+        merged = {spec.get('name'): spec for spec in self.config_rules}
+        merged.update({spec['name']: spec for spec in db_rules})
+        self.load(merged.values()); self.db_signature = signature
+        print(f"Loaded {len(self.rules)} email extraction rule(s) ({len(db_rules)} from the database).")
+        return True
+
+    def rule_for(self, sender):
+        domain = sender_domain(sender)
+        while domain:
+            rule = self.by_domain.get(domain)
+            if rule is not None: return rule
+            domain = domain.partition('.')[2]
+        return None
+
+    def extract(self, subject, body, sender):
+        # extract_info_from_email with the sender's bank rule applied first; same return value (dict or None).
+        started = time.perf_counter()
+        rule = self.rule_for(sender)
+        found = {}
+        if rule is not None:
+            try: found = rule.apply(subject, body)
+            except Exception as e: print(f"Extraction rule {rule.name} failed: {e}")
+        lead = extract_info_from_email(subject, body, sender, found)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            stats = self.stats[rule.name if rule is not None else GENERIC_RULE_NAME]
+            stats['emails'] += 1; stats['seconds'] += elapsed; stats['max_seconds'] = max(stats['max_seconds'], elapsed)
+            stats['last_at'] = datetime.datetime.now()
+            if lead is None: stats['failed'] += 1
+            else:
+                stats['leads'] += 1
+                stats['fallbacks'].update(generic_fallbacks(lead, body, sender))
+            for field in (rule.field_names if rule is not None else []):
+                stats['field_hits' if found.get(field) else 'field_misses'][field] += 1
+            if rule is None:
+                self.unmatched_domains[sender_domain(sender) or "(none)"] += 1
+                if len(self.unmatched_domains) > 2 * UNMATCHED_DOMAINS_KEPT:
+                    self.unmatched_domains = collections.Counter(dict(self.unmatched_domains.most_common(UNMATCHED_DOMAINS_KEPT)))
+        return lead
+
+    def stats_rows(self):
+        # One row per rule (and the generic path) for the admin panel / CLI; worst field hit rate first.
+        rows = []
+        with self._lock:
+            names = list(self.rules) + [name for name in self.stats if name not in self.rules]
+            for name in names:
+                stats = self.stats.get(name) or _new_stats()
+                rule = self.rules.get(name)
+                field_rates = {field: (stats['field_hits'][field], stats['field_hits'][field] + stats['field_misses'][field])
+                               for field in (rule.field_names if rule is not None else [])}
+                worst = min((hits / total for hits, total in field_rates.values() if total), default=None)
+                rows.append({
+                    'Rule': name, 'Domains': ", ".join(rule.domains) if rule is not None else "(no rule)",
+                    'Emails': stats['emails'], 'Leads': stats['leads'], 'Failed': stats['failed'],
+                    'Field Hits': ", ".join(f"{field} {hits}/{total}" for field, (hits, total) in field_rates.items()),
+                    'Worst Field %': None if worst is None else round(worst * 100, 1),
+                    'Generic Fallbacks': ", ".join(f"{field} {count}" for field, count in stats['fallbacks'].most_common()),
+                    'Avg (ms)': round(stats['seconds'] / stats['emails'] * 1000, 2) if stats['emails'] else None,
+                    'Max (ms)': round(stats['max_seconds'] * 1000, 2),
+                    'Last Email': stats['last_at'],
+                })
+        return sorted(rows, key=lambda row: (row['Worst Field %'] is None, row['Worst Field %'] or 0, -row['Emails']))
+
+
+def load_db_rules(cursor):
+    cursor.execute(EMAIL_RULES_SELECT_SQL)
+    specs = []
+    for name, domains, bank_name, fields_json, date_formats in cursor.fetchall():
+        try: templates = json.loads(fields_json)
+        except ValueError as e: print(f"Extraction rule {name}: bad fields_json ({e})"); continue
+        specs.append({'name': name, 'domains': domains.split(','), 'bank_name': bank_name,
+                      'fields': templates.get('fields', {}),
+                      'subject_fields': templates.get('subject_fields', {}),
+                      'date_formats': [fmt for fmt in (date_formats or "").split('|') if fmt]})
+    return specs
+
+def rule_upsert_params(spec, now=None):
+    # (query params) for EMAIL_RULES_UPSERT_SQL from a rule in config format.
+    ExtractionRule(spec) # refuse rules that would not compile
+    templates = {'fields': spec.get('fields', {}), 'subject_fields': spec.get('subject_fields', {})}
+    return (spec['name'], ",".join(spec['domains']), spec.get('bank_name'), json.dumps(templates),
+            "|".join(spec.get('date_formats') or []), 1 if spec.get('enabled', True) else 0, now or datetime.datetime.now())
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Per-bank email extraction rules.")
+    parser.add_argument('--list', action='store_true', help="List the rules from instance/config.py and the database.")
+    parser.add_argument('--import', dest='import_file', metavar='FILE', help="Upsert a JSON list of rules into email_extraction_rules.")
+    parser.add_argument('--synthetic', type=int, metavar='N', help="Run N generated lead emails through the rules and print hit rates.")
+    args = parser.parse_args()
+    if not (args.list or args.import_file or args.synthetic): parser.print_help(); return
+
+    import io
+    import contextlib
+    from instance import config
+    from mis_storage import backend_from_config
+    backend = backend_from_config(config)
+    if args.import_file:
+        with open(args.import_file, encoding="utf-8") as f: specs = json.load(f)
+        conn = backend.connect()
+        try:
+            cursor = conn.cursor()
+            ensure_extraction_rules_table(cursor)
+            for spec in specs: cursor.execute(EMAIL_RULES_UPSERT_SQL, rule_upsert_params(spec))
+            conn.commit(); cursor.close()
+        finally:
+            conn.close()
+        print(f"Imported {len(specs)} rule(s).")
+    registry = ExtractionRuleRegistry(getattr(config, 'EMAIL_EXTRACTION_RULES', []), backend.connect)
+    registry.refresh()
+    if args.list:
+        for rule in registry.rules.values():
+            print(f"{rule.name:<20} {', '.join(rule.domains):<40} {rule.bank_name or '-':<25} fields: {', '.join(rule.field_names)}")
+        if not registry.rules: print("No extraction rules configured.")
+    if args.synthetic:
+        import synthetic_data
+        emails = synthetic_data.generate_valuation_emails(args.synthetic)
+        with contextlib.redirect_stdout(io.StringIO()): # extract_info_from_email prints per call
+            for subject, body, sender in emails: registry.extract(subject, body, sender)
+        for row in registry.stats_rows():
+            print(f"{row['Rule']:<20} emails {row['Emails']:>5}  leads {row['Leads']:>5}  failed {row['Failed']:>4}  "
+                  f"avg {row['Avg (ms)'] or 0:6.2f} ms  fallbacks [{row['Generic Fallbacks']}]  fields [{row['Field Hits']}]")
+        print("Senders without a rule: " + ", ".join(f"{domain} ({count})" for domain, count in registry.unmatched_domains.most_common(10)))
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# mis_shared.py
+# Process-wide lead snapshot shared by every Streamlit session. One background thread owns all
+# reads of 'office': every interval (or as soon as a write is reported) it runs a one-row signature
+# query and reloads the table only when the signature changed. Sessions never query office
+# themselves, so the database load does not grow with the number of people who have the MIS open.
+#
+# Read-your-writes: notify_write() returns a ticket; get(min_ticket) waits (briefly) for a
+# snapshot whose load started after that write.
+
+import time
+import datetime
+import threading
+
+from mis_core import PANDAS_AVAILABLE, LeadStore, compute_summary_dashboard_tables
+
+SHARED_SIGNATURE_SQL = "SELECT COUNT(*), MAX(id), COALESCE(SUM(version), 0) FROM office"
+SHARED_LEADS_SQL = "SELECT * FROM office ORDER BY received_date DESC, id DESC"
+
+
+class SharedLeadSnapshot:
+    # One immutable generation of the office table: the LeadStore (typed frame prebuilt) plus
+    # aggregates computed once per generation and shared by every session.
+    def __init__(self, rows, signature, write_ticket, load_seconds):
+        self.store = LeadStore(rows)
+        self.signature = signature
+        self.write_ticket = write_ticket # writes up to this ticket are included
+        self.loaded_at = datetime.datetime.now()
+        self.load_seconds = load_seconds
+        self._aggregates = {}; self._lock = threading.Lock()
+        if PANDAS_AVAILABLE and self.store: self.store.frame # build before publishing, not on a reader's rerun
+
+    def summary_tables(self, bank_name=None):
+        with self._lock:
+            if bank_name not in self._aggregates:
+                self._aggregates[bank_name] = compute_summary_dashboard_tables(self.store.frame_for_bank(bank_name))
+            return self._aggregates[bank_name]
+
+
+class SharedLeadCache:
+    def __init__(self, connect, interval_seconds=10):
+        self.connect = connect # callable returning a new DB-API connection
+        self.interval_seconds = interval_seconds
+        self.snapshot = None
+        self.last_error = None
+        self.stats = {'signature_checks': 0, 'reloads': 0, 'started_at': datetime.datetime.now()}
+        self._write_ticket = 0
+        self._changed = threading.Condition()
+        self._wake = threading.Event(); self._stop = threading.Event()
+        self._thread = None
+
+    def start(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name="mis-shared-leads", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set(); self._wake.set()
+
+    def notify_write(self):
+        # Called after any committed write; returns the ticket to pass to get() for read-your-writes.
+        with self._changed:
+            self._write_ticket += 1; ticket = self._write_ticket
+        self._wake.set()
+        return ticket
+
+    def get(self, min_ticket=0, timeout=5.0):
+        # Latest snapshot; waits up to timeout for one that includes write min_ticket (or for the first load).
+        deadline = time.monotonic() + timeout
+        with self._changed:
+            while self.snapshot is None or self.snapshot.write_ticket < min_ticket:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0: break
+                self._changed.wait(remaining)
+            return self.snapshot
+
+    def refresh_now(self):
+        self._wake.set()
+
+    def _fetch(self, query, as_dicts=False):
+        conn = self.connect()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(query)
+            rows = cursor.fetchall()
+            if as_dicts:
+                columns = [desc[0] for desc in cursor.description]
+                rows = [dict(zip(columns, row)) for row in rows]
+            cursor.close()
+            return rows
+        finally:
+            conn.close()
+
+    def _refresh(self):
+        with self._changed: ticket = self._write_ticket
+        signature = tuple(self._fetch(SHARED_SIGNATURE_SQL)[0]); self.stats['signature_checks'] += 1
+        current = self.snapshot
+        if current is not None and current.signature == signature:
+            if current.write_ticket < ticket: # write reported but nothing changed (e.g. a failed update)
+                with self._changed: current.write_ticket = ticket; self._changed.notify_all()
+            return
+        started = time.perf_counter()
+        rows = self._fetch(SHARED_LEADS_SQL, as_dicts=True)
+        snapshot = SharedLeadSnapshot(rows, signature, ticket, time.perf_counter() - started)
+        self.stats['reloads'] += 1
+        with self._changed:
+            self.snapshot = snapshot; self._changed.notify_all()
+
+    def _run(self):
+        while not self._stop.is_set():
+            self._wake.clear()
+            try:
+                self._refresh(); self.last_error = None
+            except Exception as e:
+                self.last_error = f"{datetime.datetime.now():%H:%M:%S} {e}"
+                print(f"Shared lead cache refresh failed: {e}")
+            self._wake.wait(self.interval_seconds)
@@ -0,0 +1,172 @@
+# mis_snapshot.py
+# Columnar copy of the 'office' table for analytics: one Parquet file per received month
+# (hive layout: received_month=YYYY-MM/part-0.parquet). Refreshes are incremental - a cheap
+# per-month signature (row count, max id, sum of the row versions) is compared with the last
+# export and only changed months are rewritten. Every UPDATE of office bumps 'version', so an
+# edited row always changes its month's signature.
+#
+#   python mis_snapshot.py                   (refresh from the MySQL database in instance/config.py)
+#   python mis_snapshot.py --full            (rewrite every month)
+#   python mis_snapshot.py --sqlite bench.db --snapshot-dir /tmp/snapshot
+
+import os
+import json
+import shutil
+import argparse
+import datetime
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    PYARROW_AVAILABLE = True
+except ImportError:
+    PYARROW_AVAILABLE = False
+
+from mis_core import LEAD_CATEGORY_COLUMNS, OFFICE_DATE_COLUMNS, build_lead_dataframe
+
+SNAPSHOT_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "snapshot")
+SNAPSHOT_STATE_FILE = "snapshot_state.json"
+SNAPSHOT_NO_DATE_PARTITION = "none" # leads without a received_date
+
+# Per-dialect SQL: (month signature query, rows-for-one-month query, rows-without-date query), formatted
+# with the table to read ('office', and 'office_archive' when archived leads are included).
+SNAPSHOT_QUERIES = {
+    'mysql': (
+        "SELECT DATE_FORMAT(received_date, '%Y-%m') AS received_month, COUNT(*) AS row_count, MAX(id) AS max_id, "
+        "COALESCE(SUM(version), 0) AS version_sum FROM {table} GROUP BY received_month",
+        "SELECT * FROM {table} WHERE received_date >= %s AND received_date < %s ORDER BY id",
+        "SELECT * FROM {table} WHERE received_date IS NULL ORDER BY id",
+    ),
+    'sqlite': (
+        "SELECT strftime('%Y-%m', received_date) AS received_month, COUNT(*) AS row_count, MAX(id) AS max_id, "
+        "COALESCE(SUM(version), 0) AS version_sum FROM {table} GROUP BY received_month",
+        "SELECT * FROM {table} WHERE received_date >= ? AND received_date < ? ORDER BY id",
+        "SELECT * FROM {table} WHERE received_date IS NULL ORDER BY id",
+    ),
+}
+SNAPSHOT_ARCHIVE_ONLY_COLUMNS = ('archived_at',)
+
+
+def _fetch_dicts(conn, query, params=()):
+    cursor = conn.cursor()
+    try:
+        cursor.execute(query, params) if params else cursor.execute(query)
+        columns = [desc[0] for desc in cursor.description]
+        return [dict(zip(columns, row)) for row in cursor.fetchall()]
+    finally:
+        cursor.close()
+
+def _month_bounds(month_key):
+    first_day = datetime.datetime.strptime(month_key, "%Y-%m")
+    next_month = (first_day.replace(day=28) + datetime.timedelta(days=4)).replace(day=1)
+    return first_day.strftime("%Y-%m-%d %H:%M:%S"), next_month.strftime("%Y-%m-%d %H:%M:%S")
+
+def _arrow_type_for(col_name):
+    if col_name in ('id', 'version'): return pa.int64()
+    if col_name in OFFICE_DATE_COLUMNS: return pa.timestamp('us')
+    if col_name == 'distance': return pa.float64()
+    if col_name in LEAD_CATEGORY_COLUMNS: return pa.dictionary(pa.int32(), pa.string())
+    return pa.string()
+
+def _rows_to_table(rows):
+    # Fixed per-column types so every month file shares one schema, whatever the month's values are.
+    frame = build_lead_dataframe(rows)
+    schema = pa.schema([(col_name, _arrow_type_for(col_name)) for col_name in frame.columns])
+    for col_name in frame.columns:
+        if pa.types.is_string(schema.field(col_name).type):
+            frame[col_name] = frame[col_name].astype(object).where(frame[col_name].notna(), None).map(lambda v: v if v is None else str(v))
+    return pa.Table.from_pandas(frame, schema=schema, preserve_index=False)
+
+def _partition_dir(snapshot_dir, month_key):
+    return os.path.join(snapshot_dir, f"received_month={month_key}")
+
+def read_snapshot_state(snapshot_dir=SNAPSHOT_DIR):
+    state_path = os.path.join(snapshot_dir, SNAPSHOT_STATE_FILE)
+    if not os.path.exists(state_path): return {'partitions': {}, 'refreshed_at': None}
+    with open(state_path) as f: return json.load(f)
+
+def refresh_office_snapshot(conn, dialect='mysql', snapshot_dir=SNAPSHOT_DIR, full=False, tables=('office',)):
+    # Returns {'written': [...months], 'removed': [...months], 'unchanged': n, 'rows_written': n}.
+    # With tables=('office', 'office_archive') archived leads stay in their month; archiving a lead
+    # moves it between tables without changing the month's combined signature.
+    if not PYARROW_AVAILABLE: raise RuntimeError("pyarrow is required for the analytics snapshot.")
+    signature_query, month_query, no_date_query = SNAPSHOT_QUERIES[dialect]
+    os.makedirs(snapshot_dir, exist_ok=True)
+    state = {'partitions': {}} if full else read_snapshot_state(snapshot_dir)
+    old_partitions = state.get('partitions', {})
+
+    current_partitions = {}
+    for table in tables:
+        for sig in _fetch_dicts(conn, signature_query.format(table=table)):
+            month_key = sig['received_month'] or SNAPSHOT_NO_DATE_PARTITION
+            signature = current_partitions.setdefault(month_key, {'rows': 0, 'max_id': 0, 'version_sum': 0})
+            signature['rows'] += int(sig['row_count']); signature['version_sum'] += int(sig['version_sum'] or 0)
+            signature['max_id'] = max(signature['max_id'], int(sig['max_id'] or 0))
+
+    written = []; rows_written = 0
+    for month_key, signature in sorted(current_partitions.items()):
+        if old_partitions.get(month_key) == signature and os.path.isdir(_partition_dir(snapshot_dir, month_key)): continue
+        rows = []
+        for table in tables:
+            if month_key == SNAPSHOT_NO_DATE_PARTITION: rows.extend(_fetch_dicts(conn, no_date_query.format(table=table)))
+            else: rows.extend(_fetch_dicts(conn, month_query.format(table=table), _month_bounds(month_key)))
+        rows = [{col: value for col, value in row.items() if col not in SNAPSHOT_ARCHIVE_ONLY_COLUMNS} for row in rows] if len(tables) > 1 else rows
+        partition_path = _partition_dir(snapshot_dir, month_key)
+        os.makedirs(partition_path, exist_ok=True)
+        tmp_file = os.path.join(partition_path, "part-0.parquet.tmp")
+        pq.write_table(_rows_to_table(rows), tmp_file, compression='zstd')
+        os.replace(tmp_file, os.path.join(partition_path, "part-0.parquet"))
+        written.append(month_key); rows_written += len(rows)
+
+    removed = [month_key for month_key in old_partitions if month_key not in current_partitions]
+    for month_key in removed: shutil.rmtree(_partition_dir(snapshot_dir, month_key), ignore_errors=True)
+
+    new_state = {'partitions': current_partitions, 'refreshed_at': datetime.datetime.now().isoformat(timespec='seconds')}
+    with open(os.path.join(snapshot_dir, SNAPSHOT_STATE_FILE + ".tmp"), 'w') as f: json.dump(new_state, f, indent=1)
+    os.replace(os.path.join(snapshot_dir, SNAPSHOT_STATE_FILE + ".tmp"), os.path.join(snapshot_dir, SNAPSHOT_STATE_FILE))
+    return {'written': written, 'removed': removed, 'unchanged': len(current_partitions) - len(written), 'rows_written': rows_written}
+
+def snapshot_months(snapshot_dir=SNAPSHOT_DIR):
+    return sorted(month_key for month_key in read_snapshot_state(snapshot_dir).get('partitions', {}) if month_key != SNAPSHOT_NO_DATE_PARTITION)
+
+def load_office_snapshot(snapshot_dir=SNAPSHOT_DIR, months=None, columns=None):
+    # Memory-maps the month files and returns the same typed lead frame build_lead_dataframe gives.
+    # months: optional list of 'YYYY-MM' keys; None loads everything.
+    if not PYARROW_AVAILABLE: raise RuntimeError("pyarrow is required for the analytics snapshot.")
+    month_keys = months if months is not None else list(read_snapshot_state(snapshot_dir).get('partitions', {}))
+    tables = []
+    for month_key in sorted(month_keys):
+        part_file = os.path.join(_partition_dir(snapshot_dir, month_key), "part-0.parquet")
+        if os.path.exists(part_file): tables.append(pq.read_table(part_file, columns=columns, memory_map=True))
+    if not tables: return None
+    snapshot_df = pa.concat_tables(tables, promote_options='default').to_pandas()
+    return build_lead_dataframe(snapshot_df.sort_values(['received_date', 'id'], ascending=False, ignore_index=True)
+                                if {'received_date', 'id'} <= set(snapshot_df.columns) else snapshot_df)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Refresh the Parquet analytics snapshot of the office table.")
+    parser.add_argument('--snapshot-dir', default=SNAPSHOT_DIR)
+    parser.add_argument('--full', action='store_true', help="Rewrite every month instead of only changed ones.")
+    parser.add_argument('--sqlite', help="Read from this SQLite file instead of the database configured in instance/config.py.")
+    parser.add_argument('--include-archive', action='store_true', help="Also snapshot archived leads (office_archive).")
+    args = parser.parse_args()
+
+    from mis_storage import SqliteBackend, backend_from_config
+    if args.sqlite: backend = SqliteBackend(args.sqlite)
+    else:
+        from instance import config
+        backend = backend_from_config(config)
+    conn = backend.connect(); dialect = backend.dialect
+    try:
+        started = datetime.datetime.now()
+        result = refresh_office_snapshot(conn, dialect, args.snapshot_dir, full=args.full,
+                                         tables=('office', 'office_archive') if args.include_archive else ('office',))
+    finally:
+        conn.close()
+    print(f"Snapshot refreshed in {(datetime.datetime.now() - started).total_seconds():.2f}s: "
+          f"{len(result['written'])} month(s) written ({result['rows_written']} rows), "
+          f"{result['unchanged']} unchanged, {len(result['removed'])} removed -> {args.snapshot_dir}")
+
+if __name__ == "__main__":
+    main()
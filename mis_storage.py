@@ -0,0 +1,345 @@
+# mis_storage.py
+# Storage backends. MySQL (mysql.connector, as before) for the head office; SQLite for branch offices
+# that run the MIS on one PC, where a database server is pure overhead. Pick one in instance/config.py:
+#
+#   DB_BACKEND = "mysql"                    (MYSQL_CONFIG)
+#   DB_BACKEND = "sqlite"                   (SQLITE_DATABASE_PATH, default instance/mis_office.db)
+#
+# SqliteConnection speaks the part of the mysql.connector API the app and the mis_* modules use
+# (%s parameters, dictionary cursors, start_transaction, rowcount / lastrowid, is_connected) and
+# rewrites the few MySQL-only statements they issue (SHOW TABLES / COLUMNS / INDEX, CREATE TABLE ... LIKE,
+# AUTO_INCREMENT and inline INDEX in DDL, ON DUPLICATE KEY UPDATE, FOR UPDATE, FROM DUAL), so every
+# module runs unchanged on either backend.
+#
+# SQLite runs in WAL mode: readers never block the writer or each other. Write transactions take the
+# write lock up front (BEGIN IMMEDIATE) and wait up to busy_timeout for it instead of failing half way.
+#
+#   python mis_storage.py --check                        (backend from instance/config.py: pragmas, table sizes)
+#   python mis_storage.py --sqlite branch.db --init      (create the lead tables in a new SQLite file)
+
+import os
+import re
+import sqlite3
+import decimal
+import argparse
+import datetime
+
+try:
+    import mysql.connector
+    MYSQL_AVAILABLE = True
+    DATABASE_ERRORS = (mysql.connector.Error, sqlite3.Error)
+except ImportError:
+    MYSQL_AVAILABLE = False
+    DATABASE_ERRORS = (sqlite3.Error,)
+
+SQLITE_DEFAULT_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)), "instance", "mis_office.db") # not email_reader.py's mis_database.db
+# Per-connection pragmas; journal_mode=WAL is persistent and set once when the backend is created.
+SQLITE_DEFAULT_PRAGMAS = {
+    'busy_timeout': 10000,      # ms a writer waits for the lock held by another writer
+    'synchronous': 'NORMAL',    # safe with WAL; fsync at checkpoints instead of every commit
+    'cache_size': -32000,       # KiB of page cache per connection
+    'temp_store': 'MEMORY',
+    'mmap_size': 268435456,     # readers map the file instead of copying pages
+    'foreign_keys': 'ON',
+}
+
+SQLITE_OFFICE_DDL = """
+    CREATE TABLE IF NOT EXISTS office (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        bank_name TEXT NOT NULL, property_details TEXT NOT NULL,
+        received_date TIMESTAMP, deadline DATE, site_engineer TEXT, report_creator TEXT,
+        status TEXT NOT NULL DEFAULT 'New', report_issue_notes TEXT, admin_review_status TEXT DEFAULT 'Pending Review',
+        admin_comments TEXT, date_of_allocation DATE, customer_name TEXT, application_number TEXT, location TEXT,
+        contact_number TEXT, site_link TEXT, visit_initiation_date DATE, visit_completion_date DATE,
+        lead_completion_date DATE, appraiser_quotation_obs TEXT, distance REAL, visit_type TEXT, remarks TEXT,
+        branch_virtual TEXT, site_photo_filenames TEXT, site_document_filenames TEXT,
+        version INTEGER NOT NULL DEFAULT 0
+    )
+"""
+
+
+def sql_dialect(conn):
+    return getattr(conn, 'dialect', 'mysql')
+
+
+# --- SQLite types ---
+def _parse_sqlite_datetime(raw):
+    text = raw.decode() if isinstance(raw, bytes) else str(raw)
+    try: return datetime.datetime.fromisoformat(text.replace('T', ' ', 1))
+    except ValueError: return text
+
+def _convert_date(raw):
+    value = _parse_sqlite_datetime(raw)
+    return value.date() if isinstance(value, datetime.datetime) else value
+
+def _convert_datetime(raw):
+    return _parse_sqlite_datetime(raw)
+
+for _declared_type in ('DATETIME', 'TIMESTAMP'): sqlite3.register_converter(_declared_type, _convert_datetime)
+sqlite3.register_converter('DATE', _convert_date)
+
+def _sqlite_value(value):
+    if isinstance(value, datetime.datetime): return value.isoformat(sep=' ')
+    if isinstance(value, datetime.date): return value.isoformat()
+    if isinstance(value, decimal.Decimal): return float(value)
+    if hasattr(value, 'item') and not isinstance(value, (str, bytes)): return value.item() # numpy scalars
+    return value
+
+def _sqlite_params(params):
+    return tuple(_sqlite_value(value) for value in (params or ()))
+
+def _date_part(value, start, end):
+    if value is None: return None
+    try: return int(str(value)[start:end])
+    except ValueError: return None
+
+
+# --- MySQL -> SQLite statement rewrites ---
+_SHOW_TABLES = re.compile(r"^\s*SHOW\s+TABLES\s+LIKE\s+'([^']+)'\s*;?\s*$", re.I)
+_SHOW_COLUMNS = re.compile(r"^\s*SHOW\s+COLUMNS\s+FROM\s+`?(\w+)`?(?:\s+LIKE\s+'([^']+)')?\s*;?\s*$", re.I)
+_SHOW_INDEX = re.compile(r"^\s*SHOW\s+INDEX\s+FROM\s+`?(\w+)`?\s+WHERE\s+Key_name\s*=\s*%s\s*;?\s*$", re.I)
+_CREATE_LIKE = re.compile(r"^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?`?(\w+)`?\s+LIKE\s+`?(\w+)`?\s*;?\s*$", re.I)
+_CREATE_TABLE = re.compile(r"^\s*CREATE\s+TABLE\s+(IF\s+NOT\s+EXISTS\s+)?`?(\w+)`?\s*\((.*)\)\s*;?\s*$", re.I | re.S)
+_INLINE_INDEX = re.compile(r"^(UNIQUE\s+)?(?:INDEX|KEY)\s+`?(\w+)`?\s*(\(.*\))$", re.I | re.S)
+_UNIQUE_KEY = re.compile(r"^UNIQUE\s+KEY\s+`?\w+`?\s*(\(.*\))$", re.I | re.S)
+_AUTO_INCREMENT_PK = re.compile(r"^(`?\w+`?)\s+(?:BIG)?INT(?:EGER)?\b.*\bPRIMARY\s+KEY\s+AUTO_INCREMENT$|^(`?\w+`?)\s+(?:BIG)?INT(?:EGER)?\b.*\bAUTO_INCREMENT\s+PRIMARY\s+KEY$", re.I | re.S)
+_ON_DUPLICATE = re.compile(r"\bON\s+DUPLICATE\s+KEY\s+UPDATE\b", re.I)
+_VALUES_FUNCTION = re.compile(r"\bVALUES\((\w+)\)", re.I)
+_INSERT_TABLE = re.compile(r"^\s*INSERT\s+INTO\s+`?(\w+)`?", re.I)
+_FROM_DUAL = re.compile(r"\bFROM\s+DUAL\b", re.I)
+_FOR_UPDATE = re.compile(r"\s+FOR\s+UPDATE\s*;?\s*$", re.I)
+
+def _split_top_level(body):
+    parts = []; depth = 0; current = []
+    for char in body:
+        if char == '(': depth += 1
+        elif char == ')': depth -= 1
+        if char == ',' and depth == 0: parts.append(''.join(current).strip()); current = []
+        else: current.append(char)
+    if ''.join(current).strip(): parts.append(''.join(current).strip())
+    return parts
+
+def sqlite_create_table(query):
+    # MySQL CREATE TABLE -> SQLite statements: AUTO_INCREMENT keys become INTEGER PRIMARY KEY AUTOINCREMENT,
+    # inline INDEX / KEY definitions become CREATE INDEX statements, UNIQUE KEY becomes UNIQUE (...).
+    match = _CREATE_TABLE.match(query)
+    if not match: return [query]
+    if_not_exists, table, body = match.group(1) or '', match.group(2), match.group(3)
+    columns = []; indexes = []
+    for part in _split_top_level(body):
+        auto_pk = _AUTO_INCREMENT_PK.match(part); unique_key = _UNIQUE_KEY.match(part); inline_index = _INLINE_INDEX.match(part)
+        if auto_pk: columns.append(f"{auto_pk.group(1) or auto_pk.group(2)} INTEGER PRIMARY KEY AUTOINCREMENT")
+        elif unique_key: columns.append(f"UNIQUE {unique_key.group(1)}")
+        elif inline_index: indexes.append(f"CREATE {inline_index.group(1) or ''}INDEX IF NOT EXISTS {inline_index.group(2)} ON {table} {inline_index.group(3)}")
+        else: columns.append(part)
+    return [f"CREATE TABLE {if_not_exists}{table} (\n        " + ",\n        ".join(columns) + "\n    )"] + indexes
+
+
+class SqliteCursor:
+    def __init__(self, connection, dictionary=False):
+        self.connection = connection; self.dictionary = dictionary
+        self._cursor = connection._conn.cursor()
+        self._rows = None # rows produced by an emulated statement
+        self.description = None; self.rowcount = -1; self.lastrowid = None
+
+    def execute(self, query, params=()):
+        self._rows = None
+        statements = self.connection._translate(query, params)
+        for sql, sql_params in statements:
+            if callable(sql): # emulated statement: returns (description, rows)
+                self.description, self._rows = sql(); self.rowcount = len(self._rows); continue
+            self._cursor.execute(sql, _sqlite_params(sql_params))
+            self.description = self._cursor.description; self.rowcount = self._cursor.rowcount; self.lastrowid = self._cursor.lastrowid
+
+    def executemany(self, query, params_seq):
+        params_seq = [_sqlite_params(params) for params in params_seq]
+        self._rows = None
+        (sql, _), = self.connection._translate(query, params_seq[0] if params_seq else ())
+        self._cursor.executemany(sql, params_seq)
+        self.description = self._cursor.description; self.rowcount = self._cursor.rowcount
+        if params_seq and _INSERT_TABLE.match(sql) and 'ON CONFLICT' not in sql.upper():
+            # mysql.connector reports the first id of a multi-row INSERT; ids are consecutive under the write lock.
+            self.lastrowid = self.connection._conn.execute("SELECT last_insert_rowid()").fetchone()[0] - len(params_seq) + 1
+
+    def _shape(self, row):
+        if row is None or not self.dictionary: return row
+        return dict(zip((desc[0] for desc in self.description), row))
+
+    def fetchone(self):
+        if self._rows is not None: return self._shape(self._rows.pop(0)) if self._rows else None
+        return self._shape(self._cursor.fetchone())
+
+    def fetchall(self):
+        if self._rows is not None: rows, self._rows = self._rows, []
+        else: rows = self._cursor.fetchall()
+        return [self._shape(row) for row in rows]
+
+    def close(self):
+        self._cursor.close()
+
+
+class SqliteConnection:
+    dialect = 'sqlite'
+
+    def __init__(self, path, pragmas=None, timeout=30):
+        # IMMEDIATE: the implicit transaction opened by the first write takes the write lock at once.
+        self._conn = sqlite3.connect(path, timeout=timeout, detect_types=sqlite3.PARSE_DECLTYPES, isolation_level='IMMEDIATE', check_same_thread=False)
+        for name, value in (SQLITE_DEFAULT_PRAGMAS if pragmas is None else pragmas).items(): self._conn.execute(f"PRAGMA {name}={value}")
+        self._conn.create_function('YEAR', 1, lambda value: _date_part(value, 0, 4), deterministic=True)
+        self._conn.create_function('MONTH', 1, lambda value: _date_part(value, 5, 7), deterministic=True)
+        self._primary_keys = {}
+        self._open = True
+
+    # mysql.connector surface
+    def cursor(self, dictionary=False, **_):
+        return SqliteCursor(self, dictionary)
+
+    def start_transaction(self):
+        if self._conn.in_transaction: raise sqlite3.OperationalError("Transaction already in progress")
+        self._conn.execute("BEGIN IMMEDIATE")
+
+    @property
+    def in_transaction(self):
+        return self._conn.in_transaction
+
+    def commit(self): self._conn.commit()
+    def rollback(self): self._conn.rollback()
+    def is_connected(self): return self._open
+
+    def close(self):
+        if self._open: self._conn.close(); self._open = False
+
+    # rewrites
+    def _primary_key(self, table):
+        if table not in self._primary_keys:
+            columns = self._conn.execute("SELECT name, pk FROM pragma_table_info(?) WHERE pk > 0 ORDER BY pk", (table,)).fetchall()
+            self._primary_keys[table] = [name for name, _ in columns]
+        return self._primary_keys[table]
+
+    def _emulated(self, query, params):
+        cursor = self._conn.execute(query, params)
+        description = cursor.description; rows = cursor.fetchall()
+        return lambda: (description, rows)
+
+    def _create_like(self, if_not_exists, table, source):
+        exists = self._conn.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = ?", (table,)).fetchone()
+        if exists:
+            if if_not_exists: return []
+            raise sqlite3.OperationalError(f"table {table} already exists")
+        definitions = self._conn.execute("SELECT type, name, sql FROM sqlite_master WHERE tbl_name = ? AND sql IS NOT NULL ORDER BY type DESC", (source,)).fetchall()
+        statements = []
+        for object_type, name, sql in definitions:
+            if object_type == 'table': statements.append((re.sub(rf"^\s*CREATE\s+TABLE\s+[`\"']?{source}[`\"']?", f"CREATE TABLE {table}", sql, count=1, flags=re.I), ()))
+            else: statements.append((re.sub(rf"^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?[`\"']?{name}[`\"']?\s+ON\s+[`\"']?{source}[`\"']?",
+                                            lambda m: f"CREATE {m.group(1) or ''}INDEX {table}_{name} ON {table}", sql, count=1, flags=re.I), ()))
+        return statements
+
+    def _translate(self, query, params):
+        # -> [(sql or emulation callable, params)]
+        match = _SHOW_TABLES.match(query)
+        if match: return [(self._emulated("SELECT name AS Tables FROM sqlite_master WHERE type = 'table' AND name LIKE ?", (match.group(1),)), ())]
+        match = _SHOW_COLUMNS.match(query)
+        if match:
+            columns_sql = ("SELECT name AS Field, type AS Type, CASE WHEN \"notnull\" THEN 'NO' ELSE 'YES' END AS \"Null\", "
+                           "CASE WHEN pk > 0 THEN 'PRI' ELSE '' END AS \"Key\", dflt_value AS \"Default\", '' AS Extra FROM pragma_table_info(?)")
+            if match.group(2): return [(self._emulated(columns_sql + " WHERE name LIKE ?", (match.group(1), match.group(2))), ())]
+            return [(self._emulated(columns_sql + " ORDER BY cid", (match.group(1),)), ())]
+        match = _SHOW_INDEX.match(query)
+        if match: return [(self._emulated("SELECT tbl_name AS \"Table\", name AS Key_name FROM sqlite_master WHERE type = 'index' AND tbl_name = ? AND name = ?",
+                                          (match.group(1), *_sqlite_params(params))), ())]
+        match = _CREATE_LIKE.match(query)
+        if match: return self._create_like(bool(match.group(1)), match.group(2), match.group(3))
+        if _CREATE_TABLE.match(query): return [(statement, ()) for statement in sqlite_create_table(query)]
+
+        sql = query.replace('%s', '?')
+        sql = _FROM_DUAL.sub("WHERE 1", sql)
+        if _ON_DUPLICATE.search(sql):
+            table = _INSERT_TABLE.match(sql).group(1)
+            sql = _ON_DUPLICATE.sub(f"ON CONFLICT ({', '.join(self._primary_key(table))}) DO UPDATE SET", sql)
+            sql = _VALUES_FUNCTION.sub(r"excluded.\1", sql)
+        if _FOR_UPDATE.search(sql):
+            sql = _FOR_UPDATE.sub("", sql)
+            if not self._conn.in_transaction: self._conn.execute("BEGIN IMMEDIATE") # lock now, as FOR UPDATE would
+        return [(sql, params)]
+
+
+# --- Backends ---
+class MySqlBackend:
+    dialect = 'mysql'
+
+    def __init__(self, mysql_config):
+        if not MYSQL_AVAILABLE: raise RuntimeError("mysql-connector-python is not installed (needed for DB_BACKEND = 'mysql').")
+        self.mysql_config = mysql_config
+
+    def connect(self):
+        return mysql.connector.connect(**self.mysql_config)
+
+    def describe(self):
+        return f"MySQL {self.mysql_config.get('host', 'localhost')}/{self.mysql_config.get('database')}"
+
+
+class SqliteBackend:
+    dialect = 'sqlite'
+
+    def __init__(self, path=SQLITE_DEFAULT_PATH, pragmas=None, timeout=30):
+        self.path = path; self.pragmas = dict(SQLITE_DEFAULT_PRAGMAS, **(pragmas or {})); self.timeout = timeout
+        if os.path.dirname(path): os.makedirs(os.path.dirname(path), exist_ok=True)
+        conn = sqlite3.connect(path, timeout=timeout)
+        try: self.journal_mode = conn.execute("PRAGMA journal_mode=WAL").fetchone()[0] # persistent for the file
+        finally: conn.close()
+
+    def connect(self):
+        return SqliteConnection(self.path, self.pragmas, self.timeout)
+
+    def describe(self):
+        return f"SQLite {self.path} (journal_mode={self.journal_mode})"
+
+
+def storage_backend(name, mysql_config=None, sqlite_path=None, sqlite_pragmas=None):
+    if name == 'mysql': return MySqlBackend(mysql_config)
+    if name == 'sqlite': return SqliteBackend(sqlite_path or SQLITE_DEFAULT_PATH, sqlite_pragmas)
+    raise ValueError(f"Unknown DB_BACKEND '{name}' (use 'mysql' or 'sqlite').")
+
+def backend_from_config(config):
+    return storage_backend(getattr(config, 'DB_BACKEND', 'mysql'), getattr(config, 'MYSQL_CONFIG', None),
+                           getattr(config, 'SQLITE_DATABASE_PATH', None), getattr(config, 'SQLITE_PRAGMAS', None))
+
+def ensure_sqlite_office_table(cursor):
+    # MySQL installs create 'office' from instance/schema.sql; a new SQLite file gets it here.
+    cursor.execute(SQLITE_OFFICE_DDL)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Inspect or initialise the MIS storage backend.")
+    parser.add_argument('--sqlite', help="Use this SQLite file instead of the backend configured in instance/config.py.")
+    parser.add_argument('--init', action='store_true', help="Create 'office' if missing (SQLite only; the app adds the other tables on start).")
+    parser.add_argument('--check', action='store_true', help="Print the backend, its pragmas and row counts.")
+    args = parser.parse_args()
+    if not args.init and not args.check: parser.print_help(); return
+
+    if args.sqlite: backend = SqliteBackend(args.sqlite)
+    else:
+        from instance import config
+        backend = backend_from_config(config)
+    conn = backend.connect()
+    try:
+        cursor = conn.cursor()
+        if args.init:
+            if backend.dialect != 'sqlite': print("Nothing to do: MySQL tables come from instance/schema.sql.")
+            else: ensure_sqlite_office_table(cursor); conn.commit(); print(f"'office' ready in {backend.path}.")
+        if args.check:
+            print(backend.describe())
+            if backend.dialect == 'sqlite':
+                for pragma in ['journal_mode', *backend.pragmas]:
+                    cursor.execute(f"PRAGMA {pragma}"); print(f"  {pragma} = {cursor.fetchone()[0]}")
+            for table in ['office', 'office_archive', 'accounts', 'lead_events', 'daily_lead_stats', 'lead_alerts']:
+                cursor.execute(f"SHOW TABLES LIKE '{table}';")
+                if cursor.fetchall():
+                    cursor.execute(f"SELECT COUNT(*) FROM {table}"); print(f"  {table}: {cursor.fetchone()[0]} row(s)")
+            conn.rollback()
+        cursor.close()
+    finally:
+        conn.close()
+
+if __name__ == "__main__":
+    main()
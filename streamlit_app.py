@@ -31,14 +31,79 @@ ADMIN_SIGNUP_SECRET = None
 EMAIL_ACCOUNT = None
 EMAIL_PASSWORD = None
 IMAP_SERVER = None
+# Optional settings: config.py may override these defaults.
+PASSWORD_HASH_SCHEMES = ["bcrypt"]  # First scheme hashes new passwords; older ones are upgraded on login
+PASSWORD_HASH_ROUNDS = {}           # Per-scheme cost, e.g. {"bcrypt": 12}
+LOGIN_VERIFY_WORKERS = 4            # Threads used for password verification
+LOGIN_MAX_FAILED_ATTEMPTS = 5       # Failed logins per username before throttling...
+LOGIN_LOCKOUT_SECONDS = 300         # ...within this window
+LOGIN_TRACKED_USERNAMES = 10000     # Most usernames with recent failures kept in memory (oldest dropped first)
+PERF_HISTORY_SIZE = 200             # Reruns kept for the admin Performance panel
+PERF_SLOW_RERUN_SECONDS = 3.0       # Reruns slower than this are logged to the console
+LEADS_TABLE_PAGE_SIZE = 100         # Rows per page in the paginated leads table
+LEADS_TABLE_FULL_RENDER_MAX_ROWS = 2000  # Above this the leads table opens paginated by default
+ALERT_ENGINE_ENABLED = True         # Background deadline-alert engine (mis_alerts.py)
+ALERT_ENGINE_INTERVAL_SECONDS = 900 # Seconds between alert refreshes
+SHARED_LEAD_CACHE_ENABLED = True    # One process-wide lead snapshot for all sessions (mis_shared.py)
+SHARED_LEAD_CACHE_INTERVAL_SECONDS = 10  # Signature check interval; writes from this process refresh at once
+ASYNC_DB_POOL_SIZE = 8              # Connections in the async pool used for concurrent dashboard reads
+ARCHIVE_AFTER_DAYS = 180            # Approved leads completed longer ago than this move to office_archive
+ARCHIVE_BATCH_SIZE = 500            # Leads moved per archive transaction
+DB_BACKEND = "mysql"                # "mysql" (MYSQL_CONFIG) or "sqlite" (single-PC installs, mis_storage.py)
+SQLITE_DATABASE_PATH = None         # SQLite file; None -> instance/mis_office.db
+SQLITE_PRAGMAS = {}                 # Overrides of mis_storage.SQLITE_DEFAULT_PRAGMAS
+READ_REPLICA_CONFIG = None          # MySQL replica for read-only queries (mis_replica.py); None: all reads on the primary
+READ_REPLICA_MAX_LAG_SECONDS = 5    # Reads fall back to the primary while the replica is further behind
+READ_REPLICA_HEARTBEAT_SECONDS = 1  # Lag check interval
+EMAIL_ATTACHMENTS_ENABLED = True    # Save attachments of lead emails as the new lead's documents (mis_mail.py)
+EMAIL_ATTACHMENT_EXTENSIONS = ['.pdf', '.doc', '.docx', '.xls', '.xlsx', '.txt', '.jpg', '.jpeg', '.png']
+EMAIL_ATTACHMENT_MAX_MB = 20        # Per file; larger attachments are skipped before download
+EMAIL_ATTACHMENTS_MAX_TOTAL_MB = 50 # Per email
+EMAIL_EXTRACTION_RULES = []         # Per-bank field templates keyed by sender domain (mis_rules.py); DB rules add to these
+REPORT_SCHEDULE_ENABLED = True      # Prebuild the standard Excel reports into instance/reports (mis_reports.py)
+REPORT_SCHEDULE_TIMES = ["07:00"]   # Local times (HH:MM) of the daily builds
+REPORT_RETENTION_DAYS = 30          # Older prebuilt files are deleted...
+REPORT_KEEP_LATEST = 3              # ...except the newest few of each report
 
 try:
     from instance import config
-    MYSQL_CONFIG = config.MYSQL_CONFIG
+    DB_BACKEND = getattr(config, 'DB_BACKEND', DB_BACKEND)
+    MYSQL_CONFIG = config.MYSQL_CONFIG if DB_BACKEND == 'mysql' else getattr(config, 'MYSQL_CONFIG', None)
+    SQLITE_DATABASE_PATH = getattr(config, 'SQLITE_DATABASE_PATH', SQLITE_DATABASE_PATH)
+    SQLITE_PRAGMAS = getattr(config, 'SQLITE_PRAGMAS', SQLITE_PRAGMAS)
+    READ_REPLICA_CONFIG = getattr(config, 'READ_REPLICA_CONFIG', READ_REPLICA_CONFIG)
+    READ_REPLICA_MAX_LAG_SECONDS = getattr(config, 'READ_REPLICA_MAX_LAG_SECONDS', READ_REPLICA_MAX_LAG_SECONDS)
+    READ_REPLICA_HEARTBEAT_SECONDS = getattr(config, 'READ_REPLICA_HEARTBEAT_SECONDS', READ_REPLICA_HEARTBEAT_SECONDS)
+    EMAIL_ATTACHMENTS_ENABLED = getattr(config, 'EMAIL_ATTACHMENTS_ENABLED', EMAIL_ATTACHMENTS_ENABLED)
+    EMAIL_ATTACHMENT_EXTENSIONS = getattr(config, 'EMAIL_ATTACHMENT_EXTENSIONS', EMAIL_ATTACHMENT_EXTENSIONS)
+    EMAIL_ATTACHMENT_MAX_MB = getattr(config, 'EMAIL_ATTACHMENT_MAX_MB', EMAIL_ATTACHMENT_MAX_MB)
+    EMAIL_ATTACHMENTS_MAX_TOTAL_MB = getattr(config, 'EMAIL_ATTACHMENTS_MAX_TOTAL_MB', EMAIL_ATTACHMENTS_MAX_TOTAL_MB)
+    EMAIL_EXTRACTION_RULES = getattr(config, 'EMAIL_EXTRACTION_RULES', EMAIL_EXTRACTION_RULES)
+    REPORT_SCHEDULE_ENABLED = getattr(config, 'REPORT_SCHEDULE_ENABLED', REPORT_SCHEDULE_ENABLED)
+    REPORT_SCHEDULE_TIMES = getattr(config, 'REPORT_SCHEDULE_TIMES', REPORT_SCHEDULE_TIMES)
+    REPORT_RETENTION_DAYS = getattr(config, 'REPORT_RETENTION_DAYS', REPORT_RETENTION_DAYS)
+    REPORT_KEEP_LATEST = getattr(config, 'REPORT_KEEP_LATEST', REPORT_KEEP_LATEST)
     ADMIN_SIGNUP_SECRET = config.ADMIN_SIGNUP_SECRET
     EMAIL_ACCOUNT = config.EMAIL_ACCOUNT
     EMAIL_PASSWORD = config.EMAIL_PASSWORD
     IMAP_SERVER = config.IMAP_SERVER
+    PASSWORD_HASH_SCHEMES = getattr(config, 'PASSWORD_HASH_SCHEMES', PASSWORD_HASH_SCHEMES)
+    PASSWORD_HASH_ROUNDS = getattr(config, 'PASSWORD_HASH_ROUNDS', PASSWORD_HASH_ROUNDS)
+    LOGIN_VERIFY_WORKERS = getattr(config, 'LOGIN_VERIFY_WORKERS', LOGIN_VERIFY_WORKERS)
+    LOGIN_MAX_FAILED_ATTEMPTS = getattr(config, 'LOGIN_MAX_FAILED_ATTEMPTS', LOGIN_MAX_FAILED_ATTEMPTS)
+    LOGIN_LOCKOUT_SECONDS = getattr(config, 'LOGIN_LOCKOUT_SECONDS', LOGIN_LOCKOUT_SECONDS)
+    LOGIN_TRACKED_USERNAMES = getattr(config, 'LOGIN_TRACKED_USERNAMES', LOGIN_TRACKED_USERNAMES)
+    PERF_HISTORY_SIZE = getattr(config, 'PERF_HISTORY_SIZE', PERF_HISTORY_SIZE)
+    PERF_SLOW_RERUN_SECONDS = getattr(config, 'PERF_SLOW_RERUN_SECONDS', PERF_SLOW_RERUN_SECONDS)
+    LEADS_TABLE_PAGE_SIZE = getattr(config, 'LEADS_TABLE_PAGE_SIZE', LEADS_TABLE_PAGE_SIZE)
+    LEADS_TABLE_FULL_RENDER_MAX_ROWS = getattr(config, 'LEADS_TABLE_FULL_RENDER_MAX_ROWS', LEADS_TABLE_FULL_RENDER_MAX_ROWS)
+    ALERT_ENGINE_ENABLED = getattr(config, 'ALERT_ENGINE_ENABLED', ALERT_ENGINE_ENABLED)
+    ALERT_ENGINE_INTERVAL_SECONDS = getattr(config, 'ALERT_ENGINE_INTERVAL_SECONDS', ALERT_ENGINE_INTERVAL_SECONDS)
+    SHARED_LEAD_CACHE_ENABLED = getattr(config, 'SHARED_LEAD_CACHE_ENABLED', SHARED_LEAD_CACHE_ENABLED)
+    SHARED_LEAD_CACHE_INTERVAL_SECONDS = getattr(config, 'SHARED_LEAD_CACHE_INTERVAL_SECONDS', SHARED_LEAD_CACHE_INTERVAL_SECONDS)
+    ASYNC_DB_POOL_SIZE = getattr(config, 'ASYNC_DB_POOL_SIZE', ASYNC_DB_POOL_SIZE)
+    ARCHIVE_AFTER_DAYS = getattr(config, 'ARCHIVE_AFTER_DAYS', ARCHIVE_AFTER_DAYS)
+    ARCHIVE_BATCH_SIZE = getattr(config, 'ARCHIVE_BATCH_SIZE', ARCHIVE_BATCH_SIZE)
     # You could also load APP_NAME from config.py if you want it configurable:
     # APP_NAME = config.APP_NAME
     print("Successfully loaded configuration from instance/config.py")
@@ -67,31 +132,30 @@ except AttributeError as e:
 # Define these after config loading, so they are globally available.
 APP_NAME = "Office MIS (MySQL)"  # Or load from config.py if you added it there
 APP_ROOT_PATH = os.path.dirname(os.path.abspath(__file__))
+LEAD_FILES_BASE_PATH = os.path.join(APP_ROOT_PATH, "instance", "lead_uploads")
 
 # --- Main Script Imports ---
 # sys and os are already imported at the top.
 import subprocess
 import calendar
 import pandas as pd
-import numpy as np # Import numpy for np.datetime64
-try:
-    PANDAS_AVAILABLE = True
-    import openpyxl # For custom excel
-    from openpyxl.styles import Font, Alignment, Border, Side, PatternFill
-    from openpyxl.utils import get_column_letter
-except ImportError:
-    PANDAS_AVAILABLE = False
-    print("Pandas or Openpyxl not available. Some features might be disabled.")
+from mis_core import PANDAS_AVAILABLE # pandas + openpyxl; the Excel builders live in mis_core
 
-import mysql.connector
-from mysql.connector import Error # Error is now correctly imported
+from mis_storage import DATABASE_ERRORS as Error # mysql.connector.Error / sqlite3.Error, whichever backend is used
+from mis_storage import ensure_sqlite_office_table, storage_backend
+try:
+    STORAGE = storage_backend(DB_BACKEND, MYSQL_CONFIG, SQLITE_DATABASE_PATH, SQLITE_PRAGMAS) # every DB connection comes from here
+except (RuntimeError, ValueError, OSError) as e:
+    print(f"CRITICAL ERROR: Storage backend '{DB_BACKEND}' unavailable: {e}")
+    STORAGE = None
 import datetime # This was imported in the original, ensure it's here.
-from io import BytesIO
+from io import StringIO
 
 # --- Passlib Import and Initialization with Error Handling ---
 try:
-    from passlib.context import CryptContext
-    pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+    from mis_auth import PasswordPolicy
+    # Shared with mis_api.py: hashes using a non-default scheme or below the configured cost are rehashed on login.
+    password_policy = PasswordPolicy(PASSWORD_HASH_SCHEMES, PASSWORD_HASH_ROUNDS)
     PASSLIB_AVAILABLE = True
     print("Passlib loaded successfully.")
 except AttributeError as e_passlib: # bcrypt version issue
@@ -104,18 +168,57 @@ except AttributeError as e_passlib: # bcrypt version issue
     print("Password hashing functionality will be disabled.")
     print("="*60)
     PASSLIB_AVAILABLE = False
-    pwd_context = None
+    password_policy = None
 except ImportError:
     print("ERROR: 'passlib' library not found. Password hashing disabled. Install with 'pip install passlib[bcrypt]'")
     PASSLIB_AVAILABLE = False
-    pwd_context = None
+    password_policy = None
 # --- End Passlib Import ---
 
 import imaplib
-import email
-from email.header import decode_header
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor, TimeoutError as FutureTimeoutError
+import collections
+import cProfile
+import marshal
+import pstats
 import re
 import streamlit as st # Import Streamlit
+from mis_core import (
+    ALL_BANK_OPTIONS_COMBINED, ALL_BANK_OPTIONS_DROPDOWN, ALL_BANK_OPTIONS_FILTER, LEAD_STATUSES,
+    OFFICE_INSERT_COLUMNS, OFFICE_DATE_COLUMNS,
+    get_status_and_color_value,
+    LeadStore, lead_frame_records, LEAD_TABLE_COLUMN_ORDER, order_lead_table_rows, format_lead_table, compute_summary_dashboard_tables, build_per_day_allocation_table,
+    build_standard_excel_export, generate_custom_excel_report,
+)
+from mis_rollup import (
+    lead_stats_insert_statements, lead_stats_transition_statements, rebuild_daily_lead_stats,
+    TREND_MONTHLY_SQL, TREND_BANK_VOLUME_SQL, TREND_BACKLOG_OPENING_SQL, TREND_BACKLOG_DAILY_SQL,
+    trend_window_start, monthly_trend_frame, bank_volume_frame, backlog_frame,
+)
+from mis_events import (
+    lead_event_row, lead_event_statements, lead_created_event_statements, seed_lead_events,
+    LEAD_HISTORY_SQL, LEADS_AS_OF_SQL, USER_ACTIVITY_SQL, as_of_cutoff, leads_as_of_frames, user_activity_frame,
+)
+from mis_archive import (
+    ARCHIVE_SIGNATURE_SQL, ARCHIVE_LEADS_SQL, ARCHIVE_PENDING_SQL, ensure_archive_table, archive_completed_leads, archive_cutoff, merge_lead_rows,
+)
+from mis_analytics import TURNAROUND_GROUPINGS, lead_data_version, compute_turnaround_analytics, build_turnaround_excel
+from mis_alerts import ALERT_TYPES, ensure_alert_tables, lead_alert_statements, load_alert_settings, run_alert_cycle, start_alert_scheduler
+from mis_shared import SharedLeadCache
+from mis_async_db import MYSQL_AIO_AVAILABLE, AsyncDbRunner, mysql_pool
+from mis_replica import ReplicaRouter
+from mis_rules import ExtractionRuleRegistry, ensure_extraction_rules_table
+from mis_mail import (
+    EMAIL_TEXT_PART_MAX_BYTES, describe_fetch, fetch_lead_email,
+    stage_email_attachments, move_staged_attachments, discard_moved_attachments, discard_staging,
+)
+from mis_reports import (
+    REPORTS_DIR, REPORT_SIGNATURE_SQL, XLSX_MIME, ReportScheduler, is_report_current, latest_report, report_key,
+)
+from mis_snapshot import PYARROW_AVAILABLE, SNAPSHOT_DIR, read_snapshot_state, refresh_office_snapshot, snapshot_months, load_office_snapshot
 
 # --- Self-Launch Helper Function ---
 def run_with_streamlit():
@@ -157,53 +260,207 @@ if __name__ == "__main__":
         # Uses the globally defined APP_NAME
         st.set_page_config(page_title=APP_NAME, layout="wide", initial_sidebar_state="expanded")
 
-        # --- Bank Names List (Deduplicated and Categorized) ---
-        # These are app-specific constants, not secrets.
-        BANKS_PORTAL_REPORT = sorted([
-            "Aditya Birla HL (Portal Report)", "Chola Mandalam (Micro LAP) (Portal Report)",
-            "Chola Mandalam (Prime LAP) (Portal Report)", "CSL (Portal Report)",
-            "CSC (Portal Report)", "DMI (Portal Report)", "ICICI (Portal Report)",
-            "IIFL (Portal Report)", "Kotak (Portal Report)", "Motilal (Portal Report)",
-            "Piramal (Portal Report)", "Shubham HFC (Portal Report)", "TATA (Portal Report)"
-        ])
-
-        BANKS_NORMAL = sorted(list(set([ # Using set to ensure uniqueness from various sources
-            "AU Small Finance Bank", "Ambit Finance", "Aye Finance", "Axis", "Canara bank",
-            "Chola (HL)", "Chola (SME)", "Chola Mandalam (SBPL)", "DCB Bank",
-            "Grihum", "Godrej Finance Ltd", "HDFC Bank", "Hero Housing", "ICICI HFC",
-            "IDFC", "Incred", "IndusInd", "Jana bank", "L&T", "LICHFL", "Mahindra",
-            "Poonawalla", "SK Finance", "SMFG", "True home",
-            "Utkarsh Small Finance Bank", "Ujjivan Small Finance Bank", "Yes Bank"
-        ])))
-        ALL_BANK_OPTIONS_COMBINED = sorted(list(set(BANKS_PORTAL_REPORT + BANKS_NORMAL)))
-        ALL_BANK_OPTIONS_DROPDOWN = ["--Select Bank--"] + ALL_BANK_OPTIONS_COMBINED + ["Other"]
-        ALL_BANK_OPTIONS_FILTER = ["-- All Banks --"] + ALL_BANK_OPTIONS_COMBINED
+        # --- Indexes on 'office' (created by initialize_database if missing) ---
+        # Role-scoped lead lists filter on these columns and sort by received_date.
+        OFFICE_INDEXES = {
+            'idx_office_site_engineer': "(site_engineer, received_date)",
+            'idx_office_report_creator': "(report_creator, received_date)",
+            'idx_office_status_deadline': "(status, deadline)", # deadline-alert engine
+        }
+
+        # --- Columns added to 'office' automatically by initialize_database ---
+        # 'version' is bumped by every UPDATE so bulk actions can detect rows changed since the page loaded.
+        OFFICE_AUTO_COLUMNS = {
+            'version': "INT NOT NULL DEFAULT 0",
+        }
+
+        # --- Bulk import: spreadsheet header (lower-cased) -> office column ---
+        # Headers not listed here are matched against OFFICE_INSERT_COLUMNS after snake_casing.
+        BULK_IMPORT_HEADER_ALIASES = {
+            'bank': 'bank_name', 'bank/nbfc': 'bank_name', 'property': 'property_details', 'property address': 'property_details',
+            "customer's name": 'customer_name', 'customer': 'customer_name', 'client name': 'customer_name',
+            'application no': 'application_number', 'application no.': 'application_number', 'app no': 'application_number', 'application id': 'application_number',
+            'site engg.': 'site_engineer', 'site engg': 'site_engineer', 'engineer': 'site_engineer',
+            'branch/virtual': 'branch_virtual', 'branch': 'branch_virtual',
+            'due date': 'deadline', 'allocation date': 'date_of_allocation', 'received on': 'received_date',
+            'contact': 'contact_number', 'contact no': 'contact_number', 'mobile': 'contact_number', 'mobile no': 'contact_number', 'phone': 'contact_number',
+            'distance (km)': 'distance', 'type of visit': 'visit_type', 'address': 'location',
+        }
+        BULK_IMPORT_EXCLUDED_COLUMNS = ['site_photo_filenames', 'site_document_filenames']
+
+        # --- Unified login accounts (replaces separate admins / users / site_engineers lookups) ---
+        ACCOUNT_ROLES = ['admin', 'user', 'engineer']
+        ACCOUNTS_TABLE_DDL = """
+            CREATE TABLE IF NOT EXISTS accounts (
+                account_id INT PRIMARY KEY AUTO_INCREMENT,
+                username VARCHAR(50) NOT NULL,
+                password_hash VARCHAR(255) NOT NULL,
+                role VARCHAR(20) NOT NULL DEFAULT 'user',
+                full_name VARCHAR(100) NULL,
+                contact_number VARCHAR(20) NULL,
+                UNIQUE KEY uq_accounts_username (username)
+            )
+        """
+        # Legacy table -> INSERT..SELECT copying its rows; admins first so they win any username clash.
+        ACCOUNTS_MIGRATION_STATEMENTS = {
+            'admins': """
+                INSERT INTO accounts (username, password_hash, role)
+                SELECT a.username, a.password_hash, 'admin' FROM admins a
+                WHERE NOT EXISTS (SELECT 1 FROM accounts x WHERE x.username = a.username)
+            """,
+            'site_engineers': """
+                INSERT INTO accounts (username, password_hash, role, full_name, contact_number)
+                SELECT e.username, e.password_hash, 'engineer', e.full_name, e.contact_number FROM site_engineers e
+                WHERE NOT EXISTS (SELECT 1 FROM accounts x WHERE x.username = e.username)
+            """,
+            'users': """
+                INSERT INTO accounts (username, password_hash, role)
+                SELECT u.username, u.password_hash,
+                       CASE LOWER(TRIM(u.role)) WHEN 'admin' THEN 'admin' WHEN 'engineer' THEN 'engineer' ELSE 'user' END
+                FROM users u
+                WHERE NOT EXISTS (SELECT 1 FROM accounts x WHERE x.username = u.username)
+            """,
+        }
+
+        # --- Bulk lead transitions (same rules as the single-lead action buttons) ---
+        BULK_LEAD_TRANSITIONS = {
+            "Assign Engineer": {'from_status': 'New', 'to_status': 'Assigned Engineer', 'assignee_column': 'site_engineer', 'date_column': 'date_of_allocation', 'review_status': None, 'roles': ['admin']},
+            "Mark Visit Done": {'from_status': 'Assigned Engineer', 'to_status': 'Visit Done', 'assignee_column': None, 'date_column': 'visit_completion_date', 'review_status': None, 'roles': ['admin', 'engineer']},
+            "Assign Report Creator": {'from_status': 'Visit Done', 'to_status': 'Report in Progress', 'assignee_column': 'report_creator', 'date_column': None, 'review_status': None, 'roles': ['admin']},
+            "Approve Completed Reports": {'from_status': 'Completed', 'to_status': 'Completed', 'assignee_column': None, 'date_column': None, 'review_status': 'Approved', 'roles': ['admin']},
+        }
 
         # === UTILITY FUNCTIONS ===
+        @st.cache_resource
+        def get_password_worker_pool():
+            # Process-wide pool so bcrypt work from all sessions runs off the script threads, at most
+            # LOGIN_VERIFY_WORKERS at a time; the semaphore caps how many more may queue behind them.
+            return {
+                'executor': ThreadPoolExecutor(max_workers=LOGIN_VERIFY_WORKERS, thread_name_prefix="pwd-verify"),
+                'slots': threading.BoundedSemaphore(LOGIN_VERIFY_WORKERS * 4),
+            }
+
+        @st.cache_resource
+        def get_login_attempt_tracker():
+            return {'lock': threading.Lock(), 'failures': {}} # username -> monotonic times of recent failures
+
+        def run_in_password_pool(func, *args):
+            # Returns func(*args) computed on the worker pool, or raises TimeoutError if the pool is saturated.
+            pool = get_password_worker_pool()
+            if not pool['slots'].acquire(timeout=5): raise FutureTimeoutError("Password worker pool is saturated.")
+            try: return pool['executor'].submit(func, *args).result(timeout=30)
+            finally: pool['slots'].release()
+
+        def login_throttle_seconds_left(username):
+            tracker = get_login_attempt_tracker(); key = (username or "").strip().lower(); now = time.monotonic()
+            with tracker['lock']:
+                recent = [t for t in tracker['failures'].get(key, []) if now - t < LOGIN_LOCKOUT_SECONDS]
+                if recent: tracker['failures'][key] = recent
+                else: tracker['failures'].pop(key, None)
+                if len(recent) >= LOGIN_MAX_FAILED_ATTEMPTS: return LOGIN_LOCKOUT_SECONDS - (now - recent[0])
+            return 0
+
+        def record_login_attempt(username, succeeded):
+            # Failures are pruned as they are recorded, so usernames tried once (or never again) do not
+            # accumulate: expired entries go first, then the stalest beyond LOGIN_TRACKED_USERNAMES.
+            tracker = get_login_attempt_tracker(); key = (username or "").strip().lower(); now = time.monotonic()
+            with tracker['lock']:
+                failures = tracker['failures']
+                if succeeded: failures.pop(key, None); return
+                for stale_key in [k for k, times in failures.items() if now - times[-1] >= LOGIN_LOCKOUT_SECONDS]: del failures[stale_key]
+                failures.setdefault(key, []).append(now)
+                if len(failures) > LOGIN_TRACKED_USERNAMES:
+                    for stale_key in sorted(failures, key=lambda k: failures[k][-1])[:len(failures) - LOGIN_TRACKED_USERNAMES]: del failures[stale_key]
+
         def verify_password(plain, hashed):
+            # Returns (is_valid, new_hash); new_hash is set when the stored hash should be upgraded.
             if not PASSLIB_AVAILABLE:
                 st.error("Password verification disabled due to library error.")
-                return False
-            if not plain or not hashed: return False
-            try: return pwd_context.verify(plain, hashed)
-            except Exception as e: print(f"Verify Password Error: {e}"); return False
+                return False, None
+            # hashed None (unknown username) is checked against a dummy hash, so it costs as much as a real one.
+            if not plain: return False, None
+            try: return run_in_password_pool(password_policy.verify, plain, hashed)
+            except Exception as e: print(f"Verify Password Error: {e}"); return False, None
 
         def get_password_hash(pwd):
             if not PASSLIB_AVAILABLE:
                 st.error("Password hashing disabled due to library error.")
                 return None
-            return pwd_context.hash(pwd)
+            try: return run_in_password_pool(password_policy.hash, pwd)
+            except Exception as e: print(f"Password Hash Error: {e}"); return None
+
+        def authenticate_account(username, password, account_row, account_table):
+            # Throttles repeated failures per username before any hashing work is done, verifies on the
+            # worker pool and transparently stores a rehashed password when the hash policy has changed.
+            # Returns (ok, error_message).
+            wait_seconds = login_throttle_seconds_left(username)
+            if wait_seconds > 0:
+                return False, f"Too many failed sign-in attempts for this username. Try again in {int(wait_seconds // 60) + 1} minute(s)."
+            is_valid, upgraded_hash = verify_password(password, account_row['password_hash'] if account_row else None)
+            record_login_attempt(username, is_valid)
+            if not is_valid: return False, None
+            if upgraded_hash:
+                if run_db_query(f"UPDATE {account_table} SET password_hash=%s WHERE username=%s", (upgraded_hash, account_row['username'])) is not None:
+                    print(f"Password hash upgraded for '{account_row['username']}' in {account_table}.")
+            return True, None
+
+        def ensure_office_indexes(cursor):
+            for index_name, index_columns in OFFICE_INDEXES.items():
+                cursor.execute("SHOW INDEX FROM office WHERE Key_name = %s", (index_name,))
+                if not cursor.fetchall():
+                    print(f"Creating missing index '{index_name}' on office {index_columns}...")
+                    try: cursor.execute(f"CREATE INDEX {index_name} ON office {index_columns}")
+                    except Error as e_idx: print(f"WARNING: Could not create index '{index_name}': {e_idx}")
+
+        def ensure_office_columns(cursor):
+            for column_name, column_definition in OFFICE_AUTO_COLUMNS.items():
+                cursor.execute(f"SHOW COLUMNS FROM office LIKE '{column_name}';")
+                if not cursor.fetchone():
+                    print(f"Adding missing column '{column_name}' to office...")
+                    try: cursor.execute(f"ALTER TABLE office ADD COLUMN `{column_name}` {column_definition}")
+                    except Error as e_col: print(f"WARNING: Could not add column '{column_name}': {e_col}")
+
+        def ensure_daily_lead_stats_table(conn, cursor):
+            cursor.execute("SHOW TABLES LIKE 'daily_lead_stats';")
+            if not cursor.fetchone():
+                print("Table 'daily_lead_stats' not found. Creating it and building the rollup from office...")
+                try: print(f"  {rebuild_daily_lead_stats(conn)} rollup row(s) written.")
+                except Error as e_rollup: print(f"WARNING: Could not build daily_lead_stats: {e_rollup}")
+
+        def ensure_lead_events_table(conn, cursor):
+            cursor.execute("SHOW TABLES LIKE 'lead_events';")
+            if not cursor.fetchone():
+                print("Table 'lead_events' not found. Creating it with baseline events for existing leads...")
+                try: print(f"  {seed_lead_events(conn)} baseline event(s) written.")
+                except Error as e_events: print(f"WARNING: Could not create lead_events: {e_events}")
+
+        def migrate_to_accounts_table(cursor):
+            # Creates 'accounts' and copies every legacy login into it. The legacy tables are left untouched.
+            print("Table 'accounts' not found. Creating it and migrating legacy login tables...")
+            cursor.execute(ACCOUNTS_TABLE_DDL)
+            for legacy_table, migration_sql in ACCOUNTS_MIGRATION_STATEMENTS.items():
+                cursor.execute(f"SHOW TABLES LIKE '{legacy_table}';")
+                if cursor.fetchone():
+                    cursor.execute(migration_sql)
+                    print(f"  Migrated {cursor.rowcount} account(s) from '{legacy_table}'.")
 
         @st.cache_resource
         def initialize_database():
             print("Checking DB connection and table existence...")
-            if MYSQL_CONFIG is None: # Check if config loading failed
-                print("FATAL: MYSQL_CONFIG is not loaded. Cannot initialize database.")
+            if STORAGE is None: # Check if config loading failed
+                print("FATAL: No storage backend configured. Cannot initialize database.")
                 return False
             try:
-                conn = mysql.connector.connect(**MYSQL_CONFIG)
+                conn = STORAGE.connect()
                 cursor = conn.cursor()
-                tables = ['admins', 'users', 'office', 'site_engineers']
+                if STORAGE.dialect == 'sqlite': # MySQL installs create office from instance/schema.sql
+                    ensure_sqlite_office_table(cursor)
+                    conn.commit()
+                cursor.execute("SHOW TABLES LIKE 'accounts';")
+                if not cursor.fetchone():
+                    migrate_to_accounts_table(cursor)
+                    conn.commit()
+                tables = ['office', 'accounts']
                 exists = True
                 for t in tables:
                     cursor.execute(f"SHOW TABLES LIKE '{t}';")
@@ -217,7 +474,7 @@ if __name__ == "__main__":
                 # IMPORTANT: Inform user about new columns needed for file uploads
                 # This is a conceptual check, actual check might be more involved or done at app startup
                 if exists:
-                    conn_check_cols = mysql.connector.connect(**MYSQL_CONFIG)
+                    conn_check_cols = STORAGE.connect()
                     cursor_check_cols = conn_check_cols.cursor()
                     cursor_check_cols.execute("SHOW COLUMNS FROM office LIKE 'site_photo_filenames';")
                     if not cursor_check_cols.fetchone():
@@ -227,38 +484,245 @@ if __name__ == "__main__":
                     if not cursor_check_cols.fetchone():
                         print("WARNING: Column 'site_document_filenames' not found in 'office' table. File upload feature may not work correctly.")
                         # st.warning("Database column 'site_document_filenames' is missing. File features might be affected.")
+                    ensure_office_columns(cursor_check_cols)
+                    ensure_office_indexes(cursor_check_cols)
+                    ensure_daily_lead_stats_table(conn_check_cols, cursor_check_cols)
+                    ensure_lead_events_table(conn_check_cols, cursor_check_cols)
+                    try: ensure_archive_table(cursor_check_cols)
+                    except Error as e_archive: print(f"WARNING: Could not create office_archive: {e_archive}")
+                    ensure_alert_tables(cursor_check_cols)
+                    ensure_extraction_rules_table(cursor_check_cols)
                     cursor_check_cols.close()
                     conn_check_cols.close()
 
                 return exists
-            except Error as e: # mysql.connector.Error
-                print(f"MySQL Init Error: {e}")
+            except Error as e: # mysql.connector.Error / sqlite3.Error
+                print(f"DB Init Error ({DB_BACKEND}): {e}")
                 return False
             except Exception as e_gen: # Catch other potential errors like config issues if not caught earlier
                 print(f"General Error during DB Init: {e_gen}")
                 return False
 
 
-        def run_db_query(query, params=(), fetch_one=False, fetch_all=False):
+        @st.cache_resource
+        def get_alert_engine():
+            # One scheduler thread per server process, whatever the number of sessions.
+            if not ALERT_ENGINE_ENABLED or STORAGE is None: return None
+            print(f"Starting deadline-alert engine (every {ALERT_ENGINE_INTERVAL_SECONDS}s)...")
+            return start_alert_scheduler(STORAGE.connect, load_alert_settings(config), ALERT_ENGINE_INTERVAL_SECONDS)
+
+
+        @st.cache_resource
+        def get_replica_router():
+            # Routes read-only queries to READ_REPLICA_CONFIG while it keeps up; None when no replica is configured.
+            if not READ_REPLICA_CONFIG or STORAGE is None or STORAGE.dialect != 'mysql': return None
+            print(f"Starting read-replica router (max lag {READ_REPLICA_MAX_LAG_SECONDS}s)...")
+            return ReplicaRouter(STORAGE.connect, storage_backend('mysql', READ_REPLICA_CONFIG).connect,
+                                 READ_REPLICA_MAX_LAG_SECONDS, READ_REPLICA_HEARTBEAT_SECONDS).start()
+
+        @st.cache_resource
+        def get_extraction_rules():
+            # Compiled per-bank rules plus their hit counters, shared by every session that checks email.
+            return ExtractionRuleRegistry(EMAIL_EXTRACTION_RULES, STORAGE.connect if STORAGE is not None else None)
+
+        def read_connect():
+            # Connection for a read-only query: the replica unless it lags or lacks this session's last write.
+            replica_router = get_replica_router()
+            if replica_router is None: return STORAGE.connect()
+            return replica_router.read_connect(st.session_state.get('replica_write_at'))
+
+        @st.cache_resource
+        def get_shared_lead_cache():
+            # The only reader of 'office' for the lead lists; every session takes its rows from here.
+            if not SHARED_LEAD_CACHE_ENABLED or STORAGE is None: return None
+            print(f"Starting shared lead cache (signature check every {SHARED_LEAD_CACHE_INTERVAL_SECONDS}s)...")
+            replica_router = get_replica_router()
+            # On the replica only once it has every write made by this process, so write tickets stay honest.
+            connect = (lambda: replica_router.read_connect(replica_router.last_write_at)) if replica_router else STORAGE.connect
+            return SharedLeadCache(connect, SHARED_LEAD_CACHE_INTERVAL_SECONDS).start()
+
+        @st.cache_resource
+        def get_report_scheduler():
+            # Builds the prebuilt reports at REPORT_SCHEDULE_TIMES; also used (unstarted) for "Regenerate Now".
+            if STORAGE is None: return None
+            replica_router = get_replica_router()
+            connect = (lambda: replica_router.read_connect(replica_router.last_write_at)) if replica_router else STORAGE.connect
+            report_scheduler = ReportScheduler(connect, REPORTS_DIR, REPORT_SCHEDULE_TIMES, REPORT_RETENTION_DAYS, REPORT_KEEP_LATEST)
+            if REPORT_SCHEDULE_ENABLED:
+                print(f"Starting report scheduler (daily at {', '.join(REPORT_SCHEDULE_TIMES)})...")
+                report_scheduler.start()
+            return report_scheduler
+
+        def note_lead_write():
+            # After a commit: wake the shared cache and make this session's next read include the write.
+            replica_router = get_replica_router()
+            if replica_router is not None: st.session_state['replica_write_at'] = replica_router.note_write()
+            shared_cache = get_shared_lead_cache()
+            if shared_cache is not None: st.session_state['lead_write_ticket'] = shared_cache.notify_write()
+
+        def get_shared_lead_snapshot():
+            shared_cache = get_shared_lead_cache()
+            if shared_cache is None: return None
+            shared_snapshot = shared_cache.get(st.session_state.get('lead_write_ticket', 0))
+            if shared_snapshot is None: print(f"Shared lead cache not ready ({shared_cache.last_error or 'first load pending'}), querying directly.")
+            return shared_snapshot
+
+
+        # --- Performance instrumentation ---
+        # Streamlit re-executes this script for every rerun, so PERF_RERUN only ever holds the current rerun.
+        PERF_RERUN = {'started': time.perf_counter(), 'last_mark': time.perf_counter(), 'sections': {}, 'queries': []}
+
+        @st.cache_resource
+        def get_perf_history():
+            return {'lock': threading.Lock(), 'reruns': collections.deque(maxlen=PERF_HISTORY_SIZE)}
+
+        def perf_begin_rerun():
+            now = time.perf_counter()
+            PERF_RERUN.update(started=now, last_mark=now, sections={}, queries=[])
+
+        def perf_checkpoint(section_name):
+            # Attributes the wall time since the previous checkpoint to section_name.
+            now = time.perf_counter()
+            PERF_RERUN['sections'][section_name] = PERF_RERUN['sections'].get(section_name, 0.0) + (now - PERF_RERUN['last_mark'])
+            PERF_RERUN['last_mark'] = now
+
+        def perf_record_query(query, seconds, row_count):
+            PERF_RERUN['queries'].append({'query': " ".join(str(query).split())[:120], 'seconds': seconds, 'rows': row_count})
+
+        def perf_finish_rerun():
+            total_seconds = time.perf_counter() - PERF_RERUN['started']
+            record = {
+                'at': datetime.datetime.now(), 'user': st.session_state.get('username'), 'total': total_seconds,
+                'sections': dict(PERF_RERUN['sections']), 'queries': list(PERF_RERUN['queries']),
+            }
+            history = get_perf_history()
+            with history['lock']: history['reruns'].append(record)
+            if total_seconds > PERF_SLOW_RERUN_SECONDS:
+                slowest = sorted(record['sections'].items(), key=lambda kv: kv[1], reverse=True)[:3]
+                print(f"Slow rerun ({total_seconds:.2f}s) for {record['user']}: " + ", ".join(f"{name}={secs:.2f}s" for name, secs in slowest))
+
+        def run_instrumented_rerun(app_func):
+            # Times the whole rerun and, when an admin asked for it, captures a cProfile of this single rerun.
+            perf_begin_rerun()
+            profiler = cProfile.Profile() if st.session_state.pop('perf_profile_next_rerun', False) else None
+            completed = False
+            if profiler: profiler.enable()
+            try:
+                app_func()
+                completed = True
+            finally:
+                if profiler:
+                    profiler.disable()
+                    profiler.create_stats()
+                    stats_text = StringIO()
+                    pstats.Stats(profiler, stream=stats_text).sort_stats('cumulative').print_stats(40)
+                    st.session_state['perf_profile_dump'] = marshal.dumps(profiler.stats) # Same format as Profile.dump_stats()
+                    st.session_state['perf_profile_text'] = stats_text.getvalue()
+                    st.session_state['perf_profile_taken_at'] = datetime.datetime.now()
+                perf_finish_rerun()
+            if profiler and completed: st.rerun() # Show the captured profile straight away
+
+        def summarize_timings(df, key_col, extra_aggs=None):
+            grouped = df.groupby(key_col)
+            summary = pd.DataFrame({
+                'Samples': grouped['seconds'].size(),
+                'p50 (ms)': grouped['seconds'].quantile(0.5) * 1000,
+                'p90 (ms)': grouped['seconds'].quantile(0.9) * 1000,
+                'p99 (ms)': grouped['seconds'].quantile(0.99) * 1000,
+                'Max (ms)': grouped['seconds'].max() * 1000,
+            })
+            for label, (col, func) in (extra_aggs or {}).items(): summary[label] = grouped[col].agg(func)
+            return summary.round(1).sort_values('p90 (ms)', ascending=False).reset_index()
+
+        def display_performance_panel():
+            st.subheader("⏱️ Performance")
+            shared_cache = get_shared_lead_cache()
+            if shared_cache is not None and shared_cache.snapshot is not None:
+                st.caption(f"Shared lead cache: {len(shared_cache.snapshot.store)} leads loaded {shared_cache.snapshot.loaded_at:%H:%M:%S} "
+                           f"in {shared_cache.snapshot.load_seconds:.2f}s | {shared_cache.stats['reloads']} reload(s), "
+                           f"{shared_cache.stats['signature_checks']} signature check(s) since {shared_cache.stats['started_at']:%d-%b %H:%M}")
+            replica_router = get_replica_router()
+            if replica_router is not None:
+                replica_status = replica_router.status()
+                lag_text = "unknown" if replica_status['lag_seconds'] is None else f"{replica_status['lag_seconds']:.1f}s"
+                st.caption(f"Read replica: {'in use' if replica_status['healthy'] else 'bypassed'} (lag {lag_text}, limit {READ_REPLICA_MAX_LAG_SECONDS}s) | "
+                           f"{replica_status['replica_reads']} replica / {replica_status['primary_reads']} primary read(s), "
+                           f"{replica_status['fallback_reads']} fallback(s) since {replica_status['started_at']:%d-%b %H:%M}"
+                           + (f" | last error {replica_status['last_error']}" if replica_status['last_error'] else ""))
+            extraction_rules = get_extraction_rules()
+            if (extraction_rules.rules or extraction_rules.stats) and PANDAS_AVAILABLE:
+                with st.expander(f"Email extraction rules: {len(extraction_rules.rules)} rule(s)"
+                                 + (f", {len(extraction_rules.errors)} skipped" if extraction_rules.errors else "")):
+                    st.dataframe(pd.DataFrame(extraction_rules.stats_rows()), use_container_width=True, hide_index=True)
+                    for rule_error in extraction_rules.errors: st.caption(f"Skipped rule - {rule_error}")
+                    if extraction_rules.unmatched_domains:
+                        st.caption("Senders without a rule: " + ", ".join(f"{domain} ({count})" for domain, count in extraction_rules.unmatched_domains.most_common(10)))
+            history = get_perf_history()
+            with history['lock']: reruns = list(history['reruns'])
+            if not reruns or not PANDAS_AVAILABLE:
+                st.info("No reruns recorded yet." if PANDAS_AVAILABLE else "Pandas library needed for the performance panel.")
+            else:
+                st.caption(f"Percentiles over the last {len(reruns)} rerun(s) across all sessions (this rerun is recorded once it finishes).")
+                section_df = pd.DataFrame(
+                    [{'Section': name, 'seconds': secs} for rerun in reruns for name, secs in rerun['sections'].items()] +
+                    [{'Section': "TOTAL RERUN", 'seconds': rerun['total']} for rerun in reruns]
+                )
+                query_df = pd.DataFrame([q for rerun in reruns for q in rerun['queries']], columns=['query', 'seconds', 'rows'])
+                perf_cols = st.columns(2)
+                with perf_cols[0]:
+                    st.markdown("##### Render Sections")
+                    st.dataframe(summarize_timings(section_df, 'Section'), use_container_width=True, hide_index=True)
+                with perf_cols[1]:
+                    st.markdown("##### Database Queries")
+                    if query_df.empty: st.info("No queries recorded.")
+                    else:
+                        query_df['rows'] = pd.to_numeric(query_df['rows'], errors='coerce')
+                        st.dataframe(summarize_timings(query_df, 'query', {'Avg Rows': ('rows', 'mean')}), use_container_width=True, hide_index=True)
+                last_rerun = reruns[-1]
+                with st.expander(f"Last recorded rerun: {last_rerun['total']*1000:.0f} ms at {last_rerun['at']:%H:%M:%S} ({last_rerun['user']})"):
+                    st.dataframe(pd.DataFrame([{'Section': k, 'ms': round(v * 1000, 1)} for k, v in last_rerun['sections'].items()]), use_container_width=True, hide_index=True)
+                    st.dataframe(pd.DataFrame([{'Query': q['query'], 'ms': round(q['seconds'] * 1000, 1), 'Rows': q['rows']} for q in last_rerun['queries']]), use_container_width=True, hide_index=True)
+
+            st.markdown("##### cProfile Capture")
+            if st.button("Profile Next Rerun", key="perf_profile_next_btn_v15", help="Runs this page once under cProfile and offers the .prof file for download."):
+                st.session_state['perf_profile_next_rerun'] = True; st.rerun()
+            if st.session_state.get('perf_profile_dump'):
+                st.download_button(
+                    label=f"⬇️ Download Profile ({st.session_state['perf_profile_taken_at']:%H:%M:%S})",
+                    data=st.session_state['perf_profile_dump'],
+                    file_name=f"mis_rerun_{st.session_state['perf_profile_taken_at']:%Y%m%d_%H%M%S}.prof",
+                    mime="application/octet-stream", key="perf_profile_download_v15",
+                    help="Open with: python -m pstats <file> or snakeviz <file>"
+                )
+                with st.expander("Top 40 functions by cumulative time"): st.text(st.session_state.get('perf_profile_text', ''))
+
+        def run_db_query(query, params=(), fetch_one=False, fetch_all=False, primary=False):
+            # Fetches go to the replica (dashboards, lists); pass primary=True for reads that feed a write or a login.
             conn = None
             cursor = None
             results = None
-            if MYSQL_CONFIG is None:
+            row_count = None
+            if STORAGE is None:
                 st.error("Database configuration not loaded. Cannot run query.")
-                print("DB Error: MYSQL_CONFIG is None.")
+                print("DB Error: no storage backend configured.")
                 return None
+            query_started = time.perf_counter()
             try:
-                conn = mysql.connector.connect(**MYSQL_CONFIG)
+                conn = read_connect() if (fetch_one or fetch_all) and not primary else STORAGE.connect()
                 cursor = conn.cursor(dictionary=True)
                 cursor.execute(query, params)
                 if fetch_one:
                     results = cursor.fetchone()
+                    row_count = 1 if results else 0
                 elif fetch_all:
                     results = cursor.fetchall()
+                    row_count = len(results)
                 else:
                     conn.commit()
                     results = cursor.lastrowid
-            except Error as e: # mysql.connector.Error
+                    row_count = cursor.rowcount
+                    note_lead_write()
+            except Error as e: # mysql.connector.Error / sqlite3.Error
                 st.error(f"Database Error. See console log.")
                 print(f"DB Error: {e} | Query: {query} | Params: {params}")
                 results = None # Ensure results is None on error
@@ -266,16 +730,201 @@ if __name__ == "__main__":
                     try:
                         conn.rollback()
                         print("Transaction rolled back.")
-                    except Error as rb_e: # mysql.connector.Error
+                    except Error as rb_e: # mysql.connector.Error / sqlite3.Error
                         print(f"Rollback failed: {rb_e}")
             finally:
                 if cursor:
                     cursor.close()
                 if conn and conn.is_connected():
                     conn.close()
+                perf_record_query(query, time.perf_counter() - query_started, row_count)
             return results
 
-        def add_lead_to_db(lead_data):
+        def run_db_transaction(statements, followup=None):
+            # Runs a list of (query, params) pairs in a single transaction.
+            # followup(rowcounts, lastrowid), if given, returns more (query, params) pairs to run in the same
+            # transaction once the outcome of these is known (e.g. rollup/event rows only if the UPDATE matched).
+            # Returns the affected row count of each statement, or None if anything failed (all rolled back).
+            conn = None
+            cursor = None
+            rowcounts = None
+            if STORAGE is None:
+                st.error("Database configuration not loaded. Cannot run query.")
+                print("DB Error: no storage backend configured.")
+                return None
+            query_started = time.perf_counter()
+            try:
+                conn = STORAGE.connect()
+                conn.start_transaction()
+                cursor = conn.cursor()
+                rowcounts = []; first_lastrowid = None
+                for query, params in statements:
+                    cursor.execute(query, params)
+                    rowcounts.append(cursor.rowcount)
+                    if first_lastrowid is None: first_lastrowid = cursor.lastrowid
+                for query, params in (followup(list(rowcounts), first_lastrowid) if followup else []):
+                    cursor.execute(query, params)
+                    rowcounts.append(cursor.rowcount)
+                conn.commit()
+                note_lead_write()
+            except Error as e: # mysql.connector.Error / sqlite3.Error
+                st.error("Database Error. See console log.")
+                print(f"DB Transaction Error: {e} | Statements: {len(statements)}")
+                rowcounts = None
+                if conn and conn.is_connected():
+                    try:
+                        conn.rollback()
+                        print("Transaction rolled back.")
+                    except Error as rb_e:
+                        print(f"Rollback failed: {rb_e}")
+            finally:
+                if cursor:
+                    cursor.close()
+                if conn and conn.is_connected():
+                    conn.close()
+                perf_record_query(f"TRANSACTION x{len(statements)}: {statements[0][0] if statements else ''}", time.perf_counter() - query_started, sum(rowcounts) if rowcounts else None)
+            return rowcounts
+
+        def run_db_executemany(query, params_seq, extra_statements=(), followup=None):
+            # One executemany() (plus any extra (query, params) pairs) in a single transaction;
+            # followup(affected, lastrowid) may add more pairs once the executemany's outcome is known.
+            # Returns the executemany's affected row count, or None if rolled back.
+            if not params_seq: return 0
+            conn = None
+            cursor = None
+            affected = None
+            if STORAGE is None:
+                st.error("Database configuration not loaded. Cannot run query.")
+                print("DB Error: no storage backend configured.")
+                return None
+            query_started = time.perf_counter()
+            try:
+                conn = STORAGE.connect()
+                conn.start_transaction()
+                cursor = conn.cursor()
+                cursor.executemany(query, params_seq)
+                affected = cursor.rowcount; first_lastrowid = cursor.lastrowid
+                for extra_query, extra_params in list(extra_statements) + (followup(affected, first_lastrowid) if followup else []):
+                    cursor.execute(extra_query, extra_params)
+                conn.commit()
+                note_lead_write()
+            except Error as e: # mysql.connector.Error / sqlite3.Error
+                st.error("Database Error. See console log.")
+                print(f"DB executemany Error: {e} | Query: {query} | Rows: {len(params_seq)}")
+                affected = None
+                if conn and conn.is_connected():
+                    try:
+                        conn.rollback()
+                        print("Transaction rolled back.")
+                    except Error as rb_e:
+                        print(f"Rollback failed: {rb_e}")
+            finally:
+                if cursor:
+                    cursor.close()
+                if conn and conn.is_connected():
+                    conn.close()
+                perf_record_query(f"EXECUTEMANY x{len(params_seq)}: {query}", time.perf_counter() - query_started, affected)
+            return affected
+
+        @st.cache_resource
+        def get_async_db_runner(on_replica=False):
+            if not MYSQL_AIO_AVAILABLE or STORAGE is None or STORAGE.dialect != 'mysql': return None
+            pool_config = READ_REPLICA_CONFIG if on_replica else MYSQL_CONFIG
+            print(f"Starting async DB pool ({ASYNC_DB_POOL_SIZE} connections{', read replica' if on_replica else ''})...")
+            return AsyncDbRunner(lambda: mysql_pool(pool_config, ASYNC_DB_POOL_SIZE))
+
+        def run_db_reads(reads):
+            # reads: [(query, params, fetch_one)] -> results in order. Runs them concurrently on the async pool,
+            # or one after another through run_db_query when mysql.connector.aio is unavailable.
+            replica_router = get_replica_router()
+            on_replica = replica_router is not None and replica_router.route(st.session_state.get('replica_write_at'), len(reads))
+            runner = get_async_db_runner(on_replica)
+            if runner is None: return [run_db_query(query, params, fetch_one=fetch_one, fetch_all=not fetch_one) for query, params, fetch_one in reads]
+            query_started = time.perf_counter()
+            try: results = runner.gather_reads(reads)
+            except Exception as e:
+                print(f"Async DB reads failed ({e}), falling back to sequential queries.")
+                return [run_db_query(query, params, fetch_one=fetch_one, fetch_all=not fetch_one) for query, params, fetch_one in reads]
+            perf_record_query(f"CONCURRENT x{len(reads)}: {reads[0][0] if reads else ''}", time.perf_counter() - query_started,
+                              sum(len(r) if isinstance(r, list) else 1 for r in results if r is not None))
+            if any(result is None for result in results): st.error("Database Error. See console log.")
+            return results
+
+        def lead_alert_followup(written_leads):
+            # The lead_alerts rows of leads as they are after a write, rewritten in that write's transaction.
+            alert_settings = load_alert_settings(config)
+            return lead_alert_statements(written_leads, due_soon_days=alert_settings['due_soon_days'], nearing_days=alert_settings['nearing_days'])
+
+        def lead_change_followup(lead, new_status, new_engineer=None, changes=None, actor=None):
+            # Rollup moves + lead_events row + lead_alerts rows for one lead UPDATE (the transaction's first
+            # statement), written only if that UPDATE actually changed the row.
+            def followup(rowcounts, lastrowid):
+                if rowcounts[0] != 1: return []
+                event_changes = dict(changes or {})
+                if new_engineer is not None: event_changes.setdefault('site_engineer', new_engineer)
+                return lead_stats_transition_statements(lead, new_status, new_engineer) + \
+                    lead_event_statements([lead_event_row(lead, new_status, actor or st.session_state.get('username'), event_changes)]) + \
+                    lead_alert_followup([{**lead, **event_changes, 'status': new_status}])
+            return followup
+
+        def show_lead_update_result(rowcounts, success_message, failure_message):
+            # For UPDATEs guarded on the status and version the page loaded: 0 rows means someone else got there first.
+            if rowcounts is None: st.error(failure_message); return False
+            if rowcounts[0] != 1:
+                st.warning("This lead was changed by someone else since the page loaded. Review the latest values and try again."); return False
+            st.success(success_message); return True
+
+        def is_lead_eligible_for_transition(lead, transition):
+            if lead.get('status') != transition['from_status']: return False
+            if transition['assignee_column'] == 'report_creator' and lead.get('report_creator'): return False
+            if transition['review_status'] and lead.get('admin_review_status') == transition['review_status']: return False
+            return True
+
+        def apply_bulk_lead_transition(action_label, selected_leads, assignee_name=None, expected_versions=None):
+            # Every row is guarded by its expected status AND the version it had when the page loaded
+            # (expected_versions, {id: version} as rendered), so a row changed by someone else in the meantime
+            # is reported as a conflict instead of overwritten.
+            # Returns (updated_ids, conflict_ids), or (None, None) if the transaction failed.
+            transition = BULK_LEAD_TRANSITIONS[action_label]
+            set_parts = ["status=%s"]; set_params = [transition['to_status']]
+            if transition['assignee_column']:
+                set_parts.append(f"`{transition['assignee_column']}`=%s"); set_params.append(assignee_name)
+            if transition['date_column']:
+                set_parts.append(f"`{transition['date_column']}`=%s"); set_params.append(datetime.date.today())
+            if transition['review_status']:
+                set_parts.append("admin_review_status=%s"); set_params.append(transition['review_status'])
+            update_query = f"UPDATE office SET {', '.join(set_parts)}, version=version+1 WHERE id=%s AND status=%s AND version=%s"
+            statements = [(update_query, tuple(set_params) + (lead['id'], transition['from_status'], (expected_versions or {}).get(lead['id'], lead.get('version') or 0))) for lead in selected_leads]
+            new_engineer = assignee_name if transition['assignee_column'] == 'site_engineer' else None
+            event_changes = {transition['assignee_column']: assignee_name} if transition['assignee_column'] else {}
+            if transition['review_status']: event_changes['admin_review_status'] = transition['review_status']
+            actor = st.session_state.get('username')
+            def followup(rowcounts, lastrowid):
+                # Rollup moves, one batched lead_events insert and the lead_alerts rows, for the leads whose UPDATE won only.
+                updated_leads = [lead for lead, count in zip(selected_leads, rowcounts) if count == 1]
+                rollup_statements = [stmt for lead in updated_leads for stmt in lead_stats_transition_statements(lead, transition['to_status'], new_engineer)]
+                return rollup_statements + lead_event_statements(lead_event_row(lead, transition['to_status'], actor, event_changes) for lead in updated_leads) + \
+                    lead_alert_followup([{**lead, **event_changes, 'status': transition['to_status']} for lead in updated_leads])
+            rowcounts = run_db_transaction(statements, followup)
+            if rowcounts is None: return None, None
+            update_counts = rowcounts[:len(selected_leads)]
+            updated_ids = [lead['id'] for lead, count in zip(selected_leads, update_counts) if count == 1]
+            conflict_ids = [lead['id'] for lead, count in zip(selected_leads, update_counts) if count != 1]
+            print(f"Bulk '{action_label}': {len(updated_ids)} updated, {len(conflict_ids)} conflicts {conflict_ids}")
+            return updated_ids, conflict_ids
+
+        LEAD_SCOPE_COLUMNS = {'engineer': 'site_engineer', 'user': 'report_creator'}
+
+        def get_lead_scope_for_session():
+            # Engineers and report creators can only act on their own leads, so only their rows are fetched.
+            # Returns (where_clause, params); an empty clause means the full table (admins).
+            scope_column = LEAD_SCOPE_COLUMNS.get(st.session_state.get('role'))
+            if scope_column: return f"{scope_column} = %s", (st.session_state.get('username'),)
+            return "", ()
+
+        def add_lead_to_db(lead_data, actor=None, staged_documents=None):
+            # staged_documents: stage_email_attachments() result. Its files are listed in the INSERT and moved into
+            # the new lead's documents folder inside the same transaction (removed again if it rolls back).
             lead_data.setdefault('received_date', datetime.datetime.now())
             lead_data.setdefault('status', 'New')
             if not lead_data.get('bank_name') or lead_data['bank_name'] == "--Select Bank--":
@@ -284,14 +933,8 @@ if __name__ == "__main__":
             if not lead_data.get('property_details'):
                 st.error("Property Details required.")
                 return False
-            expected_columns = [
-                'bank_name', 'property_details', 'received_date', 'deadline', 'status',
-                'site_engineer', 'report_creator', 'report_issue_notes', 'admin_review_status', 'admin_comments',
-                'date_of_allocation', 'customer_name', 'application_number', 'location', 'contact_number',
-                'site_link', 'visit_initiation_date', 'visit_completion_date', 'lead_completion_date',
-                'appraiser_quotation_obs', 'distance', 'visit_type', 'remarks', 'branch_virtual',
-                'site_photo_filenames', 'site_document_filenames' # Added new columns
-            ]
+            if staged_documents and staged_documents['files']: lead_data['site_document_filenames'] = json.dumps(sorted(staged_documents['files']))
+            expected_columns = OFFICE_INSERT_COLUMNS
             columns_to_insert = [col for col in expected_columns if col in lead_data and lead_data[col] is not None]
             if 'received_date' not in columns_to_insert: columns_to_insert.append('received_date')
             if 'status' not in columns_to_insert: columns_to_insert.append('status')
@@ -312,93 +955,111 @@ if __name__ == "__main__":
             query = f"INSERT INTO office ({', '.join(['`'+col+'`' for col in columns_to_insert])}) VALUES ({', '.join(['%s'] * len(params_list))})"
             params_tuple = tuple(params_list) # Use a different variable name
 
-            insert_id = run_db_query(query, params_tuple) # Pass the tuple
-            success = insert_id is not None and insert_id > 0
+            actor = actor or st.session_state.get('username')
+            moved_documents = []
+            def created_followup(rowcounts, lastrowid):
+                if rowcounts[0] != 1: return []
+                if staged_documents and staged_documents['files']:
+                    moved_documents.extend(move_staged_attachments(staged_documents, os.path.join(LEAD_FILES_BASE_PATH, str(lastrowid), "documents")))
+                return lead_created_event_statements(lastrowid, [lead_data], actor) + lead_alert_followup([{**lead_data, 'id': lastrowid}])
+            try:
+                insert_rowcounts = run_db_transaction([(query, params_tuple)] + lead_stats_insert_statements([lead_data]), created_followup)
+            except OSError as e_files: # moving the attachments failed: the connection closes uncommitted, i.e. rolled back
+                print(f"Attachment move failed, lead not added: {e_files}"); insert_rowcounts = None
+            success = insert_rowcounts is not None and insert_rowcounts[0] == 1
             if success:
-                print(f"DB Insert OK, ID: {insert_id}")
+                print("DB Insert OK")
             else:
+                discard_moved_attachments(moved_documents)
                 print(f"DB Insert FAILED. Query generated: {query} | Params used: {params_tuple}")
             return success
 
-        def get_email_body(msg):
-            body = None; charset = None
-            if msg.is_multipart():
-                for part in msg.walk():
-                    ctype = part.get_content_type(); cdispo = str(part.get('Content-Disposition'))
-                    if ctype == 'text/plain' and 'attachment' not in cdispo:
-                        charset = part.get_content_charset()
-                        try: body = part.get_payload(decode=True).decode(charset or 'utf-8', errors='ignore'); break
-                        except Exception as e: print(f"Error decoding multipart: {e}")
-            else:
-                ctype = msg.get_content_type()
-                if ctype == 'text/plain':
-                    charset = msg.get_content_charset()
-                    try: body = msg.get_payload(decode=True).decode(charset or 'utf-8', errors='ignore')
-                    except Exception as e: print(f"Error decoding single part: {e}")
-            return body
-
-        def parse_subject(subject_header_val):
-            subject = "No Subject"
-            if subject_header_val:
-                try:
-                    parts = []; decoded_header = decode_header(subject_header_val)
-                    for part_content,charset in decoded_header:
-                        if isinstance(part_content, bytes): parts.append(part_content.decode(charset or 'utf-8', 'ignore'))
-                        else: parts.append(part_content)
-                    subject = "".join(parts)
-                except Exception as e: print(f"Error decoding subject: {e}"); subject = str(subject_header_val)
-            return subject
-
-        def extract_info_from_email(subject_text, body_text, sender_email):
-            print(f"\n--- Parsing Email --- From: {sender_email}, Subject: {subject_text}")
-            extracted = {}
-            if not body_text: body_text = "" # Ensure body_text is a string
-            try:
-                match_prop = re.search(r"Property(?: Address| Details| Location):\s*(.*?)(?:\n\n|Due Date:|Deadline:|$)", body_text, re.IGNORECASE | re.DOTALL)
-                if match_prop: extracted['property_details'] = match_prop.group(1).strip().replace('\r\n', ' ').replace('\n', ' ')[:400]
-                else: extracted['property_details'] = body_text[:200].strip().replace('\r\n', ' ').replace('\n', ' ')
-
-                date_kw = [r"Due Date", r"Deadline", r"Valuation Required By", r"Submit By"]; date_pats = [r"(\d{1,2}[-/]\d{1,2}[-/]\d{2,4})", r"(\d{4}[-/]\d{1,2}[-/]\d{1,2})"]; deadline_str = None
-                for kw in date_kw:
-                    if deadline_str: break
-                    for pat in date_pats:
-                        match_d = re.search(rf"{kw}[:\s]*{pat}", body_text, re.IGNORECASE)
-                        if match_d: deadline_str = match_d.group(1).strip(); break
-                if deadline_str:
-                    parsed_dt = None; fmts = ["%d/%m/%Y", "%d-%m-%Y", "%Y-%m-%d", "%d/%m/%y", "%d-%m/%y", "%m/%d/%Y", "%m-%d-%Y", "%Y/%m/%d", "%m/%d/%y", "%m-%d/%y"] # Added YY/MM/DD
-                    for fmt in fmts:
-                        try: parsed_dt = datetime.datetime.strptime(deadline_str, fmt); extracted['deadline'] = parsed_dt.strftime('%Y-%m-%d'); break
-                        except ValueError: continue
-                    if not parsed_dt: print(f"Could not parse deadline: {deadline_str}")
-
-                std_bank = None
-                for known_bank_option in ALL_BANK_OPTIONS_COMBINED: # Ensure this list is defined
-                    base_name = known_bank_option.split(" (")[0].strip().lower()
-                    if re.search(r'\b' + re.escape(base_name) + r'\b', sender_email.lower()) or \
-                       re.search(r'\b' + re.escape(base_name) + r'\b', subject_text.lower()) or \
-                       re.search(r'\b' + re.escape(base_name) + r'\b', body_text.lower()): # Added body_text search for bank
-                        std_bank = known_bank_option
-                        break
-
-                if std_bank: extracted['bank_name'] = std_bank
-                else:
-                    match_bank_body = re.search(r"Bank Name[:\s]+(.*?)(?:\n|$)", body_text, re.IGNORECASE)
-                    if match_bank_body: extracted['bank_name'] = match_bank_body.group(1).strip()
-                    else: extracted['bank_name'] = sender_email.split('@')[0] if '@' in sender_email else sender_email
-
-                match_cust = re.search(r"(?:Customer|Client) Name[:\s]+(.*?)(?:\n|$)", body_text, re.IGNORECASE)
-                if match_cust: extracted['customer_name'] = match_cust.group(1).strip()
-                match_app = re.search(r"Application (?:Number|No|ID)[:\s]+([\w-]+)", body_text, re.IGNORECASE)
-                if match_app: extracted['application_number'] = match_app.group(1).strip()
-                match_loc = re.search(r"Location[:\s]+(.*?)(?:\n\n|$)", body_text, re.IGNORECASE | re.DOTALL) # Ensure it's DOTALL
-                if match_loc: extracted['location'] = match_loc.group(1).strip().replace('\r\n', ' ').replace('\n', ' ')
-                else: extracted['location'] = extracted.get('property_details') # Fallback
-                match_contact = re.search(r"(?:Contact|Phone|Mobile) (?:Number|No)[:\s]+([\d\s()-+]+)", body_text, re.IGNORECASE)
-                if match_contact: extracted['contact_number'] = match_contact.group(1).strip()
-
-            except Exception as e_extract: print(f"ERROR during email info extraction: {e_extract}"); return None
-            if not extracted.get('property_details') or not extracted.get('bank_name'): print(f"Core details missing: Subject='{subject_text}'"); return None
-            print(f"Extraction result (Email): {extracted}"); return extracted
+        def map_bulk_import_header(header):
+            key = re.sub(r"\s+", " ", str(header).strip().lower())
+            if key in BULK_IMPORT_HEADER_ALIASES: return BULK_IMPORT_HEADER_ALIASES[key]
+            snake = re.sub(r"[^a-z0-9]+", "_", key).strip("_")
+            if snake in OFFICE_INSERT_COLUMNS and snake not in BULK_IMPORT_EXCLUDED_COLUMNS: return snake
+            return None
+
+        def prepare_bulk_lead_import(raw_df):
+            # Maps spreadsheet headers to office columns and validates/normalises every row column-wise.
+            # Returns (accepted_df, rejected_df, ignored_headers); rejected_df carries a 'reject_reason' column.
+            raw_df = raw_df.dropna(how='all').reset_index(drop=True)
+            header_map = {}; ignored_headers = []
+            for header in raw_df.columns:
+                mapped = map_bulk_import_header(header)
+                if mapped and mapped not in header_map.values(): header_map[header] = mapped
+                else: ignored_headers.append(str(header))
+            df = raw_df[list(header_map.keys())].rename(columns=header_map)
+            for required_col in ['bank_name', 'property_details']:
+                if required_col not in df.columns: df[required_col] = pd.NA
+
+            reasons = pd.Series("", index=df.index, dtype=object)
+            def flag(mask, message):
+                nonlocal reasons
+                reasons = reasons.where(~mask, reasons + message + "; ")
+
+            text_cols = [c for c in df.columns if c not in OFFICE_DATE_COLUMNS and c != 'distance']
+            for col in text_cols:
+                df[col] = df[col].astype("string").str.strip().replace("", pd.NA)
+
+            bank_lookup = {}
+            for bank_option in ALL_BANK_OPTIONS_COMBINED:
+                bank_lookup[bank_option.lower()] = bank_option
+                bank_lookup.setdefault(bank_option.split(" (")[0].strip().lower(), bank_option)
+            bank_keys = df['bank_name'].str.lower().str.replace(r"\s+", " ", regex=True)
+            known_banks = bank_keys.map(bank_lookup)
+            flag(df['bank_name'].notna() & known_banks.isna(), "Unknown Bank Name")
+            df['bank_name'] = known_banks.fillna(df['bank_name'])
+
+            flag(df['bank_name'].isna(), "Bank Name missing")
+            flag(df['property_details'].isna(), "Property Details missing")
+            if 'status' in df.columns:
+                known_statuses = df['status'].str.lower().str.replace(r"\s+", " ", regex=True).map({status.lower(): status for status in LEAD_STATUSES})
+                flag(df['status'].notna() & known_statuses.isna(), "Unknown Status")
+                df['status'] = known_statuses.fillna(df['status'])
+
+            for col in [c for c in OFFICE_DATE_COLUMNS if c in df.columns]:
+                original = df[col].replace("", pd.NA)
+                parsed = pd.to_datetime(original, errors='coerce', dayfirst=True, format='mixed')
+                flag(original.notna() & parsed.isna(), f"Invalid {col}")
+                df[col] = parsed
+            if 'distance' in df.columns:
+                original_distance = df['distance'].astype("string").str.strip().replace("", pd.NA)
+                parsed_distance = pd.to_numeric(original_distance, errors='coerce')
+                flag(original_distance.notna() & parsed_distance.isna(), "Invalid distance")
+                df['distance'] = parsed_distance
+
+            if 'received_date' not in df.columns: df['received_date'] = pd.Timestamp(datetime.datetime.now())
+            else: df['received_date'] = df['received_date'].fillna(pd.Timestamp(datetime.datetime.now()))
+            default_status = pd.Series('New', index=df.index, dtype="string")
+            if 'site_engineer' in df.columns: default_status = default_status.mask(df['site_engineer'].notna(), 'Assigned Engineer')
+            df['status'] = df['status'].fillna(default_status) if 'status' in df.columns else default_status
+
+            rejected_mask = reasons != ""
+            rejected_df = raw_df[rejected_mask].copy()
+            rejected_df.insert(0, 'reject_reason', reasons[rejected_mask].str.rstrip("; "))
+            return df[~rejected_mask].reset_index(drop=True), rejected_df, ignored_headers
+
+        def bulk_insert_leads(accepted_df):
+            # Inserts every accepted row with one executemany() in one transaction. Returns rows inserted or None.
+            columns_to_insert = [col for col in OFFICE_INSERT_COLUMNS if col in accepted_df.columns]
+            df_params = accepted_df[columns_to_insert].copy()
+            for col in [c for c in OFFICE_DATE_COLUMNS if c in df_params.columns]:
+                fmt = '%Y-%m-%d %H:%M:%S' if col == 'received_date' else '%Y-%m-%d'
+                df_params[col] = df_params[col].dt.strftime(fmt)
+            df_params = df_params.astype(object).where(df_params.notna(), None)
+            query = f"INSERT INTO office ({', '.join(['`'+col+'`' for col in columns_to_insert])}) VALUES ({', '.join(['%s'] * len(columns_to_insert))})"
+            rollup_columns = [col for col in ('received_date', 'bank_name', 'site_engineer', 'status') if col in accepted_df.columns]
+            rollup_leads = lead_frame_records(accepted_df[rollup_columns])
+            actor = st.session_state.get('username')
+            # executemany() sends one multi-row INSERT; its lastrowid is the first of the consecutive new ids.
+            inserted = run_db_executemany(
+                query, list(df_params.itertuples(index=False, name=None)), lead_stats_insert_statements(rollup_leads),
+                lambda affected, lastrowid: lead_created_event_statements(lastrowid, rollup_leads, actor) if affected == len(rollup_leads) else []
+            )
+            print(f"Bulk import: {inserted} of {len(df_params)} rows inserted." if inserted is not None else "Bulk import FAILED; rolled back.")
+            return inserted
 
         def check_emails_once():
             st.info("Checking emails... Please wait.")
@@ -429,31 +1090,47 @@ if __name__ == "__main__":
                     return 0
 
                 st.info(f"Found {len(email_id_list_bytes)} unseen emails.")
+                extraction_rules = get_extraction_rules()
+                extraction_rules.refresh() # picks up rules added to email_extraction_rules since the last check
+                bytes_fetched_total = 0; message_bytes_total = 0
                 for email_id_b in email_id_list_bytes:
                     email_id_s = email_id_b.decode()
                     print(f"Processing Email ID: {email_id_s}")
                     try:
-                        res, msg_data_list = mail.fetch(email_id_b, "(RFC822)")
-                        if res == "OK":
-                            for response_part in msg_data_list:
-                                if isinstance(response_part, tuple) and len(response_part) >= 2 and isinstance(response_part[1], bytes):
+                        fetched = fetch_lead_email(mail, email_id_b, EMAIL_TEXT_PART_MAX_BYTES) # text part only, not the attachments
+                        if fetched is not None:
+                            bytes_fetched_total += fetched['bytes_fetched']; message_bytes_total += fetched['message_size']
+                            print(f"  Fetched {describe_fetch(fetched)}")
+                            try:
+                                body = fetched['body']
+                                if body:
+                                    lead_info = extraction_rules.extract(fetched['subject'], body, fetched['sender'])
+                                    staged_documents = None
+                                    if lead_info and EMAIL_ATTACHMENTS_ENABLED:
+                                        staged_documents = stage_email_attachments(
+                                            mail, email_id_b, fetched, os.path.join(LEAD_FILES_BASE_PATH, "_incoming", f"{email_id_s}-{uuid.uuid4().hex[:8]}"),
+                                            EMAIL_ATTACHMENT_EXTENSIONS, EMAIL_ATTACHMENT_MAX_MB * 1048576, EMAIL_ATTACHMENTS_MAX_TOTAL_MB * 1048576)
+                                        bytes_fetched_total += staged_documents['bytes_fetched']
+                                        for skipped_name, skipped_reason in staged_documents['skipped']: print(f"  Attachment skipped: {skipped_name} ({skipped_reason})")
                                     try:
-                                        msg_obj = email.message_from_bytes(response_part[1])
-                                        subject = parse_subject(msg_obj["Subject"])
-                                        sender = email.utils.parseaddr(msg_obj.get('From'))[1]
-                                        body = get_email_body(msg_obj)
-                                        if body:
-                                            lead_info = extract_info_from_email(subject, body, sender)
-                                            if lead_info and add_lead_to_db(lead_info):
-                                                print(f"  Success: Added lead from Email ID {email_id_s} to DB.")
-                                                added_count += 1
-                                                processed_ids_list.append(email_id_b)
-                                            elif lead_info: print(f"  FAIL: Add lead from Email ID {email_id_s} to DB failed.")
-                                            else: print(f"  Info: Could not extract lead info from Email ID {email_id_s}.")
-                                        else: print(f"  Info: No text body for Email ID {email_id_s}.")
-                                    except Exception as e_parse: print(f"  ERROR parsing content of Email ID {email_id_s}: {e_parse}")
-                        else: print(f"Failed to fetch Email ID: {email_id_s}. Status: {res}")
+                                        if lead_info and add_lead_to_db(lead_info, actor='email', staged_documents=staged_documents):
+                                            print(f"  Success: Added lead from Email ID {email_id_s} to DB"
+                                                  + (f" with {len(staged_documents['files'])} attachment(s)." if staged_documents and staged_documents['files'] else "."))
+                                            added_count += 1
+                                            processed_ids_list.append(email_id_b)
+                                        elif lead_info: print(f"  FAIL: Add lead from Email ID {email_id_s} to DB failed.")
+                                        else:
+                                            print(f"  Info: Could not extract lead info from Email ID {email_id_s}.")
+                                            processed_ids_list.append(email_id_b) # not a lead: nothing to retry
+                                    finally: discard_staging(staged_documents)
+                                else:
+                                    print(f"  Info: No text body for Email ID {email_id_s}.")
+                                    processed_ids_list.append(email_id_b)
+                            except Exception as e_parse: print(f"  ERROR parsing content of Email ID {email_id_s}: {e_parse}")
+                        else: print(f"Failed to fetch Email ID: {email_id_s}.")
                     except Exception as e_fetch_process: print(f"  ERROR fetching/processing Email ID {email_id_s}: {e_fetch_process}")
+                st.caption(f"Downloaded {bytes_fetched_total / 1024:.1f} KB of {message_bytes_total / 1024:.1f} KB in {len(email_id_list_bytes)} email(s); "
+                           f"only text parts{' and allowed attachments' if EMAIL_ATTACHMENTS_ENABLED else ''} were fetched.")
 
                 if processed_ids_list:
                     ids_to_mark_bytes = b','.join(processed_ids_list)
@@ -481,75 +1158,24 @@ if __name__ == "__main__":
             else: st.info(end_message)
             return added_count
 
-        def get_status_and_color_value(item):
-            status = item.get('status', 'New'); deadline = item.get('deadline'); creator = item.get('report_creator'); d_str = None
-            if isinstance(deadline, (datetime.date, datetime.datetime)): d_str = deadline.strftime('%Y-%m-%d')
-            elif isinstance(deadline, str):
-                try: datetime.datetime.strptime(deadline, '%Y-%m-%d'); d_str = deadline
-                except ValueError: d_str = None
-
-            clrs={'normal':'white','red':'#ffdddd','orange':'#ffe8cc','green':'#ddffdd','grey':'#e0e0e0','blue':'#ddeeff','purple':'#e8ddff','yellow_assign':'#ffffcc','yellow_report':'#fffacd'}
-            key = 'normal'; final_status = str(status)
-
-            if status == 'Completed': key = 'green'
-            elif status == 'Visit Done' and not creator: key = 'yellow_report'; final_status += " (Pend Report)"
-            elif status == 'Report in Progress': key = 'purple'
-            elif status == 'Visit Done': key = 'blue'
-            elif status == 'Assigned Engineer': key = 'yellow_assign'
-            elif status == 'On Hold': key = 'orange'
-
-            if d_str and status != 'Completed':
-                try:
-                    deadline_date = datetime.datetime.strptime(d_str, '%Y-%m-%d').date()
-                    days_to_deadline = (deadline_date - datetime.date.today()).days
-                    if days_to_deadline < 0:
-                        key = 'grey'
-                        final_status = final_status.split(" (")[0] + " (Overdue)"
-                    elif days_to_deadline <= 2: key = 'red'
-                    elif days_to_deadline <= 5 and key not in ['red', 'grey']: key = 'orange'
-                except Exception as e: print(f"Deadline color calculation error: {e}")
-            return final_status, clrs.get(key, 'white')
-
         # --- Dashboard Functions ---
-        def display_summary_dashboard_stats(df):
+        def display_summary_dashboard_stats(df, tables=None):
+            # tables: precomputed compute_summary_dashboard_tables(df) (shared lead cache), computed here if None.
             st.subheader("Overall MIS Summary")
             if not PANDAS_AVAILABLE or df is None or df.empty: st.info("No data available for summary."); return
             if 'site_engineer' not in df.columns or 'status' not in df.columns: st.warning("Required columns ('site_engineer', 'status') missing for summary."); return
 
-            vp_df = df[df['status'] == 'Assigned Engineer']['site_engineer'].value_counts().reset_index(); vp_df.columns = ['Engineer', 'VP Count']; vp_df = vp_df[vp_df['Engineer'].notna() & (vp_df['Engineer'] != '')]
-            vd_sts = ['Visit Done', 'Report in Progress', 'Completed']; vd_df = df[df['status'].isin(vd_sts)]['site_engineer'].value_counts().reset_index(); vd_df.columns = ['Engineer', 'VD Count']; vd_df = vd_df[vd_df['Engineer'].notna() & (vd_df['Engineer'] != '')]
-
+            if tables is None: tables = compute_summary_dashboard_tables(df)
+            vp_df, vd_df = tables['visit_pending'], tables['visit_done']
             c1, c2 = st.columns(2)
             with c1: st.markdown("##### Visit Pending (VP) by Engineer"); st.dataframe(vp_df if not vp_df.empty else pd.DataFrame(columns=['Engineer', 'VP Count']),use_container_width=True, hide_index=True)
             with c2: st.markdown("##### Visit Done (VD) by Engineer"); st.dataframe(vd_df if not vd_df.empty else pd.DataFrame(columns=['Engineer', 'VD Count']), use_container_width=True, hide_index=True)
 
             st.markdown("---")
-            issue = {}
-            issue['Rejected/Revision'] = df[df.get('admin_review_status', pd.Series(dtype=str)) == 'Rejected - Needs Revision'].shape[0]
-            issue['On Hold'] = df[df.get('status', pd.Series(dtype=str)) == 'On Hold'].shape[0]
-            issue['New (Unassigned)'] = df[df.get('status', pd.Series(dtype=str)) == 'New'].shape[0]
-            st.markdown("##### Key Issues Summary"); issue_df = pd.DataFrame(list(issue.items()), columns=['Category', 'Count']); st.dataframe(issue_df, use_container_width=True, hide_index=True); st.markdown("---")
+            st.markdown("##### Key Issues Summary"); st.dataframe(tables['issues'], use_container_width=True, hide_index=True); st.markdown("---")
 
             st.markdown("##### Overall Status Counts")
-            total_leads = df.shape[0]
-            visit_done_count = df[df['status'].isin(['Visit Done', 'Report in Progress', 'Completed'])].shape[0]
-            visit_pending_count = df[df['status'] == 'Assigned Engineer'].shape[0]
-            completed_count = df[df['status'] == 'Completed'].shape[0]
-            report_in_progress_count = df[df['status'] == 'Report in Progress'].shape[0]
-            pending_delivery_count = df[
-                (df['status'] == 'Report in Progress') |
-                ((df['status'] == 'Completed') & (df.get('admin_review_status', pd.Series(dtype=str)) == 'Pending Review'))
-            ].shape[0]
-
-            summary_counts = {
-                "Total Leads": total_leads,
-                "Visits Actually Done": visit_done_count,
-                "Visits Pending (Assigned)": visit_pending_count,
-                "Reports Completed": completed_count,
-                "Reports in Progress": report_in_progress_count,
-                "Pending Admin Review/Delivery": pending_delivery_count
-            }
-            summary_df = pd.DataFrame.from_dict(summary_counts, orient='index', columns=['Count']); st.dataframe(summary_df, use_container_width=True); st.markdown("---")
+            st.dataframe(tables['summary'], use_container_width=True); st.markdown("---")
 
         def display_per_day_allocation_dashboard(df, yr, mo):
             st.subheader("PER DAY TOTAL VISIT ALLOCATION TO SITE ENGINEERS")
@@ -567,176 +1193,239 @@ if __name__ == "__main__":
             if df is None or df.empty: st.info(f"No lead data found for {month_name} {yr}."); return
             if 'received_date' not in df.columns: st.error("Report requires 'received_date' column in the data."); return
 
-            try:
-                daily_df = df.copy()
-                # Ensure 'received_date' is datetime before accessing .dt
-                daily_df['recv_date_dt'] = pd.to_datetime(daily_df['received_date'], errors='coerce')
-                # Remove timezone if present, before accessing .dt.date
-                if pd.api.types.is_datetime64_any_dtype(daily_df['recv_date_dt']) and daily_df['recv_date_dt'].dt.tz is not None:
-                    daily_df['recv_date_dt'] = daily_df['recv_date_dt'].dt.tz_localize(None)
-                daily_df['recv_date'] = daily_df['recv_date_dt'].dt.date
-                daily_df.dropna(subset=['recv_date'], inplace=True) # Drop rows where date conversion failed
-
-                month_df = daily_df[(daily_df['recv_date_dt'].dt.year == yr) & (daily_df['recv_date_dt'].dt.month == mo)]
+            try: display_df = build_per_day_allocation_table(df, yr, mo)
             except Exception as e: st.error(f"Error processing dates for daily report: {e}"); return
 
-            if month_df.empty: st.info(f"No leads received in {month_name} {yr}."); return
-
-            site_engineers_list = []
-            if 'site_engineer' in month_df.columns:
-                assigned_in_month_df = month_df[month_df['status'] == 'Assigned Engineer']
-                if not assigned_in_month_df.empty:
-                    site_engineers_list = sorted(assigned_in_month_df['site_engineer'].dropna().unique().tolist())
-                    site_engineers_list = [eng for eng in site_engineers_list if str(eng).strip()]
-
-            days_in_month_dates = [datetime.date(yr, mo, d) for d in range(1, num_days_in_month + 1)]
-            report_data_list = []
-
-            base_cols = ["Date", "Total Received", "Completed This Day", "Visit Done This Day", "Visit Pending (Assigned)"]
-            dynamic_engineer_cols = site_engineers_list
-            status_cols = ["New (Mail)", "On Hold", "Rejected/Revision"]
-            report_columns_final_order = base_cols + dynamic_engineer_cols + status_cols
-
-            for specific_day in days_in_month_dates:
-                leads_on_specific_day = month_df[month_df['recv_date'] == specific_day]
-                row_data_dict = {'Date': specific_day.strftime('%d %B %Y').upper()}
-
-                row_data_dict['Total Received'] = leads_on_specific_day.shape[0]
-                row_data_dict['Completed This Day'] = leads_on_specific_day[leads_on_specific_day['status'] == 'Completed'].shape[0]
-                row_data_dict['Visit Done This Day'] = leads_on_specific_day[leads_on_specific_day['status'].isin(['Visit Done', 'Report in Progress'])].shape[0]
-                row_data_dict['Visit Pending (Assigned)'] = leads_on_specific_day[leads_on_specific_day['status'] == 'Assigned Engineer'].shape[0]
-
-                for eng_name in site_engineers_list:
-                    row_data_dict[eng_name] = leads_on_specific_day[
-                        (leads_on_specific_day['site_engineer'] == eng_name) &
-                        (leads_on_specific_day['status'] == 'Assigned Engineer')
-                    ].shape[0]
-
-                row_data_dict['New (Mail)'] = leads_on_specific_day[leads_on_specific_day.get('status', pd.Series(dtype=str)) == 'New'].shape[0]
-                row_data_dict['On Hold'] = leads_on_specific_day[leads_on_specific_day.get('status', pd.Series(dtype=str)) == 'On Hold'].shape[0]
-                row_data_dict['Rejected/Revision'] = leads_on_specific_day[leads_on_specific_day.get('admin_review_status', pd.Series(dtype=str)) == 'Rejected - Needs Revision'].shape[0]
-
-                report_data_list.append(row_data_dict)
-
-            if report_data_list:
-                display_df = pd.DataFrame(report_data_list, columns=report_columns_final_order)
-                display_df.fillna(0, inplace=True)
-                for col_name in report_columns_final_order:
-                    if col_name != 'Date':
-                        display_df[col_name] = display_df[col_name].astype(int)
-                st.dataframe(display_df, use_container_width=True, height=min(len(report_data_list) * 35 + 38, 600), hide_index=True)
-            else: st.info(f"No processed lead data available to display for {month_name} {yr}.")
+            if display_df is None: st.info(f"No leads received in {month_name} {yr}."); return
+            st.dataframe(display_df, use_container_width=True, height=min(len(display_df) * 35 + 38, 600), hide_index=True)
             st.markdown("---")
 
-        def generate_custom_excel_report(df_all_leads):
-            if not PANDAS_AVAILABLE:
-                st.error("Pandas and Openpyxl are required for this Excel report.")
-                return None
+        # Keyed on the data version (row count, max id, sum of row versions) plus the filter and the day,
+        # so the analytics are only recomputed when a lead actually changes.
+        @st.cache_data(max_entries=8, show_spinner=False)
+        def get_turnaround_analytics(data_version, scope_key, _lead_df):
+            return compute_turnaround_analytics(_lead_df)
+
+        @st.cache_data(max_entries=4, show_spinner=False)
+        def get_turnaround_excel(data_version, scope_key, _analytics):
+            return build_turnaround_excel(_analytics)
+
+        def display_turnaround_dashboard(df):
+            st.subheader("TURNAROUND TIME & SLA")
+            if not PANDAS_AVAILABLE: st.warning("Pandas library needed for turnaround analytics."); return
+            if df is None or df.empty: st.info("No lead data for turnaround analytics."); return
+            data_version = lead_data_version(df)
+            scope_key = (st.session_state.get('selected_bank_filter'), datetime.date.today().isoformat())
+            try: analytics = get_turnaround_analytics(data_version, scope_key, df)
+            except Exception as e: st.error(f"Error computing turnaround analytics: {e}"); return
+
+            overview = analytics['overview']
+            metric_cols = st.columns(5)
+            metric_cols[0].metric("SLA Hit Rate", f"{overview['SLA Hit Rate %']}%" if overview['SLA Hit Rate %'] is not None else "-", help=f"Completed by deadline, out of {overview['SLA Decided Leads']} leads that are completed or past their deadline.")
+            metric_cols[1].metric("Total TAT p50", f"{overview['Total TAT p50 (days)']} d" if overview['Total TAT p50 (days)'] is not None else "-")
+            metric_cols[2].metric("Total TAT p90", f"{overview['Total TAT p90 (days)']} d" if overview['Total TAT p90 (days)'] is not None else "-")
+            metric_cols[3].metric("Open Leads", overview['Open Leads'])
+            metric_cols[4].metric("Open > 10 Days", overview['Open > 10 days'])
+
+            tat_tabs = st.tabs(list(TURNAROUND_GROUPINGS) + ["Open Lead Ageing"])
+            for tab, label in zip(tat_tabs, TURNAROUND_GROUPINGS):
+                with tab: st.dataframe(analytics['groups'][label], use_container_width=True)
+            with tat_tabs[-1]: st.dataframe(analytics['ageing'], use_container_width=True)
+            st.caption("Stage durations in days: Allocation = received to allocation, Visit = allocation to visit done, Report = visit done to completion, Total = received to completion.")
+            try:
+                st.download_button(
+                    label="⏱️ Download Turnaround & SLA Excel",
+                    data=get_turnaround_excel(data_version, scope_key, analytics),
+                    file_name=f"MIS_Turnaround_SLA_{datetime.date.today():%Y%m%d}.xlsx",
+                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+                    key="download_turnaround_excel_v15"
+                )
+            except Exception as e_tat_excel: st.error(f"Turnaround Excel failed: {e_tat_excel}")
+            st.markdown("---")
 
-            visit_done_statuses = ['Visit Done', 'Report in Progress', 'Completed']
-            visit_pending_statuses = ['Assigned Engineer', 'New', 'On Hold']
-
-            df_visit_done = df_all_leads[df_all_leads['status'].isin(visit_done_statuses)].copy()
-            df_visit_pending = df_all_leads[df_all_leads['status'].isin(visit_pending_statuses)].copy()
-
-            for df_temp in [df_visit_done, df_visit_pending]:
-                date_cols_to_format = ['date_of_allocation', 'received_date', 'deadline', 'visit_initiation_date', 'visit_completion_date', 'lead_completion_date']
-                for col in date_cols_to_format:
-                    if col in df_temp.columns:
-                        df_temp.loc[:, col] = pd.to_datetime(df_temp[col], errors='coerce').dt.date
-
-
-            wb = openpyxl.Workbook()
-            ws = wb.active
-            ws.title = "MIS Report"
-
-            header_font = Font(name='Calibri', size=11, bold=True, color="FFFFFF")
-            header_fill = PatternFill(start_color="4F81BD", end_color="4F81BD", fill_type="solid")
-            cell_font = Font(name='Calibri', size=11)
-            center_alignment = Alignment(horizontal='center', vertical='center', wrap_text=True)
-            left_alignment = Alignment(horizontal='left', vertical='center', wrap_text=True)
-            border_thin = Border(left=Side(style='thin'), right=Side(style='thin'), top=Side(style='thin'), bottom=Side(style='thin'))
-
-            current_date_str = datetime.date.today().strftime("%d-%b-%Y")
-            report_columns = ["Sr. No.", "Bank Name", "Branch/Virtual", "Received Date", "Customer's Name", "Location", "Site Engg.", "Deadline", "Status"]
-            current_row = 1
-
-            # VISIT DONE Section
-            ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=len(report_columns))
-            title_cell_done = ws.cell(row=current_row, column=1, value=f"VISIT DONE - as on {current_date_str}")
-            title_cell_done.font = Font(name='Calibri', size=14, bold=True)
-            title_cell_done.alignment = center_alignment
-            current_row += 1
-
-            for col_num, header_title in enumerate(report_columns, 1):
-                cell = ws.cell(row=current_row, column=col_num, value=header_title)
-                cell.font = header_font; cell.alignment = center_alignment; cell.border = border_thin; cell.fill = header_fill
-            current_row += 1
-
-            for idx, lead in enumerate(df_visit_done.to_dict('records'), 1):
-                ws.cell(row=current_row, column=1, value=idx).alignment = center_alignment
-                ws.cell(row=current_row, column=2, value=lead.get('bank_name', '')).alignment = left_alignment
-                ws.cell(row=current_row, column=3, value=lead.get('branch_virtual', '')).alignment = left_alignment
-                received_dt = lead.get('received_date'); date_str_recv = received_dt.strftime("%d-%b-%Y") if pd.notna(received_dt) and isinstance(received_dt, datetime.date) else ''
-                ws.cell(row=current_row, column=4, value=date_str_recv).alignment = center_alignment
-                ws.cell(row=current_row, column=5, value=lead.get('customer_name', '')).alignment = left_alignment
-                ws.cell(row=current_row, column=6, value=lead.get('location', '')).alignment = left_alignment
-                ws.cell(row=current_row, column=7, value=lead.get('site_engineer', '')).alignment = left_alignment
-                deadline_dt = lead.get('deadline'); date_str_dead = deadline_dt.strftime("%d-%b-%Y") if pd.notna(deadline_dt) and isinstance(deadline_dt, datetime.date) else ''
-                ws.cell(row=current_row, column=8, value=date_str_dead).alignment = center_alignment
-                ws.cell(row=current_row, column=9, value=lead.get('status', '')).alignment = left_alignment
-
-                for col_num in range(1, len(report_columns) + 1):
-                    ws.cell(row=current_row, column=col_num).border = border_thin
-                    ws.cell(row=current_row, column=col_num).font = cell_font
-                current_row += 1
-
-            current_row += 2 # Space before next section
-
-            # VISIT PENDING Section
-            ws.merge_cells(start_row=current_row, start_column=1, end_row=current_row, end_column=len(report_columns))
-            title_cell_pending = ws.cell(row=current_row, column=1, value=f"VISIT PENDING - as on {current_date_str}")
-            title_cell_pending.font = Font(name='Calibri', size=14, bold=True)
-            title_cell_pending.alignment = center_alignment
-            current_row += 1
-
-            for col_num, header_title in enumerate(report_columns, 1):
-                cell = ws.cell(row=current_row, column=col_num, value=header_title)
-                cell.font = header_font; cell.alignment = center_alignment; cell.border = border_thin; cell.fill = header_fill
-            current_row += 1
-
-            for idx, lead in enumerate(df_visit_pending.to_dict('records'), 1):
-                ws.cell(row=current_row, column=1, value=idx).alignment = center_alignment
-                ws.cell(row=current_row, column=2, value=lead.get('bank_name', '')).alignment = left_alignment
-                ws.cell(row=current_row, column=3, value=lead.get('branch_virtual', '')).alignment = left_alignment
-                received_dt = lead.get('received_date'); date_str_recv = received_dt.strftime("%d-%b-%Y") if pd.notna(received_dt) and isinstance(received_dt, datetime.date) else ''
-                ws.cell(row=current_row, column=4, value=date_str_recv).alignment = center_alignment
-                ws.cell(row=current_row, column=5, value=lead.get('customer_name', '')).alignment = left_alignment
-                ws.cell(row=current_row, column=6, value=lead.get('location', '')).alignment = left_alignment
-                ws.cell(row=current_row, column=7, value=lead.get('site_engineer', 'N/A' if lead.get('status') == 'New' else lead.get('site_engineer', ''))).alignment = left_alignment
-                deadline_dt = lead.get('deadline'); date_str_dead = deadline_dt.strftime("%d-%b-%Y") if pd.notna(deadline_dt) and isinstance(deadline_dt, datetime.date) else ''
-                ws.cell(row=current_row, column=8, value=date_str_dead).alignment = center_alignment
-                ws.cell(row=current_row, column=9, value=lead.get('status', '')).alignment = left_alignment
-
-                for col_num in range(1, len(report_columns) + 1):
-                    ws.cell(row=current_row, column=col_num).border = border_thin
-                    ws.cell(row=current_row, column=col_num).font = cell_font
-                current_row += 1
-
-            custom_widths = [7, 30, 18, 15, 30, 40, 20, 15, 20]
-            for i, col_letter in enumerate([get_column_letter(idx) for idx in range(1, len(report_columns) + 1)]):
-                ws.column_dimensions[col_letter].width = custom_widths[i] if i < len(custom_widths) else 15
-
-            excel_stream = BytesIO()
-            wb.save(excel_stream)
-            excel_stream.seek(0)
-            return excel_stream
+        def display_trend_dashboards():
+            # Reads only the daily_lead_stats rollup, so the cost does not grow with the size of 'office'.
+            st.subheader("TRENDS - LAST 12 MONTHS")
+            if not PANDAS_AVAILABLE: st.warning("Pandas library needed for the trend dashboards."); return
+            trend_since = trend_window_start(12)
+            monthly_rows, bank_rows, backlog_opening, backlog_rows = run_db_reads([
+                (TREND_MONTHLY_SQL, (trend_since,), False), (TREND_BANK_VOLUME_SQL, (trend_since,), False),
+                (TREND_BACKLOG_OPENING_SQL, (trend_since,), True), (TREND_BACKLOG_DAILY_SQL, (trend_since,), False),
+            ])
+            if monthly_rows is None or bank_rows is None or backlog_opening is None or backlog_rows is None:
+                st.info("Trend data unavailable (daily_lead_stats could not be read)."); return
+
+            monthly_df = monthly_trend_frame(monthly_rows, trend_since)
+            trend_cols = st.columns(2)
+            with trend_cols[0]:
+                st.markdown("**Received vs Completed per Month**")
+                st.line_chart(monthly_df[['Received', 'Completed']])
+            with trend_cols[1]:
+                st.markdown("**Open Backlog (not completed) per Day**")
+                st.line_chart(backlog_frame(backlog_opening.get('open_leads'), backlog_rows, trend_since))
+            st.markdown("**Leads Received per Bank (top 10)**")
+            st.bar_chart(bank_volume_frame(bank_rows, trend_since))
+            st.dataframe(monthly_df, use_container_width=True)
+
+            with st.expander("Rollup Maintenance"):
+                st.caption("daily_lead_stats is updated with every lead insert and status change. Rebuild it after manual edits to 'office' or 'office_archive'.")
+                if st.button("Rebuild Trend Rollup", key="rebuild_daily_lead_stats_v15"):
+                    try:
+                        conn = STORAGE.connect()
+                        try:
+                            with st.spinner("Rebuilding daily_lead_stats..."): rollup_rows_written = rebuild_daily_lead_stats(conn)
+                        finally: conn.close()
+                    except Exception as e:
+                        st.error("Rollup rebuild failed. See console log."); print(f"daily_lead_stats rebuild error: {e}")
+                    else: st.success(f"daily_lead_stats rebuilt ({rollup_rows_written} rows)."); st.rerun()
+            st.markdown("---")
+
+        def display_history_dashboards():
+            # Computed from lead_events only: what the MIS looked like at the end of a past day, and who did what.
+            st.subheader("HISTORY (LEAD EVENT LOG)")
+            if not PANDAS_AVAILABLE: st.warning("Pandas library needed for the history dashboards."); return
+            history_cols = st.columns(2)
+            with history_cols[0]: as_of_date = st.date_input("MIS as of (end of day):", value=datetime.date.today() - datetime.timedelta(days=1), max_value=datetime.date.today(), key="history_as_of_date_v15")
+            with history_cols[1]: activity_range = st.date_input("User activity between:", value=(datetime.date.today().replace(day=1), datetime.date.today()), key="history_activity_range_v15")
+            activity_start, activity_end = (activity_range[0], activity_range[-1]) if isinstance(activity_range, (list, tuple)) and activity_range else (datetime.date.today(), datetime.date.today())
+            as_of_rows, activity_rows = run_db_reads([
+                (LEADS_AS_OF_SQL, (as_of_cutoff(as_of_date),), False),
+                (USER_ACTIVITY_SQL, (datetime.datetime.combine(activity_start, datetime.time()), as_of_cutoff(activity_end)), False),
+            ])
+            if as_of_rows is None or activity_rows is None:
+                st.info("History unavailable (lead_events could not be read)."); return
+            as_of_status_df, as_of_bank_df = leads_as_of_frames(as_of_rows)
+            st.markdown(f"**Lead status as of {as_of_date:%d-%b-%Y}** ({len(as_of_rows)} leads)")
+            as_of_cols = st.columns([1, 3])
+            with as_of_cols[0]: st.dataframe(as_of_status_df, use_container_width=True)
+            with as_of_cols[1]: st.dataframe(as_of_bank_df, use_container_width=True)
+            st.markdown(f"**Activity per user, {activity_start:%d-%b-%Y} to {activity_end:%d-%b-%Y}**")
+            activity_df = user_activity_frame(activity_rows)
+            if activity_df.empty: st.info("No recorded activity in this period.")
+            else: st.dataframe(activity_df, use_container_width=True)
+            st.markdown("---")
+
+        def display_lead_history(lead_id):
+            with st.expander(f"History of Lead ID {lead_id}"):
+                history_rows = run_db_query(LEAD_HISTORY_SQL, (lead_id,), fetch_all=True)
+                if history_rows is None: st.info("History unavailable."); return
+                if not history_rows: st.caption("No events recorded for this lead."); return
+                for event in history_rows:
+                    status_text = f"{event['old_status'] or '-'} → {event['new_status']}" if event['old_status'] != event['new_status'] else (event['new_status'] or '-')
+                    st.markdown(f"- {event['event_at']:%d-%b-%Y %H:%M} · **{event['event_type']}** · {status_text} · by {event['actor'] or 'system'}")
+                    if event['changed_fields']:
+                        changed = json.loads(event['changed_fields'])
+                        st.caption(", ".join(f"{col}: {old!r} → {new!r}" for col, (old, new) in changed.items()))
+
+        def display_analytics_snapshot_controls():
+            with st.expander("Analytics Snapshot (Parquet)"):
+                if not PYARROW_AVAILABLE: st.info("Install pyarrow to enable the analytics snapshot."); return
+                snapshot_state = read_snapshot_state()
+                st.caption(f"Last refreshed: {snapshot_state.get('refreshed_at') or 'never'} | {len(snapshot_state.get('partitions', {}))} month file(s) in {SNAPSHOT_DIR}")
+                st.caption("Historical months can be reported from the snapshot without querying the database. Only months changed since the last refresh are rewritten.")
+                if st.button("Refresh Snapshot Now", key="refresh_analytics_snapshot_v15"):
+                    try:
+                        conn = read_connect()
+                        try:
+                            with st.spinner("Refreshing analytics snapshot..."): snapshot_result = refresh_office_snapshot(conn, STORAGE.dialect, tables=('office', 'office_archive'))
+                        finally: conn.close()
+                    except Exception as e:
+                        st.error("Snapshot refresh failed. See console log."); print(f"Snapshot refresh error: {e}")
+                    else:
+                        st.success(f"Snapshot refreshed: {len(snapshot_result['written'])} month(s) rewritten ({snapshot_result['rows_written']} rows), {snapshot_result['unchanged']} unchanged.")
+
+        def display_scheduled_report_controls(month_key):
+            with st.expander("Prebuilt Reports"):
+                report_scheduler = get_report_scheduler()
+                if report_scheduler is None or not PANDAS_AVAILABLE: st.info("Prebuilt reports need the database and pandas."); return
+                report_status = report_scheduler.status()
+                next_run_text = f"{report_status['next_run']:%d-%b %H:%M}" if REPORT_SCHEDULE_ENABLED and report_status['next_run'] else "not scheduled"
+                st.caption(f"Last built: {report_status['built_at'] or 'never'} | next build: {next_run_text} | {report_status['report_count']} report(s) in {REPORTS_DIR}, "
+                           f"kept {REPORT_RETENTION_DAYS} days (newest {REPORT_KEEP_LATEST} always)")
+                if report_status['building_since']: st.info(f"Build in progress since {report_status['building_since']:%H:%M:%S}.")
+                if report_status['last_error']: st.warning(f"Last build failed: {report_status['last_error']}")
+                allocation_report = latest_report(report_key('monthly_allocation', month_key))
+                if allocation_report is not None:
+                    with open(allocation_report[0], 'rb') as report_file:
+                        st.download_button(label=f"📅 Download Per-Day Allocation {month_key} (built {allocation_report[1]['generated_at'].replace('T', ' ')[:16]})",
+                                           data=report_file.read(), file_name=os.path.basename(allocation_report[0]), mime=XLSX_MIME, key="download_prebuilt_allocation_v15")
+                if st.button("Regenerate Now", key="regenerate_prebuilt_reports_v15", help="Build the daily, per-bank and per-day allocation reports from the current data."):
+                    try:
+                        with st.spinner("Building reports..."): report_result = report_scheduler.run_now()
+                    except Exception as e:
+                        st.error("Report build failed. See console log."); print(f"Report build error: {e}")
+                    else:
+                        st.success(f"Built {report_result['files']} report file(s) from {report_result['rows']} leads in {report_result['seconds']}s.")
+
+        def load_lead_alerts(bank_name=None):
+            # Alert rows kept by the alert engine and by every lead write (mis_alerts.py), scoped like the lead list.
+            scope_clause, scope_params = get_lead_scope_for_session()
+            conditions = [scope_clause] if scope_clause else []; params = list(scope_params)
+            if bank_name is not None: conditions.append("bank_name = %s"); params.append(bank_name)
+            where_sql = f" WHERE {' AND '.join(conditions)}" if conditions else ""
+            return run_db_query(f"SELECT lead_id, alert_type, bank_name, deadline, last_seen_at FROM lead_alerts{where_sql} ORDER BY deadline, lead_id", tuple(params), fetch_all=True) or []
+
+        @st.cache_resource(max_entries=4, show_spinner=False)
+        def load_archived_lead_rows(archive_signature, scope_clause, scope_params):
+            # Keyed on the archive's signature: archived rows only change when an archive run (or restore) happens.
+            return run_db_query(ARCHIVE_LEADS_SQL + (f" WHERE {scope_clause}" if scope_clause else ""), scope_params, fetch_all=True)
+
+        def get_archived_lead_rows():
+            archive_signature = run_db_query(ARCHIVE_SIGNATURE_SQL, fetch_one=True)
+            if archive_signature is None: return None
+            scope_clause, scope_params = get_lead_scope_for_session()
+            return load_archived_lead_rows(tuple(archive_signature.values()), scope_clause, scope_params)
+
+        def display_archive_controls():
+            with st.expander("Lead Archive"):
+                archive_signature = run_db_query(ARCHIVE_SIGNATURE_SQL, fetch_one=True)
+                pending = run_db_query(ARCHIVE_PENDING_SQL, (archive_cutoff(ARCHIVE_AFTER_DAYS),), fetch_one=True)
+                if archive_signature is None or pending is None: st.info("office_archive could not be read."); return
+                st.caption(f"{archive_signature['row_count']} lead(s) archived (last run: {archive_signature['last_archived_at'] or 'never'}). "
+                           f"{pending['pending']} approved lead(s) completed more than {ARCHIVE_AFTER_DAYS} days ago are waiting to be archived.")
+                st.caption("Archived leads are left out of lists, dashboards and exports unless 'Include archived leads' is ticked in the sidebar. "
+                           "Schedule python mis_archive.py --archive to run this regularly.")
+                if st.button("Archive Now", key="archive_leads_now_v15", disabled=not pending['pending']):
+                    try:
+                        conn = STORAGE.connect()
+                        try:
+                            with st.spinner("Archiving leads..."): archive_result = archive_completed_leads(conn, ARCHIVE_AFTER_DAYS, ARCHIVE_BATCH_SIZE)
+                        finally: conn.close()
+                    except Exception as e:
+                        st.error("Archiving failed. See console log."); print(f"Archive error: {e}")
+                    else:
+                        note_lead_write()
+                        st.success(f"Archived {archive_result['archived']} lead(s) in {archive_result['batches']} batch(es)."); st.rerun()
+
+        def display_alert_engine_controls():
+            with st.expander("Deadline Alert Engine"):
+                engine_state = get_alert_engine()
+                if engine_state is None: st.info("The alert engine is disabled (ALERT_ENGINE_ENABLED in instance/config.py)."); return
+                with engine_state['lock']: last_result = engine_state['last_result']; last_error = engine_state['last_error']
+                if last_result:
+                    st.caption(f"Last run: {last_result['ran_at']:%d-%b-%Y %H:%M:%S} | " + ", ".join(f"{ALERT_TYPES[k]}: {v}" for k, v in last_result['counts'].items())
+                               + f" | {last_result['digests_sent']} digest(s) sent")
+                if last_error: st.warning(f"Last run failed: {last_error}")
+                st.caption(f"Alerts refresh every {ALERT_ENGINE_INTERVAL_SECONDS // 60} min; each engineer and admin gets at most one email digest a day.")
+                if st.button("Refresh Alerts Now", key="refresh_lead_alerts_v15"):
+                    try:
+                        with st.spinner("Refreshing deadline alerts..."):
+                            alert_result = run_alert_cycle(STORAGE.connect, load_alert_settings(config), send_digests=False)
+                    except Exception as e:
+                        st.error("Alert refresh failed. See console log."); print(f"Alert refresh error: {e}")
+                    else:
+                        with engine_state['lock']: engine_state['last_result'] = alert_result
+                        st.success("Alerts refreshed: " + ", ".join(f"{ALERT_TYPES[k]}: {v}" for k, v in alert_result['counts'].items()))
 
         # --- Main App UI Function ---
 def build_mis_app():
+    get_alert_engine()
+    get_report_scheduler()
     st.sidebar.header(f"Welcome, {st.session_state.get('username', 'Guest')}!")
     st.sidebar.write(f"Role: {st.session_state.get('role', 'N/A').upper()}")
     st.sidebar.markdown("---")
+    include_archive = st.sidebar.checkbox("Include archived leads", key="include_archive_v15",
+                                          help=f"Also show approved leads completed more than {ARCHIVE_AFTER_DAYS} days ago (search and historical reports).")
     st.sidebar.subheader("Filter Leads by Bank")
     if 'selected_bank_filter' not in st.session_state: st.session_state.selected_bank_filter = "-- All Banks --"
     current_filter_val = st.session_state.selected_bank_filter
@@ -760,7 +1449,7 @@ def build_mis_app():
     st.title(APP_NAME) # Uses globally defined APP_NAME
     top_cols = st.columns(4)
     with top_cols[0]:
-        if st.button("🔄 Refresh Data", key="refresh_top_button_main_v15", help="Reload data from the database"): st.rerun()
+        if st.button("🔄 Refresh Data", key="refresh_top_button_main_v15", help="Reload data from the database"): note_lead_write(); st.rerun()
     with top_cols[1]:
         if st.session_state.get('role') == 'admin':
             if st.button("📧 Check Emails", key="email_top_button_main_v15", help="Fetch new leads from the configured email account"):
@@ -768,46 +1457,50 @@ def build_mis_app():
     excel_dl_pl = top_cols[2].empty()
     custom_excel_dl_pl = top_cols[3].empty()
 
-    db_list = run_db_query("SELECT * FROM office ORDER BY received_date DESC, id DESC", fetch_all=True)
+    lead_scope_clause, lead_scope_params = get_lead_scope_for_session()
+    if lead_scope_clause: st.sidebar.caption("Showing only the leads assigned to you.")
+    shared_snapshot = get_shared_lead_snapshot()
+    if shared_snapshot is not None:
+        scope_column = LEAD_SCOPE_COLUMNS.get(st.session_state.get('role'))
+        lead_store = shared_snapshot.store if scope_column is None else LeadStore(shared_snapshot.store.rows_for(scope_column, st.session_state.get('username')))
+    else:
+        lead_list_query = "SELECT * FROM office" + (f" WHERE {lead_scope_clause}" if lead_scope_clause else "")
+        lead_store = LeadStore(run_db_query(lead_list_query + " ORDER BY received_date DESC, id DESC", lead_scope_params, fetch_all=True))
+    action_lead_store = lead_store # actions only ever target the hot set
+    if include_archive:
+        archived_lead_rows = get_archived_lead_rows()
+        if archived_lead_rows is None: st.sidebar.warning("Archived leads could not be loaded.")
+        elif archived_lead_rows:
+            lead_store = LeadStore(merge_lead_rows(lead_store.rows, archived_lead_rows))
+            st.sidebar.caption(f"Including {len(archived_lead_rows)} archived lead(s).")
+    perf_checkpoint("Sidebar & lead query")
     master_df = None
-    if db_list:
+    if lead_store:
         if PANDAS_AVAILABLE:
             try:
-                master_df = pd.DataFrame(db_list)
-                date_cols_to_convert = ['received_date', 'deadline', 'date_of_allocation',
-                                        'visit_initiation_date', 'visit_completion_date', 'lead_completion_date']
-                for col_name in date_cols_to_convert:
-                    if col_name in master_df.columns:
-                        master_df.loc[:, col_name] = pd.to_datetime(master_df[col_name], errors='coerce')
-                        if pd.api.types.is_datetime64_any_dtype(master_df[col_name]) and master_df[col_name].dt.tz is not None:
-                               master_df.loc[:, col_name] = master_df[col_name].dt.tz_localize(None)
+                master_df = lead_store.frame
             except Exception as e: st.error(f"Error converting database list to Pandas DataFrame: {e}"); master_df = None
         else: st.warning("Pandas library not available. Full data processing features might be limited.")
 
-    if master_df is None and db_list: st.warning("Displaying raw list; Pandas DataFrame creation or processing failed.")
-
-    filtered_df_display = master_df.copy() if master_df is not None else None
-    list_for_display_fallback = db_list
+    if master_df is None and lead_store: st.warning("Displaying raw list; Pandas DataFrame creation or processing failed.")
+    perf_checkpoint("DataFrame conversion")
 
-    if filtered_df_display is not None and st.session_state.selected_bank_filter != "-- All Banks --":
+    selected_bank_for_store = None if st.session_state.selected_bank_filter == "-- All Banks --" else st.session_state.selected_bank_filter
+    filtered_df_display = master_df
+    filtered_lead_rows = lead_store.rows_for_bank(selected_bank_for_store)
+    if master_df is not None and selected_bank_for_store is not None:
         try:
-            if 'bank_name' in filtered_df_display.columns:
-                original_row_count = filtered_df_display.shape[0]
-                filtered_df_display = filtered_df_display[filtered_df_display['bank_name'] == st.session_state.selected_bank_filter]
-                if filtered_df_display.empty and original_row_count > 0:
-                    list_for_display_fallback = [item for item in db_list if item.get('bank_name') == st.session_state.selected_bank_filter] if db_list else []
-                elif not filtered_df_display.empty:
-                    list_for_display_fallback = filtered_df_display.to_dict('records')
-            else: st.warning("Cannot filter by bank: 'bank_name' column missing from data.")
+            filtered_df_display = lead_store.frame_for_bank(selected_bank_for_store)
         except Exception as e:
             st.error(f"Error during bank filtering: {e}")
-            filtered_df_display = master_df.copy() if master_df is not None else None
-            list_for_display_fallback = db_list
+            filtered_df_display = master_df
+    perf_checkpoint("Bank filter")
 
     if st.session_state.get('role') == 'admin':
         st.markdown("---"); st.header("Admin Dashboards & Reports")
         df_for_dashboards = filtered_df_display if filtered_df_display is not None else pd.DataFrame() # Ensure it's a DataFrame
-        display_summary_dashboard_stats(df_for_dashboards)
+        display_summary_dashboard_stats(df_for_dashboards, shared_snapshot.summary_tables(selected_bank_for_store) if shared_snapshot is not None and lead_store is shared_snapshot.store else None)
+        perf_checkpoint("Summary dashboard")
 
         st.markdown("---")
         current_datetime_obj = datetime.datetime.now() # Renamed to avoid conflict
@@ -834,14 +1527,34 @@ def build_mis_app():
             )
         selected_month_number = month_names_list.index(st.session_state.daily_report_month_name) + 1
 
-        display_per_day_allocation_dashboard(df_for_dashboards, st.session_state.daily_report_year, selected_month_number)
+        per_day_source_df = df_for_dashboards
+        selected_month_key = f"{st.session_state.daily_report_year}-{selected_month_number:02d}"
+        if PYARROW_AVAILABLE and selected_month_key in snapshot_months():
+            if st.radio("Data Source:", ["Live Database", "Analytics Snapshot"], horizontal=True, key="per_day_data_source_v15") == "Analytics Snapshot":
+                per_day_source_df = load_office_snapshot(months=[selected_month_key])
+                if per_day_source_df is not None and selected_bank_for_store is not None:
+                    per_day_source_df = per_day_source_df[per_day_source_df['bank_name'] == selected_bank_for_store]
+        display_per_day_allocation_dashboard(per_day_source_df, st.session_state.daily_report_year, selected_month_number)
+        display_analytics_snapshot_controls()
+        display_scheduled_report_controls(selected_month_key)
+        perf_checkpoint("Per-day allocation dashboard")
+
+        display_trend_dashboards()
+        perf_checkpoint("Trend dashboards")
+
+        display_turnaround_dashboard(df_for_dashboards)
+        perf_checkpoint("Turnaround & SLA analytics")
+
+        display_history_dashboards()
+        perf_checkpoint("History dashboards")
+
+        display_alert_engine_controls()
+        display_archive_controls()
 
     st.markdown("---")
     st.header(f"Leads Details (Filter Applied: {st.session_state.selected_bank_filter})")
 
-    active_data_for_display = filtered_df_display if PANDAS_AVAILABLE and filtered_df_display is not None else \
-                            ([item for item in list_for_display_fallback if item.get('bank_name') == st.session_state.selected_bank_filter]
-                                if st.session_state.selected_bank_filter != "-- All Banks --" and list_for_display_fallback else list_for_display_fallback)
+    active_data_for_display = filtered_df_display if PANDAS_AVAILABLE and filtered_df_display is not None else filtered_lead_rows
 
     condition_met = False
     if active_data_for_display is not None:
@@ -854,61 +1567,46 @@ def build_mis_app():
 
     if condition_met:
         overdue_leads = []; due_soon_leads = []; on_hold_leads = []
-        source_for_warnings = active_data_for_display.to_dict('records') if PANDAS_AVAILABLE and isinstance(active_data_for_display, pd.DataFrame) else active_data_for_display
-
-        for lead_item in source_for_warnings:
-            status_display_text, row_color = get_status_and_color_value(lead_item)
-            lead_id_display = lead_item.get('id', 'N/A')
-            lead_identifier = lead_item.get('bank_name', 'N/A')[:20]
-
-            if "Overdue" in status_display_text: overdue_leads.append(f"🚨 ID {lead_id_display} ({lead_identifier})")
-            elif row_color == '#ffdddd': due_soon_leads.append(f"⚠️ ID {lead_id_display} ({lead_identifier})")
-            elif row_color == '#ffe8cc': on_hold_leads.append(f"🔔 ID {lead_id_display} ({lead_identifier})")
+        alert_lists = {'overdue': (overdue_leads, "🚨"), 'due_soon': (due_soon_leads, "⚠️"), 'on_hold': (on_hold_leads, "🔔")}
+        for alert_row in load_lead_alerts(selected_bank_for_store): # kept current by the writes themselves, not computed per rerun
+            alert_list, alert_icon = alert_lists[alert_row['alert_type']]
+            alert_list.append(f"{alert_icon} ID {alert_row['lead_id']} ({(alert_row.get('bank_name') or 'N/A')[:20]})")
 
         if overdue_leads: st.error(f"**Overdue Leads:** {'; '.join(overdue_leads)}")
         if due_soon_leads: st.warning(f"**Leads Due Soon (Urgent):** {'; '.join(due_soon_leads)}")
         if on_hold_leads: st.info(f"**Leads On Hold / Nearing Deadline:** {'; '.join(on_hold_leads)}")
+        perf_checkpoint("Deadline warnings")
 
         if PANDAS_AVAILABLE and isinstance(active_data_for_display, pd.DataFrame) and not active_data_for_display.empty:
-            df_to_style = active_data_for_display.copy()
-            column_order_preference = [
-                'id', 'bank_name', 'branch_virtual', 'customer_name', 'application_number',
-                'location', 'contact_number', 'property_details', 'site_link',
-                'received_date', 'date_of_allocation', 'deadline',
-                'visit_initiation_date', 'visit_completion_date', 'lead_completion_date',
-                'status', 'site_engineer', 'report_creator',
-                'visit_type', 'distance', 'remarks', 'report_issue_notes',
-                'admin_review_status', 'admin_comments', 'appraiser_quotation_obs'
-                # 'site_photo_filenames', 'site_document_filenames' # Optionally add to main display
-            ]
-            actual_columns_to_display = [col for col in column_order_preference if col in df_to_style.columns]
-            remaining_cols = [col for col in df_to_style.columns if col not in actual_columns_to_display]
-            df_to_style_ordered = df_to_style[actual_columns_to_display + remaining_cols]
+            table_total_rows = active_data_for_display.shape[0]
+            table_view_mode = st.radio(
+                "Table View:", ["Paginated", "Full Table"], horizontal=True, key="leads_table_view_mode_v15",
+                index=0 if table_total_rows > LEADS_TABLE_FULL_RENDER_MAX_ROWS else 1,
+                help=f"Full Table styles every row and gets slow on large lists; Paginated only formats the {LEADS_TABLE_PAGE_SIZE} rows on screen."
+            )
+            if table_view_mode == "Paginated":
+                grid_cols = st.columns([3, 2, 1, 1])
+                table_search_text = grid_cols[0].text_input("Search Leads:", key="leads_table_search_v15", placeholder="Customer, application no., location, engineer...")
+                table_sort_column = grid_cols[1].selectbox(
+                    "Sort By:", [""] + [col for col in LEAD_TABLE_COLUMN_ORDER if col in active_data_for_display.columns],
+                    format_func=lambda k: k or "(Received date, newest first)", key="leads_table_sort_v15"
+                )
+                table_sort_desc = grid_cols[2].checkbox("Descending", key="leads_table_sort_desc_v15")
+                ordered_row_labels = order_lead_table_rows(active_data_for_display, table_search_text.strip(), table_sort_column, table_sort_desc)
+                table_page_count = max(1, -(-len(ordered_row_labels) // LEADS_TABLE_PAGE_SIZE))
+                if st.session_state.get('leads_table_page_v15', 1) > table_page_count: st.session_state['leads_table_page_v15'] = table_page_count
+                table_page = grid_cols[3].number_input(f"Page (of {table_page_count}):", min_value=1, max_value=table_page_count, step=1, key="leads_table_page_v15")
+                page_start = (table_page - 1) * LEADS_TABLE_PAGE_SIZE
+                page_row_labels = ordered_row_labels[page_start:page_start + LEADS_TABLE_PAGE_SIZE]
+                df_to_style_ordered = format_lead_table(active_data_for_display.loc[page_row_labels])
+                if len(ordered_row_labels): st.caption(f"Showing leads {page_start + 1}-{page_start + len(page_row_labels)} of {len(ordered_row_labels)} matching ({table_total_rows} in view).")
+                else: st.caption("No leads match the search.")
+            else:
+                df_to_style_ordered = format_lead_table(active_data_for_display)
 
             def apply_row_styles(row_series_data):
-                if row_series_data.name in df_to_style_ordered.index:
-                    lead_dict_for_status = df_to_style_ordered.loc[row_series_data.name].to_dict()
-                    _, color_hex = get_status_and_color_value(lead_dict_for_status)
-                    return [f'background-color: {color_hex}'] * len(row_series_data)
-                return [''] * len(row_series_data)
-
-
-            for col_name_format in df_to_style_ordered.columns:
-                if pd.api.types.is_datetime64_any_dtype(df_to_style_ordered[col_name_format]):
-                    is_only_date = False
-                    if not df_to_style_ordered[col_name_format].isna().all():
-                        try:
-                            valid_times = pd.to_datetime(df_to_style_ordered[col_name_format]).dropna().dt.time
-                            if not valid_times.empty: # Ensure there are non-NaT values
-                                is_only_date = (valid_times == datetime.time(0,0,0)).all()
-                        except AttributeError: pass
-
-                    if is_only_date:
-                        df_to_style_ordered.loc[:, col_name_format] = pd.to_datetime(df_to_style_ordered[col_name_format], errors='coerce').dt.strftime('%Y-%m-%d')
-                    else:
-                        df_to_style_ordered.loc[:, col_name_format] = pd.to_datetime(df_to_style_ordered[col_name_format], errors='coerce').dt.strftime('%Y-%m-%d %H:%M')
-
-            df_to_style_ordered = df_to_style_ordered.astype(str).replace({'None': '-', 'NaT': '-', 'nan':'-', 'nat':'-'})
+                _, color_hex = get_status_and_color_value(row_series_data.to_dict())
+                return [f'background-color: {color_hex}'] * len(row_series_data)
 
             try:
                 st.dataframe(df_to_style_ordered.style.apply(apply_row_styles, axis=1), use_container_width=True, height=450, hide_index=True)
@@ -919,37 +1617,63 @@ def build_mis_app():
         elif not PANDAS_AVAILABLE and active_data_for_display :
             st.warning("Pandas not available, displaying basic table.")
             st.table(active_data_for_display)
+        perf_checkpoint("Leads table styling & render")
 
         if PANDAS_AVAILABLE and isinstance(active_data_for_display, pd.DataFrame) and not active_data_for_display.empty:
-            df_for_standard_export = active_data_for_display.copy()
-            for col in df_for_standard_export.select_dtypes(include=[np.datetime64, 'datetime64[ns]', 'datetime64[ns, UTC]']).columns: # Added UTC
-                df_for_standard_export.loc[:, col] = pd.to_datetime(df_for_standard_export[col], errors='coerce').dt.strftime('%Y-%m-%d %H:%M:%S')
-            df_for_standard_export = df_for_standard_export.fillna('')
-
             excel_filename_standard = f"MIS_Standard_Export_{st.session_state.selected_bank_filter.replace(' ','_')}_{datetime.date.today():%Y%m%d}.xlsx"
             try:
-                output_stream_standard = BytesIO()
-                with pd.ExcelWriter(output_stream_standard, engine='openpyxl') as excel_writer_std:
-                    df_for_standard_export.to_excel(excel_writer_std, index=False, sheet_name='Filtered_Leads_Data')
                 excel_dl_pl.download_button(
                     label="📄 Download Standard Excel",
-                    data=output_stream_standard.getvalue(),
+                    data=build_standard_excel_export(active_data_for_display),
                     file_name=excel_filename_standard,
                     mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet", # Corrected MIME
                     key="download_excel_standard_v15"
                 )
             except Exception as e_std_excel: excel_dl_pl.error(f"Standard Excel DL Failed: {e_std_excel}")
-
-            excel_stream_for_custom_report = generate_custom_excel_report(active_data_for_display)
-            if excel_stream_for_custom_report:
-                excel_filename_custom = f"MIS_Formatted_Report_{datetime.date.today():%d%b%Y}.xlsx"
-                custom_excel_dl_pl.download_button(
-                    label="📑 Download Custom MIS Report",
-                    data=excel_stream_for_custom_report,
-                    file_name=excel_filename_custom,
-                    mime="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-                    key="download_excel_custom_v15"
+            perf_checkpoint("Standard Excel export")
+
+            # The prebuilt file (mis_reports.py) when this view is exactly what it covers: all leads, or one bank's.
+            # It is served as built, with its build time; nothing is built on a rerun. "Regenerate now" builds this
+            # view live once and keeps that copy in the session until the view changes.
+            custom_report_view = (selected_bank_for_store, include_archive, st.session_state.get('role'), st.session_state.get('username'))
+            live_report = st.session_state.get('custom_report_live_v15')
+            if live_report is not None and live_report['view'] != custom_report_view:
+                live_report = None
+            prebuilt_report = None
+            if live_report is None and LEAD_SCOPE_COLUMNS.get(st.session_state.get('role')) is None and not include_archive:
+                prebuilt_report = latest_report('daily_mis' if selected_bank_for_store is None else report_key('per_bank', selected_bank_for_store))
+            custom_report_box = custom_excel_dl_pl.container()
+            report_built_at = None
+            if live_report is not None:
+                report_built_at, report_data = live_report['built_at'], live_report['data']
+                report_note = "Built live for this view."
+            elif prebuilt_report is not None:
+                report_built_at = datetime.datetime.fromisoformat(prebuilt_report[1]['generated_at'])
+                with open(prebuilt_report[0], 'rb') as report_file:
+                    report_data = report_file.read()
+                if prebuilt_report[1].get('office_signature') and not is_report_current(prebuilt_report[1], run_db_query(REPORT_SIGNATURE_SQL, fetch_one=True)):
+                    report_note = "Prebuilt file; leads have changed since it was built. Use 'Regenerate now' for a current copy."
+                else:
+                    report_note = "Prebuilt file; no lead has changed since it was built."
+            if report_built_at is not None:
+                custom_report_box.download_button(
+                    label=f"📑 Download Custom MIS Report (built {report_built_at:%d-%b %H:%M})",
+                    data=report_data,
+                    file_name=f"MIS_Formatted_Report_{report_built_at:%d%b%Y_%H%M}.xlsx",
+                    mime=XLSX_MIME,
+                    key="download_excel_custom_v15",
+                    help=report_note
                 )
+            if custom_report_box.button("🔄 Regenerate now" if report_built_at is not None else "📑 Build Custom MIS Report",
+                                        key="regenerate_custom_report_v15", help="Build the Custom MIS report from the leads on screen now."):
+                excel_stream_for_custom_report = generate_custom_excel_report(active_data_for_display)
+                if excel_stream_for_custom_report:
+                    st.session_state['custom_report_live_v15'] = {'view': custom_report_view, 'built_at': datetime.datetime.now(),
+                                                                  'data': excel_stream_for_custom_report.getvalue()}
+                    st.rerun()
+                else:
+                    custom_report_box.error("Custom MIS report could not be built.")
+            perf_checkpoint("Custom Excel report")
         elif not PANDAS_AVAILABLE:
             excel_dl_pl.warning("Pandas library needed for Excel downloads.")
             custom_excel_dl_pl.warning("Pandas library needed for Custom Excel report.")
@@ -1011,10 +1735,91 @@ def build_mis_app():
                     else:
                         st.error("Failed to add the new lead. Check console logs for details.")
 
+        st.markdown("---"); st.subheader("Bulk Import Leads from Excel/CSV")
+        if PANDAS_AVAILABLE:
+            if 'bulk_import_nonce' not in st.session_state: st.session_state.bulk_import_nonce = 0
+            last_import_count = st.session_state.pop('bulk_import_result', None)
+            if last_import_count is not None: st.success(f"{last_import_count} lead(s) imported successfully.")
+            uploaded_allocation_sheet = st.file_uploader(
+                "Upload bank allocation sheet (XLSX or CSV)", type=["xlsx", "xls", "csv"],
+                key=f"bulk_import_uploader_{st.session_state.bulk_import_nonce}_v15",
+                help="Column headers are matched to lead fields, e.g. 'Bank Name', 'Property Details', 'Customer Name', 'Deadline'."
+            )
+            if uploaded_allocation_sheet is not None:
+                try:
+                    if uploaded_allocation_sheet.name.lower().endswith(".csv"): raw_import_df = pd.read_csv(uploaded_allocation_sheet, dtype=str, keep_default_na=False)
+                    else: raw_import_df = pd.read_excel(uploaded_allocation_sheet, dtype=object)
+                    accepted_import_df, rejected_import_df, ignored_import_headers = prepare_bulk_lead_import(raw_import_df)
+                except Exception as e_import:
+                    st.error(f"Could not read the uploaded sheet: {e_import}")
+                    accepted_import_df = None
+                if accepted_import_df is not None:
+                    if ignored_import_headers: st.caption(f"Ignored columns (no matching lead field): {', '.join(ignored_import_headers)}")
+                    st.markdown(f"**{len(accepted_import_df)} row(s) ready to import, {len(rejected_import_df)} rejected.**")
+                    if not rejected_import_df.empty:
+                        st.markdown("##### Rejected Rows")
+                        st.dataframe(rejected_import_df.astype(str), use_container_width=True, hide_index=True)
+                    if not accepted_import_df.empty:
+                        st.markdown("##### Preview of Accepted Rows")
+                        st.dataframe(accepted_import_df.head(50), use_container_width=True, hide_index=True)
+                        if st.button(f"Import {len(accepted_import_df)} Accepted Lead(s)", key="bulk_import_confirm_btn_v15"):
+                            inserted_count = bulk_insert_leads(accepted_import_df)
+                            if inserted_count is not None:
+                                st.session_state['bulk_import_result'] = inserted_count
+                                st.session_state.bulk_import_nonce += 1; st.rerun()
+                            else: st.error("Bulk import failed; no leads were added. Check console logs for details.")
+        else: st.warning("Pandas library needed for bulk import.")
+
+    perf_checkpoint("Add lead & bulk import")
+
+    allowed_bulk_actions = [label for label, transition in BULK_LEAD_TRANSITIONS.items() if st.session_state.get('role') in transition['roles']]
+    if action_lead_store and allowed_bulk_actions:
+        st.markdown("---"); st.subheader("Bulk Actions on Multiple Leads")
+        last_bulk_result = st.session_state.pop('bulk_action_result', None)
+        if last_bulk_result:
+            if last_bulk_result['updated']: st.success(f"'{last_bulk_result['action']}' applied to {len(last_bulk_result['updated'])} lead(s): IDs {', '.join(map(str, last_bulk_result['updated']))}")
+            if last_bulk_result['conflicts']: st.warning(f"Skipped {len(last_bulk_result['conflicts'])} lead(s) changed by someone else since the page loaded: IDs {', '.join(map(str, last_bulk_result['conflicts']))}. Review them and retry.")
+        bulk_action_label = st.selectbox("Bulk Action:", allowed_bulk_actions, key="bulk_action_select_v15")
+        bulk_transition = BULK_LEAD_TRANSITIONS[bulk_action_label]
+        eligible_bulk_leads = {str(item['id']): item for item in action_lead_store.rows_with_status(bulk_transition['from_status']) if is_lead_eligible_for_transition(item, bulk_transition)}
+        if not eligible_bulk_leads:
+            st.info(f"No leads are currently eligible for '{bulk_action_label}' (status '{bulk_transition['from_status']}').")
+        else:
+            # The submit arrives on the next rerun, after the leads were re-read: guard with the versions shown here.
+            rendered_bulk_versions = st.session_state.get('bulk_action_versions_v15', {})
+            st.session_state['bulk_action_versions_v15'] = {item['id']: item.get('version') or 0 for item in eligible_bulk_leads.values()}
+            with st.form("bulk_action_form_v15", clear_on_submit=True):
+                selected_bulk_ids = st.multiselect(
+                    f"Select Leads ({len(eligible_bulk_leads)} eligible):",
+                    options=list(eligible_bulk_leads.keys()),
+                    format_func=lambda k: f"ID {k} - {(eligible_bulk_leads[k].get('bank_name') or 'N/A')[:25]} / {(eligible_bulk_leads[k].get('customer_name') or '-')[:20]}",
+                    key="bulk_action_leads_multiselect_v15"
+                )
+                bulk_assignee_input = ""
+                if bulk_transition['assignee_column'] == 'site_engineer': bulk_assignee_input = st.text_input("Engineer Username:", key="bulk_action_engineer_txt_v15")
+                elif bulk_transition['assignee_column'] == 'report_creator': bulk_assignee_input = st.text_input("Report Creator Username:", key="bulk_action_creator_txt_v15")
+                submitted_bulk_action = st.form_submit_button(f"Apply '{bulk_action_label}' to Selected Leads")
+                if submitted_bulk_action:
+                    if not selected_bulk_ids: st.warning("Select at least one lead.")
+                    elif bulk_transition['assignee_column'] and not bulk_assignee_input.strip(): st.warning("Assignee username cannot be empty.")
+                    else:
+                        # A lead that left the eligible set since it was shown has already been changed by someone else.
+                        no_longer_eligible_ids = [int(k) for k in selected_bulk_ids if k not in eligible_bulk_leads]
+                        bulk_updated_ids, bulk_conflict_ids = apply_bulk_lead_transition(
+                            bulk_action_label, [eligible_bulk_leads[k] for k in selected_bulk_ids if k in eligible_bulk_leads],
+                            bulk_assignee_input.strip() or None, rendered_bulk_versions
+                        ) if len(no_longer_eligible_ids) < len(selected_bulk_ids) else ([], [])
+                        if bulk_updated_ids is None: st.error("Bulk action failed; no leads were changed. Check console logs for details.")
+                        else:
+                            st.session_state['bulk_action_result'] = {'action': bulk_action_label, 'updated': bulk_updated_ids, 'conflicts': bulk_conflict_ids + no_longer_eligible_ids}
+                            st.rerun()
+
+    perf_checkpoint("Bulk actions")
+
     st.markdown("---"); st.subheader("Perform Actions on a Selected Lead")
-    if db_list:
+    if action_lead_store:
         lead_action_options = {"": "--Select Lead ID--"}
-        for lead_item_option in db_list:
+        for lead_item_option in action_lead_store.rows:
             status_text_option, _ = get_status_and_color_value(lead_item_option)
             desc_text_option = lead_item_option.get('property_details', lead_item_option.get('bank_name', 'N/A'))[:30]
             lead_action_options[str(lead_item_option['id'])] = f"ID {lead_item_option['id']} - {desc_text_option}... ({status_text_option})"
@@ -1027,7 +1832,7 @@ def build_mis_app():
         )
 
         if selected_lead_id_str:
-            selected_lead_details = next((item for item in db_list if str(item['id']) == selected_lead_id_str), None)
+            selected_lead_details = action_lead_store.get(selected_lead_id_str)
             if selected_lead_details:
                 selected_lead_id_int = int(selected_lead_id_str)
                 current_lead_status = selected_lead_details.get('status', 'New')
@@ -1045,6 +1850,8 @@ def build_mis_app():
                     st.session_state.get('role') == 'user' # Assuming report creators might have 'user' role or a specific one
                 ) # Adjust if report creators have a different role, e.g. 'creator'
 
+                display_lead_history(selected_lead_id_int)
+
                 action_button_cols = st.columns(4)
                 # ... (Existing action buttons: Assign Eng, Visit Done, Assign Creator, Report Done - keep their logic as is) ...
                 with action_button_cols[0]: # Assign Engineer
@@ -1059,12 +1866,12 @@ def build_mis_app():
                             if st.button("Confirm Engineer Assignment", key=f"confirm_assign_eng_btn_{selected_lead_id_int}_v15"):
                                 if engineer_name_input.strip():
                                     # ... (db update logic)
-                                    update_query = "UPDATE office SET site_engineer=%s, status=%s, date_of_allocation=%s WHERE id=%s AND status=%s"
-                                    params_tuple = (engineer_name_input.strip(), 'Assigned Engineer', datetime.date.today(), selected_lead_id_int, 'New')
-                                    if run_db_query(update_query, params_tuple) is not None:
-                                        st.success(f"Engineer '{engineer_name_input.strip()}' assigned successfully.")
+                                    update_query = "UPDATE office SET site_engineer=%s, status=%s, date_of_allocation=%s, version=version+1 WHERE id=%s AND status=%s AND version=%s"
+                                    params_tuple = (engineer_name_input.strip(), 'Assigned Engineer', datetime.date.today(), selected_lead_id_int, 'New', selected_lead_details.get('version') or 0)
+                                    if show_lead_update_result(
+                                            run_db_transaction([(update_query, params_tuple)], lead_change_followup(selected_lead_details, 'Assigned Engineer', engineer_name_input.strip())),
+                                            f"Engineer '{engineer_name_input.strip()}' assigned successfully.", "Failed to assign engineer."):
                                         st.session_state[f'show_assign_engineer_expander_{selected_lead_id_int}']=False; st.rerun()
-                                    else: st.error("Failed to assign engineer.")
                                 else: st.warning("Engineer name cannot be empty.")
                 
                 with action_button_cols[1]: # Visit Done
@@ -1072,10 +1879,11 @@ def build_mis_app():
                     if st.button("✅ Visit Done", disabled=not can_mark_visit_done, key=f"mark_visit_done_btn_{selected_lead_id_int}_v15", use_container_width=True, help="Mark the site visit as completed."):
                         if can_mark_visit_done:
                             # ... (db update logic)
-                            update_query = "UPDATE office SET status=%s, visit_completion_date=%s WHERE id=%s AND status=%s"
-                            params_tuple = ('Visit Done', datetime.date.today(), selected_lead_id_int, 'Assigned Engineer')
-                            if run_db_query(update_query, params_tuple) is not None: st.success("Site visit marked as done."); st.rerun()
-                            else: st.error("Failed to mark visit as done.")
+                            update_query = "UPDATE office SET status=%s, visit_completion_date=%s, version=version+1 WHERE id=%s AND status=%s AND version=%s"
+                            params_tuple = ('Visit Done', datetime.date.today(), selected_lead_id_int, 'Assigned Engineer', selected_lead_details.get('version') or 0)
+                            if show_lead_update_result(
+                                    run_db_transaction([(update_query, params_tuple)], lead_change_followup(selected_lead_details, 'Visit Done')),
+                                    "Site visit marked as done.", "Failed to mark visit as done."): st.rerun()
                         else: st.warning("Only the assigned Site Engineer or an Admin can mark the visit done.")
 
                 with action_button_cols[2]: # Assign Creator
@@ -1090,12 +1898,12 @@ def build_mis_app():
                             if st.button("Confirm Creator Assignment", key=f"confirm_assign_creator_btn_{selected_lead_id_int}_v15"):
                                 if creator_name_input.strip():
                                     # ... (db update logic)
-                                    update_query = "UPDATE office SET report_creator=%s, status=%s WHERE id=%s AND status=%s"
-                                    params_tuple = (creator_name_input.strip(), 'Report in Progress', selected_lead_id_int, 'Visit Done')
-                                    if run_db_query(update_query, params_tuple) is not None:
-                                        st.success(f"Report Creator '{creator_name_input.strip()}' assigned.")
+                                    update_query = "UPDATE office SET report_creator=%s, status=%s, version=version+1 WHERE id=%s AND status=%s AND version=%s"
+                                    params_tuple = (creator_name_input.strip(), 'Report in Progress', selected_lead_id_int, 'Visit Done', selected_lead_details.get('version') or 0)
+                                    if show_lead_update_result(
+                                            run_db_transaction([(update_query, params_tuple)], lead_change_followup(selected_lead_details, 'Report in Progress', changes={'report_creator': creator_name_input.strip()})),
+                                            f"Report Creator '{creator_name_input.strip()}' assigned.", "Failed to assign report creator."):
                                         st.session_state[f'show_assign_creator_expander_{selected_lead_id_int}']=False; st.rerun()
-                                    else: st.error("Failed to assign report creator.")
                                 else: st.warning("Creator name cannot be empty.")
 
                 with action_button_cols[3]: # Report Done
@@ -1108,10 +1916,11 @@ def build_mis_app():
                     if st.button("📝 Report Done", disabled=not can_mark_report_done, key=f"mark_report_done_btn_{selected_lead_id_int}_v15", use_container_width=True, help="Mark the report as completed and ready for admin review."):
                         if can_mark_report_done:
                             # ... (db update logic)
-                            update_query = "UPDATE office SET status=%s, admin_review_status=%s, lead_completion_date=%s WHERE id=%s AND status=%s"
-                            params_tuple = ('Completed', 'Pending Review', datetime.date.today(), selected_lead_id_int, 'Report in Progress')
-                            if run_db_query(update_query, params_tuple) is not None: st.success("Report marked as done."); st.rerun()
-                            else: st.error("Failed to mark report as done.")
+                            update_query = "UPDATE office SET status=%s, admin_review_status=%s, lead_completion_date=%s, version=version+1 WHERE id=%s AND status=%s AND version=%s"
+                            params_tuple = ('Completed', 'Pending Review', datetime.date.today(), selected_lead_id_int, 'Report in Progress', selected_lead_details.get('version') or 0)
+                            if show_lead_update_result(
+                                    run_db_transaction([(update_query, params_tuple)], lead_change_followup(selected_lead_details, 'Completed', changes={'admin_review_status': 'Pending Review'})),
+                                    "Report marked as done.", "Failed to mark report as done."): st.rerun()
                         else: st.warning("Only the assigned Report Creator or an Admin can mark the report done.")
 
 
@@ -1138,11 +1947,11 @@ def build_mis_app():
                         if fields_to_update:
                             # ... (db update logic)
                             set_clause_parts = [f"`{col_name}`=%s" for col_name in fields_to_update.keys()]
-                            update_query_details = f"UPDATE office SET {', '.join(set_clause_parts)} WHERE id=%s"
-                            update_params_details = list(fields_to_update.values()) + [selected_lead_id_int]
-                            if run_db_query(update_query_details, tuple(update_params_details)) is not None:
-                                st.success("Lead details updated successfully."); st.rerun()
-                            else: st.error("Failed to update lead details.")
+                            update_query_details = f"UPDATE office SET {', '.join(set_clause_parts)}, version=version+1 WHERE id=%s AND status=%s AND version=%s"
+                            update_params_details = list(fields_to_update.values()) + [selected_lead_id_int, current_lead_status, selected_lead_details.get('version') or 0]
+                            if show_lead_update_result(
+                                    run_db_transaction([(update_query_details, tuple(update_params_details))], lead_change_followup(selected_lead_details, current_lead_status, changes=fields_to_update)),
+                                    "Lead details updated successfully.", "Failed to update lead details."): st.rerun()
                         else: st.info("No changes detected in the details to save.")
                 
                 can_edit_notes = (
@@ -1157,10 +1966,12 @@ def build_mis_app():
                     updated_notes_value = st.text_area("Notes:", value=current_notes_value, key=f"update_notes_txt_{selected_lead_id_int}_v15", height=100)
                     if st.button("Save Notes", key=f"save_notes_btn_{selected_lead_id_int}_v15"):
                         if current_notes_value != updated_notes_value:
-                            query_save_notes = "UPDATE office SET report_issue_notes=%s WHERE id=%s"
-                            if run_db_query(query_save_notes, (updated_notes_value.strip() or None, selected_lead_id_int)) is not None:
-                                st.success("Notes saved successfully."); st.rerun()
-                            else: st.error("Failed to save notes.")
+                            query_save_notes = "UPDATE office SET report_issue_notes=%s, version=version+1 WHERE id=%s AND status=%s AND version=%s"
+                            params_save_notes = (updated_notes_value.strip() or None, selected_lead_id_int, current_lead_status, selected_lead_details.get('version') or 0)
+                            if show_lead_update_result(
+                                    run_db_transaction([(query_save_notes, params_save_notes)],
+                                                       lead_change_followup(selected_lead_details, current_lead_status, changes={'report_issue_notes': params_save_notes[0]})),
+                                    "Notes saved successfully.", "Failed to save notes."): st.rerun()
                         else: st.info("No changes detected in notes to save.")
 
                 if is_admin and current_lead_status == 'Completed':
@@ -1178,11 +1989,14 @@ def build_mis_app():
                         new_overall_status_for_lead = current_lead_status
                         if new_review_status_selection == 'Rejected - Needs Revision':
                             new_overall_status_for_lead = 'Report in Progress'
-                        query_admin_review = "UPDATE office SET admin_review_status=%s, status=%s, admin_comments=%s WHERE id=%s"
-                        params_admin_review = (new_review_status_selection, new_overall_status_for_lead, admin_comments_input.strip() or None, selected_lead_id_int)
-                        if run_db_query(query_admin_review, params_admin_review) is not None:
-                            st.success("Admin review saved successfully."); st.rerun()
-                        else: st.error("Failed to save admin review.")
+                        query_admin_review = "UPDATE office SET admin_review_status=%s, status=%s, admin_comments=%s, version=version+1 WHERE id=%s AND status=%s AND version=%s"
+                        params_admin_review = (new_review_status_selection, new_overall_status_for_lead, admin_comments_input.strip() or None,
+                                               selected_lead_id_int, current_lead_status, selected_lead_details.get('version') or 0)
+                        if show_lead_update_result(
+                                run_db_transaction([(query_admin_review, params_admin_review)], lead_change_followup(
+                                    selected_lead_details, new_overall_status_for_lead,
+                                    changes={'admin_review_status': new_review_status_selection, 'admin_comments': admin_comments_input.strip() or None})),
+                                "Admin review saved successfully.", "Failed to save admin review."): st.rerun()
 
 
                 # --- BEGIN: Modified File Upload Section (Site Engineer Only) ---
@@ -1206,7 +2020,6 @@ def build_mis_app():
                     )
 
                     if st.button("Process Uploaded Files", key=f"save_files_btn_{selected_lead_id_int}_v15_eng"):
-                        LEAD_FILES_BASE_PATH = os.path.join(APP_ROOT_PATH, "instance", "lead_uploads")
                         os.makedirs(LEAD_FILES_BASE_PATH, exist_ok=True)
                         lead_specific_upload_dir = os.path.join(LEAD_FILES_BASE_PATH, str(selected_lead_id_int))
                         os.makedirs(lead_specific_upload_dir, exist_ok=True)
@@ -1235,8 +2048,8 @@ def build_mis_app():
 
                         if new_photos_saved_this_session or new_docs_saved_this_session:
                             current_files_data_db = run_db_query(
-                                "SELECT site_photo_filenames, site_document_filenames FROM office WHERE id = %s",
-                                (selected_lead_id_int,), fetch_one=True
+                                "SELECT site_photo_filenames, site_document_filenames, version FROM office WHERE id = %s",
+                                (selected_lead_id_int,), fetch_one=True, primary=True
                             )
                             db_photo_list = []
                             if current_files_data_db and current_files_data_db.get('site_photo_filenames'):
@@ -1250,15 +2063,18 @@ def build_mis_app():
                             updated_photo_list = sorted(list(set(db_photo_list + new_photos_saved_this_session)))
                             updated_doc_list = sorted(list(set(db_doc_list + new_docs_saved_this_session)))
 
-                            update_files_query_db = "UPDATE office SET site_photo_filenames=%s, site_document_filenames=%s WHERE id=%s"
+                            update_files_query_db = "UPDATE office SET site_photo_filenames=%s, site_document_filenames=%s, version=version+1 WHERE id=%s AND status=%s AND version=%s"
                             params_files_db = (
                                 json.dumps(updated_photo_list) if updated_photo_list else None,
                                 json.dumps(updated_doc_list) if updated_doc_list else None,
-                                selected_lead_id_int
+                                selected_lead_id_int, current_lead_status, (current_files_data_db or {}).get('version')
                             )
-                            if run_db_query(update_files_query_db, params_files_db) is not None:
-                                st.success("File references updated in DB."); st.rerun()
-                            else: st.error("Failed to update file references in DB.")
+                            files_rowcounts = run_db_transaction([(update_files_query_db, params_files_db)], lead_change_followup(
+                                selected_lead_details, current_lead_status,
+                                changes={'site_photo_filenames': params_files_db[0], 'site_document_filenames': params_files_db[1]}))
+                            if files_rowcounts is None: st.error("Failed to update file references in DB.")
+                            elif files_rowcounts[0] != 1: st.warning("The lead changed while the files were uploading. The files are saved on the server; click 'Process Uploaded Files' again to record them.")
+                            else: st.success("File references updated in DB."); st.rerun()
                         elif not uploaded_photos and not uploaded_docs:
                             st.info("No new files were selected for upload.")
                 # --- END: Modified File Upload Section ---
@@ -1339,6 +2155,11 @@ def build_mis_app():
             else: st.warning("Selected lead ID data could not be found. Please refresh.")
         else: st.info("Select a Lead ID from the dropdown above to view actions and details.")
     else: st.info("No leads available in the database to perform actions on.")
+    perf_checkpoint("Action panel")
+
+    if st.session_state.get('role') == 'admin':
+        st.markdown("---")
+        display_performance_panel()
 
 # --- App Entry Point Logic ---
 # (Your existing app entry point logic remains here: session state init, db_ok check, login screen, or build_mis_app call)
@@ -1352,149 +2173,55 @@ if 'db_ok' not in st.session_state:
     st.session_state['db_ok'] = initialize_database()
 
 if not st.session_state.get('db_ok', False):
-    st.error("CRITICAL ERROR: Database connection failed or required tables not found. Check logs and settings. Ensure 'admins', 'users', 'office', and 'site_engineers' tables exist in your MySQL database. \n\n For file upload functionality, also ensure 'office' table has `site_photo_filenames` (TEXT) and `site_document_filenames` (TEXT) columns.")
+    st.error("CRITICAL ERROR: Database connection failed or required tables not found. Check logs and settings. Ensure the 'office' table exists in your MySQL database ('accounts' is created and migrated automatically). \n\n For file upload functionality, also ensure 'office' table has `site_photo_filenames` (TEXT) and `site_document_filenames` (TEXT) columns.")
 elif not st.session_state.get('logged_in', False):
     login_col1, login_col2, login_col3 = st.columns([1, 1.5, 1])
     with login_col2:
         st.title(f"{APP_NAME} Portal")
-        admin_tab, user_tab, engineer_tab = st.tabs(["Admin Login/Signup", "User Login/Signup", "Site Engineer Login/Signup"])
-        # ... (Rest of your login/signup tabs logic remains here) ...
-        with admin_tab:
-            admin_action_choice = st.radio("Admin Action:", ("Sign In", "Sign Up"), horizontal=True, key="admin_action_radio_v15")
-            if admin_action_choice == "Sign In":
-                st.subheader("Admin Sign In")
-                with st.form("admin_login_form_v15"):
-                    admin_username = st.text_input("Admin Username", key="admin_uname_login_input_v15")
-                    admin_password = st.text_input("Admin Password", type="password", key="admin_pword_login_input_v15")
-                    submitted_admin_login = st.form_submit_button("Sign In as Admin")
-                    if submitted_admin_login:
-                        if not admin_username or not admin_password: st.error("Username and Password are required.")
-                        else:
-                            q = "SELECT admin_id, username, password_hash FROM admins WHERE username = %s"
-                            data = run_db_query(q, (admin_username,), fetch_one=True)
-                            if data and verify_password(admin_password, data['password_hash']):
-                                st.session_state['logged_in'] = True; st.session_state['username'] = data['username']; st.session_state['role'] = 'admin'; st.rerun()
-                            else: st.error("Invalid admin username or password.")
-            elif admin_action_choice == "Sign Up":
-                st.subheader("Admin Sign Up (Restricted)")
-                with st.form("admin_signup_form_v15"):
-                    su_admin_user = st.text_input("Choose Admin Username*", key="admin_uname_signup_input_v15")
-                    su_admin_pass = st.text_input("Choose Admin Password*", type="password", key="admin_pword_signup_input_v15")
-                    su_admin_conf = st.text_input("Confirm Admin Password*", type="password", key="admin_pword_conf_signup_input_v15")
-                    su_admin_secr = st.text_input("Admin Secret Code*", type="password", key="admin_secret_signup_input_v15")
-                    submitted_admin_signup = st.form_submit_button("Sign Up as Admin")
-                    if submitted_admin_signup:
-                        if not all([su_admin_user, su_admin_pass, su_admin_conf, su_admin_secr]): st.error("All fields are required for admin signup.")
-                        elif su_admin_pass != su_admin_conf: st.error("Passwords do not match.")
-                        elif su_admin_secr != ADMIN_SIGNUP_SECRET: st.error("Incorrect Admin Secret Code.")
-                        else:
-                            q_ex_admin = """
-                                SELECT username FROM users WHERE username = %s
-                                UNION SELECT username FROM admins WHERE username = %s
-                                UNION SELECT username FROM site_engineers WHERE username = %s
-                            """
-                            ex_u_admin = run_db_query(q_ex_admin, (su_admin_user, su_admin_user, su_admin_user), fetch_one=True)
-                            if ex_u_admin: st.error("This username is already taken.")
-                            else:
-                                h_pw_admin = get_password_hash(su_admin_pass)
-                                if h_pw_admin:
-                                    q_ins_admin = "INSERT INTO admins (username, password_hash) VALUES (%s, %s)"
-                                    if run_db_query(q_ins_admin, (su_admin_user, h_pw_admin)) is not None: st.success("Admin account created! Please Sign In.")
-                                    else: st.error("Admin signup failed. Please try again.")
-                                else: st.error("Password hashing failed. Admin account cannot be created.")
-        with user_tab:
-            user_action_choice = st.radio("User Action:", ("Sign In", "Sign Up"), horizontal=True, key="user_action_radio_v15")
-            if user_action_choice == "Sign In":
-                st.subheader("User Sign In")
-                with st.form("user_login_form_v15"):
-                    user_username = st.text_input("Username", key="user_uname_login_input_v15")
-                    user_password = st.text_input("Password", type="password", key="user_pword_login_input_v15")
-                    submitted_user_login = st.form_submit_button("Sign In")
-                    if submitted_user_login:
-                        if not user_username or not user_password: st.error("Username and Password are required.")
-                        else:
-                            q_user = "SELECT user_id, username, password_hash, role FROM users WHERE username = %s" # Ensure your 'users' table has a 'role' column
-                            data_user = run_db_query(q_user, (user_username,), fetch_one=True)
-                            if data_user and verify_password(user_password, data_user['password_hash']):
-                                st.session_state['logged_in'] = True
-                                st.session_state['username'] = data_user['username']
-                                st.session_state['role'] = data_user.get('role', 'user') # Default to 'user' if role column is missing or NULL
-                                st.rerun()
-                            else: st.error("Invalid username or password.")
-            elif user_action_choice == "Sign Up":
-                st.subheader("User Sign Up")
-                with st.form("user_signup_form_v15"):
-                    su_gen_user = st.text_input("Choose Username*", key="user_uname_signup_input_v15")
-                    su_gen_pass = st.text_input("Choose Password*", type="password", key="user_pword_signup_input_v15")
-                    su_gen_conf = st.text_input("Confirm Password*", type="password", key="user_pword_conf_signup_input_v15")
-                    # Assuming 'user' role is default for this signup. If you want to assign roles, add a field.
-                    submitted_user_signup = st.form_submit_button("Sign Up")
-                    if submitted_user_signup:
-                        if not all([su_gen_user, su_gen_pass, su_gen_conf]): st.error("All fields are required for user signup.")
-                        elif su_gen_pass != su_gen_conf: st.error("Passwords do not match.")
-                        else:
-                            q_ex_user = """
-                                SELECT username FROM users WHERE username = %s
-                                UNION SELECT username FROM admins WHERE username = %s
-                                UNION SELECT username FROM site_engineers WHERE username = %s
-                            """
-                            ex_u_user = run_db_query(q_ex_user, (su_gen_user, su_gen_user, su_gen_user), fetch_one=True)
-                            if ex_u_user: st.error("This username is already taken.")
-                            else:
-                                h_pw_user = get_password_hash(su_gen_pass)
-                                if h_pw_user:
-                                    # Ensure your 'users' table can accept role or has a default, e.g., 'user'
-                                    q_ins_user = "INSERT INTO users (username, password_hash, role) VALUES (%s, %s, %s)"
-                                    if run_db_query(q_ins_user, (su_gen_user, h_pw_user, 'user')) is not None: st.success("User account created! Please Sign In.")
-                                    else: st.error("User signup failed. Please try again.")
-                                else: st.error("Password hashing failed. User account cannot be created.")
-        
-        with engineer_tab:
-            engineer_action_choice = st.radio("Site Engineer Action:", ("Sign In", "Sign Up"), horizontal=True, key="engineer_action_radio_v15")
-            if engineer_action_choice == "Sign In":
-                st.subheader("Site Engineer Sign In")
-                with st.form("engineer_login_form_v15"):
-                    eng_username_login = st.text_input("Site Engineer Username", key="eng_uname_login_input_v15")
-                    eng_password_login = st.text_input("Site Engineer Password", type="password", key="eng_pword_login_input_v15")
-                    submitted_eng_login = st.form_submit_button("Sign In as Site Engineer")
-                    if submitted_eng_login:
-                        if not eng_username_login or not eng_password_login: st.error("Username and Password are required.")
-                        else:
-                            q_eng = "SELECT engineer_id, username, password_hash FROM site_engineers WHERE username = %s"
-                            data_eng = run_db_query(q_eng, (eng_username_login,), fetch_one=True)
-                            if data_eng and verify_password(eng_password_login, data_eng['password_hash']):
-                                st.session_state['logged_in'] = True
-                                st.session_state['username'] = data_eng['username']
-                                st.session_state['role'] = 'engineer'
-                                st.rerun()
-                            else: st.error("Invalid Site Engineer username or password.")
-            elif engineer_action_choice == "Sign Up":
-                st.subheader("Site Engineer Sign Up")
-                with st.form("engineer_signup_form_v15"):
-                    su_site_eng_user = st.text_input("Choose Site Engineer Username*", key="eng_uname_signup_input_v15")
-                    su_site_eng_pass = st.text_input("Choose Site Engineer Password*", type="password", key="eng_pword_signup_input_v15")
-                    su_site_eng__conf = st.text_input("Confirm Site Engineer Password*", type="password", key="eng_pword_conf_signup_input_v15") # Corrected variable name
-                    submitted_eng_signup = st.form_submit_button("Sign Up as Site Engineer")
-                    if submitted_eng_signup:
-                        if not all([su_site_eng_user, su_site_eng_pass, su_site_eng_conf]): # Use corrected su_site_eng_conf
-                            st.error("Username and Password fields are required for signup.")
-                        elif su_site_eng_pass != su_site_eng_conf: # Use corrected su_site_eng_conf
-                            st.error("Passwords do not match.")
-                        else:
-                            q_ex_eng = """
-                                SELECT username FROM users WHERE username = %s
-                                UNION SELECT username FROM admins WHERE username = %s
-                                UNION SELECT username FROM site_engineers WHERE username = %s
-                            """
-                            ex_u_eng = run_db_query(q_ex_eng, (su_site_eng_user, su_site_eng_user, su_site_eng_user), fetch_one=True)
-                            if ex_u_eng: st.error("This username is already taken.")
-                            else:
-                                h_pw_eng = get_password_hash(su_site_eng_pass)
-                                if h_pw_eng:
-                                    q_ins_eng = "INSERT INTO site_engineers (username, password_hash) VALUES (%s, %s)"
-                                    if run_db_query(q_ins_eng, (su_site_eng_user, h_pw_eng)) is not None:
-                                        st.success("Site Engineer account created! Please Sign In.")
-                                    else: st.error("Site Engineer signup failed. Please try again.")
-                                else: st.error("Password hashing failed. Account cannot be created.")
+        signin_tab, signup_tab = st.tabs(["Sign In", "Sign Up"])
+        with signin_tab:
+            st.subheader("Sign In")
+            st.caption("Admins, users and site engineers all sign in here.")
+            with st.form("login_form_v15"):
+                login_username = st.text_input("Username", key="uname_login_input_v15")
+                login_password = st.text_input("Password", type="password", key="pword_login_input_v15")
+                submitted_login = st.form_submit_button("Sign In")
+                if submitted_login:
+                    if not login_username or not login_password: st.error("Username and Password are required.")
+                    else:
+                        q_account = "SELECT account_id, username, password_hash, role FROM accounts WHERE username = %s"
+                        data_account = run_db_query(q_account, (login_username,), fetch_one=True, primary=True)
+                        login_ok, login_error = authenticate_account(login_username, login_password, data_account, 'accounts')
+                        if login_ok:
+                            st.session_state['logged_in'] = True
+                            st.session_state['username'] = data_account['username']
+                            st.session_state['role'] = data_account['role'] if data_account['role'] in ACCOUNT_ROLES else 'user'
+                            st.rerun()
+                        else: st.error(login_error or "Invalid username or password.")
+        with signup_tab:
+            signup_account_type = st.radio("Account Type:", ("User", "Site Engineer", "Admin"), horizontal=True, key="signup_account_type_radio_v15")
+            signup_role = {'User': 'user', 'Site Engineer': 'engineer', 'Admin': 'admin'}[signup_account_type]
+            st.subheader(f"{signup_account_type} Sign Up" + (" (Restricted)" if signup_role == 'admin' else ""))
+            with st.form(f"signup_form_{signup_role}_v15"):
+                su_username = st.text_input("Choose Username*", key=f"uname_signup_input_{signup_role}_v15")
+                su_password = st.text_input("Choose Password*", type="password", key=f"pword_signup_input_{signup_role}_v15")
+                su_confirm = st.text_input("Confirm Password*", type="password", key=f"pword_conf_signup_input_{signup_role}_v15")
+                su_secret = st.text_input("Admin Secret Code*", type="password", key="admin_secret_signup_input_v15") if signup_role == 'admin' else None
+                submitted_signup = st.form_submit_button(f"Sign Up as {signup_account_type}")
+                if submitted_signup:
+                    required_signup_fields = [su_username, su_password, su_confirm] + ([su_secret] if signup_role == 'admin' else [])
+                    if not all(required_signup_fields): st.error("All fields are required for signup.")
+                    elif su_password != su_confirm: st.error("Passwords do not match.")
+                    elif signup_role == 'admin' and su_secret != ADMIN_SIGNUP_SECRET: st.error("Incorrect Admin Secret Code.")
+                    elif run_db_query("SELECT account_id FROM accounts WHERE username = %s", (su_username,), fetch_one=True, primary=True):
+                        st.error("This username is already taken.")
+                    else:
+                        h_pw = get_password_hash(su_password)
+                        if h_pw:
+                            q_ins_account = "INSERT INTO accounts (username, password_hash, role) VALUES (%s, %s, %s)"
+                            if run_db_query(q_ins_account, (su_username, h_pw, signup_role)) is not None:
+                                st.success(f"{signup_account_type} account created! Please Sign In.")
+                            else: st.error("Signup failed. The username may have just been taken; please try again.")
+                        else: st.error("Password hashing failed. Account cannot be created.")
 else:
-    build_mis_app()
\ No newline at end of file
+    run_instrumented_rerun(build_mis_app)
\ No newline at end of file
@@ -0,0 +1,206 @@
+# synthetic_data.py
+# Seeded generator for realistic 'office' leads and valuation-request emails, so the MIS load
+# can be reproduced on a laptop. Used by benchmarks.py; can also fill a local database directly:
+#
+#   python synthetic_data.py --leads 10000 --sqlite instance/synthetic_mis.db
+#   python synthetic_data.py --leads 10000 --mysql            (uses MYSQL_CONFIG from instance/config.py)
+#   python synthetic_data.py --emails 500 --email-dir instance/synthetic_emails
+
+import os
+import random
+import sqlite3
+import argparse
+import datetime
+from email.message import EmailMessage
+
+from mis_core import ALL_BANK_OPTIONS_COMBINED, OFFICE_INSERT_COLUMNS
+from mis_storage import SQLITE_OFFICE_DDL
+
+# --- Vocabulary ---
+ENGINEERS = ["amit.k", "rahul.s", "vikas.p", "sandeep.m", "deepak.r", "manoj.t",
+             "rohit.g", "sunil.v", "ajay.n", "naveen.b", "prakash.d", "kiran.j"]
+REPORT_CREATORS = ["priya.a", "neha.s", "pooja.m", "sneha.k", "anjali.r", "kavita.p"]
+FIRST_NAMES = ["Ramesh", "Suresh", "Mahesh", "Anita", "Sunita", "Rajesh", "Kavita", "Vijay", "Meena", "Arjun",
+               "Pooja", "Sanjay", "Lakshmi", "Imran", "Farah", "Gurpreet", "Harish", "Deepa", "Nitin", "Rekha"]
+LAST_NAMES = ["Sharma", "Verma", "Patel", "Shah", "Gupta", "Singh", "Kumar", "Joshi", "Mehta", "Reddy",
+              "Iyer", "Nair", "Khan", "Das", "Jain", "Agarwal", "Chauhan", "Yadav", "Pandey", "Mishra"]
+LOCALITIES = ["Andheri East", "Borivali West", "Thane West", "Kalyan", "Vashi", "Panvel", "Dombivli", "Mira Road",
+              "Virar", "Kharghar", "Powai", "Chembur", "Ghatkopar", "Mulund", "Bhiwandi", "Ulhasnagar"]
+PROPERTY_TYPES = ["Flat", "Shop", "Row House", "Bungalow", "Office", "Plot", "Industrial Gala"]
+BUILDING_WORDS = ["Sai", "Shree", "Om", "Ganesh", "Krishna", "Lotus", "Sunrise", "Green Park", "Royal", "Balaji"]
+VISIT_TYPES = ["Physical", "Virtual", "Revisit", "Desktop"]
+NOTE_SNIPPETS = ["Customer not reachable, will revisit.", "Society NOC pending.", "Area mismatch vs agreement.",
+                 "Photos uploaded, report drafting.", "Bank asked for revised value.", "Key with neighbour.",
+                 "OC not available.", "Plan approval copy requested."]
+BANK_EMAIL_DOMAINS = {
+    "HDFC Bank": "hdfcbank.com", "ICICI HFC": "icicihfc.com", "Axis": "axisbank.com", "Yes Bank": "yesbank.in",
+    "IDFC": "idfcfirstbank.com", "IndusInd": "indusind.com", "Kotak (Portal Report)": "kotak.com",
+    "LICHFL": "lichousing.com", "Mahindra": "mahindrafinance.com", "Poonawalla": "poonawallafincorp.com",
+}
+
+# Rough share of leads per status in a live office.
+STATUS_WEIGHTS = {'New': 8, 'Assigned Engineer': 15, 'Visit Done': 6, 'Report in Progress': 10, 'Completed': 57, 'On Hold': 4}
+REVIEW_WEIGHTS = {'Approved': 80, 'Pending Review': 15, 'Rejected - Needs Revision': 5}
+
+
+def _weighted(rng, weights):
+    return rng.choices(list(weights.keys()), weights=list(weights.values()), k=1)[0]
+
+def _customer(rng):
+    return f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)}"
+
+def _address(rng):
+    return (f"{rng.choice(PROPERTY_TYPES)} No. {rng.randint(1, 999)}, {rng.choice(BUILDING_WORDS)} "
+            f"{rng.choice(['Apartments', 'Heights', 'CHS', 'Complex', 'Residency'])}, {rng.choice(LOCALITIES)}, "
+            f"Mumbai - {rng.randint(400001, 421605)}")
+
+def _phone(rng):
+    return f"9{rng.randint(100000000, 999999999)}"
+
+
+def generate_leads(count, seed=42, today=None, history_days=365):
+    # Returns a list of dicts keyed like 'office' rows (no 'id'), spread over the last history_days.
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    leads = []
+    for _ in range(count):
+        received = datetime.datetime.combine(today - datetime.timedelta(days=rng.randint(0, history_days)),
+                                             datetime.time(rng.randint(9, 19), rng.randint(0, 59), rng.randint(0, 59)))
+        status = _weighted(rng, STATUS_WEIGHTS)
+        bank = rng.choice(ALL_BANK_OPTIONS_COMBINED)
+        locality = rng.choice(LOCALITIES)
+        lead = {
+            'bank_name': bank,
+            'property_details': _address(rng),
+            'received_date': received,
+            'deadline': received.date() + datetime.timedelta(days=rng.randint(2, 10)),
+            'status': status,
+            'customer_name': _customer(rng),
+            'application_number': f"{bank[:3].upper().replace(' ', '')}{rng.randint(100000, 999999)}",
+            'location': f"{locality}, Mumbai",
+            'contact_number': _phone(rng),
+            'branch_virtual': rng.choice([f"{locality} Branch", "Virtual"]),
+            'visit_type': rng.choice(VISIT_TYPES),
+            'distance': round(rng.uniform(1, 60), 1) if rng.random() < 0.8 else None,
+            'site_engineer': None, 'report_creator': None, 'date_of_allocation': None,
+            'visit_initiation_date': None, 'visit_completion_date': None, 'lead_completion_date': None,
+            'admin_review_status': None, 'report_issue_notes': None, 'remarks': None,
+        }
+        if status != 'New':
+            allocated = received.date() + datetime.timedelta(days=rng.randint(0, 2))
+            lead['site_engineer'] = rng.choice(ENGINEERS)
+            lead['date_of_allocation'] = allocated
+            lead['visit_initiation_date'] = allocated
+            if status in ('Visit Done', 'Report in Progress', 'Completed'):
+                lead['visit_completion_date'] = allocated + datetime.timedelta(days=rng.randint(0, 4))
+            if status in ('Report in Progress', 'Completed'):
+                lead['report_creator'] = rng.choice(REPORT_CREATORS)
+            if status == 'Completed':
+                lead['lead_completion_date'] = lead['visit_completion_date'] + datetime.timedelta(days=rng.randint(0, 5))
+                lead['admin_review_status'] = _weighted(rng, REVIEW_WEIGHTS)
+            else:
+                lead['admin_review_status'] = 'Pending Review'
+        if rng.random() < 0.3: lead['report_issue_notes'] = rng.choice(NOTE_SNIPPETS)
+        if rng.random() < 0.2: lead['remarks'] = rng.choice(NOTE_SNIPPETS)
+        leads.append(lead)
+    return leads
+
+
+def generate_valuation_emails(count, seed=42, today=None):
+    # Returns [(subject, body, sender)] in the shapes extract_info_from_email has to cope with.
+    rng = random.Random(seed)
+    today = today or datetime.date.today()
+    emails = []
+    for i in range(count):
+        bank = rng.choice(list(BANK_EMAIL_DOMAINS.keys()) + ALL_BANK_OPTIONS_COMBINED)
+        domain = BANK_EMAIL_DOMAINS.get(bank, "bankmail.co.in")
+        sender = f"{rng.choice(['valuation', 'retail.ops', 'credit', 'noreply'])}@{domain}"
+        deadline = today + datetime.timedelta(days=rng.randint(2, 10))
+        customer = _customer(rng)
+        style = i % 3
+        if style == 0:
+            subject = f"Valuation Request - {bank} - {customer}"
+            body = (f"Dear Sir/Madam,\n\nPlease find the valuation request below.\n\n"
+                    f"Bank Name: {bank}\nCustomer Name: {customer}\nApplication No: APP{rng.randint(100000, 999999)}\n"
+                    f"Property Address: {_address(rng)}\n\nDue Date: {deadline:%d/%m/%Y}\n"
+                    f"Contact Number: {_phone(rng)}\n\nRegards,\nCredit Team")
+        elif style == 1:
+            subject = f"Technical verification for {customer}"
+            body = (f"Hi team,\nKindly initiate the site visit.\nClient Name: {customer}\n"
+                    f"Property Details: {_address(rng)}\nDeadline: {deadline:%Y-%m-%d}\n"
+                    f"Location: {rng.choice(LOCALITIES)}\n\nMobile No: {_phone(rng)}\nThanks")
+        else:
+            subject = f"Case allocation {rng.randint(1000, 9999)}"
+            body = (f"Allocated case details follow.\n{customer} has applied for a loan against "
+                    f"{_address(rng)}. Please submit the report at the earliest.\n{rng.choice(NOTE_SNIPPETS)}")
+        emails.append((subject, body, sender))
+    return emails
+
+
+def build_email_message(subject, body, sender, to_address="mis@example.com"):
+    msg = EmailMessage()
+    msg['Subject'] = subject; msg['From'] = sender; msg['To'] = to_address
+    msg.set_content(body)
+    return msg
+
+
+# --- Database Writers ---
+def _insert_rows(leads):
+    columns = [col for col in OFFICE_INSERT_COLUMNS if col in leads[0]]
+    return columns, [tuple(lead.get(col) for col in columns) for lead in leads]
+
+def write_leads_sqlite(path, leads):
+    conn = sqlite3.connect(path)
+    try:
+        conn.execute(SQLITE_OFFICE_DDL)
+        if leads:
+            columns, rows = _insert_rows(leads)
+            conn.executemany(f"INSERT INTO office ({', '.join(columns)}) VALUES ({', '.join(['?'] * len(columns))})", rows)
+        conn.commit()
+    finally:
+        conn.close()
+    return len(leads)
+
+def write_leads_mysql(leads, mysql_config):
+    import mysql.connector
+    conn = mysql.connector.connect(**mysql_config)
+    try:
+        cursor = conn.cursor()
+        columns, rows = _insert_rows(leads)
+        query = f"INSERT INTO office ({', '.join('`'+c+'`' for c in columns)}) VALUES ({', '.join(['%s'] * len(columns))})"
+        for start in range(0, len(rows), 1000):
+            cursor.executemany(query, rows[start:start + 1000])
+        conn.commit(); cursor.close()
+    finally:
+        conn.close()
+    return len(leads)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fill a local database / folder with synthetic MIS data.")
+    parser.add_argument('--leads', type=int, default=0, help="Number of office rows to generate.")
+    parser.add_argument('--emails', type=int, default=0, help="Number of valuation-request emails to generate.")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--sqlite', help="SQLite file to create/append the office table in.")
+    parser.add_argument('--mysql', action='store_true', help="Insert into the MySQL database from instance/config.py.")
+    parser.add_argument('--email-dir', help="Folder to write the emails to as .eml files.")
+    args = parser.parse_args()
+
+    if args.leads:
+        leads = generate_leads(args.leads, seed=args.seed)
+        if args.sqlite:
+            print(f"Wrote {write_leads_sqlite(args.sqlite, leads)} leads to {args.sqlite}")
+        if args.mysql:
+            from instance import config
+            print(f"Wrote {write_leads_mysql(leads, config.MYSQL_CONFIG)} leads to MySQL database '{config.MYSQL_CONFIG.get('database')}'")
+        if not args.sqlite and not args.mysql: print("Nothing written: pass --sqlite PATH and/or --mysql.")
+    if args.emails:
+        if not args.email_dir: parser.error("--emails needs --email-dir")
+        os.makedirs(args.email_dir, exist_ok=True)
+        for idx, (subject, body, sender) in enumerate(generate_valuation_emails(args.emails, seed=args.seed), 1):
+            with open(os.path.join(args.email_dir, f"valuation_{idx:05d}.eml"), "wb") as f:
+                f.write(bytes(build_email_message(subject, body, sender)))
+        print(f"Wrote {args.emails} emails to {args.email_dir}")
+
+if __name__ == "__main__":
+    main()